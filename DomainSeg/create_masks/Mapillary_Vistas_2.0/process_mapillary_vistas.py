@@ -4,6 +4,9 @@ from argparse import ArgumentParser
 from PIL import Image
 import os
 import numpy as np
+import sys
+sys.path.append('../../../')
+from Models.data_utils.conversion_driver import ConversionDriver, saveImageAtomic
 
 # define standard width and standard height
 standard_width = 1920
@@ -73,6 +76,46 @@ def createMask(colorMap, input_image):
     return coarseSegColorMap, viz_image, is_class_present
     
 
+# Create new coarse segmentation mask and visualization of a sample and save
+# them with its image if the sample contains the required classes, returning
+# the filepaths of the saved outputs
+def processSample(image_filepath, label_filepath, image_save_filepath, \
+                  label_save_filepath, visualization_save_filepath):
+
+    # Open images and pre-existing masks
+    image = Image.open(image_filepath)
+    label = Image.open(label_filepath)
+
+    #resize model################################
+    image = image.resize((standard_width, standard_height))
+    label = label.resize((standard_width, standard_height))
+
+    # Create new Coarse Segmentation mask
+    coarseSegColorMap, vis_image, is_class_present  = createMask(label, image)
+
+    if (is_class_present == True):
+        # Save images
+        saveImageAtomic(image, image_save_filepath, "PNG")
+        saveImageAtomic(coarseSegColorMap, label_save_filepath, "PNG")
+        saveImageAtomic(vis_image, visualization_save_filepath, "PNG")
+        return [image_save_filepath, label_save_filepath, visualization_save_filepath]
+
+    print("the image {} does not have the required class/classes".format(image_filepath))
+    return []
+
+# Tasks identified by output index and input label, output
+# indices are numbered consecutively from first_index
+def getTasks(images, labels, first_index, images_save_path, labels_save_path, visualization_save_path):
+    tasks = []
+    for index in range(0, len(images)):
+        index_for_saving = first_index + index
+        task_id = str(index_for_saving) + ':' + labels[index].name
+        tasks.append((task_id, (str(images[index]), str(labels[index]), \
+            images_save_path + '/' + str(index_for_saving) + ".png", \
+            labels_save_path + '/' + str(index_for_saving) + ".png", \
+            visualization_save_path + '/' + str(index_for_saving) + ".png")))
+    return tasks
+
 def main():
     
     parser = ArgumentParser()
@@ -83,7 +126,8 @@ def main():
     parser.add_argument("-lbs", "--labels-save", dest="labels_save_path", help="path to folder where processed labels will be saved")
     parser.add_argument("-ims", "--images-save", dest="images_save_path", help="path to folder where corresponding images will be saved")
     parser.add_argument("-vis", "--visualization-save", dest="visualization_save_path", help="path to folder where corresponding visualization will be saved")
-    
+    parser.add_argument("-w", "--num_workers", dest="num_workers", type=int, default=None, help="number of worker processes, defaults to the number of CPUs")
+
     args = parser.parse_args()
 
     # Paths to read input images and ground truth label masks from validation data
@@ -125,8 +169,8 @@ def main():
 
     
 
-    index_for_saving = 0
-        
+    # Samples processed in parallel, skipping samples completed by an earlier run
+    driver = ConversionDriver(labels_save_path + '/conversion_manifest.jsonl', args.num_workers)
 
     # Reading validation dataset labels and images and sorting returned list in alphabetical order
     val_labels = sorted([f for f in pathlib.Path(val_labels_filepath).glob("*.png")])
@@ -148,32 +192,12 @@ def main():
     if(check_passed):
 
         print('Beginning processing of validation data')
-        
 
-        # Looping through data
-        for index in range(0, val_num_images):
-            
-            # Open images and pre-existing masks
-            image = Image.open(str(val_images[index]))
-            label = Image.open(str(val_labels[index]))
-            
-            #resize model################################
-            image = image.resize((standard_width, standard_height))
-            label = label.resize((standard_width, standard_height))
-
-            # Create new Coarse Segmentation mask
-            coarseSegColorMap, vis_image, is_class_present  = createMask(label, image)
-
-            if (is_class_present == True):
-                # Save images
-                image.save(images_save_path  + '/' + str(index_for_saving) + ".png","PNG")
-                coarseSegColorMap.save(labels_save_path + '/' + str(index_for_saving) + ".png","PNG")
-                vis_image.save(visualization_save_path + '/' + str(index_for_saving) + ".png","PNG")
-                print(f'Processing image {index} of {val_num_images-1}')
-                index_for_saving = index_for_saving + 1
-            else:
-                print("the image {} does not have the required class/classes".format(index))
-    
+        # Validation samples are saved first
+        val_tasks = getTasks(val_images, val_labels, 0, \
+            images_save_path, labels_save_path, visualization_save_path)
+        driver.run(processSample, val_tasks)
+
         print('----- Processing validation complete -----') 
 
     
@@ -198,30 +222,11 @@ def main():
 
         print('Beginning processing of training data')
 
-        # Looping through data
-        for index in range(0, train_num_images):
-            
-            # Open images and pre-existing masks
-            image = Image.open(str(train_images[index]))
-            label = Image.open(str(train_labels[index]))
-
-            #resize model################################
-            image = image.resize((standard_width, standard_height))
-            label = label.resize((standard_width, standard_height))
-
-            # Create new Coarse Segmentation mask
-            coarseSegColorMap, vis_image, is_class_present  = createMask(label, image)
-
-            if (is_class_present == True):
-                # Save images
-                image.save(images_save_path + '/' + str(index_for_saving) + ".png","PNG")
-                coarseSegColorMap.save(labels_save_path + '/' + str(index_for_saving) + ".png","PNG")
-                vis_image.save(visualization_save_path + '/' + str(index_for_saving) + ".png","PNG")
-                print(f'Processing image {index} of {train_num_images-1}')
-                index_for_saving = index_for_saving + 1
-            else:
-                print("the image {} does not have the required class/classes".format(index))
-    
+        # Training samples are saved after all validation samples
+        train_tasks = getTasks(train_images, train_labels, val_num_images, \
+            images_save_path, labels_save_path, visualization_save_path)
+        driver.run(processSample, train_tasks)
+
         print('----- Processing validation complete -----') 
 
 
@@ -5,6 +5,9 @@ import numpy as np
 import os
 from argparse import ArgumentParser
 from PIL import Image
+import sys
+sys.path.append('../../../')
+from Models.data_utils.conversion_driver import ConversionDriver, saveImageAtomic
 
 # Simply function which makes a directory if it doesn't exist
 def checkDir(path):
@@ -50,12 +53,59 @@ def createMask(colorMap, image):
 
     return segMask, visMask
 
+# Create the label and visualization of an image and save them with the
+# image, returning the filepaths of the saved outputs
+def processSample(image_file, label_file, image_save_filepath, \
+                  label_save_filepath, visualization_save_filepath):
+
+    try:
+        # If we have a valid label, open it
+        label = Image.open(label_file)
+
+        # Open the Image and get its width and height
+        image = Image.open(image_file)
+        width, height = image.size
+
+        # Crop to achieve a 2:1 width to height aspect ratio if the image is too tall
+        if(height > width/2):
+
+            image = image.crop((0, height/2 - width/4, width-1, height/2 + width/4))
+            label = label.crop((0, height/2 - width/4, width-1, height/2 + width/4))
+
+        # Create the label and visualiztion
+        label_mask, vis_mask = createMask(label, image)
+
+        # Apply alpha transparency factor of 0.5
+        label_mask_composite = np.uint8(label_mask*0.5)
+
+        # Save the image
+        saveImageAtomic(image, image_save_filepath)
+
+        # Save the ground truth segmentation mask
+        mask = Image.fromarray(label_mask)
+        saveImageAtomic(mask, label_save_filepath, "PNG")
+
+        # Create the visualization through image compositing
+        vis = Image.fromarray(vis_mask)
+        label_mask_composite = Image.fromarray(label_mask_composite)
+        visualization = Image.composite(image, vis, label_mask_composite)
+
+        # Save the visualization for data auditing
+        saveImageAtomic(visualization, visualization_save_filepath, "PNG")
+
+        return [image_save_filepath, label_save_filepath, visualization_save_filepath]
+
+    except FileNotFoundError:
+        print('Label not found')
+        return []
+
 def main():
 
     # Argument parsing
     parser = ArgumentParser()
     parser.add_argument("-d", "--data_root_path", dest="data_root_path", help="path to folder with ground truth data")
     parser.add_argument("-s", "--save_root_path", dest="save_root_path", help="path to where processed data should be saved")
+    parser.add_argument("-w", "--num_workers", dest="num_workers", type=int, default=None, help="number of worker processes, defaults to the number of CPUs")
     args = parser.parse_args()
     
     # Paths to read input images and ground truth label masks from training data
@@ -80,11 +130,9 @@ def main():
     print('Found ', len(images), ' images')
     print('Found ', len(labels), ' ground truth labels')
 
-    # Process images
+    # Tasks identified by output index and input image
+    tasks = []
     for i in range(0, len(images)):
-        
-        # Print progress
-        print('Processing ', i+1, ' of ' , len(images))
 
         # Read image and get ID
         image_file = str(images[i])
@@ -94,43 +142,15 @@ def main():
         # Get corresponding label ID from image ID
         label_file = labels_filepath + image_file_id + '_labelIds.png'
 
-        try:
-            # If we have a valid label, open it
-            label = Image.open(label_file)
-
-            # Open the Image and get its width and height
-            image = Image.open(image_file)
-            width, height = image.size
-
-            # Crop to achieve a 2:1 width to height aspect ratio if the image is too tall
-            if(height > width/2):
-
-                image = image.crop((0, height/2 - width/4, width-1, height/2 + width/4))
-                label = label.crop((0, height/2 - width/4, width-1, height/2 + width/4))
-            
-            # Create the label and visualiztion
-            label_mask, vis_mask = createMask(label, image)
-
-            # Apply alpha transparency factor of 0.5
-            label_mask_composite = np.uint8(label_mask*0.5)
-
-            # Save the image
-            image.save(images_save_path + str(i).zfill(4) + ".jpg")
-
-            # Save the ground truth segmentation mask
-            mask = Image.fromarray(label_mask)
-            mask.save(labels_save_path + str(i).zfill(4) + ".png", "PNG")
-
-            # Create the visualization through image compositing
-            vis = Image.fromarray(vis_mask)
-            label_mask_composite = Image.fromarray(label_mask_composite)
-            visualization = Image.composite(image, vis, label_mask_composite)
-
-            # Save the visualization for data auditing
-            visualization.save(visualization_save_path + str(i).zfill(4) + ".png", "PNG")
+        task_id = str(i) + ':' + images[i].name
+        tasks.append((task_id, (image_file, label_file, \
+            images_save_path + str(i).zfill(4) + ".jpg", \
+            labels_save_path + str(i).zfill(4) + ".png", \
+            visualization_save_path + str(i).zfill(4) + ".png")))
 
-        except FileNotFoundError:
-            print('Label not found')
+    # Process images in parallel, skipping images completed by an earlier run
+    driver = ConversionDriver(labels_save_path + 'conversion_manifest.jsonl', args.num_workers)
+    driver.run(processSample, tasks)
 
     print('Finished processing')
 
@@ -1,13 +1,17 @@
 #! /usr/bin/env python3
 
 import argparse
-import json
 import os
+import sys
 import shutil
 import pathlib
+import itertools
 from PIL import Image, ImageDraw
 import warnings
 from datetime import datetime
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from EgoPath.create_path.common.frame_pool import runFrames
+from EgoPath.create_path.common.label_stream import LABEL_FORMATS, LabelWriter, getLabelsPath
 
 # Custom warning format cuz the default one is wayyyyyy too verbose
 def custom_warning_format(message, category, filename, lineno, line=None):
@@ -25,7 +29,7 @@ def normalizeCoords(lane, width, height):
     return [(x / width, y / height) for x, y in lane]
 
 
-def getLaneAnchor(lane):
+def getLaneAnchor(lane, img_height):
     """
     Determine "anchor" point of a lane.
 
@@ -46,7 +50,7 @@ def getLaneAnchor(lane):
     return (x0, a, b)
 
 
-def getEgoIndexes(anchors):
+def getEgoIndexes(anchors, img_width):
     """
     Identifies 2 ego lanes - left and right - from a sorted list of lane anchors.
 
@@ -61,7 +65,7 @@ def getEgoIndexes(anchors):
     return "NO LANES on the RIGHT side of frame. Something's sussy out there!"
 
 
-def getDrivablePath(left_ego, right_ego):
+def getDrivablePath(left_ego, right_ego, img_height):
     """
     Computes drivable path as midpoint between 2 ego lanes, basically the main point of this task.
 
@@ -129,7 +133,7 @@ def getDrivablePath(left_ego, right_ego):
 
 
 def annotateGT(
-        anno_entry, anno_raw_file, 
+        anno_entry, anno_raw_file, frame_id,
         raw_dir, visualization_dir, mask_dir,
         img_width, img_height,
         normalized = True,
@@ -138,7 +142,7 @@ def annotateGT(
     """
     Annotates and saves an image with:
         - Raw image, in "output_dir/image".
-        - Annotated image with all lanes, in "output_dir/visualization".
+        - Annotated image with all lanes, in "output_dir/visualization", unless visualization_dir is None.
         - Binary segmentation mask of drivable path, in "output_dir/segmentation".
 
     """
@@ -155,19 +159,18 @@ def annotateGT(
         raw_img = raw_img.crop((
             CROP_LEFT, 
             CROP_TOP, 
-            former_img_width - CROP_RIGHT, 
-            former_img_height - CROP_BOTTOM
+            CROP_LEFT + img_width, 
+            CROP_TOP + img_height
         ))
 
     # Define save name
     # Also save in PNG (EXTREMELY SLOW compared to jpg, for lossless quality)
-    save_name = str(img_id_counter).zfill(6) + ".png"
+    save_name = frame_id + ".png"
 
     # Copy raw img and put it in raw dir.
     raw_img.save(os.path.join(raw_dir, save_name))
     
     # Draw all lanes & lines
-    draw = ImageDraw.Draw(raw_img)
     lane_colors = {     
         "leftego_green": (0, 255, 0),
         "rightego_blue" : (0,0,255),
@@ -175,24 +178,28 @@ def annotateGT(
     }
     lane_w = 5
 
-    for idx,lane in enumerate(anno_entry["lanes"]):
-        if(normalized):
-            lane = [( x * img_width, y*img_height) for x,y in lane]
+    # Visualization is optional
+    if (visualization_dir is not None):
+        draw = ImageDraw.Draw(raw_img)
 
-        # left ego lane in green
-        if (idx == anno_entry["ego_indexes"][0]):           
-            draw.line(lane, fill = lane_colors["leftego_green"], width = lane_w)
+        for idx,lane in enumerate(anno_entry["lanes"]):
+            if(normalized):
+                lane = [( x * img_width, y*img_height) for x,y in lane]
 
-        # right ego lane in blue    
-        elif (idx == anno_entry["ego_indexes"][1]):
-            draw.line(lane, fill = lane_colors["rightego_blue"], width = lane_w)
+            # left ego lane in green
+            if (idx == anno_entry["ego_indexes"][0]):           
+                draw.line(lane, fill = lane_colors["leftego_green"], width = lane_w)
 
-        # Outer lanes, in yellow
-        else:            
-            draw.line(lane, fill = lane_colors["outer_yellow"], width = lane_w)    
+            # right ego lane in blue    
+            elif (idx == anno_entry["ego_indexes"][1]):
+                draw.line(lane, fill = lane_colors["rightego_blue"], width = lane_w)
 
-    # Save visualization img, same format with raw, just different dir
-    raw_img.save(os.path.join(visualization_dir, save_name))     
+            # Outer lanes, in yellow
+            else:            
+                draw.line(lane, fill = lane_colors["outer_yellow"], width = lane_w)    
+
+        # Save visualization img, same format with raw, just different dir
+        raw_img.save(os.path.join(visualization_dir, save_name))     
 
 
     # renormalize all lanes
@@ -216,7 +223,7 @@ def annotateGT(
     mask.save(os.path.join(mask_dir, save_name))  
    
 
-def parseAnnotations(anno_path, crop = None):
+def parseAnnotations(anno_path, img_width, img_height, crop = None):
     """
     Parses lane annotations from raw img + anno files, then extracts normalized GT data.
 
@@ -248,7 +255,7 @@ def parseAnnotations(anno_path, crop = None):
                 # Crop
                 lanes = [[
                     (x - CROP_LEFT, y - CROP_TOP) for x, y in lane
-                    if (CROP_LEFT <= x <= (former_img_width - CROP_RIGHT)) and (CROP_TOP <= y <= (former_img_height - CROP_BOTTOM))
+                    if (CROP_LEFT <= x <= (CROP_LEFT + img_width)) and (CROP_TOP <= y <= (CROP_TOP + img_height))
                 ] for lane in lanes]
                 # Remove empty lanes
                 lanes = [lane for lane in lanes if (lane and len(lane) >= 2)]   # Pick lanes with >= 2 points
@@ -257,8 +264,8 @@ def parseAnnotations(anno_path, crop = None):
                     return None
 
             # Determine 2 ego lanes
-            lane_anchors = [getLaneAnchor(lane) for lane in lanes]
-            ego_indexes = getEgoIndexes(lane_anchors)
+            lane_anchors = [getLaneAnchor(lane, img_height) for lane in lanes]
+            ego_indexes = getEgoIndexes(lane_anchors, img_width)
 
             if (type(ego_indexes) is str):
                 if (ego_indexes.startswith("NO")):
@@ -269,7 +276,7 @@ def parseAnnotations(anno_path, crop = None):
             right_ego = lanes[ego_indexes[1]]
 
             # Determine drivable path from 2 egos
-            drivable_path = getDrivablePath(left_ego, right_ego)
+            drivable_path = getDrivablePath(left_ego, right_ego, img_height)
 
             # Parse processed data, all coords normalized
             anno_data = {
@@ -282,6 +289,50 @@ def parseAnnotations(anno_path, crop = None):
 
             return anno_data
 
+
+def processFrame(
+        frame_id, anno_file, raw_file,
+        raw_dir, visualization_dir, mask_dir,
+        img_width, img_height,
+        crop = None
+):
+    """
+    Parses a frame and saves its images, returning (frame_id, frame GT), or (frame_id, None)
+    if the frame is skipped. Runs in the worker processes.
+
+    """
+    this_data = parseAnnotations(anno_file, img_width, img_height, crop)
+    if (this_data is None):
+        return (frame_id, None)
+
+    annotateGT(
+        anno_entry = this_data,
+        anno_raw_file = raw_file,
+        frame_id = frame_id,
+        raw_dir = raw_dir,
+        visualization_dir = visualization_dir,
+        mask_dir = mask_dir,
+        img_height = img_height,
+        img_width = img_width,
+        crop = crop
+    )
+
+    frame_data = {}
+    frame_data["egoleft_lane"] = this_data["lanes"][this_data["ego_indexes"][0]]
+    frame_data["egoright_lane"] = this_data["lanes"][this_data["ego_indexes"][1]]
+    frame_data["outer_lane"] = []
+
+    #identify the the outer lanes and save in frame_data
+    for idx,lane in enumerate(this_data["lanes"]):
+        if idx in this_data["ego_indexes"]:
+            continue
+        else:
+            frame_data["outer_lane"].append(lane)
+    frame_data["img_height"] = img_height
+    frame_data["img_width"] = img_width
+
+    return (frame_id, frame_data)
+
             
 if __name__ == "__main__":
 
@@ -333,6 +384,25 @@ if __name__ == "__main__":
         required = False,
         default = 5
     )
+    parser.add_argument(
+        "--num_workers",
+        type = int,
+        help = "Num. worker processes, defaults to the number of CPUs.",
+        required = False
+    )
+    parser.add_argument(
+        "--label_format",
+        type = str,
+        choices = LABEL_FORMATS,
+        help = "Label file format, jsonl streams each frame to drivable_path.jsonl as soon as it is processed.",
+        required = False,
+        default = "json"
+    )
+    parser.add_argument(
+        "--skip_visualization",
+        action = "store_true",
+        help = "Do not render the visualization images."
+    )
     # For debugging only
     parser.add_argument(
         "--early_stopping",
@@ -377,8 +447,6 @@ if __name__ == "__main__":
                 "BOTTOM" : args.crop[2],
                 "LEFT" : args.crop[3],
             }
-            former_img_height = img_height
-            former_img_width = img_width
             img_height -= crop["TOP"] + crop["BOTTOM"]
             img_width -= crop["LEFT"] + crop["RIGHT"]
             print(f"New image size: {img_width}W x {img_height}H.\n")
@@ -391,10 +459,10 @@ if __name__ == "__main__":
         |----image
         |----segmentation
         |----visualization
-        |----drivable_path.json
+        |----drivable_path.json (or drivable_path.jsonl)
     """
     list_splits = ["train", "val", "test"]
-    list_subdirs = ["image", "segmentation", "visualization"]
+    list_subdirs = ["image", "segmentation"] if (args.skip_visualization) else ["image", "segmentation", "visualization"]
     if (os.path.exists(output_dir)):
         warnings.warn(f"Output directory {output_dir} already exists. Purged")
         shutil.rmtree(output_dir)
@@ -413,14 +481,16 @@ if __name__ == "__main__":
         for filename in os.listdir(os.path.join(dataset_dir, list_path, test_classification))
     ]
 
-    # Parse data by batch
-    data_master = {}
-    img_id_counter = -1
+    raw_dir = os.path.join(output_dir, "image")
+    visualization_dir = None if (args.skip_visualization) else os.path.join(output_dir, "visualization")
+    mask_dir = os.path.join(output_dir, "segmentation")
 
-    for split in list_splits:
-        
-        print(f"\n==================== Processing {split} data ====================\n")
-        
+    def generateFrameTasks(split):
+        """
+        Yields the frame tasks of a split, frame IDs are assigned to every sampled file
+        in order so that they are known before the frames are parsed.
+
+        """
         if (split in ["train", "val"]):
             list_files = [os.path.join(dataset_dir, list_path, f"{split}.txt")]    # Train or Val set
         else:   # Test set and its lil more complicated
@@ -433,9 +503,13 @@ if __name__ == "__main__":
             with open(label_file, "r") as f:
                 list_raw_files = f.readlines()
 
-            for i in range(0, len(list_raw_files), sampling_step):
-                img_path = list_raw_files[i]
-                img_id_counter += 1
+            sampled_raw_files = itertools.islice(list_raw_files, 0, None, sampling_step)
+            # Early stopping, if defined
+            if (early_stopping):
+                sampled_raw_files = itertools.islice(sampled_raw_files, early_stopping)
+
+            for img_path in sampled_raw_files:
+                img_id_counter = next(img_id_iter)
                 img_path = img_path.strip()
                 if (img_path[0] == "/"):
                     img_path = img_path[1 : ]     # Remove the leading "/" so that path join works
@@ -445,41 +519,31 @@ if __name__ == "__main__":
                 else:
                     anno_file = os.path.join(dataset_dir, new_anno, anno_path)
 
-                this_data = parseAnnotations(anno_file, crop)
-                if (this_data is not None):
-
-                    print(f"Processing data in label file {anno_file}.")
-                    annotateGT(
-                        anno_entry = this_data,
-                        anno_raw_file = os.path.join(dataset_dir, img_path),
-                        raw_dir = os.path.join(output_dir, "image"),
-                        visualization_dir = os.path.join(output_dir, "visualization"),
-                        mask_dir = os.path.join(output_dir, "segmentation"),
-                        img_height = img_height,
-                        img_width = img_width,
-                        crop = crop
-                    )
-
-                    # Save as 6-digit incremental index
-                    img_index = str(str(img_id_counter).zfill(6))
-                    data_master[img_index] = {}                    
-                    data_master[img_index]["egoleft_lane"] = this_data["lanes"][this_data["ego_indexes"][0]]
-                    data_master[img_index]["egoright_lane"] = this_data["lanes"][this_data["ego_indexes"][1]]
-                    data_master[img_index]["outer_lane"]=[]
-
-                    #identify the the outer lanes and save in data_master
-                    for idx,lane in enumerate(this_data["lanes"]):
-                        if idx in this_data["ego_indexes"]:
-                            continue
-                        else:
-                            data_master[img_index]["outer_lane"].append(lane)
-                    data_master[img_index]["img_height"] = img_height
-                    data_master[img_index]["img_width"] = img_width
-                    
-                    # Early stopping, it defined
-                    if (early_stopping and img_id_counter >= early_stopping - 1):
-                        break
+                yield (
+                    str(img_id_counter).zfill(6), anno_file,
+                    os.path.join(dataset_dir, img_path),
+                    raw_dir, visualization_dir, mask_dir,
+                    img_width, img_height,
+                    crop
+                )
+
+    # Parse data by batch, labels are written in frame order as the workers finish them
+    label_writer = LabelWriter(getLabelsPath(output_dir, "drivable_path", args.label_format))
+    img_id_iter = itertools.count()
+
+    for split in list_splits:
+        
+        print(f"\n==================== Processing {split} data ====================\n")
+
+        for frame_id, frame_data in runFrames(
+            processFrame,
+            generateFrameTasks(split),
+            args.num_workers
+        ):
+            if (frame_data is not None):
+                # Save as 6-digit incremental index
+                print(f"Processed frame {frame_id}.")
+                label_writer.write(frame_id, frame_data)
 
     # Save master data
-    with open(os.path.join(output_dir, "drivable_path.json"), "w") as f:
-        json.dump(data_master, f, indent = 4)
\ No newline at end of file
+    label_writer.close()
@@ -3,13 +3,58 @@
 import argparse
 import json
 import os
+import sys
 import shutil
 import math
+import itertools
 from PIL import Image, ImageDraw
 import warnings
 from datetime import datetime
 import numpy as np
 from pprint import pprint
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from EgoPath.create_path.common.frame_pool import runFrames
+from EgoPath.create_path.common.label_stream import LABEL_FORMATS, LabelWriter, getLabelsPath
+
+
+# ============================== Dataset constants ============================== #
+
+
+IMG_DIR = "images"
+LABEL_DIR = "labels"
+
+# I got this result from `./EDA_imgsizes.ipynb`
+SIZE_DICT = {
+    "beeg" : (2560, 1440),
+    "half_beeg" : (1280, 720),
+    "weird" : (1570, 660),
+}
+
+BEEG_Y_CROP_SUM = 320
+BEEG_X_CROP = 240
+BEEG_Y_CROP_TOP_RATIO = 0.75
+CROP_BEEG = {
+    "TOP" : int(BEEG_Y_CROP_SUM * BEEG_Y_CROP_TOP_RATIO),
+    "RIGHT" : BEEG_X_CROP,
+    "BOTTOM" : int(BEEG_Y_CROP_SUM * (1 - BEEG_Y_CROP_TOP_RATIO)),
+    "LEFT" : BEEG_X_CROP
+}
+
+WEIRD_Y_CROP = 130
+WEIRD_X_CROP = 385
+CROP_WEIRD = {
+    "TOP" : WEIRD_Y_CROP,
+    "RIGHT" : WEIRD_X_CROP,
+    "BOTTOM" : WEIRD_Y_CROP,
+    "LEFT" : WEIRD_X_CROP
+}
+
+# ====== Heuristic boundaries of drivable path for automatic auditing ====== #
+
+LEFT_ANCHOR_BOUNDARY = RIGHT_ANCHOR_BOUNDARY = 0.2
+HEIGHT_BOUNDARY = 0.15
+ANGLE_BOUNDARY = 30
+
 
 # Custom warning format cuz the default one is wayyyyyy too verbose
 def custom_warning_format(message, category, filename, lineno, line=None):
@@ -184,7 +229,7 @@ def getDrivablePath(
 
 
 def annotateGT(
-        raw_img, anno_entry,
+        raw_img, anno_entry, img_index,
         raw_dir, visualization_dir, mask_dir,
         init_img_width, init_img_height,
         normalized = True,
@@ -194,13 +239,13 @@ def annotateGT(
     """
     Annotates and saves an image with:
         - Raw image, in "output_dir/image".
-        - Annotated image with all lanes, in "output_dir/visualization".
+        - Annotated image with all lanes, in "output_dir/visualization", unless visualization_dir is None.
         - Binary segmentation mask of drivable path, in "output_dir/segmentation".
     """
 
     # Define save name
     # Also save in PNG (EXTREMELY SLOW compared to jpg, for lossless quality)
-    save_name = str(img_id_counter).zfill(6) + ".png"
+    save_name = img_index + ".png"
 
     # Load img
     raw_img = raw_img
@@ -235,7 +280,6 @@ def annotateGT(
     raw_img.save(os.path.join(raw_dir, save_name))
 
     # Draw all lanes & lines
-    draw = ImageDraw.Draw(raw_img)
     lane_colors = {
        # "outer_red": (255, 0, 0), 
        # "ego_green": (0, 255, 0), 
@@ -245,40 +289,45 @@ def annotateGT(
        "otherlanes_Yellow": (255,255,0),        
     }
     lane_w = 5
-    # Draw lanes
-    for idx, lane in enumerate(anno_entry["lanes"]):
+
+    # Visualization is optional
+    if (visualization_dir is not None):
+        draw = ImageDraw.Draw(raw_img)
+
+        # Draw lanes
+        for idx, lane in enumerate(anno_entry["lanes"]):
+            if (normalized):
+                lane = [
+                    (x * new_img_width, y * new_img_height) 
+                    for x, y in lane
+                ]
+            
+            # Draw Ego Left lane in Green
+            if idx == anno_entry["ego_indexes"][0]:
+                draw.line(lane, fill = lane_colors["egoLeft_Green"], width = lane_w)
+
+            # Draw Ego Right Lane in Blue
+            elif idx == anno_entry["ego_indexes"][1]:                
+                draw.line(lane, fill = lane_colors["egoRight_Blue"], width = lane_w)
+
+            # Other lanes in yellow
+            else:
+                draw.line(lane, fill = lane_colors["otherlanes_Yellow"], width = lane_w)
+
+        """        
+        # Drivable path, in yellow
         if (normalized):
-            lane = [
+            drivable_renormed = [
                 (x * new_img_width, y * new_img_height) 
-                for x, y in lane
+                for x, y in anno_entry["drivable_path"]
             ]
-        
-        # Draw Ego Left lane in Green
-        if idx == anno_entry["ego_indexes"][0]:
-            draw.line(lane, fill = lane_colors["egoLeft_Green"], width = lane_w)
-
-        # Draw Ego Right Lane in Blue
-        elif idx == anno_entry["ego_indexes"][1]:                
-            draw.line(lane, fill = lane_colors["egoRight_Blue"], width = lane_w)
-
-        # Other lanes in yellow
         else:
-            draw.line(lane, fill = lane_colors["otherlanes_Yellow"], width = lane_w)
-
-    """        
-    # Drivable path, in yellow
-    if (normalized):
-        drivable_renormed = [
-            (x * new_img_width, y * new_img_height) 
-            for x, y in anno_entry["drivable_path"]
-        ]
-    else:
-        drivable_renormed = anno_entry["drivable_path"]
-    draw.line(drivable_renormed, fill = lane_colors["drive_path_yellow"], width = lane_w)
-    """
+            drivable_renormed = anno_entry["drivable_path"]
+        draw.line(drivable_renormed, fill = lane_colors["drive_path_yellow"], width = lane_w)
+        """
 
-    # Save visualization img, same format with raw, just different dir
-    raw_img.save(os.path.join(visualization_dir, save_name))
+        # Save visualization img, same format with raw, just different dir
+        raw_img.save(os.path.join(visualization_dir, save_name))
 
 
     #renomalize all lanes
@@ -412,46 +461,83 @@ def parseAnnotations(
                 return anno_data
 
 
+def processFrame(
+        img_index, img_path,
+        raw_dir, visualization_dir, mask_dir
+):
+    """
+    Parses a frame and saves its images, returning (img_index, frame GT), or (img_index, None)
+    if the frame is skipped. Runs in the worker processes.
+    """
+    # Preload image file for multiple uses later
+    raw_img = Image.open(img_path).convert("RGB")
+    img_width, img_height = raw_img.size
+
+    init_img_size = raw_img.size
+
+    resize = None
+    crop = None
+
+    if (init_img_size == SIZE_DICT["beeg"]):
+        resize = 0.5
+        crop = CROP_BEEG
+    elif (init_img_size == SIZE_DICT["half_beeg"]):
+        resize = None
+        crop = CROP_BEEG
+    elif (init_img_size == SIZE_DICT["weird"]):
+        resize = None
+        crop = CROP_WEIRD
+
+    anno_path = img_path.replace(".jpg", ".lines.json").replace(IMG_DIR, LABEL_DIR)
+
+    this_data = parseAnnotations(
+        anno_path = anno_path,
+        init_img_width = img_width,
+        init_img_height = img_height,
+        resize = resize,
+        crop = crop
+    )
+    if (this_data is None):
+        return (img_index, None)
+
+    annotateGT(
+        raw_img = raw_img,
+        anno_entry = this_data,
+        img_index = img_index,
+        raw_dir = raw_dir,
+        visualization_dir = visualization_dir,
+        mask_dir = mask_dir,
+        init_img_height = img_height,
+        init_img_width = img_width,
+        resize = resize,
+        crop = crop
+    )
+
+    frame_data = {}
+    #frame_data["drivable_path"] = this_data["drivable_path"]
+    frame_data["egoleft_lane"] = this_data["lanes"][this_data["ego_indexes"][0]]
+    frame_data["egoright_lane"] = this_data["lanes"][this_data["ego_indexes"][1]]
+    frame_data["other_lanes"]=[]
+
+    #identify other lanes and save in frame data
+    for idx,lane in enumerate(this_data["lanes"]):
+        if idx in this_data["ego_indexes"]:
+            continue
+        else:
+            frame_data["other_lanes"].append(lane)
+
+    frame_data["img_height"] = this_data["img_height"]
+    frame_data["img_width"] = this_data["img_width"]
+
+    return (img_index, frame_data)
+
+
 if __name__ == "__main__":
 
     # ============================== Dataset structure ============================== #
 
     ROOT_DIR = "Curvelanes"
     LIST_SPLITS = ["train", "valid"]
-    IMG_DIR = "images"
-    LABEL_DIR = "labels"
-
-    # I got this result from `./EDA_imgsizes.ipynb`
-    SIZE_DICT = {
-        "beeg" : (2560, 1440),
-        "half_beeg" : (1280, 720),
-        "weird" : (1570, 660),
-    }
-
-    BEEG_Y_CROP_SUM = 320
-    BEEG_X_CROP = 240
-    BEEG_Y_CROP_TOP_RATIO = 0.75
-    CROP_BEEG = {
-        "TOP" : int(BEEG_Y_CROP_SUM * BEEG_Y_CROP_TOP_RATIO),
-        "RIGHT" : BEEG_X_CROP,
-        "BOTTOM" : int(BEEG_Y_CROP_SUM * (1 - BEEG_Y_CROP_TOP_RATIO)),
-        "LEFT" : BEEG_X_CROP
-    }
-    
-    WEIRD_Y_CROP = 130
-    WEIRD_X_CROP = 385
-    CROP_WEIRD = {
-        "TOP" : WEIRD_Y_CROP,
-        "RIGHT" : WEIRD_X_CROP,
-        "BOTTOM" : WEIRD_Y_CROP,
-        "LEFT" : WEIRD_X_CROP
-    }
-
-    # ====== Heuristic boundaries of drivable path for automatic auditing ====== #
-
-    LEFT_ANCHOR_BOUNDARY = RIGHT_ANCHOR_BOUNDARY = 0.2
-    HEIGHT_BOUNDARY = 0.15
-    ANGLE_BOUNDARY = 30
 
     # ============================== Parsing args ============================== #
 
@@ -477,6 +563,25 @@ if __name__ == "__main__":
         required = False,
         default = 5
     )
+    parser.add_argument(
+        "--num_workers",
+        type = int,
+        help = "Num. worker processes, defaults to the number of CPUs.",
+        required = False
+    )
+    parser.add_argument(
+        "--label_format",
+        type = str,
+        choices = LABEL_FORMATS,
+        help = "Label file format, jsonl streams each frame to drivable_path.jsonl as soon as it is processed.",
+        required = False,
+        default = "json"
+    )
+    parser.add_argument(
+        "--skip_visualization",
+        action = "store_true",
+        help = "Do not render the visualization images."
+    )
     # For debugging only
     parser.add_argument(
         "--early_stopping",
@@ -510,9 +615,9 @@ if __name__ == "__main__":
         |----image
         |----segmentation
         |----visualization
-        |----drivable_path.json
+        |----drivable_path.json (or drivable_path.jsonl)
     """
-    list_subdirs = ["image", "segmentation", "visualization"]
+    list_subdirs = ["image", "segmentation"] if (args.skip_visualization) else ["image", "segmentation", "visualization"]
     if (os.path.exists(output_dir)):
         warnings.warn(f"Output directory {output_dir} already exists. Purged")
         shutil.rmtree(output_dir)
@@ -523,9 +628,13 @@ if __name__ == "__main__":
 
     # ============================== Parsing annotations ============================== #
 
-    # Parse data by batch
-    data_master = {}
-    img_id_counter = -1
+    raw_dir = os.path.join(output_dir, "image")
+    visualization_dir = None if (args.skip_visualization) else os.path.join(output_dir, "visualization")
+    mask_dir = os.path.join(output_dir, "segmentation")
+
+    # Parse data by batch, labels are written in frame order as the workers finish them
+    label_writer = LabelWriter(getLabelsPath(output_dir, "drivable_path", args.label_format))
+    img_id_iter = itertools.count()
 
     for split in LIST_SPLITS:
         print(f"\n==================== Processing {split} data ====================\n")
@@ -533,76 +642,27 @@ if __name__ == "__main__":
         with open(raw_img_book, "r") as f:
             list_raw_files = f.readlines()
 
-            for i in range(0, len(list_raw_files), sampling_step):
-                img_path = os.path.join(dataset_dir, ROOT_DIR, split, list_raw_files[i]).strip()
-                img_id_counter += 1
-                # print(img_id_counter)
-                # Preload image file for multiple uses later
-                raw_img = Image.open(img_path).convert("RGB")
-                img_width, img_height = raw_img.size
-
-                init_img_size = raw_img.size
-
-                resize = None
-                crop = None
-
-                if (init_img_size == SIZE_DICT["beeg"]):
-                    resize = 0.5
-                    crop = CROP_BEEG
-                elif (init_img_size == SIZE_DICT["half_beeg"]):
-                    resize = None
-                    crop = CROP_BEEG
-                elif (init_img_size == SIZE_DICT["weird"]):
-                    resize = None
-                    crop = CROP_WEIRD
-
-                anno_path = img_path.replace(".jpg", ".lines.json").replace(IMG_DIR, LABEL_DIR)
-
-                this_data = parseAnnotations(
-                    anno_path = anno_path,
-                    init_img_width = img_width,
-                    init_img_height = img_height,
-                    resize = resize,
-                    crop = crop
-                )
-                if (this_data is not None):
-
-                    annotateGT(
-                        raw_img = raw_img,
-                        anno_entry = this_data,
-                        raw_dir = os.path.join(output_dir, "image"),
-                        visualization_dir = os.path.join(output_dir, "visualization"),
-                        mask_dir = os.path.join(output_dir, "segmentation"),
-                        init_img_height = img_height,
-                        init_img_width = img_width,
-                        resize = resize,
-                        crop = crop
-                    )
-
-                    # Save as 6-digit incremental index
-                    img_index = str(str(img_id_counter).zfill(6))
-                    data_master[img_index] = {}
-                    #data_master[img_index]["drivable_path"] = this_data["drivable_path"]
-                    data_master[img_index]["egoleft_lane"] = this_data["lanes"][this_data["ego_indexes"][0]]
-                    data_master[img_index]["egoright_lane"] = this_data["lanes"][this_data["ego_indexes"][1]]
-                    data_master[img_index]["other_lanes"]=[]
-
-                    #identify other lanes and save in data master
-                    for idx,lane in enumerate(this_data["lanes"]):
-                        if idx in this_data["ego_indexes"]:
-                            continue
-                        else:
-                            data_master[img_index]["other_lanes"].append(lane)
-                    
-                    
-                    
-                    data_master[img_index]["img_height"] = this_data["img_height"]
-                    data_master[img_index]["img_width"] = this_data["img_width"]
-
-                    # Early stopping, it defined
-                    if (early_stopping and img_id_counter >= early_stopping - 1):
-                        break
+        sampled_raw_files = itertools.islice(list_raw_files, 0, None, sampling_step)
+        # Early stopping, if defined
+        if (early_stopping):
+            sampled_raw_files = itertools.islice(sampled_raw_files, early_stopping)
+
+        # Frame IDs are assigned to every sampled file, as 6-digit incremental index
+        frame_tasks = (
+            (
+                str(next(img_id_iter)).zfill(6),
+                os.path.join(dataset_dir, ROOT_DIR, split, raw_file).strip(),
+                raw_dir, visualization_dir, mask_dir
+            )
+            for raw_file in sampled_raw_files
+        )
+        for img_index, frame_data in runFrames(
+            processFrame,
+            frame_tasks,
+            args.num_workers
+        ):
+            if (frame_data is not None):
+                label_writer.write(img_index, frame_data)
 
     # Save master data
-    with open(os.path.join(output_dir, "drivable_path.json"), "w") as f:
-        json.dump(data_master, f, indent = 4)
\ No newline at end of file
+    label_writer.close()
@@ -3,10 +3,14 @@
 import argparse
 import json
 import os
+import sys
 import pathlib
+import itertools
 from PIL import Image, ImageDraw
 import warnings
-from datetime import datetime
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from EgoPath.create_path.common.frame_pool import runFrames
+from EgoPath.create_path.common.label_stream import LABEL_FORMATS, LabelWriter, getLabelsPath
 
 # Custom warning format cuz the default one is wayyyyyy too verbose
 def custom_warning_format(message, category, filename, lineno, line=None):
@@ -14,6 +18,10 @@ def custom_warning_format(message, category, filename, lineno, line=None):
 
 warnings.formatwarning = custom_warning_format
 
+# All TuSimple frames share the same size
+img_width = 1280
+img_height = 720
+
 # ============================== Helper functions ============================== #
 
 def normalizeCoords(lane, width, height):
@@ -126,7 +134,7 @@ def getDrivablePath(left_ego, right_ego):
 
 
 def annotateGT(
-        anno_entry, anno_raw_file, 
+        anno_entry, anno_raw_file, frame_id,
         raw_dir, visualization_dir, mask_dir,
         img_width, img_height,
         normalized = True
@@ -134,7 +142,7 @@ def annotateGT(
     """
     Annotates and saves an image with:
         - Raw image, in "output_dir/image".
-        - Annotated image with all lanes, in "output_dir/visualization".
+        - Annotated image with all lanes, in "output_dir/visualization", unless visualization_dir is None.
         - Binary segmentation mask of drivable path, in "output_dir/segmentation".
 
     """
@@ -145,40 +153,42 @@ def annotateGT(
     # Define save name
     # Keep original pathname (back to 5 levels) for traceability, but replace "/" with "-"
     # Also save in PNG (EXTREMELY SLOW compared to jpg, for lossless quality)
-    save_name = str(img_id_counter).zfill(5) + ".png"
+    save_name = frame_id + ".png"
 
     # Copy raw img and put it in raw dir.
     raw_img.save(os.path.join(raw_dir, save_name))
     
     # Draw all lanes & lines
-    draw = ImageDraw.Draw(raw_img)
     lane_colors = {         
         "leftego_green": (0, 255, 0),
         "rightego_blue" : (0,0,255),
         "outer_yellow": (255, 255, 0)
     }
     lane_w = 5
-    # Draw lanes
-    for idx, lane in enumerate(anno_entry["lanes"]):
-        if (normalized):
-            lane = [(x * img_width, y * img_height) for x, y in lane]
-        
-        # left ego lane in green
-        if (idx == anno_entry["ego_indexes"][0]):           
-            draw.line(lane, fill = lane_colors["leftego_green"], width = lane_w)
 
-        # right ego lane in blue    
-        elif (idx == anno_entry["ego_indexes"][1]):
-            draw.line(lane, fill = lane_colors["rightego_blue"], width = lane_w)
+    # Visualization is optional
+    if (visualization_dir is not None):
+        draw = ImageDraw.Draw(raw_img)
 
-        # Outer lanes, in yellow
-        else:            
-            draw.line(lane, fill = lane_colors["outer_yellow"], width = lane_w)
+        # Draw lanes
+        for idx, lane in enumerate(anno_entry["lanes"]):
+            if (normalized):
+                lane = [(x * img_width, y * img_height) for x, y in lane]
+            
+            # left ego lane in green
+            if (idx == anno_entry["ego_indexes"][0]):           
+                draw.line(lane, fill = lane_colors["leftego_green"], width = lane_w)
 
-  
+            # right ego lane in blue    
+            elif (idx == anno_entry["ego_indexes"][1]):
+                draw.line(lane, fill = lane_colors["rightego_blue"], width = lane_w)
 
-    # Save visualization img, same format with raw, just different dir
-    raw_img.save(os.path.join(visualization_dir, save_name))
+            # Outer lanes, in yellow
+            else:            
+                draw.line(lane, fill = lane_colors["outer_yellow"], width = lane_w)
+
+        # Save visualization img, same format with raw, just different dir
+        raw_img.save(os.path.join(visualization_dir, save_name))
 
     # renormalize all lanes
     lanes_renormed=[]
@@ -198,55 +208,106 @@ def annotateGT(
  
     mask.save(os.path.join(mask_dir, save_name))
 
-def parseAnnotations(anno_path):
+def parseAnnotationEntry(anno_line):
     """
-    Parses lane annotations from raw dataset file, then extracts normalized GT data.
+    Parses a single JSON line of a label file, then extracts normalized GT data.
+    Returns (raw_file, anno_data), with anno_data None if the entry is skipped.
 
     """
-    # Read each line of GT text file as JSON
-    with open(anno_path, "r") as f:
-        read_data = [json.loads(line) for line in f.readlines()]
+    item = json.loads(anno_line)
+    lanes = item["lanes"]
+    h_samples = item["h_samples"]
+    raw_file = item["raw_file"]
+
+    # Decouple from {lanes: [xi1, xi2, ...], h_samples: [y1, y2, ...]} to [(xi1, y1), (xi2, y2), ...]
+    # `lane_decoupled` is a list of sublists representing lanes, each lane is a list of (x, y) tuples.
+    lanes_decoupled = [
+        [(x, y) for x, y in zip(lane, h_samples) if x != -2]
+        for lane in lanes if sum(1 for x in lane if x != -2) >= 2     # Filter out lanes < 2 points (there's actually a bunch of em)
+    ]
+
+    # Determine 2 ego lanes
+    lane_anchors = [getLaneAnchor(lane) for lane in lanes_decoupled]
+    ego_indexes = getEgoIndexes(lane_anchors)
+
+    if (type(ego_indexes) is str):
+        if (ego_indexes.startswith("NO")):
+            warnings.warn(f"Parsing {raw_file}: {ego_indexes}")
+            return (raw_file, None)
+
+    left_ego = lanes_decoupled[ego_indexes[0]]
+    right_ego = lanes_decoupled[ego_indexes[1]]
 
-    # Parse data from those JSON lines
+    # Determine drivable path from 2 egos
+    drivable_path = getDrivablePath(left_ego, right_ego)
+
+    # Parse processed data, all coords normalized
+    anno_data = {
+        "lanes" : [normalizeCoords(lane, img_width, img_height) for lane in lanes_decoupled],
+        "ego_indexes" : ego_indexes,
+        "drivable_path" : normalizeCoords(drivable_path, img_width, img_height),
+        "img_width" : img_width,
+        "img_height" : img_height,
+    }
+
+    return (raw_file, anno_data)
+
+
+def parseAnnotations(anno_path, num_workers = None):
+    """
+    Parses lane annotations from raw dataset file, then extracts normalized GT data.
+    The JSON lines of the file are parsed in a pool of worker processes.
+
+    """
     anno_data = {}
-    for item in read_data:
-        lanes = item["lanes"]
-        h_samples = item["h_samples"]
-        raw_file = item["raw_file"]
-
-        # Decouple from {lanes: [xi1, xi2, ...], h_samples: [y1, y2, ...]} to [(xi1, y1), (xi2, y2), ...]
-        # `lane_decoupled` is a list of sublists representing lanes, each lane is a list of (x, y) tuples.
-        lanes_decoupled = [
-            [(x, y) for x, y in zip(lane, h_samples) if x != -2]
-            for lane in lanes if sum(1 for x in lane if x != -2) >= 2     # Filter out lanes < 2 points (there's actually a bunch of em)
-        ]
-
-        # Determine 2 ego lanes
-        lane_anchors = [getLaneAnchor(lane) for lane in lanes_decoupled]
-        ego_indexes = getEgoIndexes(lane_anchors)
-
-        if (type(ego_indexes) is str):
-            if (ego_indexes.startswith("NO")):
-                warnings.warn(f"Parsing {raw_file}: {ego_indexes}")
-                continue
-
-        left_ego = lanes_decoupled[ego_indexes[0]]
-        right_ego = lanes_decoupled[ego_indexes[1]]
-
-        # Determine drivable path from 2 egos
-        drivable_path = getDrivablePath(left_ego, right_ego)
-
-        # Parse processed data, all coords normalized
-        anno_data[raw_file] = {
-            "lanes" : [normalizeCoords(lane, img_width, img_height) for lane in lanes_decoupled],
-            "ego_indexes" : ego_indexes,
-            "drivable_path" : normalizeCoords(drivable_path, img_width, img_height),
-            "img_width" : img_width,
-            "img_height" : img_height,
-        }
+    with open(anno_path, "r") as f:
+        for raw_file, entry_data in runFrames(
+            parseAnnotationEntry,
+            ((line, ) for line in f),
+            num_workers,
+            chunksize = 64
+        ):
+            if (entry_data is not None):
+                anno_data[raw_file] = entry_data
 
     return anno_data
 
+
+def processFrame(
+    frame_id, anno_entry, anno_raw_file,
+    raw_dir, visualization_dir, mask_dir
+):
+    """
+    Saves the images of a parsed frame, returning (frame_id, frame GT).
+    Runs in the worker processes.
+
+    """
+    annotateGT(
+        anno_entry,
+        anno_raw_file = anno_raw_file,
+        frame_id = frame_id,
+        raw_dir = raw_dir,
+        visualization_dir = visualization_dir,
+        mask_dir = mask_dir,
+        img_height = anno_entry["img_height"],
+        img_width = anno_entry["img_width"],
+    )
+
+    anno_entry["other_lanes"]=[]
+    for idx,lane in enumerate(anno_entry["lanes"]):
+        if idx==anno_entry["ego_indexes"][0]:
+            anno_entry["egoleft_lane"]=lane
+        elif idx==anno_entry["ego_indexes"][1]:
+            anno_entry["egoright_lane"]=lane
+        else:
+            anno_entry["other_lanes"].append(lane)    
+    # Pop redundant keys
+    del anno_entry["lanes"]
+    del anno_entry["ego_indexes"]
+    del anno_entry["drivable_path"]
+
+    return (frame_id, anno_entry)
+
             
 if __name__ == "__main__":
 
@@ -259,9 +320,6 @@ if __name__ == "__main__":
     train_clip_codes = ["0313", "0531", "0601"] # Train labels are split into 3 dirs
     test_file = "test_label.json"               # Test file name
 
-    img_width = 1280
-    img_height = 720
-
     # ============================== Parsing args ============================== #
 
     parser = argparse.ArgumentParser(
@@ -277,6 +335,25 @@ if __name__ == "__main__":
         type = str, 
         help = "Output directory"
     )
+    parser.add_argument(
+        "--num_workers",
+        type = int,
+        help = "Num. worker processes, defaults to the number of CPUs.",
+        required = False
+    )
+    parser.add_argument(
+        "--label_format",
+        type = str,
+        choices = LABEL_FORMATS,
+        help = "Label file format, jsonl streams each frame to drivable_path.jsonl as soon as it is processed.",
+        required = False,
+        default = "json"
+    )
+    parser.add_argument(
+        "--skip_visualization",
+        action = "store_true",
+        help = "Do not render the visualization images."
+    )
     args = parser.parse_args()
 
     # Generate output structure
@@ -285,11 +362,11 @@ if __name__ == "__main__":
         |----image
         |----segmentation
         |----visualization
-        |----drivable_path.json
+        |----drivable_path.json (or drivable_path.jsonl)
     """
     dataset_dir = args.dataset_dir
     output_dir = args.output_dir
-    list_subdirs = ["image", "segmentation", "visualization"]
+    list_subdirs = ["image", "segmentation"] if (args.skip_visualization) else ["image", "segmentation", "visualization"]
     for subdir in list_subdirs:
         subdir_path = os.path.join(output_dir, subdir)
         if (not os.path.exists(subdir_path)):
@@ -310,60 +387,45 @@ if __name__ == "__main__":
     test_label_files = [os.path.join(dataset_dir, root_dir, test_file)]
     label_files = train_label_files + test_label_files
 
-    # Parse data by batch
-    data_master = {
-        "files": label_files,
-        "data": {}
-    }
+    raw_dir = os.path.join(output_dir, "image")
+    visualization_dir = None if (args.skip_visualization) else os.path.join(output_dir, "visualization")
+    mask_dir = os.path.join(output_dir, "segmentation")
 
-    img_id_counter = -1
+    # Parse data by batch, labels are written in frame order as the workers finish them.
+    # JSON labels keep the list of label files, next to the frames under "data"
+    label_writer = LabelWriter(
+        getLabelsPath(output_dir, "drivable_path", args.label_format),
+        metadata = {"files": label_files}
+    )
+    img_id_iter = itertools.count()
 
-    for anno_file in data_master["files"]:
+    for anno_file in label_files:
         print(f"\n==================== Processing data in label file {anno_file} ====================\n")
-        this_data = parseAnnotations(anno_file)
-        
-        list_raw_files = list(this_data.keys())
-        for raw_file in list_raw_files:
-
-            # Conduct index increment
-            img_id_counter += 1
-            #set_dir = "/".join(anno_file.split("/")[ : -1]) # Slap "train_set" or "test_set" to the end  <-- Specific to linux hence used os.path.dirname command below
-            set_dir= os.path.dirname(anno_file)
-            set_dir = os.path.join(set_dir, test_dir) if test_file in anno_file else set_dir    # Tricky test dir
-
-            # Annotate raw images
-            anno_entry = this_data[raw_file]
-            annotateGT(
-                anno_entry,
-                anno_raw_file = os.path.join(set_dir, raw_file), 
-                raw_dir = os.path.join(output_dir, "image"),
-                visualization_dir = os.path.join(output_dir, "visualization"),
-                mask_dir = os.path.join(output_dir, "segmentation"),
-                img_height = anno_entry["img_height"],
-                img_width = anno_entry["img_width"],
+        this_data = parseAnnotations(anno_file, args.num_workers)
+
+        #set_dir = "/".join(anno_file.split("/")[ : -1]) # Slap "train_set" or "test_set" to the end  <-- Specific to linux hence used os.path.dirname command below
+        set_dir= os.path.dirname(anno_file)
+        set_dir = os.path.join(set_dir, test_dir) if test_file in anno_file else set_dir    # Tricky test dir
+
+        # Change `raw_file` to 5-digit incremental index
+        frame_tasks = (
+            (
+                str(next(img_id_iter)).zfill(5), this_data[raw_file],
+                os.path.join(set_dir, raw_file),
+                raw_dir, visualization_dir, mask_dir
             )
+            for raw_file in list(this_data.keys())
+        )
+        for frame_id, frame_data in runFrames(
+            processFrame,
+            frame_tasks,
+            args.num_workers
+        ):
+            label_writer.write(frame_id, frame_data)
 
-            anno_entry["other_lanes"]=[]
-            for idx,lane in enumerate(anno_entry["lanes"]):
-                if idx==anno_entry["ego_indexes"][0]:
-                    anno_entry["egoleft_lane"]=lane
-                elif idx==anno_entry["ego_indexes"][1]:
-                    anno_entry["egoright_lane"]=lane
-                else:
-                    anno_entry["other_lanes"].append(lane)    
-            # Pop redundant keys
-            del anno_entry["lanes"]
-            del anno_entry["ego_indexes"]
-            del anno_entry["drivable_path"]
-            # Change `raw_file` to 5-digit incremental index
-            this_data[str(img_id_counter).zfill(5)] = anno_entry
-            this_data.pop(raw_file)
-
-        data_master["data"].update(this_data)
         print(f"Processed {len(this_data)} entries in above file.\n")
 
-    print(f"Done processing data with {len(data_master['data'])} entries in total.\n")
+    print(f"Done processing data with {label_writer.num_labels} entries in total.\n")
 
     # Save master data
-    with open(os.path.join(output_dir, "drivable_path.json"), "w") as f:
-        json.dump(data_master, f, indent = 4)
\ No newline at end of file
+    label_writer.close()
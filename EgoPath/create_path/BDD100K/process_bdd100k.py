@@ -1,6 +1,7 @@
 import argparse
 import json
 import os
+from multiprocessing import Pool
 from PIL import Image, ImageDraw
 import warnings
 import numpy as np
@@ -14,28 +15,42 @@ warnings.formatwarning = custom_warning_format
 
 
 # ============================== Mask Process functions ============================== #
-def extractMaskFromPNG(dir):
-    files = [f for f in os.listdir(dir) if os.path.isfile(os.path.join(dir,f))]
+def iterMaskFiles(mask_dir):
+    """
+    Lazily yields the (path, name) of every mask file in the subdirectories of mask_dir,
+    or in mask_dir itself if it has no subdirectories.
+
+    :param mask_dir: Audited BDD100k drivable area colormaps directory.
+    :return: Generator of (mask_path, mask_name) tuples.
+    """
+    mask_sub_dirs = [d for d in os.listdir(mask_dir) if os.path.isdir(os.path.join(mask_dir, d))]
+    if not mask_sub_dirs:
+        mask_sub_dirs = ['']
 
-    red_min = np.array([150, 0, 0])     # Dark red lower bound
-    red_max = np.array([255, 100, 100]) # Bright red upper bound
+    for mask_sub_dir in mask_sub_dirs:
+        with os.scandir(os.path.join(mask_dir, mask_sub_dir)) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    yield entry.path, entry.name
 
-    mask_np_list = []
+def extractMaskFromPNG(mask_path):
+    """
+    Extracts the binary mask of the red (ego lane) area of a drivable area colormap.
 
-    for f in files:
-        mask_path = os.path.join(dir, f)
-        # Load the image
-        img = Image.open(mask_path).convert("RGB")
-        img_np = np.array(img)
+    :param mask_path: Path to the colormap PNG.
+    :return: 2D uint8 numpy array, 255 for red pixels and 0 elsewhere.
+    """
+    red_min = np.array([150, 0, 0], dtype=np.uint8)     # Dark red lower bound
+    red_max = np.array([255, 100, 100], dtype=np.uint8) # Bright red upper bound
 
-        # Create a mask for red pixels
-        red_mask = np.all((img_np >= red_min) & (img_np <= red_max), axis=-1).astype(np.uint8) * 255
+    # Load the image
+    img = Image.open(mask_path).convert("RGB")
+    img_np = np.array(img)
 
-        # Append the binary mask to the list
-        mask_np_list.append(red_mask)
+    # Create a mask for red pixels (255 where all channels are within bounds)
+    red_mask = cv2.inRange(img_np, red_min, red_max)
 
-    # Return the list of binary masks
-    return mask_np_list, files
+    return red_mask
 
 def detectEdge(mask_np):
     """
@@ -44,24 +59,11 @@ def detectEdge(mask_np):
     :param mask_np: 2D numpy array representing the binary mask (e.g., grayscale image).
     :return: 2D numpy array with edge detection results.
     """
-    # Initialize two arrays to store edge detection results
-    edges1 = np.zeros_like(mask_np, dtype=np.float32)  # For forward differences
-    edges2 = np.zeros_like(mask_np, dtype=np.float32)  # For backward differences
-
-    # Iterate over each row in the mask
-    for y in range(mask_np.shape[0]):
-        row = mask_np[y, :]  # Extract the current row
+    # Absolute difference between each pixel and its right neighbour,
+    # the last column has no neighbour and is left at zero
+    edges = np.zeros(mask_np.shape, dtype=np.float32)
+    edges[:, :-1] = np.abs(np.diff(mask_np.astype(np.float32), axis=1))
 
-        # Compute the forward differences between adjacent pixels
-        edges1[y, :-1] = row[1:] - row[:-1]
-        
-        # Compute the backward differences between adjacent pixels
-        edges2[y, :-1] = row[:-1] - row[1:]
-    
-    # Combine the absolute values of the forward and backward differences
-    # Use the maximum value to capture the strongest edge response
-    edges = np.maximum(np.abs(edges1), np.abs(edges2))
-    
     return edges
 
 def fromMaskToPoint(mask_np,direction = 'x'):
@@ -70,50 +72,40 @@ def fromMaskToPoint(mask_np,direction = 'x'):
 
     :param mask_np: mask in np.array format
     :param direction: x - detect row by row, y - detect column by column
-    :return: List of points [(x1, y1), (x2, y2), ...]
+    :return: Array of points [[x1, y1], [x2, y2], ...] with shape (N, 2)
     """
     if direction not in {'x', 'y'}:
         raise ValueError("Invalid direction! Only 'x' or 'y' are accepted.")
     
-    edge_point_list = []
     if direction == 'y':
-        for x in range(mask_np.shape[1]):
-            column = mask_np[:, x]
-            column_indices = np.where(column > 0)[0]
-            for y in column_indices:
-                edge_point_list.append((x,y))
+        # Nonzero of the transposed mask is ordered column by column
+        x_indices, y_indices = np.nonzero(mask_np.T > 0)
     elif direction == 'x':
-        for y in range(mask_np.shape[0]):
-            row = mask_np[y, :]
-            row_indices = np.where(row > 0)[0]
-            for x in row_indices:
-                edge_point_list.append((x,y))
+        y_indices, x_indices = np.nonzero(mask_np > 0)
 
-    return edge_point_list
+    return np.stack([x_indices, y_indices], axis=1)
 
 def fromPointToMask(point_list, img_width = 1280, img_height = 720, show = False):
     """
     Converts a list of points into a binary mask image.
     
-    :param point_list: List of tuples representing points (x, y) to be drawn.
+    :param point_list: Array or list of points (x, y) to be drawn.
     :param img_width: Width of the output image.
     :param img_height: Height of the output image.
     :return: A numpy array representing the binary mask image.
     """
-    # Create a blank image (grayscale) with initial black background
-    new_image = Image.new('L', (img_width, img_height), 0)  # 'L' for grayscale, initial color 0 (black)
-    
-    # Initialize a drawing object
-    draw_new_image = ImageDraw.Draw(new_image)
-    
-    # Draw each point in the point list onto the image
-    for x, y in point_list:
-        draw_new_image.point((x, y), fill=255)  # Set the pixel at (x, y) to white (255)
-    
+    # Create a blank mask with initial black background
+    mask_np = np.zeros((img_height, img_width), dtype=np.uint8)
+
+    # Set the pixels of all points inside the image to white (255)
+    points = np.asarray(point_list, dtype=np.int64).reshape(-1, 2)
+    x, y = points[:, 0], points[:, 1]
+    in_image = (x >= 0) & (x < img_width) & (y >= 0) & (y < img_height)
+    mask_np[y[in_image], x[in_image]] = 255
+
     if show:
-        new_image.show()
-    # Convert the PIL image to a numpy array for further processing
-    return np.array(new_image)
+        Image.fromarray(mask_np).show()
+    return mask_np
 
 def excludeTopBottomEdge(edges,x_threshold=5, y_threshold = 1):
     """
@@ -123,33 +115,20 @@ def excludeTopBottomEdge(edges,x_threshold=5, y_threshold = 1):
     :param y_threshold: Maximum allowed spacing between two points in the y-direction.
     :return: List of filtered edge points.
     """
-    edge_point_list = fromMaskToPoint(edges,direction='y')
-    
-    filtered_edge_point_list = []
-    for count in range(len(edge_point_list) - 1):
-        next_count = count + 1
+    # A point is kept if another edge point lies 1 to x_threshold - 1 columns to its
+    # right and at most y_threshold rows above or below it
+    edge_mask = edges > 0
 
-        # Extract current point
-        prev_point_x = edge_point_list[count][0]
-        prev_point_y = edge_point_list[count][1]
+    near_rows = edge_mask.copy()
+    for y_shift in range(1, y_threshold + 1):
+        near_rows[y_shift:, :] |= edge_mask[:-y_shift, :]
+        near_rows[:-y_shift, :] |= edge_mask[y_shift:, :]
 
-        while next_count < len(edge_point_list):
-            # Extract the next point
-            current_point_x = edge_point_list[next_count][0]
-            current_point_y = edge_point_list[next_count][1]
+    has_neighbour = np.zeros_like(edge_mask)
+    for x_shift in range(1, x_threshold):
+        has_neighbour[:, :-x_shift] |= near_rows[:, x_shift:]
 
-            # Compute spacing in x and y directions
-            x_space = np.abs(current_point_x - prev_point_x)
-            y_space = np.abs(current_point_y - prev_point_y)
-
-            # Check conditions
-            if x_space != 0 and y_space <= y_threshold and x_space < x_threshold:
-                filtered_edge_point_list.append((prev_point_x, prev_point_y))
-                break  # Move to the next `count`
-
-            # Increment `next_count` to evaluate the next point
-            next_count += 1
-    return filtered_edge_point_list
+    return fromMaskToPoint(edge_mask & has_neighbour, direction='y')
 
 def filterOnePointEdge(edges):
     """
@@ -160,26 +139,16 @@ def filterOnePointEdge(edges):
     """
     # Get the height (number of rows) of the edge mask
     height = edges.shape[0]
-    prev_two_points = 0
-    # Iterate through each row of the edge mask
-    for y in range(height):
-        # Extract the current row
-        row = edges[y, :]
-        
-        # Find indices of non-zero (edge) points in the row
-        edge_index = np.where(row > 0)[0]
-        # print(edge_index)
-        
-        # If the row has fewer than two edge points, set the entire row to zero
-        if len(edge_index) < 2:
-            edges[y, :] = 0  # Set all elements in the row to zero (remove the row)
-
-        interval_to_next_two_point = y - prev_two_points
-        if interval_to_next_two_point >= 5:
-
-            edges[prev_two_points, :] = 0  # Set all elements in the row to zero (remove the row)
-        if len(edge_index) >= 2:
-            prev_two_points = y
+
+    # Rows with at least two edge points
+    two_point_rows = np.nonzero(np.count_nonzero(edges > 0, axis=1) >= 2)[0]
+
+    # A row with two points is only kept if the next one (or the last row of the mask)
+    # is less than 5 rows below it, all other rows are set to zero
+    next_rows = np.append(two_point_rows[1:], height - 1)[:len(two_point_rows)]
+    keep_rows = np.zeros(height, dtype=bool)
+    keep_rows[two_point_rows[next_rows - two_point_rows < 5]] = True
+    edges[~keep_rows, :] = 0
 
     # Return the modified edge mask
     return edges
@@ -193,49 +162,28 @@ def cutChippedEdge(edges, distance_criteria = 50):
     :param distance_criteria: The minimum distance between consecutive edges before a row is removed.
     :return: Modified edge mask with 'chipped' rows removed.
     """
-    height = edges.shape[0]
-    total_count = 0
-
-    # Count the total number of rows with edge points
-    for y in range(height):
-        row = edges[y,:]
-        edge_index = np.where(row>0)[0]
-        if len(edge_index)>0:
-            if total_count == 0:
-                # Initialize previous left and right positions
-                prev_left = edge_index[0]
-                prev_right = edge_index[-1]
-            total_count += 1
-
-    # Counter for the rows with edge points
-    count = 0
-
-    # Iterate over the edge mask rows to detect chipped lanes
-    for y in range(height):
-        row = edges[y,:]
-        edge_index = np.where(row>0)[0]
-
-        if len(edge_index) > 0:
-            # Calculate the distance from the previous edge positions
-            left_distance = np.abs(edge_index[0] - prev_left)
-            right_distance = np.abs(edge_index[-1] - prev_right)
-
-            # Update the previous positions for the next iteration
-            prev_left = edge_index[0]
-            prev_right = edge_index[-1]
-
-            # Increment the count of rows with edge points
-            count += 1
-
-            # Remove rows based on the distance criteria
-            if left_distance >= distance_criteria or right_distance >= distance_criteria:
-                if total_count // 2 >= count:
-                    # Remove the top half of the rows if the left distance is too large
-                    edges[:y,:] = 0
-                else:
-                    # Remove the bottom half of the rows if the right distance is too large
-                    edges[y:,:] = 0
-                    break
+    # Rows with edge points, with their leftmost and rightmost edge
+    edge_mask = edges > 0
+    edge_rows = np.nonzero(edge_mask.any(axis=1))[0]
+    if len(edge_rows) == 0:
+        return edges
+
+    row_masks = edge_mask[edge_rows]
+    left_index = np.argmax(row_masks, axis=1)
+    right_index = edges.shape[1] - 1 - np.argmax(row_masks[:, ::-1], axis=1)
+
+    # Distances from the edges of the previous row with edge points
+    left_distance = np.abs(np.diff(left_index, prepend=left_index[0]))
+    right_distance = np.abs(np.diff(right_index, prepend=right_index[0]))
+    chipped = np.nonzero((left_distance >= distance_criteria) | (right_distance >= distance_criteria))[0]
+
+    # Chipped rows in the top half remove all rows above them,
+    # the first one in the bottom half removes itself and all rows below
+    is_top = chipped + 1 <= len(edge_rows) // 2
+    if np.any(is_top):
+        edges[:edge_rows[chipped[is_top][-1]], :] = 0
+    if np.any(~is_top):
+        edges[edge_rows[chipped[~is_top][0]]:, :] = 0
 
     return edges
 
@@ -280,41 +228,30 @@ def getEgoLane(edge_mask):
     representing the ego lane boundaries.
 
     :param edge_mask: 2D numpy array representing the edge mask (binary image with edges).
-    :return: Two lists containing the leftmost and rightmost edge points for each row:
-             - left_edge_points: List of (x, y) tuples for leftmost edge points.
-             - right_edge_points: List of (x, y) tuples for rightmost edge points.
+    :return: Two arrays containing the leftmost and rightmost edge points for each row:
+             - left_edge_points: (N, 2) array of (x, y) leftmost edge points.
+             - right_edge_points: (N, 2) array of (x, y) rightmost edge points.
     """
     # Get the dimensions of the edge mask
     height, width = edge_mask.shape
 
-    # Initialize lists to store the leftmost and rightmost edge points
-    left_edge_points = []
-    right_edge_points = []
-
-    # Iterate through each row of the edge mask
-    for y in range(height):
-        # Extract the current row
-        row = edge_mask[y, :]
+    # Rows with at least two edge points
+    edge_points = edge_mask > 0
+    rows = np.nonzero(np.count_nonzero(edge_points, axis=1) >= 2)[0]
 
-        # Find indices of non-zero (edge) points in the row
-        edge_index = np.where(row > 0)[0]
+    # Leftmost (first non-zero index) and rightmost (last non-zero index) edge points
+    row_points = edge_points[rows]
+    leftmost_x = np.argmax(row_points, axis=1)
+    rightmost_x = width - 1 - np.argmax(row_points[:, ::-1], axis=1)
 
-        # If there are edge points in this row
-        if len(edge_index) > 0:
-            # Identify the leftmost edge point (first non-zero index)
-            leftmost_x = edge_index[0]
+    left_edge_points = np.stack([leftmost_x, rows], axis=1)
+    right_edge_points = np.stack([rightmost_x, rows], axis=1)
 
-            # If there are at least two edge points, identify the rightmost edge point
-            if len(edge_index) >= 2:
-                rightmost_x = edge_index[-1]
-                left_edge_points.append((leftmost_x, y))   
-                right_edge_points.append((rightmost_x, y))
-
-    # Return the lists of leftmost and rightmost edge points
+    # Return the arrays of leftmost and rightmost edge points
     return left_edge_points, right_edge_points
 
 
-def getDrivablePath(left_ego, right_ego):
+def getDrivablePath(left_ego, right_ego, img_height):
     """
     Computes drivable path as midpoint between 2 ego lanes, basically the main point of this task.
 
@@ -406,6 +343,87 @@ def drawDrivablePathMask(drivable_path,img_width = 1280, img_height = 720):
     return mask
 
 
+# ============================== Pipeline functions ============================== #
+
+def processMask(mask_path, mask_name, image_path, staging_name, output_dir, crop, img_width, img_height):
+    """
+    Runs the whole mask pipeline of one frame in a worker process - extracts the ego lanes and
+    drivable path from its mask, and saves the image, visualization and segmentation under a
+    staging name, which the main process renames once the frame gets its ID.
+
+    :return: (mask_name, staging_name, normalized drivable path), the drivable path is None
+             if the frame is skipped.
+    """
+    mask_np = extractMaskFromPNG(mask_path)
+    mask_height, mask_width = mask_np.shape
+
+    # Detect edges in the mask
+    edges = detectEdge(mask_np)
+
+    # Exclude isolated top and bottom edges from the detected edges
+    new_edges_point_list = excludeTopBottomEdge(edges, x_threshold=5, y_threshold=1)
+
+    # Convert the edge points back into a mask
+    edges = fromPointToMask(new_edges_point_list, mask_width, mask_height, show=False)
+
+    # Filter out any one-point edges from the mask
+    edges = filterOnePointEdge(edges)
+
+    # Cut chipped edge from the mask
+    edges = cutChippedEdge(edges)
+
+    if crop:
+        edges = cropMask(edges, crop)
+
+    # Detect the left and right ego lanes (representing the drivable area)
+    left_ego, right_ego = getEgoLane(edge_mask=edges)
+    if len(left_ego) <= 5 or len(right_ego) <= 5:
+        return mask_name, staging_name, None
+
+    # Generate the drivable path by connecting the left and right ego lanes
+    drivable_path = getDrivablePath(left_ego, right_ego, img_height)
+
+    # Crop the image with the bounding box (left, upper, right, lower) and save it
+    image = Image.open(image_path).convert("RGB")
+    if crop:
+        crop_box = (crop['LEFT'], crop['TOP'], crop['LEFT']+img_width, crop['TOP']+img_height)
+        cropped_image = image.crop(crop_box)
+    else:
+        cropped_image = image
+    cropped_image.save(os.path.join(output_dir, 'image', staging_name))
+
+    # Annotate the image with the drivable path and ego lanes
+    annotated_image = annotateImage(cropped_image, [left_ego.tolist(), right_ego.tolist()], drivable_path)
+    annotated_image.save(os.path.join(output_dir, "visualization", staging_name))
+
+    # Generate a segmentation mask for the drivable path
+    segmentation_mask = drawDrivablePathMask(drivable_path, img_width, img_height)
+    segmentation_mask.save(os.path.join(output_dir, "segmentation", staging_name))
+
+    return mask_name, staging_name, normalizeCoords(drivable_path, img_width, img_height)
+
+def processMaskTask(task):
+    return processMask(*task)
+
+def runMaskTasks(mask_tasks, num_workers = None, chunksize = 8):
+    """
+    Runs processMask for each task of a (lazy) task generator in a pool of worker processes,
+    yielding the results in task order. Masks are only loaded inside the workers, so memory
+    use does not grow with the number of masks.
+    """
+    num_workers = num_workers if num_workers else os.cpu_count()
+
+    # Masks are processed in the main process if no pool is required
+    if num_workers <= 1:
+        for task in mask_tasks:
+            yield processMaskTask(task)
+        return
+
+    with Pool(num_workers) as pool:
+        for result in pool.imap(processMaskTask, mask_tasks, chunksize=chunksize):
+            yield result
+
+
 if __name__ == '__main__':
     # ============================== Dataset structure ============================== #
 
@@ -435,6 +453,13 @@ if __name__ == '__main__':
         help = "Output directory"
     )
 
+    parser.add_argument(
+        "--num_workers",
+        type = int,
+        help = "Number of worker processes, defaults to the number of CPUs.",
+        required = False
+    )
+
     parser.add_argument(
         "--crop",
         type = int,
@@ -463,8 +488,6 @@ if __name__ == '__main__':
                 "BOTTOM" : args.crop[2],
                 "LEFT" : args.crop[3],
             }
-            former_img_height = img_height
-            former_img_width = img_width
             img_height -= crop["TOP"] + crop["BOTTOM"]
             img_width -= crop["LEFT"] + crop["RIGHT"]
             print(f"New image size: {img_width}W x {img_height}H.\n")
@@ -489,97 +512,54 @@ if __name__ == '__main__':
         if (not os.path.exists(subdir_path)):
             os.makedirs(subdir_path, exist_ok = True)
 
-    # Separate files to stop it from crashing
-    mask_sub_dirs = [d for d in os.listdir(mask_dir) if os.path.isdir(os.path.join(mask_dir, d))]
-
-
-    # Read the label JSON file and extract mask data and corresponding image names
+    # Masks are streamed one file at a time from mask_dir (or its subdirectories) to the
+    # worker processes, which save their outputs under a staging name unique to the task
+    mask_tasks = (
+        (
+            mask_path,
+            mask_name,
+            os.path.join(image_dir, mask_name.replace('png','jpg')),
+            "tmp_" + str(task_index).zfill(7) + ".png",
+            output_dir,
+            crop,
+            img_width,
+            img_height
+        )
+        for task_index, (mask_path, mask_name) in enumerate(iterMaskFiles(mask_dir))
+    )
 
     # Initialize the master data structure for storing processed results
     data_master = {}
 
     name_data = {}
-    print('Extracting mask from mask_dir')
+    print('Start Mask Processing of mask_dir')
     img_id_counter = 0
-    for mask_sub_dir in mask_sub_dirs:
-        print(f'Extracting mask from mask_dir number {mask_sub_dir}')
-        mask_np_list, name_list = extractMaskFromPNG(os.path.join(mask_dir,mask_sub_dir))
-        
-        print(f'Start Mask Procressing of sub_dir number {mask_sub_dir}')
-        
-        # Iterate over each mask and corresponding image
-        for index, mask_np in enumerate(mask_np_list):
-            # Generate the save name for the image (6-digit format)
-            save_name = str(img_id_counter).zfill(6) + ".png"
-            # print(name_list[img_id_counter])
-
-            # Get the image file path and open the image
-            image_path = os.path.join(image_dir, name_list[index].replace('png','jpg'))
-            image = Image.open(image_path).convert("RGB")
-
-            # Detect edges in the mask
-            edges = detectEdge(mask_np)
-
-            # Exclude isolated top and bottom edges from the detected edges
-            new_edges_point_list = excludeTopBottomEdge(edges, x_threshold=5, y_threshold=1)
-
-            # Convert the list of edge points back into a mask
-            edges = fromPointToMask(new_edges_point_list,former_img_width,former_img_height ,show=False)
-
-            # Filter out any one-point edges from the mask
-            edges = filterOnePointEdge(edges)
-
-            # For debugging show image
-            # showImage(edges)
-
-            # Cut chipped edge from the mask
-            edges = cutChippedEdge(edges)
-
-            # For debugging show image
-            # showImage(edges)
-            if crop:
-                edges = cropMask(edges,crop)
-            # For debugging show image
-            # showImage(edges)
-
-            # Detect the left and right ego lanes (representing the drivable area)
-            left_ego, right_ego = getEgoLane(edge_mask=edges)
-            if len(left_ego) <= 5 or len(right_ego) <=5:
-                continue
-            # Generate the drivable path by connecting the left and right ego lanes
-            drivable_path = getDrivablePath(left_ego, right_ego)
-
-            # Copy the original image and save it to the 'image' directory
-            copy_image = image.copy()
-            # Define the bounding box (left, upper, right, lower)
-            crop_box = (crop['LEFT'], crop['TOP'], crop['LEFT']+img_width, crop['TOP']+img_height)
-
-            # Crop the image
-            cropped_image = copy_image.crop(crop_box)
-            cropped_image.save(os.path.join(output_dir, 'image', save_name))
-
-            # Annotate the image with the drivable path and ego lanes, then save it to the 'visualization' directory
-            annotated_image = annotateImage(cropped_image, [left_ego, right_ego], drivable_path)
-            annotated_image.save(os.path.join(output_dir, "visualization", save_name))
-
-            # Generate a segmentation mask for the drivable path and save it to the 'segmentation' directory
-            segmentation_mask = drawDrivablePathMask(drivable_path, img_width, img_height)
-            segmentation_mask.save(os.path.join(output_dir, "segmentation", save_name))
-
-            # Prepare annotation data for the current image (normalized drivable path coordinates)
-            anno_data = {}
-            anno_data[str(img_id_counter).zfill(6)] = {
-                "drivable_path": normalizeCoords(drivable_path, img_width, img_height),
-                "img_width": img_width,
-                "img_height": img_height,
-            }
+    for mask_count, (mask_name, staging_name, drivable_path) in enumerate(runMaskTasks(mask_tasks, args.num_workers)):
+
+        if (mask_count + 1) % 1000 == 0:
+            print(f"Processed {mask_count + 1} masks, {img_id_counter} entries so far.")
+
+        if drivable_path is None:
+            continue
+
+        # Results come in mask order, so IDs are assigned here and the outputs
+        # renamed from their staging name (6-digit format)
+        save_name = str(img_id_counter).zfill(6) + ".png"
+        for subdir in list_subdirs:
+            os.replace(
+                os.path.join(output_dir, subdir, staging_name),
+                os.path.join(output_dir, subdir, save_name)
+            )
 
-            # Update the master data structure with the new annotation data
-            data_master.update(anno_data)
+        # Annotation data for the current image (normalized drivable path coordinates)
+        data_master[str(img_id_counter).zfill(6)] = {
+            "drivable_path": drivable_path,
+            "img_width": img_width,
+            "img_height": img_height,
+        }
 
-            name_data[str(img_id_counter).zfill(6)] = name_list[index]
-            img_id_counter += 1
-        print(f"Done processing data with {img_id_counter} entries.\n")
+        name_data[str(img_id_counter).zfill(6)] = mask_name
+        img_id_counter += 1
 
 
     # Print the total number of entries processed
@@ -591,4 +571,4 @@ if __name__ == '__main__':
 
     # Save the name JSON data to the output directory
     with open(os.path.join(output_dir, "name.json"), "w") as f:
-        json.dump(name_data, f, indent=4)
\ No newline at end of file
+        json.dump(name_data, f, indent=4)
@@ -7,6 +7,7 @@ import cv2
 import glob
 import json
 import argparse
+from multiprocessing import Pool
 
 # Define the region of interest (ROI)
 x_off, y_off = 62, 84  # Top-left corner coordinates
@@ -38,30 +39,50 @@ def polygon_area(x,y):
     main_area = np.dot(x[:-1], y[1:]) - np.dot(y[:-1], x[1:])
     return 0.5*np.abs(main_area + correction)
 
-def get_frame_positions_local(frame_count, frame_positions, frame_orientations):
+def create_local_trajectory(frame_positions, frame_orientations):
+    """
+    Compute the local future paths of all frames of a segment in one batched pass.
+    The sliding window is doubled until every path reaches the distance threshold
+    or the end of the segment within the window.
+
+    Parameters:
+    frame_positions (numpy.ndarray): The positions of the frames.
+    frame_orientations (numpy.ndarray): The orientations of the frames.
+
+    Returns:
+    LocalTrajectory: The local future paths of the frames.
+    """
+    num_frames = len(frame_positions)
+    window = min(future_frames, num_frames)
+    while True:
+        trajectory = orient.LocalTrajectory(frame_positions, frame_orientations, window)
+        if window == num_frames:
+            return trajectory
+        is_window_truncated = np.arange(num_frames) + window < num_frames
+        reaches_thres = np.nanmax(np.linalg.norm(trajectory.ecef_offsets, axis=2), axis=1) > distance_thres
+        if np.all(reaches_thres | ~is_window_truncated):
+            return trajectory
+        window = min(2*window, num_frames)
+
+def get_frame_positions_local(frame_count, trajectory):
     """
     Get local frame positions relative to a specific frame.
 
     Parameters:
     frame_count (int): The index of the frame to use as the reference.
-    seg_path (str): The path to the segment directory containing the global_pose data.
+    trajectory (LocalTrajectory): The local future paths of the frames of the segment.
 
     Returns:
     numpy.ndarray: An array of local frame positions.
     """
-    ecef_from_local = orient.rot_from_quat(frame_orientations[frame_count])
-    local_from_ecef = ecef_from_local.T
-    frame_positions_local = np.einsum('ij,kj->ki', local_from_ecef, frame_positions - frame_positions[frame_count])
-    frame_positions_local = frame_positions_local[frame_count:]
-    frame_positions = frame_positions[frame_count:]
-    dist = np.linalg.norm(frame_positions - frame_positions[0], axis=1)
+    frame_positions_local = trajectory.local_path(frame_count)
+    dist = trajectory.distances(frame_count)
     if np.max(dist) < distance_thres:
         end = len(dist)
     else:
         end = int(np.where(dist>distance_thres)[0][0])
     start = int(np.argmin(np.where(dist == 0)))
     frame_positions_local = frame_positions_local[start:end]
-    # print(np.linalg.norm(frame_positions[frame_count+200] - frame_positions[frame_count]))
     return frame_positions_local
 
 def extrapolate_to_bottom(img_pts):
@@ -107,24 +128,20 @@ def check_multiple_x_for_y(points):
     # Check if any y value has more than one corresponding x value
     return np.any(counts > 50) or np.any(points[:,1] < 200)
 
-def generate_mask_vis(frame_count, out_path, processed_img_count, 
-                      frame_positions, frame_orientations, org_img,
-                      height=1.2, line_color=(0,255,0)):
+def get_drivable_path_points(frame_count, trajectory, height=1.2):
     """
-    Generate a mask visualization for a specific frame.
+    Project the future path of the vehicle into a specific frame and check whether it is valid.
+    Only the poses of the segment are used, so frames can be selected without decoding the video.
 
     Parameters:
     frame_count (int): The index of the frame to process.
-    seg_path (str): The path to the segment directory containing the images.
-    width (float): The width of the path to visualize.
+    trajectory (LocalTrajectory): The local future paths of the frames of the segment.
     height (float): The height of the path to visualize.
-    fill_color (tuple): The color to fill the mask with.
-    line_color (tuple): The color to draw the lines with.
 
     Returns:
-    numpy.ndarray: An array of image points.
+    numpy.ndarray: An array of image points within the ROI, or None if the path is not valid.
     """
-    device_path = get_frame_positions_local(frame_count, frame_positions, frame_orientations)
+    device_path = get_frame_positions_local(frame_count, trajectory)
     device_path = device_path + np.array([0, 0, height])
 
 
@@ -149,91 +166,217 @@ def generate_mask_vis(frame_count, out_path, processed_img_count,
     auc = polygon_area(img_pts[:,0], img_pts[:,1])
     if auc > 17000:
         return None 
-    # print(len(img_pts_l), len(img_pts_r))
+    return img_pts
+
+def save_mask_vis(out_path, processed_img_count, org_img, img_pts, line_color=(0,255,0)):
+    """
+    Draw the drivable path of a frame and save the image, mask and visualization.
+
+    Parameters:
+    out_path (str): The path to the output directory.
+    processed_img_count (int): The number of the saved image.
+    org_img (numpy.ndarray): The cropped frame.
+    img_pts (numpy.ndarray): An array of image points within the ROI.
+    line_color (tuple): The color to draw the lines with.
+
+    Returns:
+    list: The image points normalized by the ROI size.
+    """
     img = org_img.copy()
     mask = np.zeros((img_h, img_w), np.uint8)
     for i in range(len(img_pts) - 1):
-        # if img_pts[i+1][1] > img_pts[i][1]:
-        #     return None
         cv2.line(img, img_pts[i], img_pts[i + 1], line_color, 3)
         cv2.line(mask, img_pts[i], img_pts[i + 1], (255), 3)
-    # print(processed_img_count, auc, img_pts[0], img_pts[-1])
     cv2.imwrite(f"{out_path}images/{processed_img_count:06d}.png", org_img)
     cv2.imwrite(f"{out_path}segmentation/{processed_img_count:06d}.png", mask)
     cv2.imwrite(f"{out_path}visualization/{processed_img_count:06d}.png", img)
     img_pts = [
-        [point[0] / img_w, point[1] / img_h]
+        [float(point[0]) / img_w, float(point[1]) / img_h]
         for point in img_pts
     ]
     return img_pts
 
-def extract_frames(seg_path, out_path, img_count, downsampling_factor=1):
+def generate_mask_vis(frame_count, out_path, processed_img_count, 
+                      trajectory, org_img,
+                      height=1.2, line_color=(0,255,0)):
+    """
+    Generate a mask visualization for a specific frame.
+
+    Parameters:
+    frame_count (int): The index of the frame to process.
+    out_path (str): The path to the output directory.
+    processed_img_count (int): The number of the saved image.
+    trajectory (LocalTrajectory): The local future paths of the frames of the segment.
+    org_img (numpy.ndarray): The cropped frame.
+    height (float): The height of the path to visualize.
+    line_color (tuple): The color to draw the lines with.
+
+    Returns:
+    list: The normalized image points, or None if the path is not valid.
+    """
+    img_pts = get_drivable_path_points(frame_count, trajectory, height)
+    if img_pts is None:
+        return None
+    return save_mask_vis(out_path, processed_img_count, org_img, img_pts, line_color)
+
+def select_frames(seg_path, downsampling_factor=1):
+    """
+    Select the frames of a segment which are saved, using only the poses of the segment.
+
+    Parameters:
+    seg_path (str): The path to the segment directory.
+    downsampling_factor (int): The factor by which to downsample the frames.
+
+    Returns:
+    list: A list of (frame index, image points) tuples of the selected frames.
+    """
+    frame_positions, frame_orientations = load_frame_pos(seg_path)
+    total_frames = frame_positions.shape[0]
+    trajectory = create_local_trajectory(frame_positions, frame_orientations)
+
+    selected_frames = []
+    last_saved_frame = 0
+    for frame_count in range(0, total_frames - future_frames):
+        if frame_count > last_saved_frame + downsampling_factor:
+            img_pts = get_drivable_path_points(frame_count, trajectory)
+            if img_pts is not None:
+                selected_frames.append((frame_count, img_pts))
+                last_saved_frame = frame_count
+    return selected_frames
+
+def extract_frames(seg_path, out_path, img_count, downsampling_factor=1, selected_frames=None):
     """    Extract frames from a video file and save them as images.
 
     Parameters:
     seg_path (str): The path to the segment directory containing the video file.
+    out_path (str): The path to the output directory.
+    img_count (int): The number of the first saved image.
     downsampling_factor (int): The factor by which to downsample the frames.
+    selected_frames (list): The frames to save as returned by select_frames, selected if not given.
 
     Returns:
-    int: The total number of frames extracted.
+    tuple: The drivable path of each saved image and the number of the next image.
     """
     video_path = seg_path +"video.hevc"
 
-    frame_positions, frame_orientations = load_frame_pos(seg_path)
-    total_frames = frame_positions.shape[0]
+    if selected_frames is None:
+        selected_frames = select_frames(seg_path, downsampling_factor)
 
     vidcap = cv2.VideoCapture(video_path)
 
     if not vidcap.isOpened():
         print("Error opening video file")
-        return
+        return {}, img_count
 
     frame_count = 0
-    last_saved_frame = 0
     jdata = {}
-    success, image = vidcap.read()
         
     x2, y2 = x_off+img_w, y_off+img_h # Bottom-right corner coordinates
     
-    while success and frame_count < (total_frames-future_frames):
-        if frame_count > last_saved_frame + downsampling_factor:
-            cropped_image = image[y_off:y2, x_off:x2]
-            drive_path = generate_mask_vis(frame_count, out_path, img_count, frame_positions, frame_orientations, cropped_image)
-            if drive_path is not None:
-                data = {f"{img_count:06d}":{"drivable_path": drive_path.tolist(),"img_width": img_w, "img_height": img_h}}
-                jdata.update(data)
-                img_count += 1
-                last_saved_frame = frame_count
-        success, image = vidcap.read()
-        frame_count += 1
+    for selected_frame, img_pts in selected_frames:
+        # Frames in between are only grabbed, without being retrieved as images
+        success = True
+        while success and frame_count < selected_frame:
+            success = vidcap.grab()
+            frame_count += 1
+        if success:
+            success, image = vidcap.read()
+            frame_count += 1
+        if not success:
+            print(f"Video of {seg_path} ended before frame {selected_frame}")
+            break
+        cropped_image = image[y_off:y2, x_off:x2]
+        drive_path = save_mask_vis(out_path, img_count, cropped_image, img_pts)
+        jdata[f"{img_count:06d}"] = {"drivable_path": drive_path, "img_width": img_w, "img_height": img_h}
+        img_count += 1
     vidcap.release()
     return jdata, img_count
 
+def get_segment_json_path(out_path, seg_index):
+    """
+    Get the path of the JSON lines file holding the drivable paths of a segment.
+    """
+    return f"{out_path}segments/{seg_index:05d}.jsonl"
+
+def process_segment(seg_index, seg_path, out_path, img_count, selected_frames):
+    """
+    Extract the selected frames of a segment and write their drivable paths as JSON lines.
+    The file is only created once the segment is complete, marking it as done for resumed runs.
+
+    Returns:
+    tuple: The segment index and the number of saved images.
+    """
+    jdata, _ = extract_frames(seg_path, out_path, img_count, selected_frames=selected_frames)
+    json_path = get_segment_json_path(out_path, seg_index)
+    with open(json_path + ".tmp", "w") as json_file:
+        for img_name, data in jdata.items():
+            json_file.write(json.dumps({img_name: data}) + "\n")
+    os.replace(json_path + ".tmp", json_path)
+    return seg_index, len(jdata)
+
+def process_segment_task(task):
+    return process_segment(*task)
+
+def write_drivable_path_json(out_path, num_segments):
+    """
+    Combine the JSON lines files of all segments into drivable_path.json,
+    streaming one image at a time.
+    """
+    with open(f"{out_path}drivable_path.json", "w") as json_file:
+        json_file.write("{")
+        is_first = True
+        for seg_index in range(num_segments):
+            json_path = get_segment_json_path(out_path, seg_index)
+            if not os.path.exists(json_path):
+                continue
+            with open(json_path, "r") as segment_file:
+                for line in segment_file:
+                    for img_name, data in json.loads(line).items():
+                        if not is_first:
+                            json_file.write(", ")
+                        json_file.write(json.dumps(img_name) + ": " + json.dumps(data))
+                        is_first = False
+        json_file.write("}")
+
 if __name__ == "__main__": 
     parser = argparse.ArgumentParser(description="Process video segments to generate masks and visualizations.")
     parser.add_argument('--df', type=int, default=60, help='Factor by which to downsample the frames.')
     parser.add_argument('--dataset_root_path', type=str, default="", help='Root path of the dataset.')
     parser.add_argument('--out_path', type=str, default="", help='Path to the output directory.')
+    parser.add_argument('--num_workers', type=int, default=None, help='Number of worker processes, defaults to the number of CPUs.')
 
     args = parser.parse_args()
     downsampling_factor = args.df
     dataset_root_path = args.dataset_root_path
     out_path = args.out_path
+    num_workers = args.num_workers if args.num_workers else os.cpu_count()
 
-    if not os.path.exists(out_path):
-        os.makedirs(out_path)
-        os.makedirs(out_path + "segmentation")
-        os.makedirs(out_path + "visualization")
-        os.makedirs(out_path + "images")
-
-    segments = glob.glob(dataset_root_path+"Chunk_*/*/*/")
-    json_data = {}
-    processed_img_count, img_count = 0, 0
-    for seg in segments:
-        print(f"Start processing {seg}")
-        jdata, img_count =  extract_frames(seg, out_path, img_count, downsampling_factor)
-        json_data.update(jdata)
-        # print(f"Finished processing {seg}")
-    with open(f"{out_path}drivable_path.json", "w") as json_file:
-        json.dump(json_data, json_file)
+    for out_dir in ["segmentation", "visualization", "images", "segments"]:
+        os.makedirs(out_path + out_dir, exist_ok=True)
+
+    # Segments are sorted so that images are numbered in the same order on every run
+    segments = sorted(glob.glob(dataset_root_path+"Chunk_*/*/*/"))
+
+    with Pool(num_workers) as pool:
+
+        # Frames are selected from the poses alone, which gives the number of the
+        # first image of every segment before any video is decoded
+        selected_frames = pool.starmap(select_frames, 
+            [(seg, downsampling_factor) for seg in segments])
+        img_counts = np.cumsum([0] + [len(frames) for frames in selected_frames])
+        print(f"Selected {img_counts[-1]} frames from {len(segments)} segments")
+
+        # Segments completed by an earlier run are skipped
+        tasks = [(seg_index, seg, out_path, int(img_counts[seg_index]), selected_frames[seg_index])
+                 for seg_index, seg in enumerate(segments)
+                 if not os.path.exists(get_segment_json_path(out_path, seg_index))]
+        if len(tasks) < len(segments):
+            print(f"Skipping {len(segments) - len(tasks)} segments completed by an earlier run")
+
+        for processed_count, (seg_index, num_images) in \
+                enumerate(pool.imap_unordered(process_segment_task, tasks)):
+            print(f"Processed {segments[seg_index]} - {num_images} images, "
+                  f"{processed_count + 1} of {len(tasks)} segments")
+
+    write_drivable_path_json(out_path, len(segments))
     print("All segments processed successfully", len(segments))
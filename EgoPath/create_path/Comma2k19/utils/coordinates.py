@@ -66,6 +66,22 @@ def ecef2geodetic(ecef, radians=False):
   geodetic = np.column_stack((lat, lon, h))
   return geodetic.reshape(input_shape)
 
+def ned2ecef_matrices(init_ecef):
+  """
+  Rotation matrices from NED to ECEF at each row of init_ecef
+  """
+  lat, lon, _ = (np.pi/180)*np.atleast_2d(ecef2geodetic(np.atleast_2d(init_ecef))).T
+  matrices = np.zeros((len(lat), 3, 3))
+  matrices[:, 0, 0] = -np.sin(lat)*np.cos(lon)
+  matrices[:, 0, 1] = -np.sin(lon)
+  matrices[:, 0, 2] = -np.cos(lat)*np.cos(lon)
+  matrices[:, 1, 0] = -np.sin(lat)*np.sin(lon)
+  matrices[:, 1, 1] = np.cos(lon)
+  matrices[:, 1, 2] = -np.cos(lat)*np.sin(lon)
+  matrices[:, 2, 0] = np.cos(lat)
+  matrices[:, 2, 2] = -np.sin(lat)
+  return matrices
+
 class LocalCoord(object):
   """
    Allows conversions to local frames. In this case NED.
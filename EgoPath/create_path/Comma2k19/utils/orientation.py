@@ -9,7 +9,8 @@ Supports both x2y and y_from_x format (y_from_x preferred!).
 
 import numpy as np
 from numpy import dot, inner, array, linalg
-from utils.coordinates import LocalCoord
+from numpy.lib.stride_tricks import sliding_window_view
+from utils.coordinates import LocalCoord, ned2ecef_matrices
 
 
 def euler2quat(eulers):
@@ -31,9 +32,7 @@ def euler2quat(eulers):
        np.sin(gamma / 2) * np.sin(theta / 2) * np.cos(psi / 2)
 
   quats = array([q0, q1, q2, q3]).T
-  for i in xrange(len(quats)):
-    if quats[i,0] < 0:
-      quats[i] = -quats[i]
+  quats[quats[:,0] < 0] *= -1
   return quats.reshape(output_shape)
 
 
@@ -100,14 +99,12 @@ def rot2quat(rots):
   K3[:, 3, 1] = K3[:, 1, 3]
   K3[:, 3, 2] = K3[:, 2, 3]
   K3[:, 3, 3] = (rots[:, 0, 0] + rots[:, 1, 1] + rots[:, 2, 2]) / 3.0
+  _, eigvecs = linalg.eigh(K3.transpose(0, 2, 1))
+  eigvecs = eigvecs[:, :, 3]
   q = np.empty((len(rots), 4))
-  for i in xrange(len(rots)):
-    _, eigvecs = linalg.eigh(K3[i].T)
-    eigvecs = eigvecs[:,3:]
-    q[i, 0] = eigvecs[-1]
-    q[i, 1:] = -eigvecs[:-1].flatten()
-    if q[i, 0] < 0:
-      q[i] = -q[i]
+  q[:, 0] = eigvecs[:, -1]
+  q[:, 1:] = -eigvecs[:, :-1]
+  q[q[:, 0] < 0] *= -1
 
   if len(input_shape) < 3:
     return q[0]
@@ -173,6 +170,18 @@ def rot(axis, angle):
   return ret_1 + ret_2 + ret_3
 
 
+def rots(axes, angles):
+  # Rotates around an arbitrary axis, for arrays of axes and angles
+  axes = np.atleast_2d(axes)
+  angles = np.asarray(angles)[:, None, None]
+  outer = axes[:, :, None] * axes[:, None, :]
+  cross = np.zeros((len(axes), 3, 3))
+  cross[:, 0, 1], cross[:, 0, 2] = -axes[:, 2], axes[:, 1]
+  cross[:, 1, 0], cross[:, 1, 2] = axes[:, 2], -axes[:, 0]
+  cross[:, 2, 0], cross[:, 2, 1] = -axes[:, 1], axes[:, 0]
+  return (1 - np.cos(angles)) * outer + np.cos(angles) * np.eye(3) + np.sin(angles) * cross
+
+
 def ecef_euler_from_ned(ned_ecef_init, ned_pose):
   '''
   Got it from here:
@@ -223,39 +232,40 @@ def ned_euler_from_ecef(ned_ecef_init, ecef_poses):
   ecef_poses = array(ecef_poses)
   output_shape = ecef_poses.shape
   ned_ecef_init = np.atleast_2d(ned_ecef_init)
-  if ned_ecef_init.shape[0] == 1:
-    ned_ecef_init = np.tile(ned_ecef_init[0], (output_shape[0], 1))
   ecef_poses = np.atleast_2d(ecef_poses)
+  num_poses = len(ecef_poses)
+  if ned_ecef_init.shape[0] == 1:
+    ned_ecef_init = np.tile(ned_ecef_init[0], (num_poses, 1))
+
+  x0 = np.tile(array([1., 0., 0.]), (num_poses, 1))
+  y0 = np.tile(array([0., 1., 0.]), (num_poses, 1))
+  z0 = np.tile(array([0., 0., 1.]), (num_poses, 1))
 
-  ned_poses = np.zeros(ecef_poses.shape)
-  for i, ecef_pose in enumerate(ecef_poses):
-    converter = LocalCoord.from_ecef(ned_ecef_init[i])
-    x0 = array([1, 0, 0])
-    y0 = array([0, 1, 0])
-    z0 = array([0, 0, 1])
+  yaw_rots = rots(z0, ecef_poses[:, 2])
+  x1 = np.einsum('nij,nj->ni', yaw_rots, x0)
+  y1 = np.einsum('nij,nj->ni', yaw_rots, y0)
 
-    x1 = rot(z0, ecef_pose[2]).dot(x0)
-    y1 = rot(z0, ecef_pose[2]).dot(y0)
-    z1 = rot(z0, ecef_pose[2]).dot(z0)
+  pitch_rots = rots(y1, ecef_poses[:, 1])
+  x2 = np.einsum('nij,nj->ni', pitch_rots, x1)
+  y2 = np.einsum('nij,nj->ni', pitch_rots, y1)
 
-    x2 = rot(y1, ecef_pose[1]).dot(x1)
-    y2 = rot(y1, ecef_pose[1]).dot(y1)
-    z2 = rot(y1, ecef_pose[1]).dot(z1)
+  roll_rots = rots(x2, ecef_poses[:, 0])
+  x3 = np.einsum('nij,nj->ni', roll_rots, x2)
+  y3 = np.einsum('nij,nj->ni', roll_rots, y2)
 
-    x3 = rot(x2, ecef_pose[0]).dot(x2)
-    y3 = rot(x2, ecef_pose[0]).dot(y2)
-    #z3 = rot(x2, ecef_pose[0]).dot(z2)
+  # NED axes in ECEF at each initial position
+  ned2ecef = ned2ecef_matrices(ned_ecef_init)
+  x0, y0, z0 = ned2ecef[:, :, 0], ned2ecef[:, :, 1], ned2ecef[:, :, 2]
 
-    x0 = converter.ned2ecef([1, 0, 0]) - converter.ned2ecef([0, 0, 0])
-    y0 = converter.ned2ecef([0, 1, 0]) - converter.ned2ecef([0, 0, 0])
-    z0 = converter.ned2ecef([0, 0, 1]) - converter.ned2ecef([0, 0, 0])
+  def inner_rows(u, v):
+    return np.einsum('ni,ni->n', u, v)
 
-    psi = np.arctan2(inner(x3, y0), inner(x3, x0))
-    theta = np.arctan2(-inner(x3, z0), np.sqrt(inner(x3, x0)**2 + inner(x3, y0)**2))
-    y2 = rot(z0, psi).dot(y0)
-    z2 = rot(y2, theta).dot(z0)
-    phi = np.arctan2(inner(y3, z2), inner(y3, y2))
-    ned_poses[i] = array([phi, theta, psi])
+  psi = np.arctan2(inner_rows(x3, y0), inner_rows(x3, x0))
+  theta = np.arctan2(-inner_rows(x3, z0), np.sqrt(inner_rows(x3, x0)**2 + inner_rows(x3, y0)**2))
+  y2 = np.einsum('nij,nj->ni', rots(z0, psi), y0)
+  z2 = np.einsum('nij,nj->ni', rots(y2, theta), z0)
+  phi = np.arctan2(inner_rows(y3, z2), inner_rows(y3, y2))
+  ned_poses = np.column_stack((phi, theta, psi))
 
   return ned_poses.reshape(output_shape)
 
@@ -278,11 +288,7 @@ def ecef2car(car_ecef, psi, theta, points_ecef, ned_converter):
   # output is an array of points in car's coordinate (x-front, y-left, z-up)
 
   # convert points to NED
-  points_ned = []
-  for p in points_ecef:
-    points_ned.append(ned_converter.ecef2ned_matrix.dot(array(p) - car_ecef))
-
-  points_ned = np.vstack(points_ned).T
+  points_ned = ned_converter.ecef2ned_matrix.dot((np.atleast_2d(points_ecef) - car_ecef).T)
 
   # n, e, d -> x, y, z
   # Calculate relative postions and rotate wrt to heading and pitch of car
@@ -295,3 +301,40 @@ def ecef2car(car_ecef, psi, theta, points_ecef, ned_converter):
   pitch_R = array([[c, 0., -s], [0., 1., 0.], [s, 0., c]])
 
   return dot(pitch_R, dot(yaw_R, dot(invert_R, points_ned)))
+
+
+class LocalTrajectory(object):
+  """
+  Future path of every frame of a trajectory in the local frame of that frame,
+  computed for the whole trajectory in one batched pass. Positions of the
+  following frames are taken from a sliding window over the trajectory and
+  rotated by the precomputed local_from_ecef rotation of each frame, so the
+  path of a frame is a slice rather than a recomputation.
+  """
+  def __init__(self, frame_positions, frame_orientations, window=None):
+    frame_positions = array(frame_positions, dtype=np.float64)
+    num_frames = len(frame_positions)
+    if window is None:
+      window = num_frames
+    self.num_frames = num_frames
+    self.window = window
+
+    # local_from_ecef of every frame
+    local_from_ecef = quat2rot(frame_orientations).transpose(0, 2, 1)
+
+    # ECEF offsets of the following window frames from each frame, nan past the last frame
+    padded_positions = np.concatenate((frame_positions, np.full((window - 1, 3), np.nan)))
+    windows = sliding_window_view(padded_positions, window, axis=0)
+    self.ecef_offsets = windows.transpose(0, 2, 1) - frame_positions[:, None, :]
+    self.local_positions = np.einsum('nij,nwj->nwi', local_from_ecef, self.ecef_offsets)
+
+  def frame_count_in_window(self, frame):
+    return min(self.window, self.num_frames - frame)
+
+  def local_path(self, frame):
+    # Positions of the frame and the following frames in the local frame of the frame
+    return self.local_positions[frame, :self.frame_count_in_window(frame)]
+
+  def distances(self, frame):
+    # Distances of the frame and the following frames from the position of the frame
+    return np.linalg.norm(self.ecef_offsets[frame, :self.frame_count_in_window(frame)], axis=1)
@@ -1,198 +1,77 @@
 #! /usr/bin/env python3
 
 import os
+import sys
 import cv2
 import math
 import json
 import argparse
+import itertools
 import warnings
-import numpy as np
-from PIL import Image, ImageDraw
 from process_curvelanes import (
     custom_warning_format, 
-    round_line_floats,
-    normalizeCoords,
-    interpLine,
     getLineAnchor
 )
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.bev_engine import (
+    interpX,
+    imagePointTuplize,
+    BEVTransform,
+    transformLinesBEV,
+    calTransformedDistances,
+    calEgoSides,
+    annotateGT,
+    formatLineGT
+)
+from common.frame_pool import runFrames
+from common.label_stream import (
+    LABEL_FORMATS,
+    LabelWriter,
+    getLabelsPath,
+    findLabels,
+    iterLabels
+)
 
 warnings.formatwarning = custom_warning_format
 
 PointCoords = tuple[float, float]
-ImagePointCoords = tuple[int, int]
 
 # Skipped frames
 skipped_dict = {}
 
-# ============================== Helper functions ============================== #
+# OTHER PARAMS
 
+MIN_POINTS = 30
 
-def log_skipped(frame_id, reason):
-    warnings.warn(reason)
-    skipped_dict[frame_id] = reason
+BEV_PTS = {
+    "LS" : [240, 1280],         # Left start
+    "RS" : [400, 1280],         # Right start
+    "LE" : [240, 0],            # Left end
+    "RE" : [400, 0]             # Right end
+}
 
+W = 800
+H = 400
 
-def drawLine(
-    img: np.ndarray, 
-    line: list,
-    color: tuple,
-    thickness: int = 2
-):
-    for i in range(1, len(line)):
-        pt1 = (
-            int(line[i - 1][0]), 
-            int(line[i - 1][1])
-        )
-        pt2 = (
-            int(line[i][0]), 
-            int(line[i][1])
-        )
-        cv2.line(
-            img, 
-            pt1, pt2, 
-            color = color, 
-            thickness = thickness
-        )
-
+BEV_W = 640
+BEV_H = 1280
+BEV_Y_STEP = 128
+POLYFIT_ORDER = 2
 
-def annotateGT(
-    img: np.ndarray,
-    orig_img: np.ndarray,
-    frame_id: str,
-    bev_egopath: list,
-    reproj_egopath: list,
-    bev_egoleft: list,
-    reproj_egoleft: list,
-    bev_egoright: list,
-    reproj_egoright: list,
-    raw_dir: str, 
-    visualization_dir: str,
-    normalized: bool
-):
-    """
-    Annotates and saves an image with:
-        - Raw image, in "output_dir/image".
-        - Annotated image with all lanes, in "output_dir/visualization".
-    """
+# Number of digits kept in the output JSON
+NDIGITS = 6
 
-    # =========================== RAW IMAGE =========================== #
-    
-    # Save raw img in raw dir, as PNG
-    cv2.imwrite(
-        os.path.join(
-            raw_dir,
-            f"{frame_id}.png"
-        ),
-        img
-    )
-
-    # =========================== BEV VIS =========================== #
-
-    img_bev_vis = img.copy()
-
-    # Draw egopath
-    if (normalized):
-        renormed_bev_egopath = [
-            (x * BEV_W, y * BEV_H)
-            for x, y in bev_egopath
-        ]
-    else:
-        renormed_bev_egopath = bev_egopath
-    drawLine(
-        img = img_bev_vis,
-        line = renormed_bev_egopath,
-        color = COLOR_EGOPATH
-    )
-
-    # Draw egoleft
-    if (normalized):
-        renormed_bev_egoleft = [
-            (x * BEV_W, y * BEV_H)
-            for x, y in bev_egoleft
-        ]
-    else:
-        renormed_bev_egoleft = bev_egoleft
-    drawLine(
-        img = img_bev_vis,
-        line = renormed_bev_egoleft,
-        color = COLOR_EGOLEFT
-    )
-
-    # Draw egoright
-    if (normalized):
-        renormed_bev_egoright = [
-            (x * BEV_W, y * BEV_H)
-            for x, y in bev_egoright
-        ]
-    else:
-        renormed_bev_egoright = bev_egoright
-    drawLine(
-        img = img_bev_vis,
-        line = renormed_bev_egoright,
-        color = COLOR_EGORIGHT
-    )
-
-    # Save visualization img in vis dir, as JPG (saving storage space)
-    cv2.imwrite(
-        os.path.join(
-            visualization_dir,
-            f"{frame_id}.jpg"
-        ),
-        img_bev_vis
-    )
+# SANITY CHECK PARAMS
 
-    # =========================== ORIGINAL VIS =========================== #
+EGO_ANCHOR_ANGLE_THRESHOLD = 45         # Degrees
+EGO_ANCHOR_DISTANCE_THRESHOLD = 0.3     # Should not be in 30% left or right
 
-    # Draw reprojected egopath
-    if (normalized):
-        renormed_reproj_egopath = [
-            (x * W, y * H) 
-            for x, y in reproj_egopath
-        ]
-    else:
-        renormed_reproj_egopath = reproj_egopath
-    drawLine(
-        img = orig_img,
-        line = renormed_reproj_egopath,
-        color = COLOR_EGOPATH
-    )
-    
-    # Draw reprojected egoleft
-    if (normalized):
-        renormed_reproj_egoleft = [
-            (x * W, y * H) 
-            for x, y in reproj_egoleft
-        ]
-    else:
-        renormed_reproj_egoleft = reproj_egoleft
-    drawLine(
-        img = orig_img,
-        line = renormed_reproj_egoleft,
-        color = COLOR_EGOLEFT
-    )
+# ============================== Helper functions ============================== #
 
-    # Draw reprojected egoright
-    if (normalized):
-        renormed_reproj_egoright = [
-            (x * W, y * H) 
-            for x, y in reproj_egoright
-        ]
-    else:
-        renormed_reproj_egoright = reproj_egoright
-    drawLine(
-        img = orig_img,
-        line = renormed_reproj_egoright,
-        color = COLOR_EGORIGHT
-    )
 
-    # Save it
-    cv2.imwrite(
-        os.path.join(
-            visualization_dir,
-            f"{frame_id}_orig.jpg"
-        ),
-        orig_img
-    )
+def log_skipped(frame_id, reason):
+    warnings.warn(reason)
+    skipped_dict[frame_id] = reason
 
 
 def calAngle(line: list[PointCoords]) -> float:
@@ -210,87 +89,6 @@ def calAngle(line: list[PointCoords]) -> float:
     )
 
 
-def interpX(line, y):
-    """
-    Interpolate x-value of a point on a line, given y-value
-    """
-    points = np.array(line)
-    list_x = points[:, 0]
-    list_y = points[:, 1]
-
-    if not np.all(np.diff(list_y) > 0):
-        sort_idx = np.argsort(list_y)
-        list_y = list_y[sort_idx]
-        list_x = list_x[sort_idx]
-
-    return float(np.interp(y, list_y, list_x))
-
-
-def polyfit_BEV(
-    bev_line: list,
-    order: int,
-    y_step: int,
-    y_limit: int
-):
-    valid_line = [
-        point for point in bev_line
-        if (
-            (0 <= point[0] < BEV_W) and 
-            (0 <= point[1] < BEV_H)
-        )
-    ]
-    if (not valid_line):
-        warnings.warn("No valid points in BEV line for polyfit.")
-        return None, None, None
-    
-    x = [
-        point[0] 
-        for point in valid_line
-    ]
-    y = [
-        point[1] 
-        for point in valid_line
-    ]
-
-    z = np.polyfit(y, x, order)
-    f = np.poly1d(z)
-    y_new = np.linspace(
-        0, y_limit, 
-        int(y_limit / y_step) + 1
-    )
-    x_new = f(y_new)
-
-    # Sort by decreasing y
-    fitted_bev_line = sorted(
-        tuple(zip(x_new, y_new)),
-        key = lambda x: x[1],
-        reverse = True
-    )
-
-    flag_list = [0] * len(fitted_bev_line)
-    for i in range(len(fitted_bev_line)):
-        if (not 0 <= fitted_bev_line[i][0] <= BEV_W):
-            flag_list[i - 1] = 1
-            break
-    if (not 1 in flag_list):
-        flag_list[-1] = 1
-
-    validity_list = [1] * len(fitted_bev_line)
-    last_valid_index = flag_list.index(1)
-    for i in range(last_valid_index + 1, len(validity_list)):
-        validity_list[i] = 0
-    
-    return fitted_bev_line, flag_list, validity_list
-
-
-def imagePointTuplize(point: PointCoords) -> ImagePointCoords:
-    """
-    Parse all coords of an (x, y) point to int, making it
-    suitable for image operations.
-    """
-    return (int(point[0]), int(point[1]))
-
-
 def findSourcePointsBEV(
     h: int,
     w: int,
@@ -369,204 +167,191 @@ def findSourcePointsBEV(
     return sps
 
 
-def transformBEV(
-    img: np.ndarray,
-    line: list,
-    sps: dict
+def processFrame(
+    frame_id: str,
+    frame_content: dict,
+    img_dir: str,
+    bev_img_dir: str,
+    bev_vis_dir: str
 ):
-    # Renorm/tuplize drivable path
-    line = [
-        (point[0] * W, point[1] * H)
-        for point in line
-        if (point[1] * H >= sps["ego_h"])
-    ]
-    if (not line):
-        return (None, None, None, None, None, None, False)
-
-    # Interp more points for original line
-    line = interpLine(line, MIN_POINTS)
-
-    # Get transformation matrix
-    mat, _ = cv2.findHomography(
-        srcPoints = np.array([
-            sps["LS"],
-            sps["RS"],
-            sps["LE"],
-            sps["RE"]
-        ]),
-        dstPoints = np.array([
-            BEV_PTS["LS"],
-            BEV_PTS["RS"],
-            BEV_PTS["LE"],
-            BEV_PTS["RE"],
-        ])
-    )
+    """
+    Transform the egopath of a frame to BEV with its own source points, derive
+    egoleft and egoright from it, run the sanity checks, save its BEV image and
+    visualizations, and return (frame_id, frame GT, skip reason).
+    """
 
-    # Transform image
-    im_dst = cv2.warpPerspective(
-        img, mat,
-        np.array([BEV_W, BEV_H])
+    # Acquire frame
+    frame_img_path = os.path.join(
+        img_dir,
+        f"{frame_id}.png"
     )
+    img = cv2.imread(frame_img_path)
 
-    # Transform line
-    bev_line = np.array(
-        line,
-        dtype = np.float32
-    ).reshape(-1, 1, 2)
-    bev_line = cv2.perspectiveTransform(bev_line, mat)
-    bev_line = [
-        tuple(map(int, point[0])) 
-        for point in bev_line
-    ]
+    # MAIN ALGORITHM
 
-    # Polyfit BEV line for certain amount of coords
-    # (should be 11 by default), along with flags
-    bev_line, flag_list, validity_list = polyfit_BEV(
-        bev_line = bev_line,
-        order = POLYFIT_ORDER,
-        y_step = BEV_Y_STEP,
-        y_limit = BEV_H
-    )
+    try:
+        # Get source points for transform
+        sps_dict = findSourcePointsBEV(
+            h = H,
+            w = W,
+            egoleft = frame_content["egoleft_lane"],
+            egoright = frame_content["egoright_lane"]
+        )
 
-    if (not bev_line):
-        return (None, None, None, None, None, None, False)
-    
-    # Now reproject it back to orig space
-    inv_mat = np.linalg.inv(mat)
-    reproj_line = np.array(
-        bev_line,
-        dtype = np.float32
-    ).reshape(-1, 1, 2)
-    reproj_line = cv2.perspectiveTransform(reproj_line, inv_mat)
-    reproj_line = [
-        tuple(map(int, point[0])) 
-        for point in reproj_line
-    ]
+        # Transform to BEV space, source points differ from frame to frame
+        bev_transform = BEVTransform(sps_dict, BEV_PTS, BEV_W, BEV_H)
+        im_dst = bev_transform.warpImage(img)
+
+        # Egopath
+        (egopath_result, ) = transformLinesBEV(
+            lines = [frame_content["drivable_path"]],
+            w = W,
+            h = H,
+            ego_h = sps_dict["ego_h"],
+            bev_transform = bev_transform,
+            min_points = MIN_POINTS,
+            polyfit_order = POLYFIT_ORDER,
+            bev_y_step = BEV_Y_STEP
+        )
 
-    return (
-        im_dst, 
-        bev_line, 
-        reproj_line, 
-        flag_list, 
-        validity_list, 
-        mat, 
-        True
-    )
+        # Skip if invalid frame
+        if (egopath_result is None):
+            return (frame_id, None, "Null EgoPath from BEV transformation algorithm.")
+
+        (
+            bev_egopath, orig_bev_egopath,
+            egopath_flag_list, egopath_validity_list
+        ) = egopath_result
+
+        # Egoleft and egoright, shifted from egopath by the BEV distances
+        # of their anchors to the mid anchor
+        dist_egoleft, dist_egoright = calTransformedDistances(
+            points = [sps_dict["LS"], sps_dict["RS"]],
+            anchor = sps_dict["midanchor_start"],
+            bev_transform = bev_transform
+        )
+        (
+            (bev_egoleft, orig_bev_egoleft, egoleft_flag_list, egoleft_validity_list),
+            (bev_egoright, orig_bev_egoright, egoright_flag_list, egoright_validity_list)
+        ) = calEgoSides(
+            bev_egopath = bev_egopath,
+            anchor_offsets = [- dist_egoleft, dist_egoright],
+            bev_transform = bev_transform
+        )
 
+    except Exception as e:
+        print(f"Unexpected error at frame {frame_id}: {e}")
+        return (frame_id, None, str(e))
 
-def calTransformedDistance(
-        a: ImagePointCoords | PointCoords,
-        b: ImagePointCoords | PointCoords,
-        homotrans_mat: list[list[float]]
-) -> float:
-
-    pts = np.array([a, b], dtype = np.float32).reshape(-1, 1, 2)
-    pts_bev = cv2.perspectiveTransform(pts, homotrans_mat)
-    a_bev = pts_bev[0][0]
-    b_bev = pts_bev[1][0]
-
-    distance_bev = np.linalg.norm(a_bev - b_bev)
-
-    return distance_bev
-
-
-def calEgoSide(
-        bev_egopath: list[ImagePointCoords],
-        anchor_offset: float,
-        homotrans_mat: list[list[float]]
-    ) -> list[tuple[
-            int,    # x-coord, int
-            int,    # y-coord, int
-            int,    # flag, int
-            int     # validity, int
-    ]]:
-
-    # BEV-egoside
-    bev_egoside = []
-    for point in bev_egopath:
-        x, y = point
-        bev_egoside.append((
-            int(x + anchor_offset), 
-            int(y)
-        ))
-
-    # Original egoside
-    inv_mat = np.linalg.inv(homotrans_mat)
-    orig_egoside = np.array(
-        bev_egoside,
-        dtype = np.float32
-    ).reshape(-1, 1, 2)
-    orig_egoside = cv2.perspectiveTransform(orig_egoside, inv_mat)
-    orig_egoside = [
-        tuple(map(int, point[0])) 
-        for point in orig_egoside
-    ]
+    # ======================== FRAME'S SANITY CHECK ======================== #
 
-    # Flag list
-    egoside_flag_list = [0] * len(bev_egoside)
-    for i in range(len(bev_egoside)):
-        if (not 0 <= bev_egoside[i][0] <= BEV_W):
-            egoside_flag_list[i - 1] = 1
-            break
-    if (not 1 in egoside_flag_list):
-        egoside_flag_list[-1] = 1
-
-    # Validity list
-    egoside_validity_list = [1] * len(bev_egoside)
-    last_valid_index = egoside_flag_list.index(1)
-    for i in range(last_valid_index + 1, len(egoside_validity_list)):
-        egoside_validity_list[i] = 0
-
-    return (
-        bev_egoside, 
-        orig_egoside, 
-        egoside_flag_list, 
-        egoside_validity_list
-    )
+    # Skip if the polyfit goes horribly wrong
+    if not (
+        (bev_egoleft[0][0] <= bev_egopath[0][0] <= bev_egoright[0][0]) and
+        (bev_egoleft[-1][0] <= bev_egopath[-1][0] <= bev_egoright[-1][0])
+    ):
+        return (frame_id, None, "Polyfit went horribly wrong.")
 
+    # Distance check
+    if not (
+        (BEV_W * EGO_ANCHOR_DISTANCE_THRESHOLD <= bev_egopath[0][0]) and 
+        (bev_egopath[0][0] <= BEV_W * (1 - EGO_ANCHOR_DISTANCE_THRESHOLD))
+    ):
+        return (frame_id, None, "EgoPath anchor is too far left or right.")
 
-# ============================== Main run ============================== #
+    # ANGLE CHECK
 
+    bev_egopath_anchor_angle = calAngle(bev_egopath)
+    bev_egoleft_anchor_angle = calAngle(bev_egoleft)
+    bev_egoright_anchor_angle = calAngle(bev_egoright)
 
-if __name__ == "__main__":
+    # Egopath must not be too steep
+    if not (abs(bev_egopath_anchor_angle) <= EGO_ANCHOR_ANGLE_THRESHOLD):
+        return (
+            frame_id, None,
+            f"EgoPath anchor angle is too steep: {bev_egopath_anchor_angle}"
+        )
 
-    # DIRECTORY STRUCTURE
+    # 3 angles should be same dirs at anchor level
+    if not (
+        (
+            (bev_egopath_anchor_angle > 0) and 
+            (bev_egoleft_anchor_angle > 0) and 
+            (bev_egoright_anchor_angle > 0)
+        ) or (
+            (bev_egopath_anchor_angle < 0) and 
+            (bev_egoleft_anchor_angle < 0) and 
+            (bev_egoright_anchor_angle < 0)
+        )
+    ):
+        return (
+            frame_id, None,
+            "EgoPath/EgoLeft/EgoRight anchor angles are not consistent."
+        )
 
-    IMG_DIR = "image"
-    JSON_PATH = "drivable_path.json"
+    # ======================== SANITY CHECK DONE, CONTINUING ======================== #
+
+    # Save stuffs
+    annotateGT(
+        img = im_dst,
+        orig_img = img,
+        frame_id = frame_id,
+        bev_egopath = bev_egopath,
+        reproj_egopath = orig_bev_egopath,
+        bev_egoleft = bev_egoleft,
+        reproj_egoleft = orig_bev_egoleft,
+        bev_egoright = bev_egoright,
+        reproj_egoright = orig_bev_egoright,
+        raw_dir = bev_img_dir,
+        visualization_dir = bev_vis_dir
+    )
 
-    BEV_IMG_DIR = "image_bev"
-    BEV_VIS_DIR = "visualization_bev"
-    BEV_JSON_PATH = "drivable_path_bev.json"
-    BEV_SKIPPED_JSON_PATH = "skipped_frames.json"
+    # Frame GT, each point has tuple format (x, y, flag, valid)
+    frame_data = {
+        "bev_egopath" : formatLineGT(
+            bev_egopath, egopath_flag_list, egopath_validity_list,
+            BEV_W, BEV_H, NDIGITS
+        ),
+        "reproj_egopath" : formatLineGT(
+            orig_bev_egopath, egopath_flag_list, egopath_validity_list,
+            W, H, NDIGITS
+        ),
+        "bev_egoleft" : formatLineGT(
+            bev_egoleft, egoleft_flag_list, egoleft_validity_list,
+            BEV_W, BEV_H, NDIGITS
+        ),
+        "reproj_egoleft" : formatLineGT(
+            orig_bev_egoleft, egoleft_flag_list, egoleft_validity_list,
+            W, H, NDIGITS
+        ),
+        "bev_egoright" : formatLineGT(
+            bev_egoright, egoright_flag_list, egoright_validity_list,
+            BEV_W, BEV_H, NDIGITS
+        ),
+        "reproj_egoright" : formatLineGT(
+            orig_bev_egoright, egoright_flag_list, egoright_validity_list,
+            W, H, NDIGITS
+        ),
+        "homomatrix" : bev_transform.mat.tolist()
+    }
 
-    # OTHER PARAMS
+    return (frame_id, frame_data, None)
 
-    MIN_POINTS = 30
 
-    BEV_PTS = {
-        "LS" : [240, 1280],         # Left start
-        "RS" : [400, 1280],         # Right start
-        "LE" : [240, 0],            # Left end
-        "RE" : [400, 0]             # Right end
-    }
+# ============================== Main run ============================== #
 
-    W = 800
-    H = 400
 
-    BEV_W = 640
-    BEV_H = 1280
-    BEV_Y_STEP = 128
-    POLYFIT_ORDER = 2
+if __name__ == "__main__":
 
-    COLOR_EGOPATH = (0, 255, 255)   # Yellow (BGR)
-    COLOR_EGOLEFT = (0, 128, 0)     # Green (BGR)
-    COLOR_EGORIGHT = (255, 255, 0)  # Cyan (BGR)
+    # DIRECTORY STRUCTURE
 
-    # SANITY CHECK PARAMS
+    IMG_DIR = "image"
+    LABELS_NAME = "drivable_path"
 
-    EGO_ANCHOR_ANGLE_THRESHOLD = 45         # Degrees
-    EGO_ANCHOR_DISTANCE_THRESHOLD = 0.3     # Should not be in 30% left or right
+    BEV_IMG_DIR = "image_bev"
+    BEV_VIS_DIR = "visualization_bev"
+    BEV_LABELS_NAME = "drivable_path_bev"
+    BEV_SKIPPED_JSON_PATH = "skipped_frames.json"
 
     # PARSING ARGS
 
@@ -579,6 +364,20 @@ if __name__ == "__main__":
         help = "Processed CurveLanes directory",
         required = True
     )
+    parser.add_argument(
+        "--num_workers",
+        type = int,
+        help = "Num. worker processes, defaults to the number of CPUs.",
+        required = False
+    )
+    parser.add_argument(
+        "--label_format",
+        type = str,
+        choices = LABEL_FORMATS,
+        help = "BEV label file format, jsonl streams each frame to drivable_path_bev.jsonl as soon as it is processed.",
+        required = False,
+        default = "json"
+    )
     # For debugging only
     parser.add_argument(
         "--early_stopping",
@@ -591,8 +390,9 @@ if __name__ == "__main__":
     # Parse dataset dir
     dataset_dir = args.dataset_dir
     IMG_DIR = os.path.join(dataset_dir, IMG_DIR)
-    JSON_PATH = os.path.join(dataset_dir, JSON_PATH)
-    BEV_JSON_PATH = os.path.join(dataset_dir, BEV_JSON_PATH)
+    # Labels of the process script, drivable_path.json or drivable_path.jsonl
+    LABELS_PATH = findLabels(dataset_dir, LABELS_NAME)
+    BEV_LABELS_PATH = getLabelsPath(dataset_dir, BEV_LABELS_NAME, args.label_format)
     BEV_SKIPPED_JSON_PATH = os.path.join(dataset_dir, BEV_SKIPPED_JSON_PATH)
 
     # Parse early stopping
@@ -611,268 +411,31 @@ if __name__ == "__main__":
     if not (os.path.exists(BEV_VIS_DIR)):
         os.makedirs(BEV_VIS_DIR)
 
-    # Preparing data
-    with open(JSON_PATH, "r") as f:
-        json_data = json.load(f)
-    data_master = {}    # Dumped later
+    # Preparing data, frames are read from the labels as the workers consume them
+    label_writer = LabelWriter(BEV_LABELS_PATH)
 
     # MAIN GENERATION LOOP
 
-    counter = 0
-    for frame_id, frame_content in json_data.items():
-
-        counter += 1
-
-        # Acquire frame
-        frame_img_path = os.path.join(
-            IMG_DIR,
-            f"{frame_id}.png"
-        )
-        img = cv2.imread(frame_img_path)
-
-        # Acquire frame data
-        this_frame_data = json_data[frame_id]
-
-        # MAIN ALGORITHM
-
-        try:
-            # Get source points for transform
-            sps_dict = findSourcePointsBEV(
-                h = H,
-                w = W,
-                egoleft = this_frame_data["egoleft_lane"],
-                egoright = this_frame_data["egoright_lane"]
-            )
-
-            # Transform to BEV space
-            success_flag = True
-            
-            # Egopath
-            (
-                im_dst, 
-                bev_egopath, 
-                orig_bev_egopath, 
-                egopath_flag_list, 
-                egopath_validity_list, 
-                mat, 
-                success_egopath
-            ) = transformBEV(
-                img = img,
-                line = this_frame_data["drivable_path"],
-                sps = sps_dict
-            )
-
-            # Egoleft
-            (
-                bev_egoleft, 
-                orig_bev_egoleft, 
-                egoleft_flag_list, 
-                egoleft_validity_list, 
-            ) = calEgoSide(
-                bev_egopath = bev_egopath,
-                anchor_offset = - calTransformedDistance(
-                    sps_dict["LS"],
-                    sps_dict["midanchor_start"],
-                    mat
-                ),
-                homotrans_mat = mat
-            )
-
-            # Egoright
-            (
-                bev_egoright, 
-                orig_bev_egoright, 
-                egoright_flag_list, 
-                egoright_validity_list, 
-            ) = calEgoSide(
-                bev_egopath = bev_egopath,
-                anchor_offset = calTransformedDistance(
-                    sps_dict["RS"],
-                    sps_dict["midanchor_start"],
-                    mat
-                ),
-                homotrans_mat = mat
-            )
-
-            if (not success_egopath):
-                success_flag = False
-
-        except Exception as e:
-            print(f"Unexpected error at frame {frame_id}: {e}")
-            log_skipped(frame_id, str(e))
-            continue
-
-        # ======================== FRAME'S SANITY CHECK ======================== #
-        
-        # Skip if invalid frame
-        if (success_flag == False):
-            warning_msg = "Null EgoPath from BEV transformation algorithm."
-            log_skipped(frame_id, warning_msg)
-            continue
-
-        # Skip if the polyfit goes horribly wrong
-        if not (
-            (bev_egoleft[0][0] <= bev_egopath[0][0] <= bev_egoright[0][0]) and
-            (bev_egoleft[-1][0] <= bev_egopath[-1][0] <= bev_egoright[-1][0])
-        ):
-            warning_msg = "Polyfit went horribly wrong."
-            log_skipped(frame_id, warning_msg)
-            continue
-
-        # Distance check
-        if not (
-            (BEV_W * EGO_ANCHOR_DISTANCE_THRESHOLD <= bev_egopath[0][0]) and 
-            (bev_egopath[0][0] <= BEV_W * (1 - EGO_ANCHOR_DISTANCE_THRESHOLD))
-        ):
-            warning_msg = "EgoPath anchor is too far left or right."
-            log_skipped(frame_id, warning_msg)
-            continue
-
-        # ANGLE CHECK
-        
-        bev_egopath_anchor_angle = calAngle(bev_egopath)
-        bev_egoleft_anchor_angle = calAngle(bev_egoleft)
-        bev_egoright_anchor_angle = calAngle(bev_egoright)
-
-        # Egopath must not be too steep
-        if not (abs(bev_egopath_anchor_angle) <= EGO_ANCHOR_ANGLE_THRESHOLD):
-            warning_msg = f"EgoPath anchor angle is too steep: {bev_egopath_anchor_angle}"
-            log_skipped(frame_id, warning_msg)
-            continue
-
-        # 3 angles should be same dirs at anchor level
-        if not (
-            (
-                (bev_egopath_anchor_angle > 0) and 
-                (bev_egoleft_anchor_angle > 0) and 
-                (bev_egoright_anchor_angle > 0)
-            ) or (
-                (bev_egopath_anchor_angle < 0) and 
-                (bev_egoleft_anchor_angle < 0) and 
-                (bev_egoright_anchor_angle < 0)
-            )
-        ):
-            warning_msg = "EgoPath/EgoLeft/EgoRight anchor angles are not consistent."
-            log_skipped(frame_id, warning_msg)
-            continue
-
-        # ======================== SANITY CHECK DONE, CONTINUING ======================== #
-
-        # Save stuffs
-        annotateGT(
-            img = im_dst,
-            orig_img = img,
-            frame_id = frame_id,
-            bev_egopath = bev_egopath,
-            reproj_egopath = orig_bev_egopath,
-            bev_egoleft = bev_egoleft,
-            reproj_egoleft = orig_bev_egoleft,
-            bev_egoright = bev_egoright,
-            reproj_egoright = orig_bev_egoright,
-            raw_dir = BEV_IMG_DIR,
-            visualization_dir = BEV_VIS_DIR,
-            normalized = False
+    frame_tasks = (
+        (frame_id, frame_content, IMG_DIR, BEV_IMG_DIR, BEV_VIS_DIR)
+        for frame_id, frame_content in itertools.islice(
+            iterLabels(LABELS_PATH), early_stopping
         )
+    )
 
-        # Register this frame GT to master JSON
-        # Each point has tuple format (x, y, flag, valid)
-        data_master[frame_id] = {
-            "bev_egopath" : [
-                (point[0], point[1], flag, valid)
-                for point, flag, valid in list(zip(
-                    round_line_floats(
-                        normalizeCoords(
-                            bev_egopath,
-                            width = BEV_W,
-                            height = BEV_H
-                        )
-                    ), 
-                    egopath_flag_list, 
-                    egopath_validity_list
-                ))
-            ],
-            "reproj_egopath" : [
-                (point[0], point[1], flag, valid)
-                for point, flag, valid in list(zip(
-                    round_line_floats(
-                        normalizeCoords(
-                            orig_bev_egopath,
-                            width = W,
-                            height = H
-                        )
-                    ), 
-                    egopath_flag_list, 
-                    egopath_validity_list
-                ))
-            ],
-            "bev_egoleft" : [
-                (point[0], point[1], flag, valid)
-                for point, flag, valid in list(zip(
-                    round_line_floats(
-                        normalizeCoords(
-                            bev_egoleft,
-                            width = BEV_W,
-                            height = BEV_H
-                        )
-                    ), 
-                    egoleft_flag_list, 
-                    egoleft_validity_list
-                ))
-            ],
-            "reproj_egoleft" : [
-                (point[0], point[1], flag, valid)
-                for point, flag, valid in list(zip(
-                    round_line_floats(
-                        normalizeCoords(
-                            orig_bev_egoleft,
-                            width = W,
-                            height = H
-                        )
-                    ), 
-                    egoleft_flag_list, 
-                    egoleft_validity_list
-                ))
-            ],
-            "bev_egoright" : [
-                (point[0], point[1], flag, valid)
-                for point, flag, valid in list(zip(
-                    round_line_floats(
-                        normalizeCoords(
-                            bev_egoright,
-                            width = BEV_W,
-                            height = BEV_H
-                        )
-                    ), 
-                    egoright_flag_list, 
-                    egoright_validity_list
-                ))
-            ],
-            "reproj_egoright" : [
-                (point[0], point[1], flag, valid)
-                for point, flag, valid in list(zip(
-                    round_line_floats(
-                        normalizeCoords(
-                            orig_bev_egoright,
-                            width = W,
-                            height = H
-                        )
-                    ), 
-                    egoright_flag_list, 
-                    egoright_validity_list
-                ))
-            ],
-            "homomatrix" : mat.tolist()
-        }
-
-        # Break if early_stopping reached
-        if (early_stopping is not None):
-            if (counter >= early_stopping):
-                break
+    for frame_id, frame_data, skip_reason in runFrames(
+        processFrame,
+        frame_tasks,
+        args.num_workers
+    ):
+        if (skip_reason is not None):
+            log_skipped(frame_id, skip_reason)
+        else:
+            label_writer.write(frame_id, frame_data)
 
     # Save master data
-    with open(BEV_JSON_PATH, "w") as f:
-        json.dump(data_master, f, indent = 4)
+    label_writer.close()
 
     # Save skipped frames
     with open(BEV_SKIPPED_JSON_PATH, "w") as f:
-        json.dump(skipped_dict, f, indent = 4)
\ No newline at end of file
+        json.dump(skipped_dict, f, indent = 4)
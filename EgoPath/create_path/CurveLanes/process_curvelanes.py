@@ -3,11 +3,52 @@
 import argparse
 import json
 import os
+import sys
 import shutil
 import math
+import itertools
 import warnings
 import numpy as np
 from PIL import Image, ImageDraw
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.frame_pool import runFrames
+from common.label_stream import LABEL_FORMATS, LabelWriter, getLabelsPath
+
+
+# ============================== Dataset constants ============================== #
+
+
+IMG_DIR = "images"
+LABEL_DIR = "labels"
+
+# I got this result from `./EDA_imgsizes.ipynb`
+SIZE_DICT = {
+    "beeg" : (2560, 1440),
+    "half_beeg" : (1280, 720),
+    "weird" : (1570, 660),
+}
+
+BEEG_Y_CROP_SUM = 320
+BEEG_X_CROP = 240
+BEEG_Y_CROP_TOP_RATIO = 0.75
+CROP_BEEG = {
+    "TOP" : int(BEEG_Y_CROP_SUM * BEEG_Y_CROP_TOP_RATIO),
+    "RIGHT" : BEEG_X_CROP,
+    "BOTTOM" : int(BEEG_Y_CROP_SUM * (1 - BEEG_Y_CROP_TOP_RATIO)),
+    "LEFT" : BEEG_X_CROP
+}
+
+WEIRD_Y_CROP = 130
+WEIRD_X_CROP = 385
+CROP_WEIRD = {
+    "TOP" : WEIRD_Y_CROP,
+    "RIGHT" : WEIRD_X_CROP,
+    "BOTTOM" : WEIRD_Y_CROP,
+    "LEFT" : WEIRD_X_CROP
+}
+
+# For interping lines with soooooooo few points, 2~3 or so
+LINE_INTERP_THRESHOLD = 5
 
 
 # ============================= Format functions ============================= #
@@ -219,7 +260,7 @@ def getDrivablePath(
 
 
 def annotateGT(
-        raw_img, anno_entry,
+        raw_img, anno_entry, img_index,
         raw_dir, visualization_dir,
         init_img_width, init_img_height,
         normalized = True,
@@ -229,12 +270,12 @@ def annotateGT(
     """
     Annotates and saves an image with:
         - Raw image, in "output_dir/image".
-        - Annotated image with all lanes, in "output_dir/visualization".
+        - Annotated image with all lanes, in "output_dir/visualization", unless visualization_dir is None.
     """
 
     # Define save name
     # Also save in PNG (EXTREMELY SLOW compared to jpg, for lossless quality)
-    save_name = str(img_id_counter).zfill(6) + ".png"
+    save_name = img_index + ".png"
 
     # Load img
     raw_img = raw_img
@@ -268,6 +309,10 @@ def annotateGT(
     # Copy raw img and put it in raw dir.
     raw_img.save(os.path.join(raw_dir, save_name))
 
+    # Visualization is optional
+    if (visualization_dir is None):
+        return
+
     # Draw all lanes & lines
     draw = ImageDraw.Draw(raw_img)
     lane_colors = {
@@ -426,43 +471,73 @@ def parseAnnotations(
                 return anno_data
 
 
+def processFrame(
+        img_index, img_path,
+        raw_dir, visualization_dir
+):
+    """
+    Parses a frame and saves its images, returning (img_index, frame GT), or (img_index, None)
+    if the frame is skipped. Runs in the worker processes.
+    """
+    # Preload image file for multiple uses later
+    raw_img = Image.open(img_path).convert("RGB")
+    img_width, img_height = raw_img.size
+
+    init_img_size = raw_img.size
+
+    resize = None
+    crop = None
+
+    if (init_img_size == SIZE_DICT["beeg"]):
+        resize = 0.5
+        crop = CROP_BEEG
+    elif (init_img_size == SIZE_DICT["half_beeg"]):
+        resize = None
+        crop = CROP_BEEG
+    elif (init_img_size == SIZE_DICT["weird"]):
+        resize = None
+        crop = CROP_WEIRD
+
+    anno_path = img_path.replace(".jpg", ".lines.json").replace(IMG_DIR, LABEL_DIR)
+
+    this_data = parseAnnotations(
+        frame_id = os.path.abspath(img_path),
+        anno_path = anno_path,
+        init_img_width = img_width,
+        init_img_height = img_height,
+        resize = resize,
+        crop = crop
+    )
+    if (this_data is None):
+        return (img_index, None)
+
+    annotateGT(
+        raw_img = raw_img,
+        anno_entry = this_data,
+        img_index = img_index,
+        raw_dir = raw_dir,
+        visualization_dir = visualization_dir,
+        init_img_height = img_height,
+        init_img_width = img_width,
+        resize = resize,
+        crop = crop
+    )
+
+    return (img_index, {
+        "drivable_path" : round_line_floats(this_data["drivable_path"]),
+        "egoleft_lane" : round_line_floats(this_data["egoleft_lane"]),
+        "egoright_lane" : round_line_floats(this_data["egoright_lane"]),
+        "img_height" : this_data["img_height"],
+        "img_width" : this_data["img_width"]
+    })
+
+
 if __name__ == "__main__":
 
     # ============================== Dataset structure ============================== #
 
     ROOT_DIR = "Curvelanes"
     LIST_SPLITS = ["train", "valid"]
-    IMG_DIR = "images"
-    LABEL_DIR = "labels"
-
-    # I got this result from `./EDA_imgsizes.ipynb`
-    SIZE_DICT = {
-        "beeg" : (2560, 1440),
-        "half_beeg" : (1280, 720),
-        "weird" : (1570, 660),
-    }
-
-    BEEG_Y_CROP_SUM = 320
-    BEEG_X_CROP = 240
-    BEEG_Y_CROP_TOP_RATIO = 0.75
-    CROP_BEEG = {
-        "TOP" : int(BEEG_Y_CROP_SUM * BEEG_Y_CROP_TOP_RATIO),
-        "RIGHT" : BEEG_X_CROP,
-        "BOTTOM" : int(BEEG_Y_CROP_SUM * (1 - BEEG_Y_CROP_TOP_RATIO)),
-        "LEFT" : BEEG_X_CROP
-    }
-    
-    WEIRD_Y_CROP = 130
-    WEIRD_X_CROP = 385
-    CROP_WEIRD = {
-        "TOP" : WEIRD_Y_CROP,
-        "RIGHT" : WEIRD_X_CROP,
-        "BOTTOM" : WEIRD_Y_CROP,
-        "LEFT" : WEIRD_X_CROP
-    }
-
-    # For interping lines with soooooooo few points, 2~3 or so
-    LINE_INTERP_THRESHOLD = 5
 
     # ============================== Parsing args ============================== #
 
@@ -487,6 +562,25 @@ if __name__ == "__main__":
         help = "Sampling step for each split/class",
         required = False,
     )
+    parser.add_argument(
+        "--num_workers",
+        type = int,
+        help = "Num. worker processes, defaults to the number of CPUs.",
+        required = False
+    )
+    parser.add_argument(
+        "--label_format",
+        type = str,
+        choices = LABEL_FORMATS,
+        help = "Label file format, jsonl streams each frame to drivable_path.jsonl as soon as it is processed.",
+        required = False,
+        default = "json"
+    )
+    parser.add_argument(
+        "--skip_visualization",
+        action = "store_true",
+        help = "Do not render the visualization images."
+    )
     # For debugging only
     parser.add_argument(
         "--early_stopping",
@@ -519,13 +613,15 @@ if __name__ == "__main__":
     --output_dir
         |----image
         |----visualization
-        |----drivable_path.json
+        |----drivable_path.json (or drivable_path.jsonl)
     """
     list_subdirs = [
         "image", 
         # "segmentation",   # Removed on 2025/06/05 
         "visualization"
     ]
+    if (args.skip_visualization):
+        list_subdirs.remove("visualization")
     if (os.path.exists(output_dir)):
         warnings.warn(f"Output directory {output_dir} already exists. Purged")
         shutil.rmtree(output_dir)
@@ -536,9 +632,12 @@ if __name__ == "__main__":
 
     # ============================== Parsing annotations ============================== #
 
-    # Parse data by batch
-    data_master = {}
-    img_id_counter = -1
+    raw_dir = os.path.join(output_dir, "image")
+    visualization_dir = None if (args.skip_visualization) else os.path.join(output_dir, "visualization")
+
+    # Parse data by batch, labels are written in frame order as the workers finish them
+    label_writer = LabelWriter(getLabelsPath(output_dir, "drivable_path", args.label_format))
+    img_id_iter = itertools.count()
 
     for split in LIST_SPLITS:
         print(f"\n==================== Processing {split} data ====================\n")
@@ -546,65 +645,27 @@ if __name__ == "__main__":
         with open(raw_img_book, "r") as f:
             list_raw_files = f.readlines()
 
-            for i in range(0, len(list_raw_files), sampling_step):
-                img_path = os.path.join(dataset_dir, ROOT_DIR, split, list_raw_files[i]).strip()
-                img_id_counter += 1
-
-                # Preload image file for multiple uses later
-                raw_img = Image.open(img_path).convert("RGB")
-                img_width, img_height = raw_img.size
-
-                init_img_size = raw_img.size
-
-                resize = None
-                crop = None
-
-                if (init_img_size == SIZE_DICT["beeg"]):
-                    resize = 0.5
-                    crop = CROP_BEEG
-                elif (init_img_size == SIZE_DICT["half_beeg"]):
-                    resize = None
-                    crop = CROP_BEEG
-                elif (init_img_size == SIZE_DICT["weird"]):
-                    resize = None
-                    crop = CROP_WEIRD
-
-                anno_path = img_path.replace(".jpg", ".lines.json").replace(IMG_DIR, LABEL_DIR)
-
-                this_data = parseAnnotations(
-                    frame_id = os.path.abspath(img_path),
-                    anno_path = anno_path,
-                    init_img_width = img_width,
-                    init_img_height = img_height,
-                    resize = resize,
-                    crop = crop
-                )
-                if (this_data is not None):
-
-                    annotateGT(
-                        raw_img = raw_img,
-                        anno_entry = this_data,
-                        raw_dir = os.path.join(output_dir, "image"),
-                        visualization_dir = os.path.join(output_dir, "visualization"),
-                        init_img_height = img_height,
-                        init_img_width = img_width,
-                        resize = resize,
-                        crop = crop
-                    )
-
-                    # Save as 6-digit incremental index
-                    img_index = str(str(img_id_counter).zfill(6))
-                    data_master[img_index] = {}
-                    data_master[img_index]["drivable_path"] = round_line_floats(this_data["drivable_path"])
-                    data_master[img_index]["egoleft_lane"] = round_line_floats(this_data["egoleft_lane"])
-                    data_master[img_index]["egoright_lane"] = round_line_floats(this_data["egoright_lane"])
-                    data_master[img_index]["img_height"] = this_data["img_height"]
-                    data_master[img_index]["img_width"] = this_data["img_width"]
-
-                    # Early stopping, it defined
-                    if (early_stopping and img_id_counter >= early_stopping - 1):
-                        break
+        sampled_raw_files = itertools.islice(list_raw_files, 0, None, sampling_step)
+        # Early stopping, if defined
+        if (early_stopping):
+            sampled_raw_files = itertools.islice(sampled_raw_files, early_stopping)
+
+        # Frame IDs are assigned to every sampled file, as 6-digit incremental index
+        frame_tasks = (
+            (
+                str(next(img_id_iter)).zfill(6),
+                os.path.join(dataset_dir, ROOT_DIR, split, raw_file).strip(),
+                raw_dir, visualization_dir
+            )
+            for raw_file in sampled_raw_files
+        )
+        for img_index, frame_data in runFrames(
+            processFrame,
+            frame_tasks,
+            args.num_workers
+        ):
+            if (frame_data is not None):
+                label_writer.write(img_index, frame_data)
 
     # Save master data
-    with open(os.path.join(output_dir, "drivable_path.json"), "w") as f:
-        json.dump(data_master, f, indent = 4)
\ No newline at end of file
+    label_writer.close()
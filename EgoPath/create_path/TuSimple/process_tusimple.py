@@ -3,10 +3,14 @@
 import argparse
 import json
 import os
+import sys
 import pathlib
+import itertools
 from PIL import Image, ImageDraw
 import warnings
-from datetime import datetime
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.frame_pool import runFrames
+from common.label_stream import LABEL_FORMATS, LabelWriter, getLabelsPath
 
 # Custom warning format cuz the default one is wayyyyyy too verbose
 def custom_warning_format(message, category, filename, lineno, line=None):
@@ -14,6 +18,10 @@ def custom_warning_format(message, category, filename, lineno, line=None):
 
 warnings.formatwarning = custom_warning_format
 
+# All TuSimple frames share the same size
+W = 1280
+H = 720
+
 # ============================== Helper functions ============================== #
 
 def roundLineFloats(line, ndigits = 4):
@@ -137,14 +145,14 @@ def getDrivablePath(left_ego, right_ego):
 
 
 def annotateGT(
-    anno_entry, anno_raw_file, 
+    anno_entry, anno_raw_file, frame_id,
     raw_dir, visualization_dir,
     normalized = True
 ):
     """
     Annotates and saves an image with:
         - Raw image, in "output_dir/image".
-        - Annotated image with all lanes, in "output_dir/visualization".
+        - Annotated image with all lanes, in "output_dir/visualization", unless visualization_dir is None.
 
     """
 
@@ -154,10 +162,14 @@ def annotateGT(
     # Define save name
     # Keep original pathname (back to 5 levels) for traceability, but replace "/" with "-"
     # Also save in PNG (EXTREMELY SLOW compared to jpg, for lossless quality)
-    save_name = str(img_id_counter).zfill(6) + ".png"
+    save_name = frame_id + ".png"
 
     # Copy raw img and put it in raw dir.
     raw_img.save(os.path.join(raw_dir, save_name))
+
+    # Visualization is optional
+    if (visualization_dir is None):
+        return
     
     # Draw all lanes & lines
     draw = ImageDraw.Draw(raw_img)
@@ -190,75 +202,127 @@ def annotateGT(
         save_name.replace(".png", ".jpg")
     ))
 
-def parseAnnotations(anno_path):
+def parseAnnotationEntry(anno_line):
+    """
+    Parses a single JSON line of a label file, then extracts normalized GT data.
+    Returns (raw_file, anno_data), with anno_data None if the entry is skipped.
+
+    """
+    item = json.loads(anno_line)
+    lanes = item["lanes"]
+    h_samples = item["h_samples"]
+    raw_file = item["raw_file"]
+
+    # Decouple from {lanes: [xi1, xi2, ...], h_samples: [y1, y2, ...]} to [(xi1, y1), (xi2, y2), ...]
+    # `lane_decoupled` is a list of sublists representing lanes, each lane is a list of (x, y) tuples.
+    lanes_decoupled = [
+        [(x, y) for x, y in zip(lane, h_samples) if x != -2]
+        for lane in lanes if sum(1 for x in lane if x != -2) >= 2     # Filter out lanes < 2 points (there's actually a bunch of em)
+    ]
+
+    # Determine 2 ego lanes
+    lane_anchors = [getLaneAnchor(lane) for lane in lanes_decoupled]
+    ego_indexes = getEgoIndexes(lane_anchors)
+
+    if (type(ego_indexes) is str):
+        if (ego_indexes.startswith("NO")):
+            warnings.warn(f"Parsing {raw_file}: {ego_indexes}")
+            return (raw_file, None)
+
+    left_ego = lanes_decoupled[ego_indexes[0]]
+    right_ego = lanes_decoupled[ego_indexes[1]]
+
+    # Determine drivable path from 2 egos
+    drivable_path = getDrivablePath(left_ego, right_ego)
+
+    # Parse processed data, all coords normalized
+    anno_data = {
+        "lanes" : [
+            roundLineFloats(normalizeCoords(lane, W, H)) 
+            for lane in lanes_decoupled
+        ],
+        "ego_indexes" : ego_indexes,
+        "drivable_path" : roundLineFloats(
+            normalizeCoords(
+                drivable_path, 
+                W, 
+                H
+            )
+        ),
+        "egoleft_lane" : roundLineFloats(
+            normalizeCoords(
+                left_ego, 
+                W, 
+                H
+            )
+        ),
+        "egoright_lane" : roundLineFloats(
+            normalizeCoords(
+                right_ego, 
+                W, 
+                H
+            )
+        ),
+    }
+
+    return (raw_file, anno_data)
+
+
+def parseAnnotations(anno_path, num_workers = None):
     """
     Parses lane annotations from raw dataset file, then extracts normalized GT data.
+    The JSON lines of the file are parsed in a pool of worker processes.
 
     """
-    # Read each line of GT text file as JSON
+    anno_data = {}
     with open(anno_path, "r") as f:
-        read_data = [json.loads(line) for line in f.readlines()]
+        for raw_file, entry_data in runFrames(
+            parseAnnotationEntry,
+            ((line, ) for line in f),
+            num_workers,
+            chunksize = 64
+        ):
+            if (entry_data is not None):
+                anno_data[raw_file] = entry_data
 
-    # Parse data from those JSON lines
-    anno_data = {}
-    for item in read_data:
-        lanes = item["lanes"]
-        h_samples = item["h_samples"]
-        raw_file = item["raw_file"]
-
-        # Decouple from {lanes: [xi1, xi2, ...], h_samples: [y1, y2, ...]} to [(xi1, y1), (xi2, y2), ...]
-        # `lane_decoupled` is a list of sublists representing lanes, each lane is a list of (x, y) tuples.
-        lanes_decoupled = [
-            [(x, y) for x, y in zip(lane, h_samples) if x != -2]
-            for lane in lanes if sum(1 for x in lane if x != -2) >= 2     # Filter out lanes < 2 points (there's actually a bunch of em)
-        ]
+    return anno_data
 
-        # Determine 2 ego lanes
-        lane_anchors = [getLaneAnchor(lane) for lane in lanes_decoupled]
-        ego_indexes = getEgoIndexes(lane_anchors)
-
-        if (type(ego_indexes) is str):
-            if (ego_indexes.startswith("NO")):
-                warnings.warn(f"Parsing {raw_file}: {ego_indexes}")
-                continue
-
-        left_ego = lanes_decoupled[ego_indexes[0]]
-        right_ego = lanes_decoupled[ego_indexes[1]]
-
-        # Determine drivable path from 2 egos
-        drivable_path = getDrivablePath(left_ego, right_ego)
-
-        # Parse processed data, all coords normalized
-        anno_data[raw_file] = {
-            "lanes" : [
-                roundLineFloats(normalizeCoords(lane, W, H)) 
-                for lane in lanes_decoupled
-            ],
-            "ego_indexes" : ego_indexes,
-            "drivable_path" : roundLineFloats(
-                normalizeCoords(
-                    drivable_path, 
-                    W, 
-                    H
-                )
-            ),
-            "egoleft_lane" : roundLineFloats(
-                normalizeCoords(
-                    left_ego, 
-                    W, 
-                    H
-                )
-            ),
-            "egoright_lane" : roundLineFloats(
-                normalizeCoords(
-                    right_ego, 
-                    W, 
-                    H
-                )
-            ),
-        }
 
-    return anno_data
+def processFrame(
+    frame_id, anno_entry, anno_raw_file,
+    raw_dir, visualization_dir
+):
+    """
+    Saves the images of a parsed frame, returning (frame_id, frame GT).
+    Runs in the worker processes.
+
+    """
+    annotateGT(
+        anno_entry,
+        anno_raw_file = anno_raw_file,
+        frame_id = frame_id,
+        raw_dir = raw_dir,
+        visualization_dir = visualization_dir
+    )
+
+    # Reorder all lines by decreasing y
+    return (frame_id, {
+        "drivable_path" : sorted(
+            anno_entry["drivable_path"],
+            key = lambda p: p[1],
+            reverse = True
+        ),
+        "egoleft_lane" : sorted(
+            anno_entry["egoleft_lane"],
+            key = lambda p: p[1],
+            reverse = True
+        ),
+        "egoright_lane" : sorted(
+            anno_entry["egoright_lane"],
+            key = lambda p: p[1],
+            reverse = True
+        )
+    })
 
             
 if __name__ == "__main__":
@@ -272,9 +336,6 @@ if __name__ == "__main__":
     train_clip_codes = ["0313", "0531", "0601"] # Train labels are split into 3 dirs
     test_file = "test_label.json"               # Test file name
 
-    W = 1280
-    H = 720
-
     # ============================== Parsing args ============================== #
 
     parser = argparse.ArgumentParser(
@@ -290,6 +351,25 @@ if __name__ == "__main__":
         type = str, 
         help = "Output directory"
     )
+    parser.add_argument(
+        "--num_workers",
+        type = int,
+        help = "Num. worker processes, defaults to the number of CPUs.",
+        required = False
+    )
+    parser.add_argument(
+        "--label_format",
+        type = str,
+        choices = LABEL_FORMATS,
+        help = "Label file format, jsonl streams each frame to drivable_path.jsonl as soon as it is processed.",
+        required = False,
+        default = "json"
+    )
+    parser.add_argument(
+        "--skip_visualization",
+        action = "store_true",
+        help = "Do not render the visualization images."
+    )
     # For debugging only
     parser.add_argument(
         "--early_stopping",
@@ -304,11 +384,11 @@ if __name__ == "__main__":
     --output_dir
         |----image
         |----visualization
-        |----drivable_path.json
+        |----drivable_path.json (or drivable_path.jsonl)
     """
     dataset_dir = args.dataset_dir
     output_dir = args.output_dir
-    list_subdirs = ["image", "visualization"]
+    list_subdirs = ["image"] if (args.skip_visualization) else ["image", "visualization"]
     for subdir in list_subdirs:
         subdir_path = os.path.join(output_dir, subdir)
         if (not os.path.exists(subdir_path)):
@@ -316,7 +396,7 @@ if __name__ == "__main__":
 
     # Parse early stopping
     if (args.early_stopping):
-        print(f"Early stopping set, stops after {args.early_stopping} files.")
+        print(f"Early stopping set, each label file stops after {args.early_stopping} files.")
         early_stopping = args.early_stopping
     else:
         early_stopping = None
@@ -336,66 +416,45 @@ if __name__ == "__main__":
     test_label_files = [os.path.join(dataset_dir, root_dir, test_file)]
     label_files = train_label_files + test_label_files
 
-    # Parse data by batch
-    data_master = {}
+    raw_dir = os.path.join(output_dir, "image")
+    visualization_dir = None if (args.skip_visualization) else os.path.join(output_dir, "visualization")
 
-    img_id_counter = -1
+    # Parse data by batch, labels are written in frame order as the workers finish them
+    label_writer = LabelWriter(getLabelsPath(output_dir, "drivable_path", args.label_format))
+    img_id_iter = itertools.count()
 
     for anno_file in label_files:
         print(f"\n==================== Processing data in label file {anno_file} ====================\n")
-        this_data = parseAnnotations(anno_file)
-        
-        list_raw_files = list(this_data.keys())
-        for raw_file in list_raw_files:
+        this_data = parseAnnotations(anno_file, args.num_workers)
 
-            # Conduct index increment
-            img_id_counter += 1
-
-            # Early stopping, it defined
-            if (early_stopping and img_id_counter >= early_stopping - 1):
-                break
-            
-            #set_dir = "/".join(anno_file.split("/")[ : -1]) # Slap "train_set" or "test_set" to the end  <-- Specific to linux hence used os.path.dirname command below
-            set_dir= os.path.dirname(anno_file)
-            set_dir = os.path.join(set_dir, test_dir) if test_file in anno_file else set_dir    # Tricky test dir
-
-            # Annotate raw images
-            anno_entry = this_data[raw_file]
-            annotateGT(
-                anno_entry,
-                anno_raw_file = os.path.join(set_dir, raw_file), 
-                raw_dir = os.path.join(output_dir, "image"),
-                visualization_dir = os.path.join(output_dir, "visualization")
-            )
+        #set_dir = "/".join(anno_file.split("/")[ : -1]) # Slap "train_set" or "test_set" to the end  <-- Specific to linux hence used os.path.dirname command below
+        set_dir= os.path.dirname(anno_file)
+        set_dir = os.path.join(set_dir, test_dir) if test_file in anno_file else set_dir    # Tricky test dir
 
-            # Reorder all lines by decreasing y
-            anno_entry["drivable_path"] = sorted(
-                anno_entry["drivable_path"],
-                key = lambda p: p[1],
-                reverse = True
-            )
-            anno_entry["egoleft_lane"] = sorted(
-                anno_entry["egoleft_lane"],
-                key = lambda p: p[1],
-                reverse = True
-            )
-            anno_entry["egoright_lane"] = sorted(
-                anno_entry["egoright_lane"],
-                key = lambda p: p[1],
-                reverse = True
+        list_raw_files = list(this_data.keys())
+        # Early stopping, if defined
+        if (early_stopping):
+            list_raw_files = list_raw_files[ : early_stopping]
+
+        # Change `raw_file` to 6-digit incremental index
+        frame_tasks = (
+            (
+                str(next(img_id_iter)).zfill(6), this_data[raw_file],
+                os.path.join(set_dir, raw_file),
+                raw_dir, visualization_dir
             )
-
-            # Change `raw_file` to 6-digit incremental index
-            data_master[str(img_id_counter).zfill(6)] = {
-                "drivable_path" : anno_entry["drivable_path"],
-                "egoleft_lane" : anno_entry["egoleft_lane"],
-                "egoright_lane" : anno_entry["egoright_lane"]
-            }
+            for raw_file in list_raw_files
+        )
+        for frame_id, frame_data in runFrames(
+            processFrame,
+            frame_tasks,
+            args.num_workers
+        ):
+            label_writer.write(frame_id, frame_data)
 
         print(f"Processed {len(this_data)} entries in above file.\n")
 
-    print(f"Done processing data with {len(data_master)} entries in total.\n")
+    print(f"Done processing data with {label_writer.num_labels} entries in total.\n")
 
     # Save master data
-    with open(os.path.join(output_dir, "drivable_path.json"), "w") as f:
-        json.dump(data_master, f, indent = 4)
\ No newline at end of file
+    label_writer.close()
@@ -0,0 +1,624 @@
+#! /usr/bin/env python3
+
+import os
+import cv2
+import warnings
+import numpy as np
+
+PointCoords = tuple[float, float]
+ImagePointCoords = tuple[int, int]
+
+# Visualization (colors in BGR)
+COLOR_EGOPATH = (0, 255, 255)   # Yellow
+COLOR_EGOLEFT = (0, 128, 0)     # Green
+COLOR_EGORIGHT = (255, 255, 0)  # Cyan
+
+# BEV transforms of fixed source points, computed once per process
+BEV_TRANSFORM_CACHE = {}
+
+
+# Custom warning format
+def custom_warning_format(
+    message, category, filename,
+    lineno, line = None
+):
+    return f"WARNING : {message}\n"
+
+
+# ============================== Line helpers ============================== #
+
+
+def imagePointTuplize(point: PointCoords) -> ImagePointCoords:
+    """
+    Parse all coords of an (x, y) point to int, making it
+    suitable for image operations.
+    """
+
+    return (int(point[0]), int(point[1]))
+
+
+def roundLineFloats(line, ndigits = 4):
+    line = list(line)
+    for i in range(len(line)):
+        line[i] = [
+            round(line[i][0], ndigits),
+            round(line[i][1], ndigits)
+        ]
+    line = tuple(line)
+    return line
+
+
+def normalizeCoords(line, width, height):
+    """
+    Normalize the coords of line points.
+    """
+
+    return [
+        (x / width, y / height)
+        for x, y in line
+    ]
+
+
+def renormalizeCoords(line, width, height):
+    """
+    Renormalize the coords of line points.
+    """
+
+    return [
+        (x * width, y * height)
+        for x, y in line
+    ]
+
+
+def interpLine(line: list, points_quota: int):
+    """
+    Interpolates a line of (x, y) points to have at least `point_quota` points.
+    """
+
+    if len(line) >= points_quota:
+        return line
+
+    # Extract x, y separately then parse to interp
+    x = np.array([pt[0] for pt in line])
+    y = np.array([pt[1] for pt in line])
+
+    # Interp more points along the line, based on
+    # distance between each subsequent original points.
+
+    # 1) Use distance along line as param (t)
+    # This is Euclidian distance between each point and the one before it
+    distances = np.cumsum(np.sqrt(
+        np.diff(x, prepend = x[0])**2 + \
+        np.diff(y, prepend = y[0])**2
+    ))
+    # Force first t as zero
+    distances[0] = 0
+
+    # 2) Generate new t evenly spaced along original line
+    evenly_t = np.linspace(distances[0], distances[-1], points_quota)
+
+    # 3) Interp x, y coordinates based on evenly t
+    x_new = np.interp(evenly_t, distances, x)
+    y_new = np.interp(evenly_t, distances, y)
+
+    return list(zip(x_new, y_new))
+
+
+def interpX(line, y):
+    """
+    Interpolate x-value of a point on a line, given y-value
+    """
+
+    points = np.array(line)
+    list_x = points[:, 0]
+    list_y = points[:, 1]
+
+    if not np.all(np.diff(list_y) > 0):
+        sort_idx = np.argsort(list_y)
+        list_y = list_y[sort_idx]
+        list_x = list_x[sort_idx]
+
+    return float(np.interp(y, list_y, list_x))
+
+
+def getLineAnchor(line, img_height):
+    """
+    Determine "anchor" point of a lane, where it meets the bottom of the image.
+    """
+
+    (x2, y2) = line[0]
+    (x1, y1) = line[1]
+
+    for i in range(len(line) - 2, 0, -1):
+        if (line[i][0] != x2):
+            (x1, y1) = line[i]
+            break
+
+    if (x1 == x2) or (y1 == y2):
+        if (x1 == x2):
+            error_lane = "Vertical"
+        elif (y1 == y2):
+            error_lane = "Horizontal"
+        warnings.warn("{0} line detected: {1}, with these 2 anchors: ({2}, {3}), ({4}, {5}).".format(
+            error_lane, line,
+            x1, y1,
+            x2, y2
+        ))
+        return (x1, None, None)
+
+    a = (y2 - y1) / (x2 - x1)
+    b = y1 - a * x1
+    x0 = (img_height - b) / a
+
+    return (x0, a, b)
+
+
+def formatLineGT(
+    line: list,
+    flag_list: list,
+    validity_list: list,
+    width: int,
+    height: int,
+    ndigits: int = 4
+):
+    """
+    Normalize and round a line for the output JSON, each point
+    having tuple format (x, y, flag, valid).
+    """
+
+    return [
+        (point[0], point[1], flag, valid)
+        for point, flag, valid in list(zip(
+            roundLineFloats(
+                normalizeCoords(
+                    line,
+                    width = width,
+                    height = height
+                ),
+                ndigits
+            ),
+            flag_list,
+            validity_list
+        ))
+    ]
+
+
+# ============================== Visualization ============================== #
+
+
+def drawLine(
+    img: np.ndarray,
+    line: list,
+    color: tuple,
+    thickness: int = 2
+):
+    for i in range(1, len(line)):
+        pt1 = (
+            int(line[i - 1][0]),
+            int(line[i - 1][1])
+        )
+        pt2 = (
+            int(line[i][0]),
+            int(line[i][1])
+        )
+        cv2.line(
+            img,
+            pt1, pt2,
+            color = color,
+            thickness = thickness
+        )
+
+
+def annotateGT(
+    img: np.ndarray,
+    orig_img: np.ndarray,
+    frame_id: str,
+    bev_egopath: list,
+    reproj_egopath: list,
+    bev_egoleft: list,
+    reproj_egoleft: list,
+    bev_egoright: list,
+    reproj_egoright: list,
+    raw_dir: str,
+    visualization_dir: str
+):
+    """
+    Annotates and saves an image with:
+        - Raw BEV image, in "output_dir/image_bev".
+        - BEV and original images with all lanes, in "output_dir/visualization_bev".
+    All lines are given in pixel coords.
+    """
+
+    # Save raw img in raw dir, as PNG
+    cv2.imwrite(
+        os.path.join(
+            raw_dir,
+            f"{frame_id}.png"
+        ),
+        img
+    )
+
+    # Draw BEV lines and save visualization img in vis dir, as JPG (saving storage space)
+    img_bev_vis = img.copy()
+    drawLine(img_bev_vis, bev_egopath, COLOR_EGOPATH)
+    drawLine(img_bev_vis, bev_egoleft, COLOR_EGOLEFT)
+    drawLine(img_bev_vis, bev_egoright, COLOR_EGORIGHT)
+    cv2.imwrite(
+        os.path.join(
+            visualization_dir,
+            f"{frame_id}.jpg"
+        ),
+        img_bev_vis
+    )
+
+    # Draw reprojected lines on original image and save it
+    drawLine(orig_img, reproj_egopath, COLOR_EGOPATH)
+    drawLine(orig_img, reproj_egoleft, COLOR_EGOLEFT)
+    drawLine(orig_img, reproj_egoright, COLOR_EGORIGHT)
+    cv2.imwrite(
+        os.path.join(
+            visualization_dir,
+            f"{frame_id}_orig.jpg"
+        ),
+        orig_img
+    )
+
+
+# ============================== BEV transform ============================== #
+
+
+def calFlagsValidity(
+    bev_line: list,
+    bev_w: int
+):
+    """
+    Flag the last point of a BEV line before it leaves the BEV image
+    horizontally, and mark all points after it as invalid.
+    """
+
+    flag_list = [0] * len(bev_line)
+    for i in range(len(bev_line)):
+        if (not 0 <= bev_line[i][0] <= bev_w):
+            flag_list[i - 1] = 1
+            break
+    if (not 1 in flag_list):
+        flag_list[-1] = 1
+
+    validity_list = [1] * len(bev_line)
+    last_valid_index = flag_list.index(1)
+    for i in range(last_valid_index + 1, len(validity_list)):
+        validity_list[i] = 0
+
+    return flag_list, validity_list
+
+
+def polyfit_BEV(
+    bev_line: list,
+    order: int,
+    y_step: int,
+    y_limit: int,
+    bev_w: int,
+    bev_h: int
+):
+    valid_line = [
+        point for point in bev_line
+        if (0 <= point[0] < bev_w) and (0 <= point[1] < bev_h)
+    ]
+    if (not valid_line):
+        warnings.warn("No valid points in BEV line for polyfit.")
+        return None, None, None
+
+    x = [point[0] for point in valid_line]
+    y = [point[1] for point in valid_line]
+    z = np.polyfit(y, x, order)
+    f = np.poly1d(z)
+    y_new = np.linspace(
+        0, y_limit,
+        int(y_limit / y_step) + 1
+    )
+    x_new = f(y_new)
+
+    # Sort by decreasing y
+    fitted_bev_line = sorted(
+        tuple(zip(x_new, y_new)),
+        key = lambda x: x[1],
+        reverse = True
+    )
+
+    flag_list, validity_list = calFlagsValidity(fitted_bev_line, bev_w)
+
+    return fitted_bev_line, flag_list, validity_list
+
+
+def findSourcePointsBEV(
+    h: int,
+    w: int,
+    egoleft: list,
+    egoright: list,
+    ego_height_ratio: float
+) -> dict:
+    """
+    Find 4 source points for the BEV homography transform, from the
+    start and end points of the 2 egolines.
+    """
+
+    # Renorm 2 egolines
+    egoleft = renormalizeCoords(egoleft, w, h)
+    egoright = renormalizeCoords(egoright, w, h)
+
+    ego_height = max(egoleft[-1][1], egoright[-1][1]) * ego_height_ratio
+
+    sps = {
+        "LS" : egoleft[0],
+        "RS" : egoright[0],
+        "LE" : egoleft[-1],
+        "RE" : egoright[-1]
+    }
+
+    # Tuplize 4 corners
+    for i, pt in sps.items():
+        sps[i] = imagePointTuplize(pt)
+
+    # Log the ego_height too
+    sps["ego_h"] = ego_height
+
+    return sps
+
+
+class BEVTransform():
+    """
+    Homography from 4 source points of the original image to 4 points of the
+    BEV image, with its inverse for reprojecting BEV lines back.
+    """
+
+    def __init__(
+        self,
+        sps: dict,
+        bev_pts: dict,
+        bev_w: int,
+        bev_h: int,
+        remap: bool = False
+    ):
+        self.bev_w = bev_w
+        self.bev_h = bev_h
+        self.mat, _ = cv2.findHomography(
+            srcPoints = np.array([
+                sps["LS"],
+                sps["RS"],
+                sps["LE"],
+                sps["RE"]
+            ]),
+            dstPoints = np.array([
+                bev_pts["LS"],
+                bev_pts["RS"],
+                bev_pts["LE"],
+                bev_pts["RE"],
+            ])
+        )
+        self.inv_mat = np.linalg.inv(self.mat)
+
+        # Remap tables, only worth building when the homography is reused
+        self.map1 = None
+        self.map2 = None
+        if (remap):
+            self.initRemapTables()
+
+    def initRemapTables(self):
+        """
+        Precompute the source pixel of every BEV pixel as fixed-point remap tables,
+        so that warping an image is a table lookup instead of recomputing the
+        homography per pixel. Interpolation is in fixed-point, so warped pixels may
+        differ from cv2.warpPerspective by a few intensity levels.
+        """
+
+        bev_grid = np.stack(
+            np.meshgrid(
+                np.arange(self.bev_w, dtype = np.float32),
+                np.arange(self.bev_h, dtype = np.float32)
+            ),
+            axis = -1
+        )
+        src_map = self.transformPoints(
+            bev_grid.reshape(-1, 2),
+            inverse = True
+        ).reshape(self.bev_h, self.bev_w, 2)
+        self.map1, self.map2 = cv2.convertMaps(
+            src_map, None,
+            cv2.CV_16SC2
+        )
+
+    def warpImage(self, img: np.ndarray) -> np.ndarray:
+        if (self.map1 is not None):
+            return cv2.remap(
+                img, self.map1, self.map2,
+                cv2.INTER_LINEAR
+            )
+        return cv2.warpPerspective(
+            img, self.mat,
+            np.array([self.bev_w, self.bev_h])
+        )
+
+    def transformPoints(
+        self,
+        points: list,
+        inverse: bool = False
+    ) -> np.ndarray:
+        """
+        Transform (x, y) points to BEV space, or back to original space if
+        inverse, returning an (N, 2) float32 array.
+        """
+
+        points = np.array(
+            points,
+            dtype = np.float32
+        ).reshape(-1, 1, 2)
+        mat = self.inv_mat if inverse else self.mat
+        return cv2.perspectiveTransform(points, mat).reshape(-1, 2)
+
+    def transformLines(
+        self,
+        lines: list,
+        inverse: bool = False
+    ) -> list:
+        """
+        Transform several lines in a single call, returning each line as a list of
+        int (x, y) tuples.
+        """
+
+        if (not lines):
+            return []
+
+        lengths = [len(line) for line in lines]
+        points = self.transformPoints(
+            [point for line in lines for point in line],
+            inverse
+        )
+
+        transformed_lines = []
+        start = 0
+        for length in lengths:
+            transformed_lines.append([
+                tuple(map(int, point))
+                for point in points[start : start + length]
+            ])
+            start += length
+
+        return transformed_lines
+
+
+def getBEVTransform(
+    sps: dict,
+    bev_pts: dict,
+    bev_w: int,
+    bev_h: int,
+    remap: bool = False
+) -> BEVTransform:
+    """
+    Get the BEV transform of fixed source points, computing the homography (and
+    its remap tables if remap) only the first time it is requested in a process.
+    """
+
+    key = (
+        tuple(tuple(sps[corner]) for corner in ("LS", "RS", "LE", "RE")),
+        tuple(tuple(bev_pts[corner]) for corner in ("LS", "RS", "LE", "RE")),
+        bev_w, bev_h, remap
+    )
+    if (key not in BEV_TRANSFORM_CACHE):
+        BEV_TRANSFORM_CACHE[key] = BEVTransform(sps, bev_pts, bev_w, bev_h, remap)
+
+    return BEV_TRANSFORM_CACHE[key]
+
+
+def transformLinesBEV(
+    lines: list,
+    w: int,
+    h: int,
+    ego_h: float,
+    bev_transform: BEVTransform,
+    min_points: int,
+    polyfit_order: int,
+    bev_y_step: int
+) -> list:
+    """
+    Transform the normalized lines of a frame to BEV space, polyfit them and reproject
+    them back to original space, with a single point transform call in each direction.
+    Returns (bev_line, reproj_line, flag_list, validity_list) for each line, or None
+    for a line which could not be transformed.
+    """
+
+    # Renorm lines, keep points below ego height and interp more points
+    interp_lines = []
+    for line in lines:
+        line = [
+            (point[0] * w, point[1] * h) for point in line
+            if (point[1] * h >= ego_h)
+        ]
+        interp_lines.append(
+            interpLine(line, min_points) if line
+            else None
+        )
+
+    # Transform all lines to BEV
+    valid_indices = [i for i, line in enumerate(interp_lines) if line]
+    bev_lines = bev_transform.transformLines(
+        [interp_lines[i] for i in valid_indices]
+    )
+
+    # Polyfit BEV lines for certain amount of coords
+    # (should be 11 by default), along with flags
+    fitted_lines = {}
+    for i, bev_line in zip(valid_indices, bev_lines):
+        fitted_line, flag_list, validity_list = polyfit_BEV(
+            bev_line = bev_line,
+            order = polyfit_order,
+            y_step = bev_y_step,
+            y_limit = bev_transform.bev_h,
+            bev_w = bev_transform.bev_w,
+            bev_h = bev_transform.bev_h
+        )
+        if (fitted_line):
+            fitted_lines[i] = (fitted_line, flag_list, validity_list)
+
+    # Reproject all fitted lines back to orig space
+    fitted_indices = list(fitted_lines.keys())
+    reproj_lines = bev_transform.transformLines(
+        [fitted_lines[i][0] for i in fitted_indices],
+        inverse = True
+    )
+
+    results = [None] * len(lines)
+    for i, reproj_line in zip(fitted_indices, reproj_lines):
+        fitted_line, flag_list, validity_list = fitted_lines[i]
+        results[i] = (fitted_line, reproj_line, flag_list, validity_list)
+
+    return results
+
+
+def calTransformedDistances(
+    points: list,
+    anchor: PointCoords,
+    bev_transform: BEVTransform
+) -> list:
+    """
+    Distances of points from an anchor point after transforming all of them
+    to BEV space in a single call.
+    """
+
+    pts_bev = bev_transform.transformPoints(list(points) + [anchor])
+
+    return [
+        np.linalg.norm(point_bev - pts_bev[-1])
+        for point_bev in pts_bev[:-1]
+    ]
+
+
+def calEgoSides(
+    bev_egopath: list,
+    anchor_offsets: list,
+    bev_transform: BEVTransform
+) -> list:
+    """
+    Shift the BEV egopath horizontally by each anchor offset to create the BEV
+    egosides, and reproject all of them to original space in a single call.
+    Returns (bev_egoside, orig_egoside, flag_list, validity_list) for each offset.
+    """
+
+    bev_egosides = [
+        [
+            (int(x + anchor_offset), int(y))
+            for x, y in bev_egopath
+        ]
+        for anchor_offset in anchor_offsets
+    ]
+
+    orig_egosides = bev_transform.transformLines(
+        bev_egosides,
+        inverse = True
+    )
+
+    results = []
+    for bev_egoside, orig_egoside in zip(bev_egosides, orig_egosides):
+        flag_list, validity_list = calFlagsValidity(bev_egoside, bev_transform.bev_w)
+        results.append((bev_egoside, orig_egoside, flag_list, validity_list))
+
+    return results
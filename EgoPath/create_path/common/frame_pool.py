@@ -0,0 +1,40 @@
+#! /usr/bin/env python3
+
+import os
+from multiprocessing import Pool
+
+
+# ============================== Frame driver ============================== #
+
+
+def runFrameTask(task):
+    process_frame, frame_args = task
+    return process_frame(*frame_args)
+
+
+def runFrames(
+    process_frame,
+    frame_tasks,
+    num_workers: int = None,
+    chunksize: int = 16
+):
+    """
+    Run process_frame(*frame_args) for each of the frame tasks in a pool of worker
+    processes, yielding the results in the order of the tasks so that outputs are
+    identical to a serial run. frame_tasks can be any iterable, including a generator,
+    in which case tasks are only built as the pool consumes them. process_frame must
+    be a module level function.
+    """
+
+    num_workers = num_workers if num_workers else os.cpu_count()
+    tasks = ((process_frame, frame_args) for frame_args in frame_tasks)
+
+    # Frames are processed in the main process if no pool is required
+    if (num_workers <= 1):
+        for task in tasks:
+            yield runFrameTask(task)
+        return
+
+    with Pool(num_workers) as pool:
+        for result in pool.imap(runFrameTask, tasks, chunksize = chunksize):
+            yield result
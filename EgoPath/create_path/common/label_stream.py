@@ -0,0 +1,110 @@
+#! /usr/bin/env python3
+
+import os
+import json
+
+# Label file formats, picked from the extension of the label file path:
+#   .json  - a single dict of {frame_id : label}, written at once when closed
+#   .jsonl - one {"frame_id" : frame_id, "label" : label} object per line, written
+#            and flushed as each frame comes in so consumers can read it incrementally
+LABEL_FORMATS = ["json", "jsonl"]
+
+
+# ============================== Writing ============================== #
+
+
+class LabelWriter():
+    """
+    Writes frame labels to a JSON or JSON-lines label file. JSON labels are kept
+    until the writer is closed and dumped like the process scripts always did,
+    JSON-lines labels are streamed to disk one frame per line. With metadata, the
+    JSON file is dumped as the metadata followed by the labels under "data", as the
+    EgoLanes TuSimple labels are - metadata is not written to JSON-lines files.
+    """
+
+    def __init__(self, labels_path: str, metadata: dict = None):
+
+        self.labels_path = labels_path
+        self.metadata = metadata
+        self.streaming = labels_path.endswith(".jsonl")
+        self.num_labels = 0
+
+        if (self.streaming):
+            # Line buffered, every frame is on disk as soon as it is written
+            self.labels_file = open(labels_path, "w", buffering = 1)
+        else:
+            self.labels = {}
+
+    def write(self, frame_id: str, label):
+        if (self.streaming):
+            self.labels_file.write(json.dumps({
+                "frame_id" : frame_id,
+                "label" : label
+            }) + "\n")
+        else:
+            self.labels[frame_id] = label
+        self.num_labels += 1
+
+    def close(self):
+        if (self.streaming):
+            self.labels_file.close()
+        else:
+            labels = self.labels
+            if (self.metadata is not None):
+                labels = {**self.metadata, "data" : self.labels}
+            with open(self.labels_path, "w") as f:
+                json.dump(labels, f, indent = 4)
+
+
+def getLabelsPath(labels_dir: str, labels_name: str, label_format: str = "json"):
+    """
+    Path of a label file of the given format, e.g. drivable_path.jsonl.
+    """
+
+    return os.path.join(labels_dir, f"{labels_name}.{label_format}")
+
+
+# ============================== Reading ============================== #
+
+
+def findLabels(labels_dir: str, labels_name: str):
+    """
+    Path of an existing label file, the JSON one if both formats exist.
+    """
+
+    for label_format in LABEL_FORMATS:
+        labels_path = getLabelsPath(labels_dir, labels_name, label_format)
+        if (os.path.exists(labels_path)):
+            return labels_path
+
+    raise FileNotFoundError(
+        f"No {labels_name}.json or {labels_name}.jsonl label file in {labels_dir}"
+    )
+
+
+def iterLabels(labels_path: str):
+    """
+    Yield (frame_id, label) pairs of a JSON or JSON-lines label file in file order.
+    JSON-lines files are read line by line, and an incomplete last line of a file
+    that is still being written is left for the next read.
+    """
+
+    if (labels_path.endswith(".jsonl")):
+        with open(labels_path, "r") as f:
+            for line in f:
+                if (not line.endswith("\n")):
+                    break
+                if (line.strip()):
+                    entry = json.loads(line)
+                    yield entry["frame_id"], entry["label"]
+    else:
+        with open(labels_path, "r") as f:
+            yield from json.load(f).items()
+
+
+def loadLabels(labels_path: str):
+    """
+    Load a JSON or JSON-lines label file as a dict of {frame_id : label}.
+    """
+
+    return dict(iterLabels(labels_path))
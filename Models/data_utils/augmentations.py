@@ -13,6 +13,24 @@ DATA_TYPES_LITERAL = Literal[
 ]
 DATA_TYPES_LIST = list(get_args(DATA_TYPES_LITERAL))
 
+# Augmentations instances of this process, one for each combination of
+# train vs test/val mode and dataset type
+AUGMENTATIONS_CACHE = {}
+
+# Get the long-lived Augmentations instance for the given mode and dataset
+# type, building its transform pipelines only on first use in this process
+def getAugmentations(is_train: bool, data_type: DATA_TYPES_LITERAL):
+    key = (bool(is_train), data_type)
+    if(key not in AUGMENTATIONS_CACHE):
+        AUGMENTATIONS_CACHE[key] = Augmentations(is_train=is_train, data_type=data_type)
+    return AUGMENTATIONS_CACHE[key]
+
+# Seed the random number generators used by the transforms, e.g. with a
+# different seed in each DataLoader worker process
+def seedAugmentations(seed):
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+
 class Augmentations():
     def __init__(self, is_train: bool, data_type: DATA_TYPES_LITERAL):
 
@@ -247,6 +265,33 @@ class Augmentations():
 
         return self.augmented_image
 
+    # BATCH
+    # Apply the transform of the dataset type to each sample of a batch, given as
+    # lists of images and ground truth. Returns the list of augmented images, and
+    # the list of augmented ground truth for all but KEYPOINTS data
+    def applyTransformBatch(self, images, ground_truths = None):
+
+        if(self.data_type == 'KEYPOINTS'):
+            return [self.applyTransformKeypoint(image) for image in images]
+
+        if(self.data_type == 'SEGMENTATION'):
+            applyTransform = self.applyTransformSeg
+        elif(self.data_type == 'BINARY_SEGMENTATION'):
+            applyTransform = self.applyTransformBinarySeg
+        else:
+            applyTransform = self.applyTransformDepth
+
+        augmented_images = []
+        augmented_ground_truths = []
+
+        for image, ground_truth in zip(images, ground_truths):
+            augmented_image, augmented_ground_truth = \
+                applyTransform(image=image, ground_truth=ground_truth)
+            augmented_images.append(augmented_image)
+            augmented_ground_truths.append(augmented_ground_truth)
+
+        return augmented_images, augmented_ground_truths
+
     # ADDITIONAL DATA SPECIFIC NOISE
     # Apply roadwork objects noise for DomainSeg
     def applyNoiseRoadWork(self):
@@ -0,0 +1,227 @@
+#! /usr/bin/env python3
+
+import json
+import numpy as np
+
+# Keypoint lines of a BEV label, each stored as (x, y) points - the flag and
+# validity of each point in the label files are not used for training
+LINE_FIELDS = [
+    "bev_egopath",
+    "reproj_egopath",
+    "bev_egoleft",
+    "reproj_egoleft",
+    "bev_egoright",
+    "reproj_egoright"
+]
+
+# Label entry holding the homography shared by all frames of a dataset
+STANDARD_HOMOMATRIX_KEY = "standard_homomatrix"
+
+
+# Read (frame_id, label) pairs of a label file, either a JSON dict or the JSON-lines
+# files streamed by the EgoPath process scripts - {"frame_id": ..., "label": ...}
+# per line - which are read line by line instead of being parsed at once. An
+# incomplete last line of a JSON-lines file which is still being written is skipped
+def readLabels(labels_filepath):
+    with open(labels_filepath, "r") as f:
+        if (labels_filepath.endswith(".jsonl")):
+            for line in f:
+                if (not line.endswith("\n")):
+                    break
+                if (line.strip()):
+                    entry = json.loads(line)
+                    yield entry["frame_id"], entry["label"]
+        else:
+            yield from json.load(f).items()
+
+
+# Number of frames converted to arrays at once while labels are read
+CHUNK_FRAMES = 4096
+
+
+# (x, y) points of the lines of a chunk of frames, as a float32 (frames, points, 2)
+# array padded to the longest line, and the number of points of each line
+def packLines(lines, max_length = None):
+    line_lengths = np.array([len(line) for line in lines], dtype = np.int32)
+    if (max_length is None):
+        max_length = int(line_lengths.max()) if (len(lines) > 0) else 0
+
+    # Lines of the BEV parsers all have the same number of points
+    if (len(lines) > 0 and (line_lengths == max_length).all()):
+        packed_lines = np.array(lines, dtype = np.float32)
+        packed_lines = packed_lines.reshape(len(lines), max_length, -1)[:, :, 0:2]
+        return np.ascontiguousarray(packed_lines), line_lengths
+
+    packed_lines = np.zeros((len(lines), max_length, 2), dtype = np.float32)
+    for row, line in enumerate(lines):
+        if (len(line) > 0):
+            packed_lines[row, 0:len(line)] = np.array(line, dtype = np.float32)[:, 0:2]
+    return packed_lines, line_lengths
+
+
+# Number of values of the BEV-to-image matrix at the start of a packed sample
+HOMOTRANS_MAT_SIZE = 9
+
+
+# Pack the BEV-to-image matrix and the keypoint lines of a sample into a single
+# contiguous float32 buffer - the 9 matrix values followed by the x row and the
+# y row of each line - so that a sample is copied to the device at once. Returns
+# the buffer and the number of points of each line
+def packKeypoints(homotrans_mat, lines):
+    line_lengths = [len(line) for line in lines]
+    packed = np.empty(HOMOTRANS_MAT_SIZE + 2*sum(line_lengths), dtype = np.float32)
+    packed[0:HOMOTRANS_MAT_SIZE] = np.asarray(homotrans_mat, dtype = np.float32).reshape(-1)
+
+    offset = HOMOTRANS_MAT_SIZE
+    for line, line_length in zip(lines, line_lengths):
+        if (line_length > 0):
+            line = np.asarray(line, dtype = np.float32).reshape(line_length, -1)
+            packed[offset:offset + 2*line_length].reshape(2, line_length)[:] = \
+                line[:, 0:2].transpose()
+        offset += 2*line_length
+
+    return packed, line_lengths
+
+
+# Split a packed sample, a numpy array or a torch tensor, into the (3, 3) BEV-to-image
+# matrix and the (2, points) x/y rows of each line - views of the packed buffer, with
+# leading batch dimensions kept if samples were stacked into a mini-batch
+def unpackKeypoints(packed, line_lengths):
+    batch_shape = tuple(packed.shape[:-1])
+    homotrans_mat = packed[..., 0:HOMOTRANS_MAT_SIZE].reshape(batch_shape + (3, 3))
+
+    lines = []
+    offset = HOMOTRANS_MAT_SIZE
+    for line_length in line_lengths:
+        line = packed[..., offset:offset + 2*line_length]
+        lines.append(line.reshape(batch_shape + (2, line_length)))
+        offset += 2*line_length
+
+    return homotrans_mat, lines
+
+
+# Columnar store of the BEV labels of a dataset - each keypoint line is kept as a
+# single float32 (N, max points, 2) array with the number of points of each row,
+# and BEV-to-image transforms are inverted once for all frames
+class AutoSteerLabelStore():
+    def __init__(self, labels_filepath: str):
+
+        self.labels_filepath = labels_filepath
+
+        # Homographies from image to BEV, shared or per frame
+        self.standard_homomatrix = None
+
+        # Labels are converted to arrays a chunk of frames at a time as they are
+        # read, so the whole label file is never held as Python lists
+        frame_id_chunks = []
+        line_chunks = {field: [] for field in LINE_FIELDS}
+        homomatrix_chunks = []
+
+        chunk_frame_ids = []
+        chunk_lines = {field: [] for field in LINE_FIELDS}
+        chunk_homomatrices = []
+
+        def packChunk():
+            frame_id_chunks.append(np.array(chunk_frame_ids, dtype = str))
+            for field in LINE_FIELDS:
+                line_chunks[field].append(packLines(chunk_lines[field]))
+                chunk_lines[field].clear()
+            homomatrix_chunks.append(np.array(chunk_homomatrices, dtype = np.float64))
+            chunk_frame_ids.clear()
+            chunk_homomatrices.clear()
+
+        for frame_id, label in readLabels(self.labels_filepath):
+
+            if (frame_id == STANDARD_HOMOMATRIX_KEY):
+                self.standard_homomatrix = np.array(label, dtype = np.float64)
+                continue
+
+            chunk_frame_ids.append(frame_id)
+            for field in LINE_FIELDS:
+                chunk_lines[field].append(label[field])
+            if ("homomatrix" in label):
+                chunk_homomatrices.append(label["homomatrix"])
+
+            if (len(chunk_frame_ids) == CHUNK_FRAMES):
+                packChunk()
+
+        if (len(chunk_frame_ids) > 0 or len(frame_id_chunks) == 0):
+            packChunk()
+
+        # Frame ID of each row as a fixed-width string array, and row of each frame ID
+        self.frame_ids = np.concatenate(frame_id_chunks)
+        self.num_frames = len(self.frame_ids)
+        self.index = {
+            frame_id: row
+            for row, frame_id in enumerate(self.frame_ids.tolist())
+        }
+
+        # Lines of each field, padded to the longest line of all chunks
+        self.lines = {}
+        self.line_lengths = {}
+        for field in LINE_FIELDS:
+            max_length = max(chunk[0].shape[1] for chunk in line_chunks[field])
+            field_lines = np.zeros((self.num_frames, max_length, 2), dtype = np.float32)
+            row = 0
+            for packed_lines, _ in line_chunks[field]:
+                field_lines[row:row + len(packed_lines), 0:packed_lines.shape[1]] = packed_lines
+                row += len(packed_lines)
+            field_lines.flags.writeable = False
+            self.lines[field] = field_lines
+            self.line_lengths[field] = np.concatenate([
+                line_lengths for _, line_lengths in line_chunks[field]
+            ])
+            line_chunks[field] = None
+
+        # Each frame needs a BEV-to-image transform, either its own homography
+        # or the standard one shared by all frames of the dataset
+        homomatrices = np.concatenate(homomatrix_chunks).reshape(-1, 3, 3)
+        if (len(homomatrices) not in (0, self.num_frames)):
+            raise ValueError(
+                f"{self.labels_filepath}: {len(homomatrices)} of {self.num_frames} "
+                f"frames have a homomatrix, expected all or none of them"
+            )
+        if (self.num_frames > 0 and len(homomatrices) == 0 \
+                and self.standard_homomatrix is None):
+            raise ValueError(
+                f"{self.labels_filepath}: no per-frame homomatrix "
+                f"and no {STANDARD_HOMOMATRIX_KEY} entry"
+            )
+
+        # BEV-to-image transforms, inverted in float64 in a single batch
+        self.standard_bev_to_image_transform = (
+            np.linalg.inv(self.standard_homomatrix)
+            if (self.standard_homomatrix is not None)
+            else None
+        )
+        if (self.num_frames > 0 and len(homomatrices) == self.num_frames):
+            self.bev_to_image_transforms = np.linalg.inv(homomatrices).astype(np.float32)
+            self.bev_to_image_transforms.flags.writeable = False
+        else:
+            self.bev_to_image_transforms = None
+
+    def getItemCount(self):
+        return self.num_frames
+
+    # Frame ID of a row
+    def getFrameID(self, row: int):
+        return str(self.frame_ids[row])
+
+    # Row of a frame ID
+    def getRow(self, frame_id: str):
+        return self.index[frame_id]
+
+    # Zero-copy view of the (x, y) points of a keypoint line of a row
+    def getLine(self, row: int, field: str):
+        return self.lines[field][row, 0:self.line_lengths[field][row]]
+
+    # Zero-copy views of all keypoint lines of a row, in LINE_FIELDS order
+    def getLines(self, row: int):
+        return [self.getLine(row, field) for field in LINE_FIELDS]
+
+    # BEV-to-image transform of a row, per frame if the labels have a
+    # homography for each frame, otherwise the shared one
+    def getBEVToImageTransform(self, row: int):
+        if (self.bev_to_image_transforms is not None):
+            return self.bev_to_image_transforms[row]
+        return self.standard_bev_to_image_transform
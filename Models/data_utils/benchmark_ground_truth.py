@@ -0,0 +1,157 @@
+#%%
+# Comment above is for Jupyter execution in VSCode
+#! /usr/bin/env python3
+import time
+import numpy as np
+from argparse import ArgumentParser
+from PIL import Image
+import sys
+sys.path.append('..')
+from data_utils.load_data_scene_seg import LoadDataSceneSeg, COLOUR_TO_CLASS_ID
+
+# Reference per-pixel implementation of LoadDataSceneSeg.createGroundTruth
+# used to verify the output of the vectorized version
+def createGroundTruthReference(input_label):
+    # Colourmaps for classes
+    sky_colour = (61, 184, 255)
+    background_objects_colour = (61, 93, 255)
+    road_edge_delimiter_colour = (216, 255, 61)
+    unlabelled_colour = (0,0,0)
+    vulnerable_living_colour = (255, 61, 61)
+    small_mobile_vehicle_colour = (255, 190, 61)
+    large_mobile_vehicle_colour = (255, 116, 61)
+    foreground_objects_colour = (255, 28, 145)
+    road_colour = (0, 255, 220)
+
+    # Image Size
+    row, col = input_label.size
+    num_pixels = row*col
+
+    # Ground Truth Visualization
+    vis = Image.new(mode="RGB", size=(row, col))
+
+    # Ground Truth Multi-Channel Label
+    ground_truth_background = Image.new(mode="L", size=(row, col))
+    ground_truth_foreground = Image.new(mode="L", size=(row,col))
+    ground_truth_road = Image.new(mode="L", size=(row,col))
+
+    # Loading images
+    px = input_label.load()
+    vx = vis.load()
+    bx = ground_truth_background.load()
+    fx = ground_truth_foreground.load()
+    rx = ground_truth_road.load()
+
+    # Counters for pixel level class frequency in image
+    background_class_freq = 0
+    foreground_class_freq = 0
+    road_class_freq = 0
+
+    # Extracting classes and assigning to colourmap
+    for x in range(row):
+        for y in range(col):
+
+            # BACKGROUND OBJECTS
+            if px[x,y] == background_objects_colour or \
+                px[x,y] == road_edge_delimiter_colour or \
+                px[x,y] == unlabelled_colour or \
+                px[x,y] == sky_colour:
+
+                vx[x,y] = background_objects_colour
+                bx[x, y] = 255
+                background_class_freq += 1
+
+            # FOREGROUND OBJECTS
+            elif px[x,y] == vulnerable_living_colour or \
+                px[x,y] == small_mobile_vehicle_colour or \
+                px[x,y] == large_mobile_vehicle_colour or \
+                px[x,y] == foreground_objects_colour:
+
+                vx[x,y] = foreground_objects_colour
+                fx[x, y] = 255
+                foreground_class_freq += 1
+
+            # ROAD
+            elif px[x,y] == road_colour:
+
+                vx[x,y] = road_colour
+                rx[x, y] = 255
+                road_class_freq += 1
+
+    # Calculate class weights for loss function
+    class_weights = []
+    class_weights.append(num_pixels/(background_class_freq + 5120))
+    class_weights.append(num_pixels/(foreground_class_freq + 5120))
+    class_weights.append(num_pixels/(road_class_freq + 5120))
+
+    # Getting ground truth data
+    ground_truth = []
+    ground_truth.append(np.array(vis))
+    ground_truth.append(np.array(ground_truth_background))
+    ground_truth.append(np.array(ground_truth_foreground))
+    ground_truth.append(np.array(ground_truth_road))
+
+    return ground_truth, class_weights
+
+# Create a random label image made up of blocks of the SceneSeg label colours
+# as well as a small share of colours which do not belong to any class
+def createRandomLabel(width, height, block_size = 8):
+    colours = np.array(list(COLOUR_TO_CLASS_ID.keys()) + [(12, 34, 56)], dtype=np.uint8)
+    blocks_y = -(-height//block_size)
+    blocks_x = -(-width//block_size)
+    block_ids = np.random.randint(0, len(colours), size=(blocks_y, blocks_x))
+    block_ids = np.repeat(np.repeat(block_ids, block_size, axis=0), block_size, axis=1)
+    return Image.fromarray(colours[block_ids[0:height, 0:width]])
+
+def timeFunction(function, input_label, num_runs):
+    timings = []
+    for _ in range(0, num_runs):
+        start_time = time.perf_counter()
+        output = function(input_label)
+        timings.append(time.perf_counter() - start_time)
+    return output, np.mean(timings)*1000
+
+def main():
+
+    parser = ArgumentParser()
+    parser.add_argument("-l", "--label", dest="label", default="", help="path to a SceneSeg ground truth mask, a random label is used if not provided")
+    parser.add_argument("-W", "--width", dest="width", type=int, default=1920, help="width of the random label")
+    parser.add_argument("-H", "--height", dest="height", type=int, default=990, help="height of the random label")
+    parser.add_argument("-n", "--num_runs", dest="num_runs", type=int, default=10, help="number of timed runs of the vectorized implementation")
+    args = parser.parse_args()
+
+    if(len(args.label) > 0):
+        input_label = Image.open(args.label)
+    else:
+        input_label = createRandomLabel(args.width, args.height)
+
+    print('Label size:', input_label.size)
+
+    # Instance only used for its createGroundTruth method, data
+    # loading in __init__ is not required for the benchmark
+    dataset = LoadDataSceneSeg.__new__(LoadDataSceneSeg)
+
+    reference_output, reference_time = \
+        timeFunction(createGroundTruthReference, input_label, 1)
+    vectorized_output, vectorized_time = \
+        timeFunction(dataset.createGroundTruth, input_label, args.num_runs)
+
+    # Compare ground truth channels and class weights
+    reference_ground_truth, reference_class_weights = reference_output
+    vectorized_ground_truth, vectorized_class_weights = vectorized_output
+
+    is_equal = all([np.array_equal(reference, vectorized) for reference, vectorized \
+        in zip(reference_ground_truth, vectorized_ground_truth)])
+    is_equal = is_equal and np.allclose(reference_class_weights, vectorized_class_weights)
+
+    print('Outputs match:', is_equal)
+    print('Per-pixel loop: %.2f ms' % reference_time)
+    print('Vectorized lookup: %.2f ms' % vectorized_time)
+    print('Speedup: %.1fx' % (reference_time/vectorized_time))
+
+    if(not is_equal):
+        raise Exception('Vectorized ground truth does not match the reference implementation')
+
+if __name__ == '__main__':
+    main()
+# %%
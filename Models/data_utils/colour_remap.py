@@ -0,0 +1,91 @@
+#! /usr/bin/env python3
+import numpy as np
+from PIL import Image
+from .load_data_scene_seg import packColours
+
+# Remap the labels of an open dataset to colours of a different labelling scheme
+# with lookup tables, rather than comparing each pixel against every label in turn.
+# The remap table maps source labels to target RGB colours - RGB tuples for colour
+# labels and integer IDs for single channel (greyscale or palette) labels, a table
+# can contain both. Pixels whose label is not in the table are set to default_colour
+class ColourRemap():
+    def __init__(self, remap_table, default_colour = (0, 0, 0)):
+
+        # Target colours, with the default colour at index 0
+        target_colours = [tuple(default_colour)]
+        for target_colour in remap_table.values():
+            if(tuple(target_colour) not in target_colours):
+                target_colours.append(tuple(target_colour))
+
+        if(len(target_colours) > 256):
+            raise ValueError('Remap table can contain at most 255 different target colours')
+
+        self.target_colours = np.array(target_colours, dtype=np.uint8)
+
+        # Lookup tables from packed 24-bit colour or label ID to target colour index
+        colour_table = {}
+        id_table = {}
+        for source, target_colour in remap_table.items():
+            target_index = target_colours.index(tuple(target_colour))
+            if(isinstance(source, (tuple, list))):
+                colour_table[tuple(source)] = target_index
+            else:
+                id_table[int(source)] = target_index
+
+        self.colour_lut = None
+        if(len(colour_table) > 0):
+            self.colour_lut = np.zeros(1 << 24, dtype=np.uint8)
+            for colour, target_index in colour_table.items():
+                self.colour_lut[packColours(np.array(colour, dtype=np.uint8))] = target_index
+
+        self.id_lut = None
+        if(len(id_table) > 0):
+            self.id_lut = np.zeros(max(id_table.keys()) + 1, dtype=np.uint8)
+            for label_id, target_index in id_table.items():
+                self.id_lut[label_id] = target_index
+
+    # Index into the target colours of each pixel of a label image or array
+    def getTargetIndices(self, label):
+        label = np.asarray(label)
+
+        # Single channel label IDs
+        if(label.ndim == 2):
+            if(self.id_lut is None):
+                return np.zeros(label.shape, dtype=np.uint8)
+
+            label_ids = label.astype(np.int64)
+            is_known = (label_ids >= 0) & (label_ids < len(self.id_lut))
+            indices = self.id_lut[np.where(is_known, label_ids, 0)]
+            indices[~is_known] = 0
+            return indices
+
+        # RGB colours, an alpha channel is ignored
+        if(self.colour_lut is None or label.shape[2] < 3):
+            return np.zeros(label.shape[:2], dtype=np.uint8)
+
+        return self.colour_lut[packColours(label.astype(np.uint8, copy=False))]
+
+    # Remap a label image or array to an (H, W, 3) uint8 RGB array
+    def remap(self, label):
+        return self.target_colours[self.getTargetIndices(label)]
+
+    # Remap a label image to an RGB PIL image
+    def remapImage(self, label):
+        return Image.fromarray(self.remap(label), mode='RGB')
+
+    # Count the pixels of a label image or array which have any of the given
+    # source labels - RGB tuples or integer IDs
+    def countPixels(self, label, source_labels):
+        label = np.asarray(label)
+
+        if(label.ndim == 2):
+            label_ids = [source for source in source_labels \
+                if not isinstance(source, (tuple, list))]
+            return int(np.count_nonzero(np.isin(label, label_ids)))
+
+        colours = [source for source in source_labels if isinstance(source, (tuple, list))]
+        if(len(colours) == 0 or label.shape[2] < 3):
+            return 0
+
+        keys = packColours(np.array(colours, dtype=np.uint8))
+        return int(np.count_nonzero(np.isin(packColours(label.astype(np.uint8, copy=False)), keys)))
@@ -0,0 +1,134 @@
+#! /usr/bin/env python3
+import os
+import json
+import time
+import numpy as np
+from multiprocessing import Pool
+from PIL import Image
+
+# Save an image such that a file at filepath is always complete - the image
+# is written to a temporary file in the same folder which then replaces filepath,
+# so an interrupted conversion never leaves a truncated output behind
+def saveImageAtomic(image, filepath, format = None):
+
+    if(isinstance(image, np.ndarray)):
+        image = Image.fromarray(image)
+
+    if(format is None):
+        extension = os.path.splitext(filepath)[1].lower()
+        format = Image.registered_extensions()[extension]
+
+    temp_filepath = filepath + '.' + str(os.getpid()) + '.tmp'
+    try:
+        image.save(temp_filepath, format)
+        os.replace(temp_filepath, filepath)
+    finally:
+        if(os.path.exists(temp_filepath)):
+            os.remove(temp_filepath)
+
+# Run the worker function of a single task in a pool process
+def runTask(task):
+    worker, task_id, task_args = task
+    return task_id, worker(*task_args)
+
+# Converts the files of a dataset in parallel worker processes and keeps a
+# manifest of completed tasks, so that a rerun only processes the remaining files.
+# Each task is a (task_id, task_args) tuple - the worker is called as
+# worker(*task_args), saves its outputs with saveImageAtomic and returns the list
+# of saved filepaths. Task IDs should identify both the input and the output of
+# a task, e.g. the output index and the input filename, and the worker must be a
+# module level function so that it can be sent to the pool processes
+class ConversionDriver():
+    def __init__(self, manifest_filepath, num_workers = None, report_interval = 100):
+
+        self.manifest_filepath = manifest_filepath
+        self.num_workers = num_workers if num_workers else os.cpu_count()
+        self.report_interval = report_interval
+
+        # Outputs of the tasks completed by earlier runs
+        self.completed = self.loadManifest()
+
+    # Read the outputs of completed tasks from the manifest, ignoring a
+    # line which was being written when a previous run was interrupted
+    def loadManifest(self):
+        completed = {}
+
+        if(not os.path.exists(self.manifest_filepath)):
+            return completed
+
+        with open(self.manifest_filepath, 'r') as manifest_file:
+            for line in manifest_file:
+                try:
+                    entry = json.loads(line)
+                    completed[entry['id']] = entry['outputs']
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+
+        return completed
+
+    # Check whether a task was completed by an earlier run and all of its outputs exist
+    def isCompleted(self, task_id):
+        if(task_id not in self.completed):
+            return False
+        return all(os.path.exists(filepath) for filepath in self.completed[task_id])
+
+    # Print progress and throughput
+    def reportProgress(self, num_processed, num_tasks, start_time):
+        elapsed_time = time.perf_counter() - start_time
+        throughput = num_processed/max(elapsed_time, 1e-6)
+        remaining_time = (num_tasks - num_processed)/max(throughput, 1e-6)
+        print(f'Processed {num_processed} of {num_tasks} files - ' \
+            f'{throughput:.2f} files/s, {remaining_time:.0f}s remaining')
+
+    # Run all tasks which have not been completed yet, recording each
+    # task in the manifest as soon as its outputs have been saved
+    def run(self, worker, tasks):
+
+        pending_tasks = [(worker, str(task_id), task_args) for task_id, task_args in tasks \
+            if not self.isCompleted(str(task_id))]
+
+        num_tasks = len(pending_tasks)
+        num_skipped = len(tasks) - num_tasks
+        if(num_skipped > 0):
+            print(f'Skipping {num_skipped} files completed by an earlier run')
+        print(f'Processing {num_tasks} files with {self.num_workers} worker processes')
+
+        manifest_dirpath = os.path.dirname(self.manifest_filepath)
+        if(len(manifest_dirpath) > 0):
+            os.makedirs(manifest_dirpath, exist_ok = True)
+
+        start_time = time.perf_counter()
+        num_processed = 0
+
+        with open(self.manifest_filepath, 'a+b') as manifest_file:
+
+            # Terminate a line left incomplete by an interrupted run
+            if(manifest_file.tell() > 0):
+                manifest_file.seek(-1, os.SEEK_END)
+                if(manifest_file.read(1) != b'\n'):
+                    manifest_file.write(b'\n')
+
+            # Workers run in the main process if no pool is required
+            pool = None
+            if(self.num_workers > 1 and num_tasks > 1):
+                pool = Pool(self.num_workers)
+                results = pool.imap_unordered(runTask, pending_tasks)
+            else:
+                results = map(runTask, pending_tasks)
+
+            try:
+                for task_id, outputs in results:
+
+                    outputs = [str(filepath) for filepath in outputs]
+                    entry = json.dumps({'id': task_id, 'outputs': outputs}) + '\n'
+                    manifest_file.write(entry.encode())
+                    manifest_file.flush()
+                    self.completed[task_id] = outputs
+
+                    num_processed += 1
+                    if(num_processed % self.report_interval == 0 or num_processed == num_tasks):
+                        self.reportProgress(num_processed, num_tasks, start_time)
+            finally:
+                if(pool is not None):
+                    pool.terminate()
+                    pool.join()
@@ -0,0 +1,353 @@
+#! /usr/bin/env python3
+import os
+import numpy as np
+import torch
+from abc import ABC, abstractmethod
+from torch.utils.data import Dataset, DataLoader
+from torchvision import transforms
+from PIL import Image
+import sys
+sys.path.append('..')
+from data_utils.augmentations import getAugmentations, seedAugmentations
+from data_utils.auto_steer_label_store import packKeypoints
+
+# Get the order in which samples are drawn from multiple datasets during an epoch,
+# matching the round-robin scheme of the training scripts - one sample is taken
+# from each dataset in turn, and a dataset is dropped from the rotation once all
+# of its samples have been used. Returns a list of (dataset name, sample index),
+# optionally limited to the given number of steps
+def getRoundRobinSchedule(data_list, num_samples, sample_lists = None, num_steps = None):
+
+    # Datasets in the order of the rotation
+    data_list = list(data_list)
+    data_list_count = 0
+
+    # Iterators and completion status of each dataset
+    iters = {dataset: 0 for dataset in data_list}
+    is_complete = {dataset: False for dataset in data_list}
+
+    schedule = []
+    total_samples = sum([num_samples[dataset] for dataset in data_list])
+    if(num_steps is not None):
+        total_samples = min(total_samples, num_steps)
+
+    for _ in range(0, total_samples):
+
+        # Remove datasets from the rotation once all samples have been used
+        for dataset in list(iters.keys()):
+            if(iters[dataset] == num_samples[dataset] and \
+               is_complete[dataset] == False):
+                is_complete[dataset] = True
+                data_list.remove(dataset)
+
+        if(data_list_count >= len(data_list)):
+            data_list_count = 0
+
+        dataset = data_list[data_list_count]
+        sample_index = iters[dataset]
+        if(sample_lists is not None):
+            sample_index = sample_lists[dataset][sample_index]
+
+        schedule.append((dataset, sample_index))
+        iters[dataset] += 1
+        data_list_count += 1
+
+    return schedule
+
+# Get the order in which validation samples are read - all samples of
+# each dataset in turn. Returns a list of (dataset name, sample index)
+def getSequentialSchedule(data_list, num_samples):
+    schedule = []
+    for dataset in data_list:
+        for sample_index in range(0, num_samples[dataset]):
+            schedule.append((dataset, sample_index))
+    return schedule
+
+# Return samples as they are, keeping numpy data for visualization
+# as numpy arrays - tensors are still pinned by the DataLoader
+def collateSample(sample):
+    return sample
+
+# Stack the tensors of a list of samples into NCHW mini-batch tensors,
+# other data is kept as a list with one entry per sample
+def collateBatch(samples):
+    batch = {}
+    for key in samples[0].keys():
+        values = [sample[key] for sample in samples]
+        if(torch.is_tensor(values[0])):
+            batch[key] = torch.stack(values)
+        else:
+            batch[key] = values
+    return batch
+
+# Seed the augmentations of each worker process from its torch seed,
+# which the DataLoader sets differently for every worker and epoch
+def seedWorker(worker_id):
+    seedAugmentations(torch.initial_seed())
+
+# Create a DataLoader which fetches samples in the order of the given schedule,
+# preparing them in worker processes and prefetching them into pinned memory.
+# Samples are returned one at a time, or collated into mini-batches of
+# consecutive samples of the schedule if a batch size is given
+def createDataLoader(dataset, schedule, num_workers = 4, prefetch_factor = 2, \
+        batch_size = None):
+
+    loader_args = {}
+    if(num_workers > 0):
+        loader_args['prefetch_factor'] = prefetch_factor
+
+    collate_fn = collateSample
+    if(batch_size is not None):
+        collate_fn = collateBatch
+
+    data_loader = DataLoader(
+        dataset,
+        batch_size = batch_size,
+        sampler = schedule,
+        num_workers = num_workers,
+        collate_fn = collate_fn,
+        pin_memory = torch.cuda.is_available(),
+        worker_init_fn = seedWorker,
+        **loader_args
+    )
+
+    return data_loader
+
+# Base class wrapping one or more data loading helper classes as a torch Dataset,
+# indexed by (dataset name, sample index). Subclasses implement loadSample and processSample
+class MultiDatasetWrapper(Dataset, ABC):
+    def __init__(self, datasets, is_train, apply_augmentations):
+
+        # Dictionary of dataset name to data loading helper class
+        self.datasets = datasets
+
+        # Train vs Val split of the datasets
+        self.is_train = is_train
+
+        # Train vs Test/Val mode of the augmentations
+        self.apply_augmentations = apply_augmentations
+
+        # Loaders
+        self.image_loader = transforms.Compose(
+            [
+                transforms.ToTensor(),
+                transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+            ]
+        )
+
+        self.gt_loader = transforms.Compose(
+            [transforms.ToTensor()]
+        )
+
+    def __len__(self):
+        return sum([dataset.getItemCount()[0 if self.is_train else 1] \
+            for dataset in self.datasets.values()])
+
+    def __getitem__(self, item):
+        return self.__getitems__([item])[0]
+
+    # Prepare a list of samples, given as (dataset name, sample index) - the
+    # DataLoader fetches each mini-batch with a single call, so that all of its
+    # samples are augmented with one call to the batched augmentations API
+    def __getitems__(self, items):
+        samples = [self.loadSample(dataset, index) for dataset, index in items]
+        images = [sample['image'] for sample in samples]
+
+        if(self.augmentations.data_type == 'KEYPOINTS'):
+            augmented_images = self.augmentations.applyTransformBatch(images)
+            augmented_gts = [None]*len(samples)
+        else:
+            gts = [sample['gt'] for sample in samples]
+            augmented_images, augmented_gts = \
+                self.augmentations.applyTransformBatch(images, gts)
+
+        return [self.processSample(sample, image, gt) for sample, image, gt \
+            in zip(samples, augmented_images, augmented_gts)]
+
+    # Read the sample at the given index of the named dataset, returning a
+    # dictionary with its 'image' and, for all but KEYPOINTS data, its 'gt'
+    @abstractmethod
+    def loadSample(self, dataset, index):
+        pass
+
+    # Prepare a sample read by loadSample from its augmented image and ground truth
+    @abstractmethod
+    def processSample(self, sample, image, gt):
+        pass
+
+# SceneSeg - wraps LoadDataSceneSeg
+class SceneSegDataset(MultiDatasetWrapper):
+    def __init__(self, datasets, is_train, apply_augmentations = True):
+        super().__init__(datasets, is_train, apply_augmentations)
+        self.augmentations = getAugmentations(is_train=apply_augmentations, \
+            data_type='SEGMENTATION')
+
+    def loadSample(self, dataset, index):
+        if(self.is_train):
+            image, gt, class_weights = self.datasets[dataset].getItemTrain(index)
+        else:
+            image, gt, class_weights = self.datasets[dataset].getItemVal(index)
+
+        return {'image': image, 'gt': gt, 'class_weights': class_weights}
+
+    def processSample(self, sample, image, augmented):
+        class_weights = sample['class_weights']
+
+        # Ground Truth with probabiliites for each class in separate channels
+        gt_fused = np.stack((augmented[1], augmented[2], augmented[3]), axis=2)
+
+        return {
+            'image': image,
+            'augmented': augmented,
+            'gt_fused': gt_fused,
+            'class_weights': class_weights,
+            'image_tensor': self.image_loader(image),
+            'gt_tensor': self.gt_loader(gt_fused),
+            'class_weights_tensor': torch.tensor(class_weights)
+        }
+
+# Binary segmentation - shared by DomainSeg and EgoSpace
+class BinarySegDataset(MultiDatasetWrapper):
+    def __init__(self, datasets, is_train, apply_augmentations = True):
+        super().__init__(datasets, is_train, apply_augmentations)
+        self.augmentations = getAugmentations(is_train=apply_augmentations, \
+            data_type='BINARY_SEGMENTATION')
+
+    def loadSample(self, dataset, index):
+        if(self.is_train):
+            image, gt = self.datasets[dataset].getItemTrain(index)
+        else:
+            image, gt = self.datasets[dataset].getItemVal(index)
+
+        return {'image': image, 'gt': gt}
+
+    def processSample(self, sample, image, gt):
+        return {
+            'image': image,
+            'gt': gt,
+            'image_tensor': self.image_loader(image),
+            'gt_tensor': self.gt_loader(gt)
+        }
+
+# DomainSeg - wraps LoadDataDomainSeg
+class DomainSegDataset(BinarySegDataset):
+    pass
+
+# EgoSpace - wraps LoadDataEgoSpace
+class EgoSpaceDataset(BinarySegDataset):
+    pass
+
+# Scene3D - wraps LoadDataScene3D
+class Scene3DDataset(MultiDatasetWrapper):
+    def __init__(self, datasets, is_train, apply_augmentations = True):
+        super().__init__(datasets, is_train, apply_augmentations)
+        self.augmentations = getAugmentations(is_train=apply_augmentations, \
+            data_type='DEPTH')
+
+    def loadSample(self, dataset, index):
+        if(self.is_train):
+            image, gt = self.datasets[dataset].getItemTrain(index)
+        else:
+            image, gt = self.datasets[dataset].getItemVal(index)
+
+        return {'image': image, 'gt': gt}
+
+    def processSample(self, sample, image, gt):
+        gt_tensor = torch.from_numpy(gt)
+        gt_tensor = gt_tensor.permute(2, 0, 1)
+        gt_tensor = gt_tensor.type(torch.FloatTensor)
+
+        return {
+            'image': image,
+            'gt': gt,
+            'image_tensor': self.image_loader(image),
+            'gt_tensor': gt_tensor
+        }
+
+# Size of an image, read from its header without decoding the image
+def getImageSize(image_path):
+    with Image.open(image_path) as image:
+        return image.size
+
+# Read the perspective image and BEV visualization of an AutoSteer frame,
+# which are only needed on the steps where visualizations are logged
+def loadAutoSteerVisualization(perspective_image_path, bev_vis_path):
+    perspective_image = np.array(Image.open(perspective_image_path).convert("RGB"))
+    bev_vis = np.array(Image.open(bev_vis_path).convert("RGB"))
+    return perspective_image, bev_vis
+
+# AutoSteer - wraps LoadDataAutoSteer. Keypoints and the BEV-to-image matrix are
+# packed into a single float32 tensor, and the perspective image and BEV
+# visualization of each frame are not read - only their paths and the size
+# of the perspective image are returned, see loadAutoSteerVisualization
+class AutoSteerDataset(MultiDatasetWrapper):
+    def __init__(self, datasets, is_train, apply_augmentations = True, \
+            perspective_image_dirpaths = None, bev_vis_dirpaths = None):
+        super().__init__(datasets, is_train, apply_augmentations)
+        self.augmentations = getAugmentations(is_train=apply_augmentations, \
+            data_type='KEYPOINTS')
+
+        # Dictionaries of dataset name to image directory
+        self.perspective_image_dirpaths = perspective_image_dirpaths
+        self.bev_vis_dirpaths = bev_vis_dirpaths
+
+    def loadSample(self, dataset, index):
+        [   frame_id, bev_image,
+            homotrans_mat,
+            bev_egopath, reproj_egopath,
+            bev_egoleft, reproj_egoleft,
+            bev_egoright, reproj_egoright,
+        ] = self.datasets[dataset].getItem(index, is_train = self.is_train)
+
+        # Perspective image and BEV visualization
+        perspective_image_path = os.path.join(
+            self.perspective_image_dirpaths[dataset],
+            f"{frame_id}.png"
+        )
+        bev_vis_path = os.path.join(
+            self.bev_vis_dirpaths[dataset],
+            f"{frame_id}.jpg"
+        )
+        perspective_W, perspective_H = getImageSize(perspective_image_path)
+
+        # BEV image and its original size, before augmentations
+        bev_image = np.array(bev_image)
+        bev_H, bev_W, _ = bev_image.shape
+
+        # BEV-to-image matrix and keypoints, as (x, y) rows of a single buffer
+        keypoints, keypoint_lengths = packKeypoints(homotrans_mat, [
+            bev_egopath, reproj_egopath,
+            bev_egoleft, reproj_egoleft,
+            bev_egoright, reproj_egoright
+        ])
+
+        return {
+            'dataset': dataset,
+            'frame_id': frame_id,
+            'image': bev_image,
+            'perspective_image_path': perspective_image_path,
+            'bev_vis_path': bev_vis_path,
+            'perspective_H': perspective_H,
+            'perspective_W': perspective_W,
+            'bev_H': bev_H,
+            'bev_W': bev_W,
+            'keypoints': keypoints,
+            'keypoint_lengths': keypoint_lengths
+        }
+
+    def processSample(self, sample, bev_image, gt):
+        return {
+            'dataset': sample['dataset'],
+            'frame_id': sample['frame_id'],
+            'bev_image': bev_image,
+            'perspective_image_path': sample['perspective_image_path'],
+            'bev_vis_path': sample['bev_vis_path'],
+            'perspective_H': sample['perspective_H'],
+            'perspective_W': sample['perspective_W'],
+            'bev_H': sample['bev_H'],
+            'bev_W': sample['bev_W'],
+            'keypoints': sample['keypoints'],
+            'keypoint_lengths': sample['keypoint_lengths'],
+            'keypoints_tensor': torch.from_numpy(sample['keypoints']),
+            'bev_image_tensor': self.image_loader(bev_image)
+        }
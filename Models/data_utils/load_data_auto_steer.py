@@ -1,7 +1,6 @@
 #! /usr/bin/env python3
 
 import os
-import json
 import pathlib
 import numpy as np
 import sys
@@ -13,6 +12,7 @@ sys.path.append(os.path.abspath(os.path.join(
 from PIL import Image
 from typing import Literal, get_args
 from Models.data_utils.check_data import CheckData
+from Models.data_utils.auto_steer_label_store import AutoSteerLabelStore
 
 # Currently limiting to available datasets only. Will unlock eventually
 VALID_DATASET_LITERALS = Literal[
@@ -54,21 +54,20 @@ class LoadDataAutoSteer():
         if not (self.dataset_name in VALID_DATASET_LIST):
             raise ValueError("Unknown dataset! Contact our team so we can work on this.")
 
-        # Load JSON labels, get homotrans matrix as well
-        with open(self.label_filepath, "r") as f:
-            json_data = json.load(f)
-            if (self.dataset_name in FIXED_HOMOTRANS_DATASETS):
-                homotrans_mat = json_data.pop("standard_homomatrix")
-                self.BEV_to_image_transform = np.linalg.inv(homotrans_mat)
-            else:
-                self.BEV_to_image_transform = None
-            self.labels = json_data
+        # Load JSON or JSON-lines labels into a columnar label store, get homotrans matrix as well
+        self.label_store = AutoSteerLabelStore(self.label_filepath)
+        if (self.dataset_name in FIXED_HOMOTRANS_DATASETS):
+            if (self.label_store.standard_bev_to_image_transform is None):
+                raise ValueError(f"No standard homomatrix in {self.dataset_name} labels!")
+            self.BEV_to_image_transform = self.label_store.standard_bev_to_image_transform
+        else:
+            self.BEV_to_image_transform = None
 
         self.images = sorted([
             f for f in pathlib.Path(self.image_dirpath).glob("*.png")
         ])
 
-        self.N_labels = len(self.labels)
+        self.N_labels = self.label_store.getItemCount()
         self.N_images = len(self.images)
 
         # Sanity check func by Mr. Zain
@@ -79,18 +78,17 @@ class LoadDataAutoSteer():
 
         # ================= Initiate data loading ================= #
 
+        # Label store rows of the Train/Val samples
         self.train_images = []
-        self.train_labels = []
-        self.train_ids = []
+        self.train_rows = []
         self.val_images = []
-        self.val_labels = []
-        self.val_ids = []
+        self.val_rows = []
 
         self.N_trains = 0
         self.N_vals = 0
 
         if (checkData.getCheck()):
-            for set_idx, frame_id in enumerate(self.labels):
+            for set_idx, frame_id in enumerate(self.label_store.frame_ids.tolist()):
 
                 # Check if there might be frame ID mismatch - happened to CULane before, just to make sure
                 frame_id_from_img_path = str(self.images[set_idx]).split("/")[-1].replace(".png", "")
@@ -99,103 +97,58 @@ class LoadDataAutoSteer():
                     if (set_idx % 10 == 0):
                         # Slap it to Val
                         self.val_images.append(str(self.images[set_idx]))
-                        self.val_labels.append(self.labels[frame_id])
-                        self.val_ids.append(frame_id)
+                        self.val_rows.append(set_idx)
                         self.N_vals += 1 
                     else:
                         # Slap it to Train
                         self.train_images.append(str(self.images[set_idx]))
-                        self.train_labels.append(self.labels[frame_id])
-                        self.train_ids.append(frame_id)
+                        self.train_rows.append(set_idx)
                         self.N_trains += 1
                 else:
                     raise ValueError(f"Mismatch data detected in {self.dataset_name}!")
 
+        self.train_rows = np.array(self.train_rows, dtype = np.int64)
+        self.val_rows = np.array(self.val_rows, dtype = np.int64)
+
+        # Frame IDs of the Train/Val samples
+        self.train_ids = self.label_store.frame_ids[self.train_rows].tolist()
+        self.val_ids = self.label_store.frame_ids[self.val_rows].tolist()
+
         print(f"Dataset {self.dataset_name} loaded with {self.N_trains} trains and {self.N_vals} vals.")
 
     # Get sizes of Train/Val sets
     def getItemCount(self):
         return self.N_trains, self.N_vals
        
-    # Get item at index ith, returning img and EgoPath
+    # Get item at index ith, returning img and EgoPath - keypoint lines
+    # are read-only float32 (x, y) views of the label store
     def getItem(self, index, is_train: bool):
         if (is_train):
+            image_path = self.train_images[index]
+            row = int(self.train_rows[index])
+        else:
+            image_path = self.val_images[index]
+            row = int(self.val_rows[index])
 
-            # BEV Image
-            bev_img = Image.open(str(self.train_images[index])).convert("RGB")
-
-            # Frame ID
-            frame_id = self.train_ids[index]
-
-            # BEV-to-image transform
-            bev_to_image_transform = (
-                self.BEV_to_image_transform
-                if (self.BEV_to_image_transform is not None)
-                else np.linalg.inv(self.train_labels[index]["homomatrix"])
-            )
-
-            # BEV EgoPath
-            bev_egopath = self.train_labels[index]["bev_egopath"]
-            bev_egopath = [lab[0:2] for lab in bev_egopath]
-
-            # Reprojected EgoPath
-            reproj_egopath = self.train_labels[index]["reproj_egopath"]
-            reproj_egopath = [lab[0:2] for lab in reproj_egopath]
-
-            # BEV EgoLeft Lane
-            bev_egoleft = self.train_labels[index]["bev_egoleft"]
-            bev_egoleft = [lab[0:2] for lab in bev_egoleft]
-
-            # Reprojected EgoLeft Lane
-            reproj_egoleft = self.train_labels[index]["reproj_egoleft"]
-            reproj_egoleft = [lab[0:2] for lab in reproj_egoleft]
-
-            # BEV EgoRight Lane
-            bev_egoright = self.train_labels[index]["bev_egoright"]
-            bev_egoright = [lab[0:2] for lab in bev_egoright]
+        # BEV Image
+        bev_img = Image.open(image_path).convert("RGB")
 
-            # Reprojected EgoRight Lane
-            reproj_egoright = self.train_labels[index]["reproj_egoright"]
-            reproj_egoright = [lab[0:2] for lab in reproj_egoright]
+        # Frame ID
+        frame_id = self.label_store.getFrameID(row)
 
-        else:
+        # BEV-to-image transform, inverted once when labels are loaded
+        bev_to_image_transform = (
+            self.BEV_to_image_transform
+            if (self.BEV_to_image_transform is not None)
+            else self.label_store.getBEVToImageTransform(row)
+        )
 
-            # BEV Image
-            bev_img = Image.open(str(self.val_images[index])).convert("RGB")
-
-            # Frame ID
-            frame_id = self.val_ids[index]
-
-            # BEV-to-image transform
-            bev_to_image_transform = (
-                self.BEV_to_image_transform
-                if (self.BEV_to_image_transform is not None)
-                else np.linalg.inv(self.val_labels[index]["homomatrix"])
-            )
-            
-            # BEV EgoPath
-            bev_egopath = self.val_labels[index]["bev_egopath"]
-            bev_egopath = [lab[0:2] for lab in bev_egopath]
-
-            # Reprojected EgoPath
-            reproj_egopath = self.val_labels[index]["reproj_egopath"]
-            reproj_egopath = [lab[0:2] for lab in reproj_egopath]
-
-            # BEV EgoLeft Lane
-            bev_egoleft = self.val_labels[index]["bev_egoleft"]
-            bev_egoleft = [lab[0:2] for lab in bev_egoleft]
-
-            # Reprojected EgoLeft Lane
-            reproj_egoleft = self.val_labels[index]["reproj_egoleft"]
-            reproj_egoleft = [lab[0:2] for lab in reproj_egoleft]
-
-            # BEV EgoRight Lane
-            bev_egoright = self.val_labels[index]["bev_egoright"]
-            bev_egoright = [lab[0:2] for lab in bev_egoright]
-            
-            # Reprojected EgoRight Lane
-            reproj_egoright = self.val_labels[index]["reproj_egoright"]
-            reproj_egoright = [lab[0:2] for lab in reproj_egoright]
+        # BEV and reprojected EgoPath, EgoLeft Lane and EgoRight Lane
+        [
+            bev_egopath, reproj_egopath,
+            bev_egoleft, reproj_egoleft,
+            bev_egoright, reproj_egoright
+        ] = self.label_store.getLines(row)
 
         # Convert image to OpenCV/Numpy format for augmentations
         bev_img = np.array(bev_img)
@@ -207,4 +160,3 @@ class LoadDataAutoSteer():
             bev_egoleft, reproj_egoleft,
             bev_egoright, reproj_egoright,
         ]
-
@@ -5,13 +5,22 @@ from PIL import Image
 from .check_data import CheckData
 
 class LoadDataScene3D():
-    def __init__(self, labels_filepath, images_filepath):
-        
+    def __init__(self, labels_filepath, images_filepath, depth_store = None):
+
+        # Optional precompiled depth store (Scene3DDepthStore) - if provided, images
+        # and depth maps are read from its memory-mapped shards, and each split
+        # holds sample indices of the store instead of filepaths
+        self.depth_store = depth_store
+
         # Getting data list and counting number of training samples and ground truth samples
-        self.labels = sorted([f for f in pathlib.Path(labels_filepath).glob("*.npy")])
-        self.num_labels = len(self.labels)
+        if(self.depth_store is not None):
+            self.labels = list(range(0, self.depth_store.getItemCount()))
+            self.images = self.labels
+        else:
+            self.labels = sorted([f for f in pathlib.Path(labels_filepath).glob("*.npy")])
+            self.images = sorted([f for f in pathlib.Path(images_filepath).glob("*")])
 
-        self.images = sorted([f for f in pathlib.Path(images_filepath).glob("*")])
+        self.num_labels = len(self.labels)
         self.num_images = len(self.images)
 
         # Performing sanity checks to ensure samples are correct in number
@@ -31,21 +40,37 @@ class LoadDataScene3D():
         if (checkData.getCheck()):
             for count in range (0, self.num_images):
 
+                image = self.images[count]
+                label = self.labels[count]
+                if(self.depth_store is None):
+                    image = str(image)
+                    label = str(label)
+
                 if((count+1) % 20 == 0):
-                    self.val_images.append(str(self.images[count]))
-                    self.val_labels.append(str(self.labels[count]))
+                    self.val_images.append(image)
+                    self.val_labels.append(label)
                     self.num_val_samples += 1 
                 else:
-                    self.train_images.append(str(self.images[count]))
-                    self.train_labels.append(str(self.labels[count]))
+                    self.train_images.append(image)
+                    self.train_labels.append(label)
                     self.num_train_samples += 1
 
     # Get number of Train/Val samples
     def getItemCount(self):
         return self.num_train_samples, self.num_val_samples
 
+    # Get image and normalized depth map of a sample from the depth store
+    def getStoredItem(self, sample_index):
+        image = self.depth_store.getImage(sample_index).convert('RGB')
+        ground_truth = self.depth_store.getNormalizedDepthMap(sample_index)
+        ground_truth = np.expand_dims(ground_truth, axis=-1)
+        return np.array(image), ground_truth
+
     # Get training data in numpy format
     def getItemTrain(self, index):
+        if(self.depth_store is not None):
+            return self.getStoredItem(self.train_images[index])
+
         train_image = Image.open(str(self.train_images[index])).convert('RGB')
         train_ground_truth = np.load(str(self.train_labels[index]))
         train_ground_truth =  \
@@ -57,6 +82,9 @@ class LoadDataScene3D():
     
     # Get validation data in numpy format
     def getItemVal(self, index):
+        if(self.depth_store is not None):
+            return self.getStoredItem(self.val_images[index])
+
         val_image = Image.open(str(self.val_images[index])).convert('RGB')
         val_ground_truth = np.load(str(self.val_labels[index]))
         val_ground_truth =  \
@@ -4,12 +4,128 @@ import numpy as np
 from typing import Literal
 from PIL import Image
 
+# Class IDs of the SceneSeg ground truth, pixels which do not match any
+# of the known colours are assigned to UNLABELLED_CLASS_ID
+BACKGROUND_CLASS_ID = 0
+FOREGROUND_CLASS_ID = 1
+ROAD_CLASS_ID = 2
+UNLABELLED_CLASS_ID = 3
+
+# Colourmaps for classes
+SKY_COLOUR = (61, 184, 255)
+BACKGROUND_OBJECTS_COLOUR = (61, 93, 255)
+ROAD_EDGE_DELIMITER_COLOUR = (216, 255, 61)
+UNLABELLED_COLOUR = (0,0,0)
+VULNERABLE_LIVING_COLOUR = (255, 61, 61)
+SMALL_MOBILE_VEHICLE_COLOUR = (255, 190, 61)
+LARGE_MOBILE_VEHICLE_COLOUR = (255, 116, 61)
+FOREGROUND_OBJECTS_COLOUR = (255, 28, 145)
+ROAD_COLOUR = (0, 255, 220)
+
+# Mapping from label colour to class ID
+COLOUR_TO_CLASS_ID = {
+    BACKGROUND_OBJECTS_COLOUR: BACKGROUND_CLASS_ID,
+    ROAD_EDGE_DELIMITER_COLOUR: BACKGROUND_CLASS_ID,
+    UNLABELLED_COLOUR: BACKGROUND_CLASS_ID,
+    SKY_COLOUR: BACKGROUND_CLASS_ID,
+    VULNERABLE_LIVING_COLOUR: FOREGROUND_CLASS_ID,
+    SMALL_MOBILE_VEHICLE_COLOUR: FOREGROUND_CLASS_ID,
+    LARGE_MOBILE_VEHICLE_COLOUR: FOREGROUND_CLASS_ID,
+    FOREGROUND_OBJECTS_COLOUR: FOREGROUND_CLASS_ID,
+    ROAD_COLOUR: ROAD_CLASS_ID,
+}
+
+# Visualization colour of each class ID
+CLASS_VIS_COLOURS = np.array([
+    BACKGROUND_OBJECTS_COLOUR,
+    FOREGROUND_OBJECTS_COLOUR,
+    ROAD_COLOUR,
+    (0, 0, 0)
+], dtype=np.uint8)
+
+# Pack the first three channels of an (H, W, C) uint8 array into (H, W) uint32 keys
+def packColours(rgb):
+    keys = rgb[..., 0].astype(np.uint32)
+    keys <<= 8
+    keys |= rgb[..., 1]
+    keys <<= 8
+    keys |= rgb[..., 2]
+    return keys
+
+# Lookup table from every packed 24-bit colour to its class ID, built on
+# first use - 16MB which is shared by all instances in a process
+CLASS_ID_LUT = None
+
+def getClassIdLUT():
+    global CLASS_ID_LUT
+    if(CLASS_ID_LUT is None):
+        lut = np.full(1 << 24, UNLABELLED_CLASS_ID, dtype=np.uint8)
+        for colour, class_id in COLOUR_TO_CLASS_ID.items():
+            lut[packColours(np.array(colour, dtype=np.uint8))] = class_id
+        CLASS_ID_LUT = lut
+    return CLASS_ID_LUT
+
+# Map every pixel of an RGB label image to its class ID in a single pass
+def getClassMap(input_label):
+    label = np.asarray(input_label)
+
+    # Labels without RGB channels cannot match any class colour
+    if(label.ndim != 3 or label.shape[2] != 3):
+        return np.full(label.shape[:2], UNLABELLED_CLASS_ID, dtype=np.uint8)
+
+    return getClassIdLUT()[packColours(label)]
+
+# Calculate class weights for the loss function from a class map
+def calcClassWeights(class_map):
+
+    # Image Size
+    num_pixels = class_map.size
+
+    # Counters for pixel level class frequency in image
+    background_class_freq = np.count_nonzero(class_map == BACKGROUND_CLASS_ID)
+    foreground_class_freq = np.count_nonzero(class_map == FOREGROUND_CLASS_ID)
+    road_class_freq = np.count_nonzero(class_map == ROAD_CLASS_ID)
+
+    # Calculate class weights for loss function
+    class_weights = []
+
+    background_class_weight = num_pixels/(background_class_freq + 5120)
+    class_weights.append(background_class_weight)
+
+    foreground_class_weight = num_pixels/(foreground_class_freq + 5120)
+    class_weights.append(foreground_class_weight)
+
+    road_class_weight = num_pixels/(road_class_freq + 5120)
+    class_weights.append(road_class_weight)
+
+    return class_weights
+
+# Create the visualization and the binary channels of each class from a class map
+def createGroundTruthChannels(class_map):
+    ground_truth = []
+    ground_truth.append(np.take(CLASS_VIS_COLOURS, class_map, axis=0))
+    ground_truth.append((class_map == BACKGROUND_CLASS_ID).view(np.uint8)*np.uint8(255))
+    ground_truth.append((class_map == FOREGROUND_CLASS_ID).view(np.uint8)*np.uint8(255))
+    ground_truth.append((class_map == ROAD_CLASS_ID).view(np.uint8)*np.uint8(255))
+    return ground_truth
+
+# Create ground truth data and class weights from a class map
+def createGroundTruthFromClassMap(class_map):
+    ground_truth = createGroundTruthChannels(class_map)
+    class_weights = calcClassWeights(class_map)
+    return ground_truth, class_weights
+
 class LoadDataSceneSeg():
     def __init__(self, labels_filepath, images_filepath, \
-        dataset: Literal['ACDC', 'BDD100K', 'IDDAW', 'MUSES', 'MAPILLARY', 'COMMA10K']):
+        dataset: Literal['ACDC', 'BDD100K', 'IDDAW', 'MUSES', 'MAPILLARY', 'COMMA10K'], \
+        label_cache = None):
 
         self.dataset = dataset
 
+        # Optional precompiled label cache (SceneSegLabelCache) - if provided, class maps
+        # and class weights are read from the cache instead of decoding the colour labels
+        self.label_cache = label_cache
+
         if(self.dataset != 'ACDC' and self.dataset != 'BDD100K' and  \
            self.dataset != 'IDDAW' and self.dataset != 'MUSES' \
            and self.dataset != 'MAPILLARY' and self.dataset != 'COMMA10K'):
@@ -30,10 +146,15 @@ class LoadDataSceneSeg():
         if (self.num_labels == 0):
             raise ValueError('No ground truth masks found - check the root path')
         
+        if(self.label_cache is not None):
+            self.label_cache.checkLabels(self.labels)
+
         self.train_images = []
         self.train_labels = []
+        self.train_label_ids = []
         self.val_images = []
         self.val_labels = []
+        self.val_label_ids = []
         
         self.num_train_samples = 0
         self.num_val_samples = 0
@@ -43,136 +164,77 @@ class LoadDataSceneSeg():
             if((count+1) % 10 == 0):
                 self.val_images.append(str(self.images[count]))
                 self.val_labels.append(str(self.labels[count]))
+                self.val_label_ids.append(count)
                 self.num_val_samples += 1 
             else:
                 self.train_images.append(str(self.images[count]))
                 self.train_labels.append(str(self.labels[count]))
+                self.train_label_ids.append(count)
                 self.num_train_samples += 1
 
     def getItemCount(self):
         return self.num_train_samples, self.num_val_samples
     
     def createGroundTruth(self, input_label):
-        # Colourmaps for classes
-        sky_colour = (61, 184, 255)
-        background_objects_colour = (61, 93, 255)
-        road_edge_delimiter_colour = (216, 255, 61)
-        unlabelled_colour = (0,0,0)
-        vulnerable_living_colour = (255, 61, 61)
-        small_mobile_vehicle_colour = (255, 190, 61)
-        large_mobile_vehicle_colour = (255, 116, 61)
-        foreground_objects_colour = (255, 28, 145)
-        road_colour = (0, 255, 220)
-
-        # Image Size
-        row, col = input_label.size
-        num_pixels = row*col
-
-        # Ground Truth Visualization
-        vis = Image.new(mode="RGB", size=(row, col))
-
-        # Ground Truth Multi-Channel Label
-        ground_truth_sky = Image.new(mode="L", size=(row, col))
-        ground_truth_background = Image.new(mode="L", size=(row, col))
-        ground_truth_foreground = Image.new(mode="L", size=(row,col))
-        ground_truth_road = Image.new(mode="L", size=(row,col))
-   
-        # Loading images
-        px = input_label.load()
-        vx = vis.load()
-        sx = ground_truth_sky.load()
-        bx = ground_truth_background.load()
-        fx = ground_truth_foreground.load()
-        rx = ground_truth_road.load()
-
-        # Counters for pixel level class frequency in image
-        background_class_freq = 0
-        foreground_class_freq = 0
-        road_class_freq = 0
-
-        # Extracting classes and assigning to colourmap
-        for x in range(row):
-            for y in range(col):
-
-                # BACKGROUND OBJECTS
-                if px[x,y] == background_objects_colour or \
-                    px[x,y] == road_edge_delimiter_colour or \
-                    px[x,y] == unlabelled_colour or \
-                    px[x,y] == sky_colour:
-
-                    vx[x,y] = background_objects_colour
-                    bx[x, y] = 255
-                    background_class_freq += 1
-
-                # FOREGROUND OBJECTS
-                elif px[x,y] == vulnerable_living_colour or \
-                    px[x,y] == small_mobile_vehicle_colour or \
-                    px[x,y] == large_mobile_vehicle_colour or \
-                    px[x,y] == foreground_objects_colour:
-
-                    vx[x,y] = foreground_objects_colour
-                    fx[x, y] = 255
-                    foreground_class_freq += 1
-                
-                # ROAD
-                elif px[x,y] == road_colour:
-
-                    vx[x,y] = road_colour
-                    rx[x, y] = 255
-                    road_class_freq += 1
-
-        # Calculate class weights for loss function
-        class_weights = []
-
-        background_class_weight = num_pixels/(background_class_freq + 5120)
-        class_weights.append(background_class_weight)
-
-        foreground_class_weight = num_pixels/(foreground_class_freq + 5120)
-        class_weights.append(foreground_class_weight)
-
-        road_class_weight = num_pixels/(road_class_freq + 5120)
-        class_weights.append(road_class_weight)
-
-        # Getting ground truth data
-        ground_truth = []
-        ground_truth.append(np.array(vis))
-        ground_truth.append(np.array(ground_truth_background))
-        ground_truth.append(np.array(ground_truth_foreground))
-        ground_truth.append(np.array(ground_truth_road))
 
-        return ground_truth, class_weights
+        # Class index for every pixel of the label
+        class_map = getClassMap(input_label)
+
+        return createGroundTruthFromClassMap(class_map)
+
+    # Crop box of the region of interest, None if the full image is used
+    def getROIBox(self, input_image):
+        roi_box = None
 
-    def extractROI(self, input_image, input_label):
         if(self.dataset == 'ACDC'):
-            input_image = input_image.crop((0, 0, 1919, 990))
-            input_label = input_label.crop((0, 0, 1919, 990))
+            roi_box = (0, 0, 1919, 990)
         elif(self.dataset == 'BDD100K'):
-            input_image = input_image.crop((0, 0, 1000, 500))
-            input_label = input_label.crop((0, 0, 1000, 500))
+            roi_box = (0, 0, 1000, 500)
         elif(self.dataset == 'IDDAW'):
-            input_image = input_image.crop((0, 476, 2047, 1500))
-            input_label = input_label.crop((0, 476, 2047, 1500))
+            roi_box = (0, 476, 2047, 1500)
         elif(self.dataset == 'MUSES'):
-            input_image = input_image.crop((0, 0, 1919, 918))
-            input_label = input_label.crop((0, 0, 1919, 918))
+            roi_box = (0, 0, 1919, 918)
         elif(self.dataset == 'COMMA10K'):
             input_image_height = input_image.height 
             input_image_width = input_image.width 
-            input_image = input_image.crop((0, 0, \
-                input_image_width-1, int(input_image_height*(0.7))))
-            input_label = input_label.crop((0, 0, \
-                input_image_width-1, int(input_image_height*(0.7))))
+            roi_box = (0, 0, input_image_width-1, int(input_image_height*(0.7)))
+
+        return roi_box
+
+    def extractImageROI(self, input_image):
+        roi_box = self.getROIBox(input_image)
+        if(roi_box is not None):
+            input_image = input_image.crop(roi_box)
+        return input_image
+
+    def extractROI(self, input_image, input_label):
+        roi_box = self.getROIBox(input_image)
+        if(roi_box is not None):
+            input_image = input_image.crop(roi_box)
+            input_label = input_label.crop(roi_box)
 
         return input_image, input_label
+
+    # Get ground truth data and class weights from the label cache
+    def getCachedGroundTruth(self, label_id):
+        class_map = self.label_cache.getClassMap(label_id)
+        ground_truth = createGroundTruthChannels(class_map)
+        class_weights = self.label_cache.getClassWeights(label_id)
+        return ground_truth, class_weights
     
     def getItemTrain(self, index):
         self.train_image = Image.open(str(self.train_images[index]))
-        self.train_label = Image.open(str(self.train_labels[index]))
-        
-        self.train_image, self.train_label = \
-            self.extractROI(self.train_image, self.train_label)
-        self.train_ground_truth, self.train_class_weights = \
-            self.createGroundTruth(self.train_label)
+
+        if(self.label_cache is not None):
+            self.train_image = self.extractImageROI(self.train_image)
+            self.train_ground_truth, self.train_class_weights = \
+                self.getCachedGroundTruth(self.train_label_ids[index])
+        else:
+            self.train_label = Image.open(str(self.train_labels[index]))
+            self.train_image, self.train_label = \
+                self.extractROI(self.train_image, self.train_label)
+            self.train_ground_truth, self.train_class_weights = \
+                self.createGroundTruth(self.train_label)
  
         return np.array(self.train_image), self.train_ground_truth, \
             self.train_class_weights
@@ -182,12 +244,17 @@ class LoadDataSceneSeg():
     
     def getItemVal(self, index):
         self.val_image = Image.open(str(self.val_images[index]))
-        self.val_label = Image.open(str(self.val_labels[index]))
 
-        self.val_image, self.val_label = \
-            self.extractROI(self.val_image, self.val_label)
-        self.val_ground_truth, self.val_class_weights = \
-            self.createGroundTruth(self.val_label)
+        if(self.label_cache is not None):
+            self.val_image = self.extractImageROI(self.val_image)
+            self.val_ground_truth, self.val_class_weights = \
+                self.getCachedGroundTruth(self.val_label_ids[index])
+        else:
+            self.val_label = Image.open(str(self.val_labels[index]))
+            self.val_image, self.val_label = \
+                self.extractROI(self.val_image, self.val_label)
+            self.val_ground_truth, self.val_class_weights = \
+                self.createGroundTruth(self.val_label)
 
         return np.array(self.val_image), self.val_ground_truth, \
             self.val_class_weights
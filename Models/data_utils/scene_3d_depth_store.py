@@ -0,0 +1,295 @@
+#%%
+# Comment above is for Jupyter execution in VSCode
+#! /usr/bin/env python3
+import io
+import os
+import time
+import pathlib
+import numpy as np
+from argparse import ArgumentParser
+from PIL import Image
+import sys
+sys.path.append('..')
+from data_utils.check_data import CheckData
+
+# Files making up the depth store of a dataset:
+#   <DATASET>_<SHARD>.bin - image file bytes, depth maps and bit-packed validity
+#                           masks of the samples in a shard, concatenated
+#   <DATASET>_index.npy   - INDEX_DTYPE record of each sample
+#   <DATASET>_names.txt   - image file name of each sample, for sanity checks
+SHARD_FILE_SUFFIX = '_{:04d}.bin'
+INDEX_FILE_SUFFIX = '_index.npy'
+NAMES_FILE_SUFFIX = '_names.txt'
+
+# Location, size and depth encoding of a sample - depth_min and depth_max are
+# the range of the original float32 depth map, used for normalization on read
+INDEX_DTYPE = np.dtype([
+    ('shard', np.int32),
+    ('image_offset', np.int64),
+    ('image_size', np.int64),
+    ('depth_offset', np.int64),
+    ('validity_offset', np.int64),
+    ('height', np.int32),
+    ('width', np.int32),
+    ('depth_format', np.uint8),
+    ('depth_min', np.float32),
+    ('depth_max', np.float32)
+])
+
+# Depth encodings - float16 depth, or uint16 depth quantized over the
+# depth range of each sample
+DEPTH_FORMATS = {
+    'float16': 0,
+    'uint16': 1
+}
+
+# Largest quantized uint16 depth
+MAX_QUANTIZED_DEPTH = 65535
+
+# Size after which a new shard file is started
+DEFAULT_SHARD_SIZE = 2*1024*1024*1024
+
+# Byte alignment of depth maps within a shard
+DEPTH_ALIGNMENT = 8
+
+class Scene3DDepthStore():
+    def __init__(self, store_root_path, dataset):
+
+        self.dataset = dataset
+        self.store_prefix = os.path.join(store_root_path, dataset)
+
+        # Sample index is small and kept in memory
+        self.index = np.load(self.store_prefix + INDEX_FILE_SUFFIX)
+
+        with open(self.store_prefix + NAMES_FILE_SUFFIX, 'r') as names_file:
+            self.names = names_file.read().splitlines()
+
+        self.num_samples = len(self.index)
+
+        if(self.num_samples != len(self.names)):
+            raise ValueError('Depth store for ' + dataset + ' is incomplete - please recompile it')
+
+        # Shards are memory-mapped when first read and only paged in when read
+        self.shards = {}
+
+    # Memory map of a shard file
+    def getShard(self, shard):
+        if(shard not in self.shards):
+            self.shards[shard] = np.memmap(self.store_prefix + \
+                SHARD_FILE_SUFFIX.format(shard), dtype=np.uint8, mode='r')
+        return self.shards[shard]
+
+    def getItemCount(self):
+        return self.num_samples
+
+    # Decode the stored image file of a sample
+    def getImage(self, index):
+        record = self.index[index]
+        shard = self.getShard(int(record['shard']))
+        image_offset = int(record['image_offset'])
+        image_bytes = shard[image_offset:image_offset + int(record['image_size'])]
+        image = Image.open(io.BytesIO(image_bytes.tobytes()))
+        image.load()
+        return image
+
+    # Zero-copy read-only view of the encoded depth map of a sample
+    def getEncodedDepthMap(self, index):
+        record = self.index[index]
+        shard = self.getShard(int(record['shard']))
+        height, width = int(record['height']), int(record['width'])
+        depth_dtype = np.float16 if record['depth_format'] == DEPTH_FORMATS['float16'] \
+            else np.uint16
+        depth_offset = int(record['depth_offset'])
+        depth_size = height*width*np.dtype(depth_dtype).itemsize
+        return shard[depth_offset:depth_offset + depth_size] \
+            .view(depth_dtype).reshape(height, width)
+
+    # Float32 depth map of a sample
+    def getDepthMap(self, index):
+        record = self.index[index]
+        depth_map = self.getEncodedDepthMap(index).astype(np.float32)
+        if(record['depth_format'] == DEPTH_FORMATS['uint16']):
+            depth_scale = (record['depth_max'] - record['depth_min'])/MAX_QUANTIZED_DEPTH
+            depth_map = depth_map*depth_scale + record['depth_min']
+        return depth_map
+
+    # Float32 depth map of a sample normalized to the range 0 to 1, using the
+    # depth range stored in the index instead of searching the depth map
+    def getNormalizedDepthMap(self, index):
+        record = self.index[index]
+        depth_map = self.getEncodedDepthMap(index).astype(np.float32)
+        if(record['depth_format'] == DEPTH_FORMATS['uint16']):
+            return depth_map/MAX_QUANTIZED_DEPTH
+        return (depth_map - record['depth_min'])/(record['depth_max'] - record['depth_min'])
+
+    # Validity mask of a sample, 1 where depth is available and 0 otherwise
+    def getValidityMask(self, index):
+        record = self.index[index]
+        shard = self.getShard(int(record['shard']))
+        num_pixels = int(record['height'])*int(record['width'])
+        validity_offset = int(record['validity_offset'])
+        validity_mask = np.unpackbits(shard[validity_offset:validity_offset + (num_pixels + 7)//8], \
+            count=num_pixels)
+        return validity_mask.reshape(int(record['height']), int(record['width']))
+
+# Writes the samples of a dataset to the depth store, shard files are written to
+# temporary files which only replace an existing store once all samples are written
+class Scene3DDepthStoreWriter():
+    def __init__(self, store_root_path, dataset, depth_format = 'uint16', \
+            shard_size = DEFAULT_SHARD_SIZE):
+
+        if(depth_format not in DEPTH_FORMATS):
+            raise ValueError('Unknown depth format ' + depth_format + \
+                ' - depth format must be float16 or uint16')
+
+        if (not os.path.exists(store_root_path)):
+            os.makedirs(store_root_path)
+
+        self.store_prefix = os.path.join(store_root_path, dataset)
+        self.depth_format = depth_format
+        self.shard_size = shard_size
+
+        self.records = []
+        self.names = []
+
+        # Shard currently being written
+        self.shard = -1
+        self.shard_file = None
+        self.shard_offset = 0
+
+    # Close the current shard and start writing the next one
+    def startShard(self):
+        if(self.shard_file is not None):
+            self.shard_file.close()
+        self.shard += 1
+        self.shard_file = open(self.store_prefix + SHARD_FILE_SUFFIX.format(self.shard) + '.tmp', 'wb')
+        self.shard_offset = 0
+
+    # Append data to the current shard, returning its offset in the shard
+    def writeBytes(self, data, alignment = 1):
+        padding = -self.shard_offset % alignment
+        if(padding > 0):
+            self.shard_file.write(bytes(padding))
+            self.shard_offset += padding
+
+        offset = self.shard_offset
+        self.shard_file.write(data)
+        self.shard_offset += len(data)
+        return offset
+
+    # Encode a float32 depth map in the depth format of the store
+    def encodeDepthMap(self, depth_map):
+        depth_min = float(np.min(depth_map))
+        depth_max = float(np.max(depth_map))
+
+        if(self.depth_format == 'float16'):
+            encoded_depth_map = depth_map.astype(np.float16)
+        else:
+            depth_range = max(depth_max - depth_min, np.finfo(np.float32).tiny)
+            encoded_depth_map = np.round((depth_map - depth_min)/depth_range \
+                *MAX_QUANTIZED_DEPTH).astype(np.uint16)
+
+        return encoded_depth_map, depth_min, depth_max
+
+    # Add a sample given as the filepath of its image, its depth map and
+    # optionally its validity mask - if not given, pixels with non-zero
+    # depth are valid, matching the Scene3D processing scripts
+    def addSample(self, image_filepath, depth_map, validity_mask = None):
+
+        depth_map = np.asarray(depth_map, dtype=np.float32)
+        if(validity_mask is None):
+            validity_mask = depth_map != 0
+
+        with open(image_filepath, 'rb') as image_file:
+            image_bytes = image_file.read()
+
+        encoded_depth_map, depth_min, depth_max = self.encodeDepthMap(depth_map)
+        packed_validity_mask = np.packbits(np.asarray(validity_mask) != 0)
+
+        if(self.shard_file is None or self.shard_offset >= self.shard_size):
+            self.startShard()
+
+        image_offset = self.writeBytes(image_bytes)
+        depth_offset = self.writeBytes(encoded_depth_map.tobytes(), DEPTH_ALIGNMENT)
+        validity_offset = self.writeBytes(packed_validity_mask.tobytes())
+
+        self.records.append((self.shard, image_offset, len(image_bytes), depth_offset, \
+            validity_offset, depth_map.shape[0], depth_map.shape[1], \
+            DEPTH_FORMATS[self.depth_format], depth_min, depth_max))
+        self.names.append(os.path.basename(str(image_filepath)))
+
+    # Move the shard files into place and write the index,
+    # returning the number of shards written
+    def close(self):
+        if(self.shard_file is not None):
+            self.shard_file.close()
+
+        for shard in range(0, self.shard + 1):
+            shard_filepath = self.store_prefix + SHARD_FILE_SUFFIX.format(shard)
+            os.replace(shard_filepath + '.tmp', shard_filepath)
+
+        with open(self.store_prefix + NAMES_FILE_SUFFIX, 'w') as names_file:
+            names_file.write('\n'.join(self.names))
+        np.save(self.store_prefix + INDEX_FILE_SUFFIX, np.array(self.records, dtype=INDEX_DTYPE))
+
+        return self.shard + 1
+
+# Write the images, depth maps and validity masks saved by a Scene3D processing
+# script to the depth store, returning the number of shards written
+def compileDepthStore(images, depth_maps, validity_masks, store_root_path, dataset, \
+        depth_format = 'uint16', shard_size = DEFAULT_SHARD_SIZE):
+
+    writer = Scene3DDepthStoreWriter(store_root_path, dataset, depth_format, shard_size)
+
+    for count in range(0, len(images)):
+
+        depth_map = np.load(str(depth_maps[count]))
+        validity_mask = None
+        if(validity_masks is not None):
+            validity_mask = np.array(Image.open(str(validity_masks[count])))
+
+        writer.addSample(images[count], depth_map, validity_mask)
+
+        if((count+1) % 1000 == 0):
+            print('Compiled', count+1, 'of', len(images), 'samples')
+
+    return writer.close()
+
+def main():
+
+    parser = ArgumentParser()
+    parser.add_argument("-i", "--images", dest="images_filepath", help="path to folder with images")
+    parser.add_argument("-d", "--depth", dest="depth_filepath", help="path to folder with .npy depth maps")
+    parser.add_argument("-v", "--validity", dest="validity_filepath", default="", help="path to folder with validity masks, derived from non-zero depth if not provided")
+    parser.add_argument("-s", "--store_root_path", dest="store_root_path", help="root path where the depth store should be saved")
+    parser.add_argument("-n", "--name", dest="dataset", default="DIVERSE", help="name of the dataset in the depth store")
+    parser.add_argument("-f", "--depth_format", dest="depth_format", default="uint16", choices=["uint16", "float16"], help="encoding of the stored depth maps")
+    parser.add_argument("-z", "--shard_size", dest="shard_size", type=int, default=2048, help="size in MB after which a new shard file is started")
+    args = parser.parse_args()
+
+    # Reading samples and sorting returned list in alphabetical order
+    images = sorted([f for f in pathlib.Path(args.images_filepath).glob("*")])
+    depth_maps = sorted([f for f in pathlib.Path(args.depth_filepath).glob("*.npy")])
+
+    check_passed = CheckData(len(images), len(depth_maps)).getCheck()
+
+    validity_masks = None
+    if(len(args.validity_filepath) > 0):
+        validity_masks = sorted([f for f in pathlib.Path(args.validity_filepath).glob("*.png")])
+        check_passed = check_passed and CheckData(len(images), len(validity_masks)).getCheck()
+
+    # If all data checks have been passed
+    if(check_passed):
+
+        print('Compiling depth store for', args.dataset)
+        start_time = time.time()
+
+        num_shards = compileDepthStore(images, depth_maps, validity_masks, \
+            args.store_root_path, args.dataset, args.depth_format, args.shard_size*1024*1024)
+
+        print('Compiled', len(images), 'samples into', num_shards, 'shards in', \
+            '%.1f s' % (time.time() - start_time))
+
+if __name__ == '__main__':
+    main()
+# %%
@@ -0,0 +1,153 @@
+#%%
+# Comment above is for Jupyter execution in VSCode
+#! /usr/bin/env python3
+import os
+import time
+import numpy as np
+from argparse import ArgumentParser
+from PIL import Image
+import sys
+sys.path.append('..')
+from data_utils.load_data_scene_seg import LoadDataSceneSeg, getClassMap, calcClassWeights
+
+# Files making up the label cache of a dataset:
+#   <DATASET>_labels.bin        - uint8 class maps of all samples, concatenated
+#   <DATASET>_index.npy         - int64 (offset, height, width) of each class map
+#   <DATASET>_class_weights.npy - float64 (background, foreground, road) weights
+#   <DATASET>_names.txt         - label file name of each sample, for sanity checks
+LABELS_FILE_SUFFIX = '_labels.bin'
+INDEX_FILE_SUFFIX = '_index.npy'
+CLASS_WEIGHTS_FILE_SUFFIX = '_class_weights.npy'
+NAMES_FILE_SUFFIX = '_names.txt'
+
+class SceneSegLabelCache():
+    def __init__(self, cache_root_path, dataset):
+
+        self.dataset = dataset
+        cache_prefix = os.path.join(cache_root_path, dataset)
+
+        # Offset index and class weights table are small and kept in memory
+        self.index = np.load(cache_prefix + INDEX_FILE_SUFFIX)
+        self.class_weights = np.load(cache_prefix + CLASS_WEIGHTS_FILE_SUFFIX)
+
+        with open(cache_prefix + NAMES_FILE_SUFFIX, 'r') as names_file:
+            self.names = names_file.read().splitlines()
+
+        self.num_labels = len(self.index)
+
+        if(self.num_labels != len(self.class_weights) or \
+           self.num_labels != len(self.names)):
+            raise ValueError('Label cache for ' + dataset + ' is incomplete - please recompile it')
+
+        # Class maps are memory-mapped and only paged in when read
+        self.class_maps = np.memmap(cache_prefix + LABELS_FILE_SUFFIX, \
+            dtype=np.uint8, mode='r')
+
+    # Ensure the cache was compiled from the given list of label files
+    def checkLabels(self, labels):
+        label_names = [os.path.basename(str(label)) for label in labels]
+        if(label_names != self.names):
+            raise ValueError('Label cache for ' + self.dataset + \
+                ' does not match the ground truth labels - please recompile it')
+
+    def getItemCount(self):
+        return self.num_labels
+
+    # Zero-copy read-only view of the class map of a sample
+    def getClassMap(self, index):
+        offset, height, width = self.index[index]
+        return self.class_maps[offset:offset + height*width].reshape(height, width)
+
+    def getClassWeights(self, index):
+        return self.class_weights[index].tolist()
+
+# Decode every colour label of a dataset once and write its class maps,
+# offset index and class weights to the label cache
+def compileLabelCache(dataset, cache_root_path):
+
+    if (not os.path.exists(cache_root_path)):
+        os.makedirs(cache_root_path)
+
+    cache_prefix = os.path.join(cache_root_path, dataset.dataset)
+
+    index = np.zeros((dataset.num_labels, 3), dtype=np.int64)
+    class_weights = np.zeros((dataset.num_labels, 3), dtype=np.float64)
+    names = []
+    offset = 0
+
+    # Class maps are streamed to a temporary file which only replaces
+    # the existing cache once all labels have been written
+    labels_tmp_path = cache_prefix + LABELS_FILE_SUFFIX + '.tmp'
+
+    with open(labels_tmp_path, 'wb') as labels_file:
+        for count in range(0, dataset.num_labels):
+
+            label = Image.open(str(dataset.labels[count]))
+            roi_box = dataset.getROIBox(label)
+            if(roi_box is not None):
+                label = label.crop(roi_box)
+
+            class_map = getClassMap(label)
+            labels_file.write(class_map.tobytes())
+
+            index[count] = (offset, class_map.shape[0], class_map.shape[1])
+            class_weights[count] = calcClassWeights(class_map)
+            names.append(os.path.basename(str(dataset.labels[count])))
+            offset += class_map.size
+
+            if((count+1) % 1000 == 0):
+                print('Compiled', count+1, 'of', dataset.num_labels, 'labels')
+
+    np.save(cache_prefix + CLASS_WEIGHTS_FILE_SUFFIX, class_weights)
+    with open(cache_prefix + NAMES_FILE_SUFFIX, 'w') as names_file:
+        names_file.write('\n'.join(names))
+    os.replace(labels_tmp_path, cache_prefix + LABELS_FILE_SUFFIX)
+    np.save(cache_prefix + INDEX_FILE_SUFFIX, index)
+
+    return offset
+
+def main():
+
+    parser = ArgumentParser()
+    parser.add_argument("-r", "--root", dest="root", help="root path to folder where data training data is stored")
+    parser.add_argument("-c", "--cache_root_path", dest="cache_root_path", help="root path where the compiled label cache should be saved")
+    args = parser.parse_args()
+
+    # Root path
+    root = args.root
+
+    # Label cache path
+    cache_root_path = args.cache_root_path
+
+    # Data paths of each dataset
+    dataset_filepaths = {
+        'ACDC': 'ACDC/',
+        'BDD100K': 'BDD100K/',
+        'IDDAW': 'IDDAW/',
+        'MUSES': 'MUSES/',
+        'MAPILLARY': 'Mapillary_Vistas/',
+        'COMMA10K': 'comma10k/'
+    }
+
+    for dataset_name, dataset_filepath in dataset_filepaths.items():
+
+        labels_filepath = root + dataset_filepath + 'gt_masks/'
+        images_filepath = root + dataset_filepath + 'images/'
+
+        if (not os.path.exists(labels_filepath)):
+            print('Skipping', dataset_name, '- no ground truth masks found')
+            continue
+
+        print('Compiling label cache for', dataset_name)
+        start_time = time.time()
+
+        dataset = LoadDataSceneSeg(labels_filepath, images_filepath, dataset_name)
+        num_pixels = compileLabelCache(dataset, cache_root_path)
+
+        print('Compiled', dataset.num_labels, 'labels,', \
+            '%.1f MB' % (num_pixels/(1024*1024)), 'in', \
+            '%.1f s' % (time.time() - start_time))
+
+if __name__ == '__main__':
+    main()
+# %%
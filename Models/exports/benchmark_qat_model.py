@@ -35,11 +35,11 @@ if project_root not in sys.path:
 
 try:
     from data_utils.load_data_scene_seg import LoadDataSceneSeg
-    from data_utils.augmentations import Augmentations
+    from data_utils.augmentations import getAugmentations
 except ImportError:
     sys.path.append(os.path.abspath(os.path.join(script_dir, '..', '..')))
     from data_utils.load_data_scene_seg import LoadDataSceneSeg
-    from data_utils.augmentations import Augmentations
+    from data_utils.augmentations import getAugmentations
 
 from torch.export import export_for_training
 from torch.ao.quantization.quantize_pt2e import prepare_qat_pt2e, convert_pt2e
@@ -52,7 +52,7 @@ from torch.ao.quantization import move_exported_model_to_eval
 # --- Project Imports ---
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from data_utils.load_data_scene_seg import LoadDataSceneSeg
-from data_utils.augmentations import Augmentations
+from data_utils.augmentations import getAugmentations
 # IMPORTANT: Use the original FP32 network, not the one with Quantized stubs
 from model_components.scene_seg_network import SceneSegNetwork
 
@@ -133,7 +133,7 @@ def create_onnx_from_qat_checkpoint(
             for dataset_key, sample_idx in tqdm(calibration_set, desc="Calibrating"):
                 dataset = datasets[dataset_key]
                 img_np, gt_list, _ = dataset.getItemVal(sample_idx)
-                augmenter = Augmentations(is_train=False, data_type='SEGMENTATION')
+                augmenter = getAugmentations(is_train=False, data_type='SEGMENTATION')
                 augmenter.setDataSeg(img_np, gt_list)
                 img_aug, _ = augmenter.applyTransformSeg(image=img_np, ground_truth=gt_list)
                 calib_tensor = image_transformer(img_aug).unsqueeze(0).to(device)
@@ -276,7 +276,7 @@ def main():
             img_np, gt_list, _ = dataset.getItemVal(i)
             
             # Process image
-            augmenter = Augmentations(is_train=False, data_type='SEGMENTATION')
+            augmenter = getAugmentations(is_train=False, data_type='SEGMENTATION')
             augmenter.setDataSeg(img_np, gt_list)
             img_aug, _ = augmenter.applyTransformSeg(image=img_np, ground_truth=gt_list)
             img_tensor = image_transformer(img_aug).unsqueeze(0) # Keep on CPU for ONNX
@@ -31,7 +31,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 # Import required modules
 from data_utils.load_data_scene_seg import LoadDataSceneSeg
-from data_utils.augmentations import Augmentations
+from data_utils.augmentations import getAugmentations
 from model_components.scene_seg_network import SceneSegNetwork
 
 # Configure logging
@@ -67,7 +67,7 @@ def run_validation(model, dataset_loader, num_samples, device):
             img_np, gt_list, _ = dataset_loader.getItemVal(i)
             
             # CRITICAL FIX: Add the missing augmentation/resizing step for validation images
-            augmenter = Augmentations(is_train=False, data_type='SEGMENTATION')
+            augmenter = getAugmentations(is_train=False, data_type='SEGMENTATION')
             augmenter.setDataSeg(img_np, gt_list)
             # We only need the augmented image for input, gt is handled later
             img_aug, _ = augmenter.applyTransformSeg(image=img_np, ground_truth=gt_list)
@@ -299,7 +299,7 @@ def main_qat():
             img_np, gt_list, class_weights = dataset.getItemTrain(sample_idx)
 
             # 2. Augment Data
-            augmenter = Augmentations(is_train=False, data_type='SEGMENTATION')
+            augmenter = getAugmentations(is_train=False, data_type='SEGMENTATION')
             augmenter.setDataSeg(img_np, gt_list)
             img_aug, augmented_gt = augmenter.applyTransformSeg(image=img_np, ground_truth=gt_list)
             
@@ -370,7 +370,7 @@ def main_qat():
                         for val_idx in range(num_samples):
                             img_np, gt_list, _ = dataset.getItemVal(val_idx)
                             
-                            augmenter = Augmentations(is_train=False, data_type='SEGMENTATION')
+                            augmenter = getAugmentations(is_train=False, data_type='SEGMENTATION')
                             augmenter.setDataSeg(img_np, gt_list)
                             img_aug, _ = augmenter.applyTransformSeg(image=img_np, ground_truth=gt_list)
                             
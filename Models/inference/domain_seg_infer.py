@@ -7,6 +7,7 @@ import sys
 sys.path.append('..')
 from model_components.scene_seg_network import SceneSegNetwork
 from model_components.domain_seg_network import DomainSegNetwork
+from inference.image_batch import load_image_batch
 
 
 class DomainSegNetworkInfer():
@@ -58,6 +59,16 @@ class DomainSegNetworkInfer():
         output[output > 0] = 1.0
 
         return output
-        
 
-    
\ No newline at end of file
+    # Run the network on a batch of RGB frames, given as a list of PIL images
+    # or HxWx3 uint8 arrays, or an NxHxWx3 uint8 array. Frames are resized to
+    # 640x320 and thresholded on the device, returning an (N, 320, 640) uint8
+    # array which is 1 for foreground and 0 for background pixels
+    def infer_batch(self, frames):
+
+        with torch.inference_mode():
+            image_tensor = load_image_batch(frames, self.device)
+            prediction = self.model(image_tensor)
+            output = (prediction[:, 0] > 0).to(torch.uint8)
+
+        return output.cpu().numpy()
@@ -0,0 +1,58 @@
+#! /usr/bin/env python3
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# ImageNet normalization used by all networks
+IMAGE_MEAN = [0.485, 0.456, 0.406]
+IMAGE_STD = [0.229, 0.224, 0.225]
+
+# Network input size
+INPUT_WIDTH = 640
+INPUT_HEIGHT = 320
+
+# Convert a list of RGB frames (PIL images or HxWx3 uint8 arrays) or an
+# NxHxWx3 uint8 array to a normalized network input tensor (N, 3, 320, 640)
+# on the given device. Frames are resized and normalized as a whole batch
+# on the device, frames of different sizes are resized one by one
+def load_image_batch(frames, device):
+
+    if(isinstance(frames, np.ndarray) and frames.ndim == 3):
+        frames = frames[np.newaxis]
+
+    frames = [np.asarray(frame, dtype=np.uint8) for frame in frames]
+    if(len(frames) == 0):
+        raise ValueError('No frames provided for batched inference')
+
+    for frame in frames:
+        if(frame.ndim != 3 or frame.shape[2] != 3):
+            raise ValueError('Incorrect input shape - frames must be RGB images of shape HxWx3')
+
+    # Group frames of the same size into a single tensor
+    frame_groups = []
+    for frame in frames:
+        if(len(frame_groups) > 0 and frame_groups[-1][0].shape == frame.shape):
+            frame_groups[-1].append(frame)
+        else:
+            frame_groups.append([frame])
+
+    image_tensors = []
+    for frame_group in frame_groups:
+        image_tensor = torch.from_numpy(np.stack(frame_group)).to(device, non_blocking=True)
+        image_tensor = image_tensor.permute(0, 3, 1, 2).float()
+
+        # Bicubic resize with antialiasing, matching PIL Image.resize
+        if(image_tensor.shape[2] != INPUT_HEIGHT or image_tensor.shape[3] != INPUT_WIDTH):
+            image_tensor = F.interpolate(image_tensor, size=(INPUT_HEIGHT, INPUT_WIDTH), \
+                mode='bicubic', align_corners=False, antialias=True)
+            image_tensor = torch.clamp(torch.round(image_tensor), 0, 255)
+
+        image_tensors.append(image_tensor)
+
+    image_tensor = torch.cat(image_tensors, dim=0)
+
+    mean = torch.tensor(IMAGE_MEAN, device=device).reshape(1, 3, 1, 1)*255
+    std = torch.tensor(IMAGE_STD, device=device).reshape(1, 3, 1, 1)*255
+    image_tensor = (image_tensor - mean)/std
+
+    return image_tensor.contiguous()
@@ -0,0 +1,210 @@
+#! /usr/bin/env python3
+import time
+import torch
+import sys
+sys.path.append('..')
+from model_components.scene_seg_network import SceneSegNetwork
+from model_components.domain_seg_network import DomainSegNetwork
+from model_components.ego_space_network import EgoSpaceNetwork
+from model_components.scene_3d_network import Scene3DNetwork
+from inference.image_batch import load_image_batch
+
+TASK_LIST = ['SceneSeg', 'DomainSeg', 'EgoSpace', 'Scene3D']
+
+# Check whether two modules are of the same type and hold identical weights
+def is_same_module(module_a, module_b):
+    if(type(module_a) != type(module_b)):
+        return False
+
+    state_a = module_a.state_dict()
+    state_b = module_b.state_dict()
+    if(state_a.keys() != state_b.keys()):
+        return False
+
+    for key in state_a:
+        if(not torch.equal(state_a[key], state_b[key])):
+            return False
+    return True
+
+
+# Runs SceneSeg, DomainSeg, EgoSpace and Scene3D on the same frames, sharing
+# the work which the networks have in common. DomainSeg, EgoSpace and Scene3D
+# are trained on top of a frozen SceneSeg backbone, so the Backbone features
+# are calculated once and fanned out to the context, neck and head of each
+# network - DomainSeg and EgoSpace also share the SceneSeg context and neck.
+# Blocks are only shared when their weights are identical in all checkpoints,
+# so outputs match those of the individual networks exactly
+class MultiTaskNetworkInfer():
+    def __init__(self, scene_seg_checkpoint_path = '', domain_seg_checkpoint_path = '', \
+                 ego_space_checkpoint_path = '', scene_3d_checkpoint_path = ''):
+
+        # Checking devices (GPU vs CPU)
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        print(f'Using {self.device} for inference')
+
+        checkpoint_paths = {
+            'SceneSeg': scene_seg_checkpoint_path,
+            'DomainSeg': domain_seg_checkpoint_path,
+            'EgoSpace': ego_space_checkpoint_path,
+            'Scene3D': scene_3d_checkpoint_path
+        }
+
+        # Instantiate the network of each task with a checkpoint
+        self.networks = {}
+        for task in TASK_LIST:
+            if(len(checkpoint_paths[task]) > 0):
+                self.networks[task] = self.load_network(task, checkpoint_paths[task])
+
+        if(len(self.networks) == 0):
+            raise ValueError('No path to checkpiont file provided in class initialization')
+
+        # Blocks of each network - backbone, context and neck, head
+        self.blocks = {task: self.get_blocks(task, network) \
+            for task, network in self.networks.items()}
+
+        # Distinct backbones and necks, with the index of the one used by each task
+        self.backbones = []
+        self.necks = []
+        self.backbone_ids = {}
+        self.neck_ids = {}
+
+        for task, (backbone, context, neck, head) in self.blocks.items():
+            self.backbone_ids[task] = self.get_shared_block_id(self.backbones, (backbone,))
+            self.neck_ids[task] = self.get_shared_block_id(self.necks, \
+                (context, neck), self.backbone_ids[task])
+
+        print(f'Running {len(self.backbones)} backbone(s) and {len(self.necks)} neck(s) for', \
+            ', '.join(self.networks.keys()))
+
+        # Latency of each stage of the latest run in milliseconds
+        self.latency = {}
+
+    # Instantiate network of a task, load its checkpoint to device
+    # and set to evaluation mode
+    def load_network(self, task, checkpoint_path):
+
+        if(task == 'SceneSeg'):
+            network = SceneSegNetwork()
+        elif(task == 'DomainSeg'):
+            network = DomainSegNetwork(SceneSegNetwork())
+        elif(task == 'EgoSpace'):
+            network = EgoSpaceNetwork(SceneSegNetwork())
+        else:
+            network = Scene3DNetwork(SceneSegNetwork())
+
+        network.load_state_dict(torch.load \
+            (checkpoint_path, weights_only=True, map_location=self.device))
+
+        network = network.to(self.device)
+        return network.eval()
+
+    # Backbone, context, neck and head of a task network,
+    # mirroring the forward pass of each network
+    def get_blocks(self, task, network):
+
+        if(task == 'SceneSeg'):
+            return network.Backbone, network.SceneContext, \
+                network.SceneNeck, network.SceneSegHead
+        elif(task == 'DomainSeg'):
+            upstream = network.DomainSegUpstream
+            return upstream.pretrainedBackBone, upstream.pretrainedContext, \
+                upstream.pretrainedNeck, network.DomainSegHead
+        elif(task == 'EgoSpace'):
+            upstream = network.EgoSpaceUpstream
+            return upstream.pretrainedBackBone, upstream.pretrainedContext, \
+                upstream.pretrainedNeck, network.EgoSpaceHead
+        else:
+            return network.PreTrainedBackbone.pretrainedBackBone, network.DepthContext, \
+                network.DepthNeck, network.SuperDepthHead
+
+    # Index of an identical block already in the list of shared blocks,
+    # which is added to the list if there is none
+    def get_shared_block_id(self, shared_blocks, modules, input_id = 0):
+
+        for block_id, (shared_modules, shared_input_id) in enumerate(shared_blocks):
+            if(shared_input_id == input_id and \
+                all(is_same_module(a, b) for a, b in zip(shared_modules, modules))):
+                return block_id
+
+        shared_blocks.append((modules, input_id))
+        return len(shared_blocks) - 1
+
+    # Run a stage of the network, adding its duration to the latency breakdown
+    def run_timed(self, stage, function, *args):
+
+        start_time = time.perf_counter()
+        output = function(*args)
+
+        if(self.device.type == 'cuda'):
+            torch.cuda.synchronize(self.device)
+
+        latency = (time.perf_counter() - start_time)*1000
+        self.latency[stage] = self.latency.get(stage, 0) + latency
+        return output
+
+    # Run all networks on a normalized image tensor (N, 3, H, W), returning
+    # the raw prediction of each task. The time spent in the shared backbone
+    # is logged separately, the time of a shared context and neck is counted
+    # towards the first task using it
+    def run_network(self, image_tensor):
+
+        self.latency = {}
+
+        # Backbone features, calculated once for each distinct backbone
+        features = []
+        for (backbone,), _ in self.backbones:
+            features.append(self.run_timed('Backbone', backbone, image_tensor))
+
+        necks = [None]*len(self.necks)
+        predictions = {}
+
+        # Fan out features to the context, neck and head of each task
+        for task, (_, context, neck, head) in self.blocks.items():
+
+            task_features = features[self.backbone_ids[task]]
+            neck_id = self.neck_ids[task]
+
+            if(necks[neck_id] is None):
+                necks[neck_id] = self.run_timed(task, \
+                    lambda: neck(context(task_features[4]), task_features))
+
+            predictions[task] = self.run_timed(task, head, necks[neck_id], task_features)
+
+        self.latency['Total'] = sum(self.latency.values())
+        return predictions
+
+    # Run all networks on a batch of RGB frames, given as a list of PIL images
+    # or HxWx3 uint8 arrays, or an NxHxWx3 uint8 array. Returns a dictionary
+    # of (N, 320, 640) outputs for each task - uint8 class ids for SceneSeg,
+    # uint8 binary masks for DomainSeg and EgoSpace, and float32 depth for Scene3D
+    def infer_batch(self, frames):
+
+        with torch.inference_mode():
+            image_tensor = self.run_timed('Preprocessing', \
+                load_image_batch, frames, self.device)
+            latency_preprocessing = self.latency['Preprocessing']
+
+            predictions = self.run_network(image_tensor)
+            self.latency = {'Preprocessing': latency_preprocessing, **self.latency}
+            self.latency['Total'] += latency_preprocessing
+
+            outputs = {}
+            for task, prediction in predictions.items():
+                if(task == 'SceneSeg'):
+                    output = torch.argmax(prediction, dim=1).to(torch.uint8)
+                elif(task == 'Scene3D'):
+                    output = prediction[:, 0].float()
+                else:
+                    output = (prediction[:, 0] > 0).to(torch.uint8)
+                outputs[task] = output.cpu().numpy()
+
+        return outputs
+
+    # Latency breakdown in milliseconds of the latest run
+    def get_latency(self):
+        return dict(self.latency)
+
+    # Print latency breakdown of the latest run
+    def print_latency(self):
+        for stage, latency in self.latency.items():
+            print(f'{stage}: {latency:.2f} ms')
@@ -7,6 +7,7 @@ import sys
 sys.path.append('..')
 from model_components.scene_seg_network import SceneSegNetwork
 from model_components.scene_3d_network import Scene3DNetwork
+from inference.image_batch import load_image_batch
 
 
 class Scene3DNetworkInfer():
@@ -56,6 +57,15 @@ class Scene3DNetworkInfer():
         output = prediction.numpy()
 
         return output
-        
 
-    
\ No newline at end of file
+    # Run the network on a batch of RGB frames, given as a list of PIL images
+    # or HxWx3 uint8 arrays, or an NxHxWx3 uint8 array. Frames are resized to
+    # 640x320, returning an (N, 320, 640) float32 array of depth predictions
+    def infer_batch(self, frames):
+
+        with torch.inference_mode():
+            image_tensor = load_image_batch(frames, self.device)
+            prediction = self.model(image_tensor)
+            output = prediction[:, 0].float()
+
+        return output.cpu().numpy()
@@ -6,6 +6,7 @@ from torchvision import transforms
 import sys
 sys.path.append('..')
 from model_components.scene_seg_network import SceneSegNetwork
+from inference.image_batch import load_image_batch
 
 
 class SceneSegNetworkInfer():
@@ -55,6 +56,16 @@ class SceneSegNetworkInfer():
         output = output.numpy()
 
         return output
-        
 
-    
\ No newline at end of file
+    # Run the network on a batch of RGB frames, given as a list of PIL images
+    # or HxWx3 uint8 arrays, or an NxHxWx3 uint8 array. Frames are resized to
+    # 640x320 and the class with highest probability is found on the device,
+    # returning an (N, 320, 640) uint8 array of class ids
+    def infer_batch(self, frames):
+
+        with torch.inference_mode():
+            image_tensor = load_image_batch(frames, self.device)
+            prediction = self.model(image_tensor)
+            output = torch.argmax(prediction, dim=1).to(torch.uint8)
+
+        return output.cpu().numpy()
@@ -41,9 +41,7 @@ class BEVPathContext(nn.Module):
         c2 = self.sigmoid(c2)
    
         # Reshape
-        c3 = c2.reshape([20, 10])
-        c3 = c3.unsqueeze(0)
-        c3 = c3.unsqueeze(0)
+        c3 = c2.reshape([-1, 1, 20, 10])
         
         # Context
         c4 = self.context_layer_3(c3)
@@ -38,9 +38,7 @@ class SceneContext(nn.Module):
         c2 = self.sigmoid(c2)
         
         # Reshape
-        c3 = c2.reshape([10, 20])
-        c3 = c3.unsqueeze(0)
-        c3 = c3.unsqueeze(0)
+        c3 = c2.reshape([-1, 1, 10, 20])
         
         # Context
         c4 = self.context_layer_3(c3)
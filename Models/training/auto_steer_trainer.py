@@ -11,17 +11,23 @@ import sys
 
 sys.path.append('..')
 from model_components.auto_steer_network import AutoSteerNetwork
-from data_utils.augmentations import Augmentations
+from data_utils.augmentations import getAugmentations
 from data_utils.load_data_auto_steer import VALID_DATASET_LIST
+from data_utils.auto_steer_label_store import packKeypoints, unpackKeypoints
+from training.mixed_precision import MixedPrecision
 
 
 class AutoSteerTrainer():
     def __init__(
         self,  
-        checkpoint_path = ""
+        checkpoint_path = "",
+        precision = "fp32",
+        channels_last = False
     ):
         
         # Initializing Data
+        self.keypoints = None
+        self.keypoint_lengths = None
         self.homotrans_mat = None
         self.bev_image = None
         self.perspective_image = None
@@ -84,6 +90,10 @@ class AutoSteerTrainer():
             print("Loading vanilla AutoSteer model for training")
             
         self.model = self.model.to(self.device)
+
+        # Mixed precision and memory format
+        self.mixed_precision = MixedPrecision(self.device, precision, channels_last)
+        self.model = self.mixed_precision.prepare_model(self.model)
         
         # TensorBoard
         self.writer = SummaryWriter()
@@ -108,27 +118,51 @@ class AutoSteerTrainer():
     def set_learning_rate(self, learning_rate):
         self.learning_rate = learning_rate
         
-    # Assign input variables
-    def set_data(self, homotrans_mat, bev_image, perspective_image, \
+    # Assign input variables - the BEV-to-image matrix and keypoints are packed
+    # into a single buffer, perspective_image_size is the (width, height) of the
+    # perspective image, which is only read for visualization
+    def set_data(self, homotrans_mat, bev_image, perspective_image_size, \
                 bev_egopath, bev_egoleft, bev_egoright, reproj_egopath, \
                 reproj_egoleft, reproj_egoright):
 
-        self.homotrans_mat = np.array(homotrans_mat, dtype = "float32")
+        self.keypoints, self.keypoint_lengths = packKeypoints(homotrans_mat, [
+            bev_egopath, reproj_egopath,
+            bev_egoleft, reproj_egoleft,
+            bev_egoright, reproj_egoright
+        ])
+        self.unpack_keypoints()
         self.bev_image = np.array(bev_image)
-        self.perspective_image = np.array(perspective_image)
-        self.bev_egopath = np.array(bev_egopath, dtype = "float32").transpose()
-        self.bev_egoleft = np.array(bev_egoleft, dtype = "float32").transpose()
-        self.bev_egoright = np.array(bev_egoright, dtype = "float32").transpose()
-        self.reproj_egopath = np.array(reproj_egopath, dtype = "float32").transpose()
-        self.reproj_egoleft = np.array(reproj_egoleft, dtype = "float32").transpose()
-        self.reproj_egoright = np.array(reproj_egoright, dtype = "float32").transpose()
-        self.perspective_H, self.perspective_W, _ = self.perspective_image.shape
+        self.perspective_image = None
+        self.perspective_W, self.perspective_H = perspective_image_size
         self.BEV_H, self.BEV_W, _ = self.bev_image.shape
 
+    # Assign perspective image for visualization
+    def set_perspective_image(self, perspective_image):
+        self.perspective_image = np.array(perspective_image)
+
+    # Numpy BEV-to-image matrix and keypoints for visualization,
+    # as views of the packed keypoints
+    def unpack_keypoints(self):
+        self.homotrans_mat, [
+            self.bev_egopath, self.reproj_egopath,
+            self.bev_egoleft, self.reproj_egoleft,
+            self.bev_egoright, self.reproj_egoright
+        ] = unpackKeypoints(self.keypoints, self.keypoint_lengths)
+
+    # Copy packed keypoints to the device in a single non-blocking transfer,
+    # the BEV-to-image matrix and ground truth tensors are views of the copy
+    def load_keypoints_tensor(self, keypoints_tensor):
+        keypoints_tensor = keypoints_tensor.to(self.device, non_blocking = True)
+        self.homotrans_mat_tensor, [
+            self.gt_bev_egopath_tensor, self.gt_reproj_egopath_tensor,
+            self.gt_bev_egoleft_lane_tensor, self.gt_reproj_egoleft_lane_tensor,
+            self.gt_bev_egoright_lane_tensor, self.gt_reproj_egoright_lane_tensor
+        ] = unpackKeypoints(keypoints_tensor, self.keypoint_lengths)
+
     # Image agumentations
     def apply_augmentations(self, is_train):
         # Augmenting data for train or val/test
-        aug = Augmentations(
+        aug = getAugmentations(
             is_train = is_train, 
             data_type = "KEYPOINTS"
         )
@@ -138,50 +172,49 @@ class AutoSteerTrainer():
     # Load data as Pytorch tensors
     def load_data(self):
 
-        # BEV to Image matrix
-        homotrans_mat_tensor = torch.from_numpy(self.homotrans_mat)
-        homotrans_mat_tensor = homotrans_mat_tensor.type(torch.FloatTensor)
-        self.homotrans_mat_tensor = homotrans_mat_tensor.to(self.device)
-
         # BEV Image
         bev_image_tensor = self.image_loader(self.bev_image)
         bev_image_tensor = bev_image_tensor.unsqueeze(0)
         self.bev_image_tensor = bev_image_tensor.to(self.device)
 
-        # BEV Egopath
-        bev_egopath_tensor = torch.from_numpy(self.bev_egopath)
-        bev_egopath_tensor = bev_egopath_tensor.type(torch.FloatTensor)
-        self.gt_bev_egopath_tensor = bev_egopath_tensor.to(self.device)
+        # BEV to Image matrix and keypoints, from pinned memory
+        keypoints_tensor = torch.from_numpy(self.keypoints)
+        if (self.device.type == "cuda"):
+            keypoints_tensor = keypoints_tensor.pin_memory()
+        self.load_keypoints_tensor(keypoints_tensor)
+    
+    # Load sample prepared by AutoSteerDataset, tensors are
+    # copied to the device asynchronously from pinned memory
+    def load_prefetched_data(self, sample):
+
+        # Numpy data for visualization, the perspective image
+        # is only read on visualization steps
+        self.keypoints = sample["keypoints"]
+        self.keypoint_lengths = sample["keypoint_lengths"]
+        self.unpack_keypoints()
+        self.bev_image = sample["bev_image"]
+        self.perspective_image = None
+        self.perspective_H = sample["perspective_H"]
+        self.perspective_W = sample["perspective_W"]
+        self.BEV_H = sample["bev_H"]
+        self.BEV_W = sample["bev_W"]
 
-        # BEV Egoleft Lane
-        bev_egoleft_lane_tensor = torch.from_numpy(self.bev_egoleft)
-        bev_egoleft_lane_tensor = bev_egoleft_lane_tensor.type(torch.FloatTensor)
-        self.gt_bev_egoleft_lane_tensor = bev_egoleft_lane_tensor.to(self.device)
+        # Tensors
+        self.bev_image_tensor = sample["bev_image_tensor"].unsqueeze(0) \
+            .to(self.device, non_blocking = True)
+        self.load_keypoints_tensor(sample["keypoints_tensor"])
 
-        # BEV Egoright Lane
-        bev_egoright_lane_tensor = torch.from_numpy(self.bev_egoright)
-        bev_egoright_lane_tensor = bev_egoright_lane_tensor.type(torch.FloatTensor)
-        self.gt_bev_egoright_lane_tensor = bev_egoright_lane_tensor.to(self.device)
-        
-        # Reprojected Egopath
-        reproj_egopath_tensor = torch.from_numpy(self.reproj_egopath)
-        reproj_egopath_tensor = reproj_egopath_tensor.type(torch.FloatTensor)
-        self.gt_reproj_egopath_tensor = reproj_egopath_tensor.to(self.device)
-
-        # Reprojected Egoleft Lane
-        reproj_egoleft_lane_tensor = torch.from_numpy(self.reproj_egoleft)
-        reproj_egoleft_lane_tensor = reproj_egoleft_lane_tensor.type(torch.FloatTensor)
-        self.gt_reproj_egoleft_lane_tensor = reproj_egoleft_lane_tensor.to(self.device)
-
-        # Reprojected Egoright Lane
-        reproj_egoright_lane_tensor = torch.from_numpy(self.reproj_egoright)
-        reproj_egoright_lane_tensor = reproj_egoright_lane_tensor.type(torch.FloatTensor)
-        self.gt_reproj_egoright_lane_tensor = reproj_egoright_lane_tensor.to(self.device)
-    
     # Run Model
     def run_model(self):
-        self.pred_bev_ego_path_tensor, self.pred_bev_egoleft_lane_tensor, \
-            self.pred_bev_egoright_lane_tensor = self.model(self.bev_image_tensor)
+        with self.mixed_precision.autocast():
+            self.pred_bev_ego_path_tensor, self.pred_bev_egoleft_lane_tensor, \
+                self.pred_bev_egoright_lane_tensor = self.model( \
+                    self.mixed_precision.prepare_input(self.bev_image_tensor))
+
+        # Losses are calculated in fp32
+        self.pred_bev_ego_path_tensor = self.pred_bev_ego_path_tensor.float()
+        self.pred_bev_egoleft_lane_tensor = self.pred_bev_egoleft_lane_tensor.float()
+        self.pred_bev_egoright_lane_tensor = self.pred_bev_egoright_lane_tensor.float()
 
         # BEV Loss
         BEV_data_loss_driving_corridor = self.calc_BEV_data_loss_driving_corridor()
@@ -329,28 +362,12 @@ class AutoSteerTrainer():
 
         prediction_reprojected, _ = \
             self.getPerspectivePointsFromBEV(gt_tensor, pred_tensor)
-        
-        gt_tensor_x_vals = gt_tensor[0,:]
-        gt_reprojected_tensor_x_vals = gt_reprojected_tesnor[0,:]
-        gt_reprojected_tensor_y_vals = gt_reprojected_tesnor[1,:]
-
-        data_error_sum = 0
-
-        for i in range(0, len(gt_tensor_x_vals)):
 
-            gt_reprojected_x = gt_reprojected_tensor_x_vals[i]
-            prediction_reprojected_x = prediction_reprojected[i][0]
-            
-            gt_reprojected_y = gt_reprojected_tensor_y_vals[i]
-            prediction_reprojected_y = prediction_reprojected[i][1]
-            
-            x_error = torch.abs(gt_reprojected_x - prediction_reprojected_x)
-            y_error = torch.abs(gt_reprojected_y - prediction_reprojected_y)
-            L1_error = x_error + y_error
+        # L1 error of the reprojected (x, y) points
+        gt_reprojected_points = gt_reprojected_tesnor[0:2,:].transpose(0, 1)
+        data_error = torch.abs(gt_reprojected_points - prediction_reprojected)
 
-            data_error_sum = data_error_sum + L1_error
-
-        reprojected_data_loss = data_error_sum/len(gt_tensor_x_vals)
+        reprojected_data_loss = torch.sum(data_error)/gt_tensor.shape[1]
         return reprojected_data_loss
     
     # Reprojected points gradient loss for a single lane/path element
@@ -360,27 +377,21 @@ class AutoSteerTrainer():
         prediction_reprojected, _ = \
             self.getPerspectivePointsFromBEV(gt_tensor, pred_tensor)
         
-        gt_tensor_x_vals = gt_tensor[0,:]
         gt_reprojected_tensor_x_vals = gt_reprojected_tesnor[0,:]
+        prediction_reprojected_x_vals = prediction_reprojected[:,0]
 
-        reprojected_gradient_error = 0
-
-        for i in range(0, len(gt_tensor_x_vals)-1):
-
-            gt_reprojected_gradient = gt_reprojected_tensor_x_vals[i+1] \
-                - gt_reprojected_tensor_x_vals[i]
-            
-            prediction_reprojected_gradient = prediction_reprojected[i+1][0] \
-                - prediction_reprojected[i][0]
-            
-            error = torch.abs(gt_reprojected_gradient - prediction_reprojected_gradient)
-            reprojected_gradient_error = reprojected_gradient_error + error
+        gt_reprojected_gradient = gt_reprojected_tensor_x_vals[1:] \
+            - gt_reprojected_tensor_x_vals[:-1]
+        
+        prediction_reprojected_gradient = prediction_reprojected_x_vals[1:] \
+            - prediction_reprojected_x_vals[:-1]
 
-        reprojected_gradient_loss = reprojected_gradient_error/len(gt_tensor_x_vals)
+        reprojected_gradient_error = torch.abs(gt_reprojected_gradient - prediction_reprojected_gradient)
+        reprojected_gradient_loss = torch.sum(reprojected_gradient_error)/gt_tensor.shape[1]
             
         return reprojected_gradient_loss
 
-    # Get the list of reprojected points from X,Y BEV coordinates
+    # Get the reprojected points from X,Y BEV coordinates, as (N, 2) tensors
     def getPerspectivePointsFromBEV(self, gt_tensor, pred_tensor):
         gt_tensor_y_vals = gt_tensor[1,:]
         pred_tensor_x_vals = pred_tensor[0]
@@ -390,36 +401,35 @@ class AutoSteerTrainer():
 
         return perspective_image_points_normalized, perspective_image_points
 
-    # Reproject BEV points to perspective image
+    # Reproject BEV points to perspective image - x and y are (..., N) tensors of
+    # normalized BEV coordinates, reprojected with one matmul by the BEV to Image
+    # matrix and a perspective divide. Leading batch dimensions broadcast against
+    # the matrix, which may be a single (3, 3) or a batch of (..., 3, 3) matrices.
+    # Returns (..., N, 2) tensors of image points and normalized image points
     def projectBEVtoImage(self, bev_x_points, bev_y_points):
 
-        perspective_image_points = []
-        perspective_image_points_normalized = []
+        # Homogeneous BEV points in pixels, as (..., N, 3) rows
+        bev_homogenous_points = torch.stack([
+            self.BEV_W*bev_x_points,
+            self.BEV_H*bev_y_points,
+            torch.ones_like(bev_x_points)
+        ], dim = -1)
 
-        for i in range(0, len(bev_x_points)):
-            
-            image_homogenous_point_x = self.BEV_W*bev_x_points[i]*self.homotrans_mat_tensor[0][0] + \
-                self.BEV_H*bev_y_points[i]*self.homotrans_mat_tensor[0][1] + self.homotrans_mat_tensor[0][2]
-            
-            image_homogenous_point_y = self.BEV_W*bev_x_points[i]*self.homotrans_mat_tensor[1][0] + \
-                self.BEV_H*bev_y_points[i]*self.homotrans_mat_tensor[1][1] + self.homotrans_mat_tensor[1][2]
-            
-            image_homogenous_point_scale_factor = self.BEV_W*bev_x_points[i]*self.homotrans_mat_tensor[2][0] + \
-                self.BEV_H*bev_y_points[i]*self.homotrans_mat_tensor[2][1] + self.homotrans_mat_tensor[2][2]
-            
-            image_point = [(image_homogenous_point_x/image_homogenous_point_scale_factor), \
-                (image_homogenous_point_y/image_homogenous_point_scale_factor)]
-            
-            image_point_normalized = [image_point[0]/self.perspective_W, image_point[1]/self.perspective_H]
+        # Points are rows, so they are multiplied by the transposed matrix
+        image_homogenous_points = torch.matmul(bev_homogenous_points, 
+            self.homotrans_mat_tensor.transpose(-1, -2))
 
-            perspective_image_points.append(image_point)
-            perspective_image_points_normalized.append(image_point_normalized)
+        perspective_image_points = image_homogenous_points[..., 0:2] / \
+            image_homogenous_points[..., 2:3]
+        
+        perspective_image_points_normalized = perspective_image_points / \
+            perspective_image_points.new_tensor([self.perspective_W, self.perspective_H])
 
         return perspective_image_points, perspective_image_points_normalized
 
     # Loss backward pass
     def loss_backward(self):
-        self.total_loss.backward()
+        self.mixed_precision.backward(self.total_loss)
 
     # Get total loss value
     def get_total_loss(self):
@@ -448,7 +458,7 @@ class AutoSteerTrainer():
 
     # Run optimizer
     def run_optimizer(self):
-        self.optimizer.step()
+        self.mixed_precision.step(self.optimizer)
         self.optimizer.zero_grad()
 
     # Set train mode
@@ -481,15 +491,9 @@ class AutoSteerTrainer():
         _, pred_reprojected_ego_path_tensor = \
                 self.getPerspectivePointsFromBEV(self.gt_bev_egopath_tensor, 
                                             self.pred_bev_ego_path_tensor)
-        pred_reprojected_ego_path_x_vals = []
-        pred_reprojected_ego_path_y_vals = []
-
-        for i in range(0, len(pred_reprojected_ego_path_tensor)):
-            pred_reprojected_ego_path_x_val = pred_reprojected_ego_path_tensor[i][0].cpu().detach().numpy()
-            pred_reprojected_ego_path_y_val = pred_reprojected_ego_path_tensor[i][1].cpu().detach().numpy()
-
-            pred_reprojected_ego_path_x_vals.append(pred_reprojected_ego_path_x_val)
-            pred_reprojected_ego_path_y_vals.append(pred_reprojected_ego_path_y_val)
+        pred_reprojected_ego_path = pred_reprojected_ego_path_tensor.cpu().detach().numpy()
+        pred_reprojected_ego_path_x_vals = pred_reprojected_ego_path[:,0]
+        pred_reprojected_ego_path_y_vals = pred_reprojected_ego_path[:,1]
 
         # Predicted Egoleft Lane (BEV)
         prev_bev_egoleft_lane = self.pred_bev_egoleft_lane_tensor.cpu().detach().numpy()
@@ -498,15 +502,9 @@ class AutoSteerTrainer():
         _, pred_reprojected_egoleft_lane_tensor = \
                 self.getPerspectivePointsFromBEV(self.gt_bev_egoleft_lane_tensor, 
                                             self.pred_bev_egoleft_lane_tensor)
-        pred_reprojected_egoleft_lane_x_vals = []
-        pred_reprojected_egoleft_lane_y_vals = []
-
-        for i in range(0, len(pred_reprojected_egoleft_lane_tensor)):
-            pred_reprojected_egoleft_lane_x_val = pred_reprojected_egoleft_lane_tensor[i][0].cpu().detach().numpy()
-            pred_reprojected_egoleft_lane_y_val = pred_reprojected_egoleft_lane_tensor[i][1].cpu().detach().numpy()
-
-            pred_reprojected_egoleft_lane_x_vals.append(pred_reprojected_egoleft_lane_x_val)
-            pred_reprojected_egoleft_lane_y_vals.append(pred_reprojected_egoleft_lane_y_val)
+        pred_reprojected_egoleft_lane = pred_reprojected_egoleft_lane_tensor.cpu().detach().numpy()
+        pred_reprojected_egoleft_lane_x_vals = pred_reprojected_egoleft_lane[:,0]
+        pred_reprojected_egoleft_lane_y_vals = pred_reprojected_egoleft_lane[:,1]
 
         # Predicted Egoright Lane (BEV)
         pred_bev_egoright_lane = self.pred_bev_egoright_lane_tensor.cpu().detach().numpy()
@@ -515,16 +513,9 @@ class AutoSteerTrainer():
         _, pred_reprojected_egoright_lane_tensor = \
                 self.getPerspectivePointsFromBEV(self.gt_bev_egoright_lane_tensor, 
                                             self.pred_bev_egoright_lane_tensor)
-
-        pred_reprojected_egoright_lane_x_vals = []
-        pred_reprojected_egoright_lane_y_vals = []
-
-        for i in range(0, len(pred_reprojected_egoright_lane_tensor)):
-            pred_reprojected_egoright_lane_x_val = pred_reprojected_egoright_lane_tensor[i][0].cpu().detach().numpy()
-            pred_reprojected_egoright_lane_y_val = pred_reprojected_egoright_lane_tensor[i][1].cpu().detach().numpy()
-
-            pred_reprojected_egoright_lane_x_vals.append(pred_reprojected_egoright_lane_x_val)
-            pred_reprojected_egoright_lane_y_vals.append(pred_reprojected_egoright_lane_y_val)
+        pred_reprojected_egoright_lane = pred_reprojected_egoright_lane_tensor.cpu().detach().numpy()
+        pred_reprojected_egoright_lane_x_vals = pred_reprojected_egoright_lane[:,0]
+        pred_reprojected_egoright_lane_y_vals = pred_reprojected_egoright_lane[:,1]
 
         # BEV fixed y-values of anchors
         bev_y_vals = self.gt_bev_egopath_tensor[1,:].cpu().detach().numpy()*self.BEV_H
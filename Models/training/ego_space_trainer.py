@@ -12,10 +12,14 @@ import sys
 sys.path.append('..')
 from model_components.scene_seg_network import SceneSegNetwork
 from model_components.ego_space_network import EgoSpaceNetwork
-from data_utils.augmentations import Augmentations
+from data_utils.augmentations import getAugmentations
+from training.mixed_precision import MixedPrecision
+from training.segmentation_metrics import SegmentationMetrics, \
+    get_classes_from_binary_logits, get_classes_from_binary_gt
 
 class EgoSpaceTrainer():
-    def __init__(self,  checkpoint_path = '', pretrained_checkpoint_path = '', is_pretrained = False):
+    def __init__(self,  checkpoint_path = '', pretrained_checkpoint_path = '', is_pretrained = False, \
+            precision = 'fp32', channels_last = False):
 
         # Image and ground truth as Numpy arrays and Pytorch tensors
         self.image = 0
@@ -66,6 +70,13 @@ class EgoSpaceTrainer():
         # Model to device
         self.model = self.model.to(self.device)
 
+        # Mixed precision and memory format
+        self.mixed_precision = MixedPrecision(self.device, precision, channels_last)
+        self.model = self.mixed_precision.prepare_model(self.model)
+
+        # Validation metrics - background and foreground classes
+        self.val_metrics = SegmentationMetrics(num_classes=2, device=self.device)
+
         # TensorBoard
         self.writer = SummaryWriter()
 
@@ -101,14 +112,14 @@ class EgoSpaceTrainer():
 
         if(is_train):
             # Augmenting Data for training
-            augTrain = Augmentations(is_train=True, data_type='BINARY_SEGMENTATION')
+            augTrain = getAugmentations(is_train=True, data_type='BINARY_SEGMENTATION')
             augTrain.setData(self.image, self.gt)
             self.image, self.gt  = \
                 augTrain.applyTransformBinarySeg(image=self.image, ground_truth=self.gt)
             #self.image = augTrain.applyNoiseRoadWork()
         else:
             # Augmenting Data for testing/validation
-            augVal = Augmentations(is_train=False, data_type='BINARY_SEGMENTATION')
+            augVal = getAugmentations(is_train=False, data_type='BINARY_SEGMENTATION')
             augVal.setData(self.image, self.gt)
             self.image, self.gt = \
                 augVal.applyTransformBinarySeg(image=self.image, ground_truth=self.gt)
@@ -118,6 +129,17 @@ class EgoSpaceTrainer():
         self.load_image_tensor()
         self.load_gt_tensor()
 
+    # Load training sample prepared by EgoSpaceDataset, tensors
+    # are copied to the device asynchronously from pinned memory
+    def load_prefetched_data(self, sample):
+        self.image = sample['image']
+        self.gt = sample['gt']
+
+        self.image_tensor = sample['image_tensor'].unsqueeze(0) \
+            .to(self.device, non_blocking=True)
+        self.gt_tensor = sample['gt_tensor'].unsqueeze(0) \
+            .to(self.device, non_blocking=True)
+
     # Load Image as Tensor
     def load_image_tensor(self):
         image_tensor = self.image_loader(self.image)
@@ -132,7 +154,12 @@ class EgoSpaceTrainer():
 
     # Run Model
     def run_model(self):
-        self.prediction = self.model(self.image_tensor)
+        with self.mixed_precision.autocast():
+            self.prediction = self.model( \
+                self.mixed_precision.prepare_input(self.image_tensor))
+
+        # Loss is calculated in fp32
+        self.prediction = self.prediction.float()
         BCELoss = nn.BCEWithLogitsLoss()
         self.loss = BCELoss(self.prediction, self.gt_tensor)
 
@@ -173,10 +200,12 @@ class EgoSpaceTrainer():
             test_image_tensor = self.image_loader(image_pil)
             test_image_tensor = test_image_tensor.unsqueeze(0)
             test_image_tensor = test_image_tensor.to(self.device)
-            test_output = self.model(test_image_tensor)
+            with self.mixed_precision.autocast():
+                test_output = self.model( \
+                    self.mixed_precision.prepare_input(test_image_tensor))
 
             # Process the output and scale to match the input image size
-            test_output = test_output.squeeze(0).cpu().detach()
+            test_output = test_output.float().squeeze(0).cpu().detach()
             test_output = test_output.permute(1, 2, 0)
             test_output = test_output.numpy()
 
@@ -195,7 +224,7 @@ class EgoSpaceTrainer():
 
     # Loss Backward Pass
     def loss_backward(self):
-        self.loss.backward()
+        self.mixed_precision.backward(self.loss)
 
     # Get loss value
     def get_loss(self):
@@ -203,7 +232,7 @@ class EgoSpaceTrainer():
 
     # Run Optimizer
     def run_optimizer(self):
-        self.optimizer.step()
+        self.mixed_precision.step(self.optimizer)
         self.optimizer.zero_grad()
 
     # Set train mode
@@ -232,18 +261,49 @@ class EgoSpaceTrainer():
         print('Logging Validation')
         self.writer.add_scalar("IoU/val", mIoU, (log_count))
 
-    # Calculate IoU score for validation
+    # Logging Validation dataset-level IoU Score
+    def log_dataset_IoU(self, IoU, log_count):
+        self.writer.add_scalar("IoU/val_dataset", IoU, (log_count))
+
+    # Calculate IoU score for validation, the thresholding and intersection
+    # and union of the foreground class are calculated on the device
     def calc_IoU_val(self):
-        output_val = self.model(self.image_tensor)
-        output_val = output_val.squeeze(0).cpu().detach()
-        output_val = output_val.permute(1, 2, 0)
-        output_val = output_val.numpy()
-        output_val[output_val <= 0] = 0.0
-        output_val[output_val > 0] = 1.0
-        iou_score = self.IoU(output_val, self.gt)
+        with self.mixed_precision.autocast():
+            output_val = self.model( \
+                self.mixed_precision.prepare_input(self.image_tensor))
+
+        prediction_classes = get_classes_from_binary_logits(output_val)
+        gt_classes = get_classes_from_binary_gt(self.gt_tensor)
+        iou_scores = self.val_metrics.update(prediction_classes, gt_classes)
 
+        # IoU of the foreground class
+        iou_score = iou_scores[0, 2].item()
+        
         return iou_score
 
+    # Run validation on a mini-batch collated by createDataLoader,
+    # accumulating IoU metrics
+    def validate_batch(self, batch):
+        self.image_tensor = batch['image_tensor'] \
+            .to(self.device, non_blocking=True)
+        self.gt_tensor = batch['gt_tensor'] \
+            .to(self.device, non_blocking=True)
+        self.calc_IoU_val()
+
+    # Reset IoU metrics accumulated over a validation pass
+    def reset_val_metrics(self):
+        self.val_metrics.reset()
+
+    # Mean foreground IoU score over all samples
+    # validated since the last reset
+    def get_val_mIoU(self):
+        return self.val_metrics.get_mean_IoU()[2]
+
+    # Foreground IoU from the intersection and union accumulated
+    # over all pixels validated since the last reset
+    def get_val_dataset_IoU(self):
+        return self.val_metrics.get_accumulated_IoU()[2]
+    
     # IoU calculation
     def IoU(self, output, label):
         intersection = np.logical_and(label, output)
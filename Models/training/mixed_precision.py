@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+import torch
+
+# Numerical precision of the forward pass
+PRECISION_LIST = ['fp32', 'bf16', 'fp16']
+
+# Shared mixed precision (AMP) and memory format settings of the trainers.
+# The network forward pass runs under autocast in the chosen precision while
+# losses are calculated in fp32, and fp16 gradients are scaled by a GradScaler
+# so that small gradient values do not underflow
+class MixedPrecision():
+    def __init__(self, device, precision = 'fp32', channels_last = False):
+
+        if(precision not in PRECISION_LIST):
+            raise ValueError('Precision must be one of ' + ', '.join(PRECISION_LIST))
+
+        # fp16 autocast is only supported on GPU, CPU runs in bf16 instead
+        if(precision == 'fp16' and device.type == 'cpu'):
+            print('fp16 autocast is not supported on CPU, using bf16 instead')
+            precision = 'bf16'
+
+        self.device = device
+        self.precision = precision
+        self.channels_last = channels_last
+
+        self.is_autocast = (precision != 'fp32')
+        self.dtype = torch.float32
+        if(precision == 'bf16'):
+            self.dtype = torch.bfloat16
+        elif(precision == 'fp16'):
+            self.dtype = torch.float16
+
+        # Loss scaling is only required for fp16, bf16 shares the range of fp32
+        self.scaler = torch.amp.GradScaler(device.type, enabled=(precision == 'fp16'))
+
+        print(f'Using {precision} precision', \
+            'with channels_last memory format' if channels_last else '')
+
+    # Context manager for the network forward pass
+    def autocast(self):
+        return torch.autocast(device_type=self.device.type, dtype=self.dtype, \
+            enabled=self.is_autocast)
+
+    # Convert the network weights to the chosen memory format
+    def prepare_model(self, model):
+        if(self.channels_last):
+            model = model.to(memory_format=torch.channels_last)
+        return model
+
+    # Convert an NCHW image tensor to the chosen memory format
+    def prepare_input(self, image_tensor):
+        if(self.channels_last):
+            image_tensor = image_tensor.contiguous(memory_format=torch.channels_last)
+        return image_tensor
+
+    # Backward pass of the (scaled) loss, gradients are accumulated
+    # until the next optimizer step
+    def backward(self, loss):
+        self.scaler.scale(loss).backward()
+
+    # Unscale the accumulated gradients, skipping the optimizer step
+    # if they overflowed, and update the loss scale
+    def step(self, optimizer):
+        self.scaler.step(optimizer)
+        self.scaler.update()
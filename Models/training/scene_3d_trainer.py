@@ -10,10 +10,12 @@ import sys
 sys.path.append('..')
 from model_components.scene_seg_network import SceneSegNetwork
 from model_components.scene_3d_network import Scene3DNetwork
-from data_utils.augmentations import Augmentations
+from data_utils.augmentations import getAugmentations
+from training.mixed_precision import MixedPrecision
 
 class Scene3DTrainer():
-    def __init__(self,  checkpoint_path = '', pretrained_checkpoint_path = '', is_pretrained = False):
+    def __init__(self,  checkpoint_path = '', pretrained_checkpoint_path = '', is_pretrained = False, \
+            precision = 'fp32', channels_last = False):
 
         # Image and Ground Truth
         self.image = 0
@@ -35,6 +37,11 @@ class Scene3DTrainer():
         self.statistics_loss = 0
         self.edge_scale_factor = 4
 
+        # Validation losses accumulated over a validation pass
+        self.val_mAE = 0
+        self.val_mEL = 0
+        self.num_val_samples = 0
+
         # Checking devices (GPU vs CPU)
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         print(f'Using {self.device} for inference')
@@ -74,6 +81,10 @@ class Scene3DTrainer():
        
         # Model to device
         self.model = self.model.to(self.device)
+
+        # Mixed precision and memory format
+        self.mixed_precision = MixedPrecision(self.device, precision, channels_last)
+        self.model = self.mixed_precision.prepare_model(self.model)
         
         # TensorBoard
         self.writer = SummaryWriter()
@@ -97,16 +108,14 @@ class Scene3DTrainer():
         [0.25, 0, -0.25],
         [0.125, 0, -0.125]])
         self.gx_filter = self.gx_filter.view((1,1,3,3))
-        self.gx_filter = self.gx_filter.type(torch.cuda.FloatTensor)
-        self.gx_filter.to(self.device)
+        self.gx_filter = self.gx_filter.to(self.device)
         
         # Gradient - y
         self.gy_filter = torch.Tensor([[0.125, 0.25, 0.125],
         [0, 0, 0],
         [-0.125, -0.25, -0.125]])
         self.gy_filter = self.gy_filter.view((1,1,3,3))
-        self.gy_filter = self.gy_filter.type(torch.cuda.FloatTensor)
-        self.gy_filter.to(self.device)
+        self.gy_filter = self.gy_filter.to(self.device)
 
     # Learning Rate adjustment
     def set_learning_rate(self, learning_rate):
@@ -122,14 +131,14 @@ class Scene3DTrainer():
 
         if(is_train):
             # Augmenting Data for training
-            augTrain = Augmentations(is_train=True, data_type='DEPTH')
+            augTrain = getAugmentations(is_train=True, data_type='DEPTH')
             augTrain.setData(self.image, self.gt)
             self.image, self.gt = \
                 augTrain.applyTransformDepth(image=self.image,ground_truth=self.gt)
             
         else:
             # Augmenting Data for testing/validation
-            augVal = Augmentations(is_train=False, data_type='DEPTH')
+            augVal = getAugmentations(is_train=False, data_type='DEPTH')
             augVal.setData(self.image, self.gt)
             self.image, self.gt = \
                 augVal.applyTransformDepth(image=self.image,ground_truth=self.gt)
@@ -147,18 +156,40 @@ class Scene3DTrainer():
         gt_tensor = gt_tensor.type(torch.FloatTensor)
         self.gt_tensor = gt_tensor.to(self.device)
 
+    # Load training sample prepared by Scene3DDataset, tensors
+    # are copied to the device asynchronously from pinned memory
+    def load_prefetched_data(self, sample):
+        self.image = sample['image']
+        self.gt = sample['gt']
+
+        self.image_tensor = sample['image_tensor'].unsqueeze(0) \
+            .to(self.device, non_blocking=True)
+        self.gt_tensor = sample['gt_tensor'].unsqueeze(0) \
+            .to(self.device, non_blocking=True)
+
     # Run Model
     def run_model(self):     
-        self.prediction = self.model(self.image_tensor)
+        self.prediction = self.run_network(self.image_tensor)
         prediction_ssi = self.get_ssi_nom_tensor(self.prediction)
         gt_ssi = self.get_ssi_nom_tensor(self.gt_tensor)    
-        self.mAE_loss = self.calc_mAE_ssi_loss_robust(prediction_ssi, gt_ssi)
-        self.edge_loss = self.calc_multi_scale_ssi_edge_loss(prediction_ssi, gt_ssi)
+        self.mAE_loss = torch.mean(self.calc_mAE_ssi_loss_robust(prediction_ssi, gt_ssi))
+        self.edge_loss = torch.mean(self.calc_multi_scale_ssi_edge_loss(prediction_ssi, gt_ssi))
         self.loss = self.mAE_loss + self.edge_scale_factor*self.edge_loss
 
+    # Forward pass under autocast, the prediction is returned in fp32 as
+    # the scale and shift invariant losses normalise by the depth range
+    # and would lose precision in half precision formats
+    def run_network(self, image_tensor):
+        with self.mixed_precision.autocast():
+            prediction = self.model(self.mixed_precision.prepare_input(image_tensor))
+        return prediction.float()
+
+    # Scale and shift invariant normalisation of each sample in a batch
     def get_ssi_nom_tensor(self, tensor):
-        ssi_tensor = (tensor - torch.min(tensor)) \
-            /(torch.max(tensor) - torch.mean(tensor))
+        sample_dims = [1, 2, 3]
+        ssi_tensor = (tensor - torch.amin(tensor, dim=sample_dims, keepdim=True)) \
+            /(torch.amax(tensor, dim=sample_dims, keepdim=True) \
+              - torch.mean(tensor, dim=sample_dims, keepdim=True))
         return ssi_tensor
 
     def get_ssi_tensor(self, tensor):
@@ -168,11 +199,15 @@ class Scene3DTrainer():
         ssi_tensor = shifted_tensor/scale_val
         return ssi_tensor
 
+    # Robust mAE of each sample in a batch, ignoring the
+    # largest 10% of errors of the sample
     def calc_mAE_ssi_loss_robust(self, prediction_ssi, gt_ssi):
         mAE = torch.abs(prediction_ssi - gt_ssi)
-        mAE_robust_val = torch.quantile(mAE, 0.9, interpolation='linear')
-        mAE_robust = mAE[mAE < mAE_robust_val]
-        mAE_loss = torch.mean(mAE_robust)
+        mAE = mAE.reshape(mAE.shape[0], -1)
+        mAE_robust_val = torch.quantile(mAE, 0.9, dim=1, keepdim=True, \
+            interpolation='linear')
+        is_robust = mAE < mAE_robust_val
+        mAE_loss = torch.sum(mAE*is_robust, dim=1)/torch.sum(is_robust, dim=1)
         return mAE_loss    
         
     def calc_multi_scale_ssi_edge_loss(self, prediction_ssi, gt_ssi):
@@ -205,14 +240,14 @@ class Scene3DTrainer():
 
         edge_diff_mAE = torch.abs(G_x_pred - G_x_gt) + \
                             torch.abs(G_y_pred - G_y_gt)
-        edge_loss = torch.mean(edge_diff_mAE)
+        edge_loss = torch.mean(edge_diff_mAE, dim=[1, 2, 3])
 
         return edge_loss
     
 
     # Loss Backward Pass
     def loss_backward(self): 
-        self.loss.backward()
+        self.mixed_precision.backward(self.loss)
 
     # Get mAE loss value
     def get_loss(self):
@@ -253,7 +288,7 @@ class Scene3DTrainer():
          
     # Run Optimizer
     def run_optimizer(self):
-        self.optimizer.step()
+        self.mixed_precision.step(self.optimizer)
         self.optimizer.zero_grad()
 
     # Set train mode
@@ -304,19 +339,48 @@ class Scene3DTrainer():
         self.load_data()
 
         # Running model
-        self.prediction = self.model(self.image_tensor)
+        self.prediction = self.run_network(self.image_tensor)
 
         # Calculate loss
         gt_ssi = self.get_ssi_nom_tensor(self.gt_tensor)
         prediction_ssi = self.get_ssi_nom_tensor(self.prediction)
         
-        val_mAE_loss = self.calc_mAE_ssi_loss_robust(prediction_ssi, gt_ssi)
-        val_mEL_loss = self.calc_multi_scale_ssi_edge_loss(prediction_ssi, gt_ssi)
+        val_mAE_loss = torch.mean(self.calc_mAE_ssi_loss_robust(prediction_ssi, gt_ssi))
+        val_mEL_loss = torch.mean(self.calc_multi_scale_ssi_edge_loss(prediction_ssi, gt_ssi))
 
         val_mAE = val_mAE_loss.detach().cpu().numpy()
         val_mEL = val_mEL_loss.detach().cpu().numpy()
 
         return val_mAE, val_mEL
+
+    # Run validation on a mini-batch collated by createDataLoader,
+    # accumulating the mAE and edge losses of each sample
+    def validate_batch(self, batch):
+        self.image_tensor = batch['image_tensor'] \
+            .to(self.device, non_blocking=True)
+        self.gt_tensor = batch['gt_tensor'] \
+            .to(self.device, non_blocking=True)
+        self.prediction = self.run_network(self.image_tensor)
+
+        gt_ssi = self.get_ssi_nom_tensor(self.gt_tensor)
+        prediction_ssi = self.get_ssi_nom_tensor(self.prediction)
+
+        self.val_mAE += torch.sum(self.calc_mAE_ssi_loss_robust(prediction_ssi, gt_ssi))
+        self.val_mEL += torch.sum(self.calc_multi_scale_ssi_edge_loss(prediction_ssi, gt_ssi))
+        self.num_val_samples += self.image_tensor.shape[0]
+
+    # Reset losses accumulated over a validation pass
+    def reset_val_metrics(self):
+        self.val_mAE = 0
+        self.val_mEL = 0
+        self.num_val_samples = 0
+
+    # Mean mAE and edge loss over all samples validated since the last reset
+    def get_val_losses(self):
+        num_val_samples = max(self.num_val_samples, 1)
+        avg_mAE = float(self.val_mAE)/num_val_samples
+        avg_mEL = float(self.val_mEL)/num_val_samples
+        return avg_mAE, avg_mEL
     
     # Run network on test image and visualize result
     def test(self, image_test, save_path):
@@ -329,7 +393,7 @@ class Scene3DTrainer():
         test_image_tensor = self.image_loader(image_pil)
         test_image_tensor = test_image_tensor.unsqueeze(0)
         test_image_tensor = test_image_tensor.to(self.device)
-        test_output = self.model(test_image_tensor)
+        test_output = self.run_network(test_image_tensor)
 
         test_output = test_output.squeeze(0).cpu().detach()
         test_output = test_output.permute(1, 2, 0)
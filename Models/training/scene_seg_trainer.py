@@ -1,7 +1,7 @@
 
 import torch
 from torchvision import transforms
-from torch import nn, optim
+from torch import optim
 from torch.utils.tensorboard import SummaryWriter
 import matplotlib.pyplot as plt
 import numpy as np
@@ -9,10 +9,13 @@ from PIL import Image
 import sys
 sys.path.append('..')
 from model_components.scene_seg_network import SceneSegNetwork
-from data_utils.augmentations import Augmentations
+from data_utils.augmentations import getAugmentations
+from training.mixed_precision import MixedPrecision
+from training.segmentation_metrics import SegmentationMetrics, \
+    get_classes_from_logits, get_classes_from_fused_gt
 
 class SceneSegTrainer():
-    def __init__(self, checkpoint_path = '', size=''):
+    def __init__(self, checkpoint_path = '', size='', precision = 'fp32', channels_last = False):
 
         self.image = 0
         self.image_val = 0
@@ -28,6 +31,7 @@ class SceneSegTrainer():
         self.gt_tensor = 0
         self.gt_val_tensor = 0
         self.class_weights_tensor = 0
+        self.batch_size = 1
         self.loss = 0
         self.prediction = 0
         self.calc_loss = 0
@@ -46,6 +50,13 @@ class SceneSegTrainer():
                 (self.checkpoint_path, weights_only=True))
         self.model = self.model.to(self.device)
 
+        # Mixed precision and memory format
+        self.mixed_precision = MixedPrecision(self.device, precision, channels_last)
+        self.model = self.mixed_precision.prepare_model(self.model)
+
+        # Validation metrics - background, foreground and road classes
+        self.val_metrics = SegmentationMetrics(num_classes=3, device=self.device)
+
         # TensorBoard
         self.writer = SummaryWriter()
 
@@ -80,6 +91,16 @@ class SceneSegTrainer():
         }, (log_count))
         
         self.writer.add_scalar("Val/IoU", mIoU_full, (log_count))
+
+    # Logging Validation dataset-level IoU Score
+    def log_dataset_IoU(self, IoU_full, IoU_bg, IoU_fg, IoU_rd, log_count):
+        self.writer.add_scalars("Val/Dataset_IoU_Classes",{
+            'IoU_bg': IoU_bg,
+            'IoU_fg': IoU_fg,
+            'IoU_rd': IoU_rd
+        }, (log_count))
+
+        self.writer.add_scalar("Val/Dataset_IoU", IoU_full, (log_count))
         
     # Assign input variables
     def set_data(self, image, gt, class_weights):
@@ -96,7 +117,7 @@ class SceneSegTrainer():
 
         if(is_train):
             # Augmenting Data for training
-            augTrain = Augmentations(is_train=True, data_type='SEGMENTATION')
+            augTrain = getAugmentations(is_train=True, data_type='SEGMENTATION')
             augTrain.setData(self.image, self.gt)
             self.image, self.augmented,  = \
                 augTrain.applyTransformSeg(image=self.image, ground_truth=self.gt)
@@ -106,7 +127,7 @@ class SceneSegTrainer():
                         self.augmented[3]), axis=2)
         else:
             # Augmenting Data for testing/validation
-            augVal = Augmentations(is_train=False, data_type='SEGMENTATION')
+            augVal = getAugmentations(is_train=False, data_type='SEGMENTATION')
             augVal.setData(self.image_val, self.gt_val)
             self.image_val, self.augmented_val = \
                 augVal.applyTransformSeg(image=self.image_val, ground_truth=self.gt_val)
@@ -124,15 +145,62 @@ class SceneSegTrainer():
             self.class_weights_tensor = \
             torch.tensor(self.class_weights).to(self.device)
 
+    # Load training sample prepared by SceneSegDataset, tensors
+    # are copied to the device asynchronously from pinned memory
+    def load_prefetched_data(self, sample):
+        self.image = sample['image']
+        self.augmented = sample['augmented']
+        self.gt_fused = sample['gt_fused']
+        self.class_weights = sample['class_weights']
+
+        self.image_tensor = sample['image_tensor'].unsqueeze(0) \
+            .to(self.device, non_blocking=True)
+        self.gt_tensor = sample['gt_tensor'].unsqueeze(0) \
+            .to(self.device, non_blocking=True)
+        self.class_weights_tensor = sample['class_weights_tensor'] \
+            .to(self.device, non_blocking=True)
+
+    # Load mini-batch collated by createDataLoader, the first sample
+    # of the batch is kept for visualization
+    def load_prefetched_batch(self, batch):
+        self.image = batch['image'][0]
+        self.augmented = batch['augmented'][0]
+        self.gt_fused = batch['gt_fused'][0]
+        self.class_weights = batch['class_weights'][0]
+        self.batch_size = len(batch['image'])
+
+        self.image_tensor = batch['image_tensor'] \
+            .to(self.device, non_blocking=True)
+        self.gt_tensor = batch['gt_tensor'] \
+            .to(self.device, non_blocking=True)
+        self.class_weights_tensor = batch['class_weights_tensor'] \
+            .to(self.device, non_blocking=True)
+
     # Run Model
-    def run_model(self):     
-        self.loss = nn.CrossEntropyLoss(weight=self.class_weights_tensor)
-        self.prediction = self.model(self.image_tensor)
-        self.calc_loss = self.loss(self.prediction, self.gt_tensor)
+    def run_model(self):
+        with self.mixed_precision.autocast():
+            self.prediction = self.model( \
+                self.mixed_precision.prepare_input(self.image_tensor))
+
+        # Loss is calculated in fp32
+        self.prediction = self.prediction.float()
+        self.calc_loss = self.calc_weighted_loss(self.prediction, \
+            self.gt_tensor, self.class_weights_tensor)
+
+    # Cross entropy loss with probability targets, weighted by the class
+    # weights of each sample and averaged over all pixels of the batch -
+    # equal to nn.CrossEntropyLoss(weight=class_weights) for a single sample
+    def calc_weighted_loss(self, prediction, gt_tensor, class_weights_tensor):
+        num_classes = prediction.shape[1]
+        class_weights_tensor = class_weights_tensor.to(prediction.dtype) \
+            .reshape(-1, num_classes, 1, 1)
+        log_prob = torch.log_softmax(prediction, dim=1)
+        pixel_loss = -torch.sum(class_weights_tensor*gt_tensor*log_prob, dim=1)
+        return torch.mean(pixel_loss)
 
     # Loss Backward Pass
     def loss_backward(self): 
-        self.calc_loss.backward()
+        self.mixed_precision.backward(self.calc_loss)
 
     # Get loss value
     def get_loss(self):
@@ -140,7 +208,7 @@ class SceneSegTrainer():
 
     # Run Optimizer
     def run_optimizer(self):
-        self.optimizer.step()
+        self.mixed_precision.step(self.optimizer)
         self.optimizer.zero_grad()
 
     # Set train mode
@@ -154,7 +222,7 @@ class SceneSegTrainer():
     # Save predicted visualization
     def save_visualization(self, log_count):
         print('Saving Visualization')
-        self.prediction_vis = self.prediction.squeeze(0).cpu().detach()
+        self.prediction_vis = self.prediction[0].cpu().detach()
         self.prediction_vis = self.prediction_vis.permute(1, 2, 0)
                 
         vis_predict = self.make_visualization()
@@ -202,40 +270,47 @@ class SceneSegTrainer():
         print('Saving model')
         torch.save(self.model.state_dict(), model_save_path)
     
-    # Calculate IoU score for validation
+    # Calculate IoU score for validation, the argmax and per-class
+    # intersection and union are calculated on the device
     def calc_IoU_val(self):
-        output_val = self.model(self.image_val_tensor)
-        output_val = output_val.squeeze(0).cpu().detach()
-        output_val = output_val.permute(1, 2, 0)
-        output_val = output_val.numpy()
+        with self.mixed_precision.autocast():
+            output_val = self.model( \
+                self.mixed_precision.prepare_input(self.image_val_tensor))
 
-        for x in range(0, output_val.shape[0]):
-            for y in range(0, output_val.shape[1]):
-                
-                bg_prob = output_val[x,y,0]
-                fg_prob = output_val[x,y,1]
-                rd_prob = output_val[x,y,2]
-
-                if(bg_prob >= fg_prob and bg_prob >= rd_prob):
-                    output_val[x,y,0] = 1
-                    output_val[x,y,1] = 0
-                    output_val[x,y,2] = 0
-                elif(fg_prob >= bg_prob and fg_prob >= rd_prob):
-                    output_val[x,y,0] = 0
-                    output_val[x,y,1] = 1
-                    output_val[x,y,2] = 0
-                elif(rd_prob >= bg_prob and rd_prob >= fg_prob):
-                    output_val[x,y,0] = 0
-                    output_val[x,y,1] = 0
-                    output_val[x,y,2] = 1
-       
-        iou_score_full = self.IoU(output_val, self.gt_val_fused)
-        iou_score_bg = self.IoU(output_val[:,:,0], self.gt_val_fused[:,:,0])
-        iou_score_fg = self.IoU(output_val[:,:,1], self.gt_val_fused[:,:,1])
-        iou_score_rd = self.IoU(output_val[:,:,2], self.gt_val_fused[:,:,2])
+        prediction_classes = get_classes_from_logits(output_val)
+        gt_classes = get_classes_from_fused_gt(self.gt_val_tensor)
+        iou_scores = self.val_metrics.update(prediction_classes, gt_classes)
+
+        iou_score_full, iou_score_bg, iou_score_fg, iou_score_rd = \
+            iou_scores[0].tolist()
 
         return iou_score_full, iou_score_bg, iou_score_fg, iou_score_rd
 
+    # Run validation on a mini-batch collated by createDataLoader,
+    # accumulating IoU metrics
+    def validate_batch(self, batch):
+        self.image_val_tensor = batch['image_tensor'] \
+            .to(self.device, non_blocking=True)
+        self.gt_val_tensor = batch['gt_tensor'] \
+            .to(self.device, non_blocking=True)
+        self.calc_IoU_val()
+
+    # Reset IoU metrics accumulated over a validation pass
+    def reset_val_metrics(self):
+        self.val_metrics.reset()
+
+    # Mean IoU scores - full, background, foreground, road - over
+    # all samples validated since the last reset
+    def get_val_mIoU(self):
+        mIoU_full, mIoU_bg, mIoU_fg, mIoU_rd = self.val_metrics.get_mean_IoU()
+        return mIoU_full, mIoU_bg, mIoU_fg, mIoU_rd
+
+    # IoU scores - full, background, foreground, road - from the intersection
+    # and union accumulated over all pixels validated since the last reset
+    def get_val_dataset_IoU(self):
+        IoU_full, IoU_bg, IoU_fg, IoU_rd = self.val_metrics.get_accumulated_IoU()
+        return IoU_full, IoU_bg, IoU_fg, IoU_rd
+
     # IoU calculation
     def IoU(self, output, label):
         intersection = np.logical_and(label, output)
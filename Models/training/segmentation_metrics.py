@@ -0,0 +1,125 @@
+#! /usr/bin/env python3
+import torch
+
+# Convert multi-class network output logits (N, C, H, W) to class ids (N, H, W),
+# ties are resolved in favour of the lower class id
+def get_classes_from_logits(prediction):
+    return torch.argmax(prediction, dim=1)
+
+# Convert binary network output logits (N, 1, H, W) to class ids (N, H, W)
+# of background (0) and foreground (1)
+def get_classes_from_binary_logits(prediction):
+    return (prediction[:, 0] > 0).long()
+
+# Convert ground truth with one channel per class (N, C, H, W) to class ids
+# (N, H, W) - pixels which do not belong to any class are assigned id C
+def get_classes_from_fused_gt(gt_tensor):
+    num_classes = gt_tensor.shape[1]
+    gt_classes = torch.argmax(gt_tensor, dim=1)
+    is_unlabelled = torch.amax(gt_tensor, dim=1) <= 0
+    gt_classes[is_unlabelled] = num_classes
+    return gt_classes
+
+# Convert binary ground truth (N, 1, H, W) to class ids (N, H, W)
+# of background (0) and foreground (1)
+def get_classes_from_binary_gt(gt_tensor):
+    return (gt_tensor[:, 0] > 0).long()
+
+# Confusion matrix based IoU metrics, calculated on the device of the network
+# output. Each update adds a batch of samples to the per-class intersection
+# and union accumulated over the whole validation pass, as well as to the
+# running sum of per-sample IoU scores which are averaged over the validation set
+class SegmentationMetrics():
+    def __init__(self, num_classes, device):
+
+        self.num_classes = num_classes
+        self.device = device
+
+        self.intersection = 0
+        self.union = 0
+        self.running_IoU = 0
+        self.num_samples = 0
+        self.reset()
+
+    # Clear all accumulated values at the start of a validation pass
+    def reset(self):
+
+        # Per-class intersection and union summed over all pixels
+        self.intersection = torch.zeros(self.num_classes, \
+            dtype=torch.int64, device=self.device)
+        self.union = torch.zeros(self.num_classes, \
+            dtype=torch.int64, device=self.device)
+
+        # Sum of per-sample IoU over all classes followed by each class
+        self.running_IoU = torch.zeros(self.num_classes + 1, \
+            dtype=torch.float64, device=self.device)
+
+        self.num_samples = 0
+
+    # Confusion matrix (N, C+1, C) of each sample, counted with a single bincount -
+    # rows are ground truth classes, with an additional row for pixels without a
+    # ground truth class, columns are predicted classes
+    def calc_confusion_matrices(self, prediction_classes, gt_classes):
+        batch_size = prediction_classes.shape[0]
+        num_cells = (self.num_classes + 1)*self.num_classes
+
+        sample_offset = torch.arange(batch_size, device=prediction_classes.device) \
+            .reshape(batch_size, 1)*num_cells
+        index = gt_classes.reshape(batch_size, -1)*self.num_classes \
+            + prediction_classes.reshape(batch_size, -1) + sample_offset
+
+        confusion_matrices = torch.bincount(index.flatten(), \
+            minlength=batch_size*num_cells)
+        return confusion_matrices.reshape(batch_size, self.num_classes + 1, self.num_classes)
+
+    # Intersection and union of each class from confusion matrices (..., C+1, C)
+    def calc_intersection_union(self, confusion_matrices):
+        intersection = torch.diagonal(confusion_matrices[..., 0:self.num_classes, :], \
+            dim1=-2, dim2=-1)
+        gt_count = torch.sum(confusion_matrices[..., 0:self.num_classes, :], dim=-1)
+        prediction_count = torch.sum(confusion_matrices, dim=-2)
+        union = gt_count + prediction_count - intersection
+        return intersection, union
+
+    # Per-sample IoU (N, C+1) over all classes followed by each class, smoothed
+    # by one so that a class absent from both prediction and label scores 1
+    def calc_IoU_scores(self, confusion_matrices):
+        intersection, union = self.calc_intersection_union(confusion_matrices)
+        intersection = intersection.double()
+        union = union.double()
+
+        iou_score_full = (torch.sum(intersection, dim=-1) + 1) \
+            / (torch.sum(union, dim=-1) + 1)
+        iou_score_classes = (intersection + 1)/(union + 1)
+
+        return torch.cat((iou_score_full.unsqueeze(-1), iou_score_classes), dim=-1)
+
+    # Add a batch of predicted and ground truth class ids (N, H, W),
+    # returning the per-sample IoU scores of the batch
+    def update(self, prediction_classes, gt_classes):
+        confusion_matrices = self.calc_confusion_matrices(prediction_classes, gt_classes)
+        iou_scores = self.calc_IoU_scores(confusion_matrices)
+
+        intersection, union = self.calc_intersection_union( \
+            torch.sum(confusion_matrices, dim=0))
+        self.intersection += intersection
+        self.union += union
+        self.running_IoU += torch.sum(iou_scores, dim=0)
+        self.num_samples += prediction_classes.shape[0]
+
+        return iou_scores
+
+    # Mean of the per-sample IoU scores over all classes followed by each class
+    def get_mean_IoU(self):
+        return (self.running_IoU/max(self.num_samples, 1)).tolist()
+
+    # Dataset-level IoU over all classes followed by each class, from the
+    # intersection and union accumulated over all pixels of the validation pass
+    def get_accumulated_IoU(self):
+        intersection = self.intersection.double()
+        union = self.union.double()
+
+        iou_score_full = torch.sum(intersection)/torch.clamp(torch.sum(union), min=1)
+        iou_score_classes = intersection/torch.clamp(union, min=1)
+
+        return [iou_score_full.item()] + iou_score_classes.tolist()
@@ -4,14 +4,16 @@
 import os
 import random
 import torch
-from PIL import Image
 from typing import Literal, get_args
 import sys
 sys.path.append('../..')
 from Models.data_utils.load_data_auto_steer import LoadDataAutoSteer, VALID_DATASET_LIST
+from Models.data_utils.data_pipeline import AutoSteerDataset, getRoundRobinSchedule, createDataLoader, \
+    getImageSize, loadAutoSteerVisualization
 from Models.training.auto_steer_trainer import AutoSteerTrainer
 
 BEV_JSON_PATH = "drivable_path_bev.json"
+BEV_JSONL_PATH = "drivable_path_bev.jsonl"
 BEV_IMG_PATH = "image_bev"
 BEV_VIS_PATH = "visualization_bev"
 PERSPECTIVE_IMG_PATH = "image"
@@ -39,8 +41,12 @@ def main():
     # Init metadata for datasets
     msdict = {}
     for dataset in VALID_DATASET_LIST:
+        # BEV labels are either JSON, or JSON-lines if streamed by the BEV parsers
+        path_labels = os.path.join(ROOT_PATH, dataset, BEV_JSON_PATH)
+        if (not os.path.exists(path_labels)):
+            path_labels = os.path.join(ROOT_PATH, dataset, BEV_JSONL_PATH)
         msdict[dataset] = {
-            "path_labels"   : os.path.join(ROOT_PATH, dataset, BEV_JSON_PATH),
+            "path_labels"   : path_labels,
             "path_images"   : os.path.join(ROOT_PATH, dataset, BEV_IMG_PATH),
             "path_perspective_vis" : os.path.join(ROOT_PATH, dataset, PERSPECTIVE_VIS_PATH),
             "path_perspective_image": os.path.join(ROOT_PATH, dataset, PERSPECTIVE_IMG_PATH),
@@ -94,10 +100,16 @@ def main():
     trainer = None
 
     CHECKPOINT_PATH = None #args.checkpoint_path
+
+    # Mixed precision - one of fp32, bf16, fp16 - and memory format
+    PRECISION = "fp32" #args.precision
+    CHANNELS_LAST = False #args.channels_last
+
     if (CHECKPOINT_PATH != None):
-        trainer = AutoSteerTrainer(checkpoint_path = CHECKPOINT_PATH)    
+        trainer = AutoSteerTrainer(checkpoint_path = CHECKPOINT_PATH, \
+            precision = PRECISION, channels_last = CHANNELS_LAST)    
     else:
-        trainer = AutoSteerTrainer()
+        trainer = AutoSteerTrainer(precision = PRECISION, channels_last = CHANNELS_LAST)
     
     # Zero gradients
     trainer.zero_grad()
@@ -111,6 +123,33 @@ def main():
     # Val visualization param
     N_VALVIS = 25
 
+    # Number of worker processes preparing training samples
+    NUM_WORKERS = 4
+
+    # Data loading helper classes and image directories of each dataset
+    datasets = {
+        dataset: msdict[dataset]["loader"]
+        for dataset in VALID_DATASET_LIST
+    }
+    perspective_image_dirpaths = {
+        dataset: msdict[dataset]["path_perspective_image"]
+        for dataset in VALID_DATASET_LIST
+    }
+    bev_vis_dirpaths = {
+        dataset: msdict[dataset]["path_bev_vis"]
+        for dataset in VALID_DATASET_LIST
+    }
+
+    # An epoch ends once all but the last sample of every dataset have been used
+    num_train_samples = {
+        dataset: msdict[dataset]["N_trains"] - 1
+        for dataset in VALID_DATASET_LIST
+    }
+    sample_lists = {
+        dataset: msdict[dataset]["sample_list"]
+        for dataset in VALID_DATASET_LIST
+    }
+
     
     # ========================= Main training loop ========================= #
     print('Beginning Training')
@@ -146,94 +185,30 @@ def main():
 
         # Shuffle overall data list at start of epoch
         random.shuffle(data_list)
-        msdict["data_list_count"] = 0
-        
-        # Reset all data counters
-        msdict["sample_counter"] = 0
-        for dataset in VALID_DATASET_LIST:
-            msdict[dataset]["iter"] = 0
-            msdict[dataset]["completed"] = False
+
+        # Read images and apply augmentations in worker processes
+        train_data = AutoSteerDataset(
+            datasets,
+            is_train = True,
+            apply_augmentations = apply_augmentation,
+            perspective_image_dirpaths = perspective_image_dirpaths,
+            bev_vis_dirpaths = bev_vis_dirpaths
+        )
+        train_schedule = getRoundRobinSchedule(data_list, num_train_samples, sample_lists)
+        train_loader = createDataLoader(train_data, train_schedule, NUM_WORKERS)
 
         # Loop through data
-        while (True):
+        for count, sample in enumerate(train_loader):
 
             # Log count
-            msdict["sample_counter"] = msdict["sample_counter"] + 1
+            msdict["sample_counter"] = count + 1
             msdict["log_counter"] = (
                 msdict["sample_counter"] + \
                 msdict["Nsum_trains"] * epoch
             )
 
-            # Reset iterators and shuffle individual datasets
-            # based on data sampling scheme
-            for dataset in VALID_DATASET_LIST:
-                N_trains = msdict[dataset]["N_trains"]
-                if (msdict[dataset]["iter"] == N_trains-1):
-                    if ((msdict[dataset]["completed"] == False)):
-                        data_list.remove(dataset)
-                    msdict[dataset]["completed"] = True
-            
-            # If we have looped through each dataset at least once - restart the epoch
-            if (all([
-                msdict[dataset]["completed"]
-                for dataset in VALID_DATASET_LIST
-            ])):
-                break
-
-            # Reset the data list count if out of range
-            if (msdict["data_list_count"] >= len(data_list)):
-                msdict["data_list_count"] = 0
-
-            # Fetch data from current processed dataset
-            frame_id = 0
-            bev_image = None
-            homotrans_mat = []
-            bev_egopath = []
-            reproj_egopath = []
-            bev_egoleft = []
-            reproj_egoleft = []
-            bev_egoright = []
-            reproj_egoright = []
-           
-            current_dataset = data_list[msdict["data_list_count"]]
-            current_dataset_iter = msdict[current_dataset]["iter"]
-            [   frame_id, bev_image,
-                homotrans_mat,
-                bev_egopath, reproj_egopath,
-                bev_egoleft, reproj_egoleft,
-                bev_egoright, reproj_egoright,
-            ] = msdict[current_dataset]["loader"].getItem(
-                msdict[current_dataset]["sample_list"][current_dataset_iter],
-                is_train = True
-            )
-            msdict[current_dataset]["iter"] = current_dataset_iter + 1
-
-            # Perspective image
-            perspective_image = Image.open(
-                os.path.join(
-                    msdict[current_dataset]["path_perspective_image"],
-                    f"{frame_id}.png"
-                )
-            ).convert("RGB")
-            
-            # BEV visualization
-            bev_vis = Image.open(
-                os.path.join(
-                    msdict[current_dataset]["path_bev_vis"],
-                    f"{frame_id}.jpg"
-                )
-            ).convert("RGB")
-          
-            # Assign data
-            trainer.set_data(homotrans_mat, bev_image, perspective_image, \
-                bev_egopath, bev_egoleft, bev_egoright, reproj_egopath, \
-                reproj_egoleft, reproj_egoright)
-            
-            # Augment image
-            trainer.apply_augmentations(apply_augmentation)
-            
-            # Converting to tensor and loading
-            trainer.load_data()
+            # Assign prepared data and load to device
+            trainer.load_prefetched_data(sample)
             
             # Run model and calculate loss
             trainer.run_model()
@@ -251,6 +226,13 @@ def main():
             
             # Logging Visualization to Tensor Board
             if((msdict["sample_counter"] + 1) % LOGSTEP_VIS == 0):  
+
+                # Perspective image and BEV visualization are only read here
+                perspective_image, bev_vis = loadAutoSteerVisualization(
+                    sample["perspective_image_path"],
+                    sample["bev_vis_path"]
+                )
+                trainer.set_perspective_image(perspective_image)
                 trainer.save_visualization(msdict["log_counter"] + 1, bev_vis, is_train=True)
             
             # Save model and run Validation on entire validation dataset
@@ -296,24 +278,18 @@ def main():
                             )
                             msdict[dataset]["num_val_samples"] = msdict[dataset]["num_val_samples"] + 1
                             
-                            # BEV
-                            perspective_image = Image.open(
-                                os.path.join(
-                                    msdict[dataset]["path_perspective_image"],
-                                    f"{frame_id}.png"
-                                )
-                            ).convert("RGB")
-
-                            # BEV visualization
-                            bev_vis = Image.open(
-                                os.path.join(
-                                    msdict[dataset]["path_bev_vis"],
-                                    f"{frame_id}.jpg"
-                                )
-                            ).convert("RGB")
+                            # Perspective image and BEV visualization
+                            perspective_image_path = os.path.join(
+                                msdict[dataset]["path_perspective_image"],
+                                f"{frame_id}.png"
+                            )
+                            bev_vis_path = os.path.join(
+                                msdict[dataset]["path_bev_vis"],
+                                f"{frame_id}.jpg"
+                            )
 
-                            # Assign data
-                            trainer.set_data(homotrans_mat, bev_image, perspective_image, \
+                            # Assign data, only the size of the perspective image is read
+                            trainer.set_data(homotrans_mat, bev_image, getImageSize(perspective_image_path), \
                                 bev_egopath, bev_egoleft, bev_egoright, reproj_egopath, \
                                 reproj_egoleft, reproj_egoright)
                             
@@ -331,6 +307,11 @@ def main():
 
                             # Save visualization to Tensorboard
                             if(val_count < N_VALVIS): 
+                                perspective_image, bev_vis = loadAutoSteerVisualization(
+                                    perspective_image_path,
+                                    bev_vis_path
+                                )
+                                trainer.set_perspective_image(perspective_image)
                                 vis_path = VIS_SAVE_ROOT_PATH + dataset + '_epoch_'+ str(epoch) + '_step_' + \
                                     str(msdict["log_counter"] + 1) + '_image_' + str(frame_id)
                                 trainer.save_visualization(msdict["log_counter"] + 1 + val_count, bev_vis, vis_path, is_train=False)
@@ -362,8 +343,6 @@ def main():
                 print("================ Continuing with training ================")
                 trainer.set_train_mode()
             
-            msdict["data_list_count"] = msdict["data_list_count"] + 1
-            
 
 if (__name__ == "__main__"):
     main()
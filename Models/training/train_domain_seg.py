@@ -1,12 +1,13 @@
 #%%
 # Comment above is for Jupyter execution in VSCode
 #! /usr/bin/env python3
-import torch
 import random
 from argparse import ArgumentParser
 import sys
 sys.path.append('..')
 from data_utils.load_data_domain_seg import LoadDataDomainSeg
+from data_utils.data_pipeline import DomainSegDataset, getRoundRobinSchedule, createDataLoader
+from training.validation_runner import ValidationRunner
 from training.domain_seg_trainer import DomainSegTrainer
 
 
@@ -19,6 +20,10 @@ def main():
     parser.add_argument('-t', "--test_images_save_path", dest="test_images_save_path", help="path to where visualizations from inference on test images are saved")
     parser.add_argument("-r", "--root", dest="root", help="root path to folder where data training data is stored")
     parser.add_argument('-l', "--load_from_save", action='store_true', help="flag for whether model is being loaded from a Scene3D checkpoint file")
+    parser.add_argument("-w", "--num_workers", dest="num_workers", type=int, default=4, help="number of worker processes preparing training samples")
+    parser.add_argument("-v", "--val_batch_size", dest="val_batch_size", type=int, default=8, help="number of validation samples run through the network together")
+    parser.add_argument("-p", "--precision", dest="precision", default="fp32", choices=["fp32", "bf16", "fp16"], help="numerical precision of the network forward pass, bf16 and fp16 use mixed precision (AMP) autocast")
+    parser.add_argument("--channels_last", action='store_true', help="flag for whether the network and input images use the channels_last memory format")
     args = parser.parse_args()
 
     # Root path
@@ -58,12 +63,23 @@ def main():
     checkpoint_path = args.pretrained_checkpoint_path
     
 
+    # Training data prepared in worker processes
+    num_workers = args.num_workers
+
+    # Validation data prepared in worker processes and run in mini-batches
+    val_data = DomainSegDataset({'ROADWORK': roadwork_Dataset}, is_train=False, \
+        apply_augmentations=False)
+    val_runner = ValidationRunner(val_data, ['ROADWORK'], \
+        {'ROADWORK': roadwork_num_val_samples}, args.val_batch_size, num_workers)
+
     # Trainer Class
     trainer = 0
     if(load_from_checkpoint == False):
-        trainer = DomainSegTrainer(pretrained_checkpoint_path=pretrained_checkpoint_path)
+        trainer = DomainSegTrainer(pretrained_checkpoint_path=pretrained_checkpoint_path, \
+            precision=args.precision, channels_last=args.channels_last)
     else:
-        trainer = DomainSegTrainer(checkpoint_path=checkpoint_path, is_pretrained=True)
+        trainer = DomainSegTrainer(checkpoint_path=checkpoint_path, is_pretrained=True, \
+            precision=args.precision, channels_last=args.channels_last)
 
     trainer.zero_grad()
     
@@ -109,28 +125,21 @@ def main():
         if(epoch >= 25):
             apply_augmentations = False
 
+        # Read images and apply augmentations in worker processes
+        train_data = DomainSegDataset({'ROADWORK': roadwork_Dataset}, is_train=True, \
+            apply_augmentations=apply_augmentations)
+        train_schedule = getRoundRobinSchedule(['ROADWORK'], \
+            {'ROADWORK': total_train_samples}, {'ROADWORK': randomlist_train_data})
+        train_loader = createDataLoader(train_data, train_schedule, num_workers)
+
         # Loop through data
-        for count in range(0, total_train_samples):
+        for count, sample in enumerate(train_loader):
 
             # Log counter
             log_count = count + total_train_samples*epoch
 
-    
-            # Read images, apply augmentation, run prediction, calculate
-            # loss for iterated image from each dataset, and increment
-            # dataset iterators
-
-            # Get data
-            image, gt = roadwork_Dataset.getItemTrain(randomlist_train_data[count])
-            
-            # Assign Data
-            trainer.set_data(image, gt)
-            
-            # Augmenting Image
-            trainer.apply_augmentations(apply_augmentations)
-
-            # Converting to tensor and loading
-            trainer.load_data()
+            # Assign prepared data and load to device
+            trainer.load_prefetched_data(sample)
 
             # Run model and calculate loss
             trainer.run_model()
@@ -171,28 +180,21 @@ def main():
         # Setting model to evaluation mode
         trainer.set_eval_mode()
 
-        # Overall IoU
-        running_IoU = 0
-
-        # No gradient calculation
-        with torch.no_grad():
+        # Run validation on all validation samples, IoU
+        # metrics are accumulated over the validation pass
+        val_runner.run(trainer)
 
-            # ROADWork
-            for val_count in range(0, roadwork_num_val_samples):
-                image_val, gt_val = roadwork_Dataset.getItemVal(val_count)
-
-                # Run Validation and calculate IoU Score
-                IoU_score = trainer.validate(image_val, gt_val)
+        # Calculating average loss of complete validation set
+        mIoU = trainer.get_val_mIoU()
+        print('mIoU: ', mIoU)
+        
+        # Logging average validation loss to TensorBoard
+        trainer.log_IoU(mIoU, log_count)
 
-                # Accumulate individual IoU scores for validation samples
-                running_IoU += IoU_score
-            
-            # Calculating average loss of complete validation set
-            mIoU = running_IoU/total_val_samples
-            print('mIoU: ', mIoU)
-          
-            # Logging average validation loss to TensorBoard
-            trainer.log_IoU(mIoU, log_count)
+        # Dataset-level IoU from the intersection and union of the whole validation set
+        dataset_IoU = trainer.get_val_dataset_IoU()
+        print('Dataset IoU: ', dataset_IoU)
+        trainer.log_dataset_IoU(dataset_IoU, log_count)
 
         # Resetting model back to training
         trainer.set_train_mode()
@@ -1,13 +1,14 @@
 #%%
 # Comment above is for Jupyter execution in VSCode
 #! /usr/bin/env python3
-import torch
 import random
 from argparse import ArgumentParser
 import sys
 sys.path.append('..')
-from data_utils.load_ego_space import LoadDataEgoSpace
+from data_utils.load_data_ego_space import LoadDataEgoSpace
+from data_utils.data_pipeline import EgoSpaceDataset, getRoundRobinSchedule, createDataLoader
 from training.ego_space_trainer import EgoSpaceTrainer
+from training.validation_runner import ValidationRunner
 
 
 def main():
@@ -18,6 +19,10 @@ def main():
     parser.add_argument('-t', "--test_images_save_path", dest="test_images_save_path", help="path to where visualizations from inference on test images are saved")
     parser.add_argument("-r", "--root", dest="root", help="root path to folder where training data is stored")
     parser.add_argument('-l', "--load_from_save", action='store_true', help="flag for whether model is being loaded from a Scene3D checkpoint file")
+    parser.add_argument("-w", "--num_workers", dest="num_workers", type=int, default=4, help="number of worker processes preparing training samples")
+    parser.add_argument("-v", "--val_batch_size", dest="val_batch_size", type=int, default=8, help="number of validation samples run through the network together")
+    parser.add_argument("-p", "--precision", dest="precision", default="fp32", choices=["fp32", "bf16", "fp16"], help="numerical precision of the network forward pass, bf16 and fp16 use mixed precision (AMP) autocast")
+    parser.add_argument("--channels_last", action='store_true', help="flag for whether the network and input images use the channels_last memory format")
     args = parser.parse_args()
 
     # Root path
@@ -72,12 +77,42 @@ def main():
     pretrained_checkpoint_path = args.pretrained_checkpoint_path
     checkpoint_path = args.pretrained_checkpoint_path
 
+    # Training data prepared in worker processes
+    num_workers = args.num_workers
+
+    datasets = {
+        'ZENSEACT': zenseact_dataset,
+        'MAPILLARY': mapillary_dataset,
+        'COMMA10K': comma10k_dataset
+    }
+
+    num_train_samples = {
+        'ZENSEACT': zenseact_num_train_samples,
+        'MAPILLARY': mapillary_num_train_samples,
+        'COMMA10K': comma10k_num_train_samples
+    }
+
+    train_data = EgoSpaceDataset(datasets, is_train=True, apply_augmentations=False)
+
+    # Validation data prepared in worker processes and run in mini-batches
+    num_val_samples = {
+        'ZENSEACT': zenseact_num_val_samples,
+        'MAPILLARY': mapillary_num_val_samples,
+        'COMMA10K': comma10k_num_val_samples
+    }
+
+    val_data = EgoSpaceDataset(datasets, is_train=False, apply_augmentations=False)
+    val_runner = ValidationRunner(val_data, list(num_val_samples.keys()), \
+        num_val_samples, args.val_batch_size, num_workers)
+
     # Trainer Class
     trainer = 0
     if(load_from_checkpoint == False):
-        trainer = EgoSpaceTrainer(pretrained_checkpoint_path=pretrained_checkpoint_path)
+        trainer = EgoSpaceTrainer(pretrained_checkpoint_path=pretrained_checkpoint_path, \
+            precision=args.precision, channels_last=args.channels_last)
     else:
-        trainer = EgoSpaceTrainer(checkpoint_path=checkpoint_path, is_pretrained=True)
+        trainer = EgoSpaceTrainer(checkpoint_path=checkpoint_path, is_pretrained=True, \
+            precision=args.precision, channels_last=args.channels_last)
 
     trainer.zero_grad()
 
@@ -91,21 +126,11 @@ def main():
         # Printing epochs
         print('Epoch: ', epoch + 1)
 
-        # Iterators for datasets
-        zenseact_count = 0
-        comma10k_count = 0
-        mapillary_count = 0
-
-        is_zenseact_complete = False
-        is_mapillary_complete = False
-        is_comma10k_complete = False
-
         data_list = []
         data_list.append('ZENSEACT')
         data_list.append('MAPILLARY')
         data_list.append('COMMA10K')
         random.shuffle(data_list)
-        data_list_count = 0
 
         # Batch size schedule
         if(epoch == 1):
@@ -120,58 +145,20 @@ def main():
         if(epoch >= 4):
             batch_size = 3
 
+        # Read images and apply augmentations in worker processes, taking
+        # one sample from each dataset in turn
+        train_schedule = getRoundRobinSchedule(data_list, num_train_samples, \
+            num_steps=total_train_samples)
+        train_loader = createDataLoader(train_data, train_schedule, num_workers)
+
         # Loop through data
-        for count in range(0, total_train_samples):
+        for count, sample in enumerate(train_loader):
 
             # Log counter
             log_count = count + total_train_samples*epoch
 
-            # Reset iterators
-            if(zenseact_count == zenseact_num_train_samples and \
-                is_zenseact_complete == False):
-                is_zenseact_complete = True
-                data_list.remove('ZENSEACT')
-
-            if(mapillary_count == mapillary_num_train_samples and \
-               is_mapillary_complete == False):
-                is_mapillary_complete = True
-                data_list.remove('MAPILLARY')
-
-            if(comma10k_count == comma10k_num_train_samples and \
-               is_comma10k_complete == False):
-                is_comma10k_complete = True
-                data_list.remove('COMMA10K')
-
-            if(data_list_count >= len(data_list)):
-                data_list_count = 0
-
-            # Read images, apply augmentation, run prediction, calculate
-            # loss for iterated image from each dataset, and increment
-            # dataset iterators
-
-            if(data_list[data_list_count] == 'ZENSEACT' and \
-               is_zenseact_complete == False):
-                image, gt = zenseact_dataset.getItemTrain(zenseact_count)
-                zenseact_count += 1
-
-            if(data_list[data_list_count] == 'MAPILLARY' and \
-               is_mapillary_complete == False):
-                image, gt = mapillary_dataset.getItemTrain(mapillary_count)
-                mapillary_count +=1
-
-            if(data_list[data_list_count] == 'COMMA10K' and \
-                is_comma10k_complete == False):
-                image, gt = comma10k_dataset.getItemTrain(comma10k_count)
-                comma10k_count += 1
-
-            # Assign Data
-            trainer.set_data(image, gt)
-
-            # Augmenting Image
-            trainer.apply_augmentations(is_train=False)
-
-            # Converting to tensor and loading
-            trainer.load_data()
+            # Assign prepared data and load to device
+            trainer.load_prefetched_data(sample)
 
             # Run model and calculate loss
             trainer.run_model()
@@ -213,54 +200,25 @@ def main():
                 # Setting model to evaluation mode
                 trainer.set_eval_mode()
 
-                # Overall IoU
-                running_IoU = 0
-
-                # No gradient calculation
-                with torch.no_grad():
-
-                    # ZENSEACT
-                    for val_count in range(0, zenseact_num_val_samples):
-                        image_val, gt_val = zenseact_dataset.getItemVal(val_count)
-
-                        # Run Validation and calculate IoU Score
-                        IoU_score = trainer.validate(image_val, gt_val)
+                # Run validation on all validation samples, IoU
+                # metrics are accumulated over the validation pass
+                val_runner.run(trainer)
 
-                        # Accumulate individual IoU scores for validation samples
-                        running_IoU += IoU_score
+                # Calculating average loss of complete validation set
+                mIoU = trainer.get_val_mIoU()
+                print('mIoU: ', mIoU)
 
-                    # MAPILLARY
-                    for val_count in range(0, mapillary_num_val_samples):
-                        image_val, gt_val = mapillary_dataset.getItemVal(val_count)
+                # Logging average validation loss to TensorBoard
+                trainer.log_IoU(mIoU, log_count)
 
-                        # Run Validation and calculate IoU Score
-                        IoU_score = trainer.validate(image_val, gt_val)
-
-                        # Accumulate individual IoU scores for validation samples
-                        running_IoU += IoU_score
-
-                    # COMMA10K
-                    for val_count in range(0, comma10k_num_val_samples):
-                        image_val, gt_val = comma10k_dataset.getItemVal(val_count)
-
-                        # Run Validation and calculate IoU Score
-                        IoU_score = trainer.validate(image_val, gt_val)
-
-                        # Accumulate individual IoU scores for validation samples
-                        running_IoU += IoU_score
-
-                    # Calculating average loss of complete validation set
-                    mIoU = running_IoU/total_val_samples
-                    print('mIoU: ', mIoU)
-
-                    # Logging average validation loss to TensorBoard
-                    trainer.log_IoU(mIoU, log_count)
+                # Dataset-level IoU from the intersection and union of the whole validation set
+                dataset_IoU = trainer.get_val_dataset_IoU()
+                print('Dataset IoU: ', dataset_IoU)
+                trainer.log_dataset_IoU(dataset_IoU, log_count)
 
                 # Resetting model back to training
                 trainer.set_train_mode()
 
-            data_list_count += 1
-
     trainer.cleanup()
 
 
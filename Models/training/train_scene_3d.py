@@ -8,6 +8,9 @@ from argparse import ArgumentParser
 import sys
 sys.path.append('..')
 from data_utils.load_data_scene_3d import LoadDataScene3D
+from data_utils.scene_3d_depth_store import Scene3DDepthStore
+from data_utils.data_pipeline import Scene3DDataset, getRoundRobinSchedule, createDataLoader
+from training.validation_runner import ValidationRunner
 from training.scene_3d_trainer import Scene3DTrainer
 
 def main():
@@ -19,6 +22,11 @@ def main():
     parser.add_argument("-r", "--root", dest="root", help="root path to folder where data training data is stored")
     parser.add_argument("-t", "--test_images_save_root_path", dest="test_images_save_root_path", help="root path where test images are stored")
     parser.add_argument('-l', "--load_from_save", action='store_true', help="flag for whether model is being loaded from a Scene3D checkpoint file")
+    parser.add_argument("-w", "--num_workers", dest="num_workers", type=int, default=4, help="number of worker processes preparing training samples")
+    parser.add_argument("-v", "--val_batch_size", dest="val_batch_size", type=int, default=8, help="number of validation samples run through the network together")
+    parser.add_argument("-p", "--precision", dest="precision", default="fp32", choices=["fp32", "bf16", "fp16"], help="numerical precision of the network forward pass, bf16 and fp16 use mixed precision (AMP) autocast")
+    parser.add_argument("-d", "--depth_store_root_path", dest="depth_store_root_path", default="", help="root path to depth store compiled with scene_3d_depth_store.py, images and .npy depth maps are read from their folders if not provided")
+    parser.add_argument("--channels_last", action='store_true', help="flag for whether the network and input images use the channels_last memory format")
     args = parser.parse_args()
 
     # Root path
@@ -42,8 +50,13 @@ def main():
     diverse_labels_filepath = root + 'Diverse/relative-depth/'
     diverse_images_filepath = root + 'Diverse/image/'
 
+    # Precompiled depth store, if available
+    depth_store = None
+    if(len(args.depth_store_root_path) > 0):
+        depth_store = Scene3DDepthStore(args.depth_store_root_path, 'DIVERSE')
+
     # Data Loading
-    Dataset = LoadDataScene3D(diverse_labels_filepath, diverse_images_filepath)
+    Dataset = LoadDataScene3D(diverse_labels_filepath, diverse_images_filepath, depth_store)
     total_train_samples, total_val_samples = Dataset.getItemCount()
     
     # Total train samples
@@ -59,12 +72,23 @@ def main():
     pretrained_checkpoint_path = args.pretrained_checkpoint_path
     checkpoint_path = args.checkpoint_path
 
+    # Training data prepared in worker processes
+    num_workers = args.num_workers
+    train_data = Scene3DDataset({'DIVERSE': Dataset}, is_train=True)
+
+    # Validation data prepared in worker processes and run in mini-batches
+    val_data = Scene3DDataset({'DIVERSE': Dataset}, is_train=False, apply_augmentations=False)
+    val_runner = ValidationRunner(val_data, ['DIVERSE'], \
+        {'DIVERSE': total_val_samples}, args.val_batch_size, num_workers)
+
     # Trainer Class
     trainer = 0
     if(load_from_checkpoint == False):
-        trainer = Scene3DTrainer(pretrained_checkpoint_path=pretrained_checkpoint_path)
+        trainer = Scene3DTrainer(pretrained_checkpoint_path=pretrained_checkpoint_path, \
+            precision=args.precision, channels_last=args.channels_last)
     else:
-        trainer = Scene3DTrainer(checkpoint_path=checkpoint_path, is_pretrained=True)
+        trainer = Scene3DTrainer(checkpoint_path=checkpoint_path, is_pretrained=True, \
+            precision=args.precision, channels_last=args.channels_last)
 
     trainer.zero_grad()
     
@@ -85,22 +109,18 @@ def main():
             batch_size = 3
 
 
-        for count in range(0, total_train_samples):
+        # Read images and apply augmentations in worker processes
+        train_schedule = getRoundRobinSchedule(['DIVERSE'], \
+            {'DIVERSE': total_train_samples}, {'DIVERSE': randomlist_train_data})
+        train_loader = createDataLoader(train_data, train_schedule, num_workers)
+
+        for count, sample in enumerate(train_loader):
 
             # Log value of iterator
             log_count = count + total_train_samples*epoch
 
-            # Dataset sample 
-            image, gt = Dataset.getItemTrain(randomlist_train_data[count])
-            
-            # Assign Data
-            trainer.set_data(image, gt)
-            
-            # Augmenting Image
-            trainer.apply_augmentations(is_train=True)
-
-            # Converting to tensor and loading
-            trainer.load_data()
+            # Assign prepared data and load to device
+            trainer.load_prefetched_data(sample)
 
             # Run model and calculate loss
             trainer.run_model()
@@ -136,10 +156,6 @@ def main():
                 # Setting model to evaluation mode
                 trainer.set_eval_mode()
 
-                # Error
-                mAE = 0
-                mEL = 0
-
                 # No gradient calculation
                 with torch.no_grad():
 
@@ -154,26 +170,19 @@ def main():
                         
                         trainer.test(test_image, test_save_path)
 
-                    # VALIDATION
-                    for val_count in range(0, total_val_samples):
-                        image_val, gt_val = Dataset.getItemVal(val_count)
-
-                        # Run Validation and calculate mAE Score
-                        mAE_item, mEL_item = trainer.validate(image_val, gt_val)
-
-                        # Accumulating mAE score
-                        mAE += mAE_item
-                        mEL += mEL_item
-
-                    # LOGGING
-                    # Calculating average loss of complete validation set for
-                    # each specific dataset as well as the overall combined dataset
-                    avg_mEL = mEL/total_val_samples
-                    avg_mAE = mAE/total_val_samples
-                    avg_overall = avg_mEL + avg_mAE
-                    
-                    # Logging average validation loss to TensorBoard
-                    trainer.log_val_loss(avg_overall, avg_mAE, avg_mEL, log_count)
+                # VALIDATION
+                # Run validation on all validation samples, mAE and
+                # edge losses are accumulated over the validation pass
+                val_runner.run(trainer)
+
+                # LOGGING
+                # Calculating average loss of complete validation set for
+                # each specific dataset as well as the overall combined dataset
+                avg_mAE, avg_mEL = trainer.get_val_losses()
+                avg_overall = avg_mEL + avg_mAE
+                
+                # Logging average validation loss to TensorBoard
+                trainer.log_val_loss(avg_overall, avg_mAE, avg_mEL, log_count)
 
                 # Resetting model back to training
                 trainer.set_train_mode()
@@ -1,20 +1,32 @@
 #%%
 # Comment above is for Jupyter execution in VSCode
 #! /usr/bin/env python3
-import torch
 import random
 from argparse import ArgumentParser
 import sys
 sys.path.append('..')
 from data_utils.load_data_scene_seg import LoadDataSceneSeg
+from data_utils.scene_seg_label_cache import SceneSegLabelCache
+from data_utils.data_pipeline import SceneSegDataset, getRoundRobinSchedule, createDataLoader
 from training.scene_seg_trainer import SceneSegTrainer
+from training.validation_runner import ValidationRunner
 
+# Check whether a multiple of the given number of samples
+# was reached by the samples of the latest mini-batch
+def is_interval_reached(prev_sample_count, sample_count, interval):
+    return (sample_count // interval) > (prev_sample_count // interval)
 
 def main():
 
     parser = ArgumentParser()
     parser.add_argument("-s", "--model_save_root_path", dest="model_save_root_path", help="root path where pytorch checkpoint file should be saved")
     parser.add_argument("-r", "--root", dest="root", help="root path to folder where data training data is stored")
+    parser.add_argument("-l", "--label_cache_root_path", dest="label_cache_root_path", default="", help="root path to label cache compiled with scene_seg_label_cache.py, colour labels are decoded on the fly if not provided")
+    parser.add_argument("-w", "--num_workers", dest="num_workers", type=int, default=4, help="number of worker processes preparing training samples")
+    parser.add_argument("-b", "--max_batch_size", dest="max_batch_size", type=int, default=8, help="largest number of samples run through the network together, larger batches are split into mini-batches with accumulated gradients")
+    parser.add_argument("-v", "--val_batch_size", dest="val_batch_size", type=int, default=8, help="number of validation samples run through the network together")
+    parser.add_argument("-p", "--precision", dest="precision", default="fp32", choices=["fp32", "bf16", "fp16"], help="numerical precision of the network forward pass, bf16 and fp16 use mixed precision (AMP) autocast")
+    parser.add_argument("--channels_last", action='store_true', help="flag for whether the network and input images use the channels_last memory format")
     args = parser.parse_args()
 
     # Root path
@@ -23,6 +35,15 @@ def main():
     # Model save path
     model_save_root_path =args.model_save_root_path
 
+    # Label cache path
+    label_cache_root_path = args.label_cache_root_path
+
+    # Precompiled label cache for a dataset, if available
+    def get_label_cache(dataset):
+        if(len(label_cache_root_path) > 0):
+            return SceneSegLabelCache(label_cache_root_path, dataset)
+        return None
+
     # Data paths
     # ACDC
     acdc_labels_filepath= root + 'ACDC/gt_masks/'
@@ -46,23 +67,28 @@ def main():
 
 
     # ACDC - Data Loading
-    acdc_Dataset = LoadDataSceneSeg(acdc_labels_filepath, acdc_images_filepath, 'ACDC')
+    acdc_Dataset = LoadDataSceneSeg(acdc_labels_filepath, acdc_images_filepath, 'ACDC', \
+        get_label_cache('ACDC'))
     acdc_num_train_samples, acdc_num_val_samples = acdc_Dataset.getItemCount()
 
     # IDDAW - Data Loading
-    iddaw_Dataset = LoadDataSceneSeg(iddaw_labels_fileapath, iddaw_images_fileapath, 'IDDAW')
+    iddaw_Dataset = LoadDataSceneSeg(iddaw_labels_fileapath, iddaw_images_fileapath, 'IDDAW', \
+        get_label_cache('IDDAW'))
     iddaw_num_train_samples, iddaw_num_val_samples = iddaw_Dataset.getItemCount()
 
     # MUSES - Data Loading
-    muses_Dataset = LoadDataSceneSeg(muses_labels_fileapath, muses_images_fileapath, 'MUSES')
+    muses_Dataset = LoadDataSceneSeg(muses_labels_fileapath, muses_images_fileapath, 'MUSES', \
+        get_label_cache('MUSES'))
     muses_num_train_samples, muses_num_val_samples = muses_Dataset.getItemCount()
 
     # Mapillary - Data Loading
-    mapillary_Dataset = LoadDataSceneSeg(mapillary_labels_fileapath, mapillary_images_fileapath, 'MAPILLARY')
+    mapillary_Dataset = LoadDataSceneSeg(mapillary_labels_fileapath, mapillary_images_fileapath, 'MAPILLARY', \
+        get_label_cache('MAPILLARY'))
     mapillary_num_train_samples, mapillary_num_val_samples = mapillary_Dataset.getItemCount()
 
     # comma10k - Data Loading
-    comma10k_Dataset = LoadDataSceneSeg(comma10k_labels_fileapath, comma10k_images_fileapath, 'COMMA10K')
+    comma10k_Dataset = LoadDataSceneSeg(comma10k_labels_fileapath, comma10k_images_fileapath, 'COMMA10K', \
+        get_label_cache('COMMA10K'))
     comma10k_num_train_samples, comma10k_num_val_samples = comma10k_Dataset.getItemCount()
 
     # Total number of training samples
@@ -77,8 +103,45 @@ def main():
     + mapillary_num_val_samples + comma10k_num_val_samples
     print(total_val_samples, ': total validation samples')
 
+    # Training data prepared in worker processes
+    num_workers = args.num_workers
+
+    # Largest mini-batch run through the network together
+    max_batch_size = args.max_batch_size
+
+    datasets = {
+        'ACDC': acdc_Dataset,
+        'IDDAW': iddaw_Dataset,
+        'MUSES': muses_Dataset,
+        'MAPILLARY': mapillary_Dataset,
+        'COMMA10K': comma10k_Dataset
+    }
+
+    num_train_samples = {
+        'ACDC': acdc_num_train_samples,
+        'IDDAW': iddaw_num_train_samples,
+        'MUSES': muses_num_train_samples,
+        'MAPILLARY': mapillary_num_train_samples,
+        'COMMA10K': comma10k_num_train_samples
+    }
+
+    train_data = SceneSegDataset(datasets, is_train=True)
+
+    # Validation data prepared in worker processes and run in mini-batches
+    num_val_samples = {
+        'ACDC': acdc_num_val_samples,
+        'MUSES': muses_num_val_samples,
+        'IDDAW': iddaw_num_val_samples,
+        'MAPILLARY': mapillary_num_val_samples,
+        'COMMA10K': comma10k_num_val_samples
+    }
+
+    val_data = SceneSegDataset(datasets, is_train=False, apply_augmentations=False)
+    val_runner = ValidationRunner(val_data, list(num_val_samples.keys()), \
+        num_val_samples, args.val_batch_size, num_workers)
+
     # Trainer Class
-    trainer = SceneSegTrainer()
+    trainer = SceneSegTrainer(precision=args.precision, channels_last=args.channels_last)
     trainer.zero_grad()
     
     # Total training epochs
@@ -88,19 +151,6 @@ def main():
     # Epochs
     for epoch in range(0, num_epochs):
 
-        # Iterators for datasets
-        acdc_count = 0
-        iddaw_count = 0
-        muses_count = 0
-        comma10k_count = 0
-        mapillary_count = 0
-
-        is_acdc_complete = False
-        is_iddaw_complete = False
-        is_muses_complete = False
-        is_mapillary_complete = False
-        is_comma10k_complete = False
-
         data_list = []
         data_list.append('ACDC')
         data_list.append('IDDAW')
@@ -108,7 +158,6 @@ def main():
         data_list.append('MAPILLARY')
         data_list.append('COMMA10K')
         random.shuffle(data_list)
-        data_list_count = 0
 
         if(epoch == 1):
             batch_size = 16
@@ -129,82 +178,29 @@ def main():
             batch_size = 1
 
 
+        # Read images and apply augmentations in worker processes, taking
+        # one sample from each dataset in turn, and stack consecutive samples
+        # into mini-batches of at most max_batch_size samples
+        mini_batch_size = min(batch_size, max_batch_size)
+        train_schedule = getRoundRobinSchedule(data_list, num_train_samples)
+        train_loader = createDataLoader(train_data, train_schedule, num_workers, \
+            batch_size=mini_batch_size)
+
+        # Number of samples processed in this epoch
+        sample_count = 0
+
         # Loop through data
-        for count in range(0, total_train_samples):
+        for batch in train_loader:
 
-            log_count = count + total_train_samples*epoch
+            prev_sample_count = sample_count
+            sample_count = sample_count + len(batch['image'])
 
-            # Reset iterators
-            if(acdc_count == acdc_num_train_samples and \
-               is_acdc_complete == False):
-                is_acdc_complete =  True
-                data_list.remove("ACDC")
-            
-            if(iddaw_count == iddaw_num_train_samples and \
-               is_iddaw_complete == False):
-                is_iddaw_complete = True
-                data_list.remove("IDDAW")
-            
-            if(muses_count == muses_num_train_samples and \
-                is_muses_complete == False):
-                is_muses_complete = True
-                data_list.remove('MUSES')
-            
-            if(mapillary_count == mapillary_num_train_samples and \
-               is_mapillary_complete == False):
-                is_mapillary_complete = True
-                data_list.remove('MAPILLARY')
-
-            if(comma10k_count == comma10k_num_train_samples and \
-               is_comma10k_complete == False):
-                is_comma10k_complete = True
-                data_list.remove('COMMA10K')
-
-            if(data_list_count >= len(data_list)):
-                data_list_count = 0
-
-            # Read images, apply augmentation, run prediction, calculate
-            # loss for iterated image from each dataset, and increment
-            # dataset iterators
-
-            if(data_list[data_list_count] == 'ACDC' and \
-                is_acdc_complete == False):
-                image, gt, class_weights = \
-                        acdc_Dataset.getItemTrain(acdc_count)
-                acdc_count += 1
-            
-            if(data_list[data_list_count] == 'IDDAW' and \
-               is_iddaw_complete == False):
-                image, gt, class_weights = \
-                    iddaw_Dataset.getItemTrain(iddaw_count)      
-                iddaw_count += 1
-
-            if(data_list[data_list_count] == 'MUSES' and \
-               is_muses_complete == False):
-                image, gt, class_weights = \
-                    muses_Dataset.getItemTrain(muses_count)
-                muses_count += 1
-            
-            if(data_list[data_list_count] == 'MAPILLARY' and \
-               is_mapillary_complete == False):
-                image, gt, class_weights = \
-                    mapillary_Dataset.getItemTrain(mapillary_count)
-                mapillary_count +=1
-            
-            if(data_list[data_list_count] == 'COMMA10K' and \
-                is_comma10k_complete == False):
-                image, gt, class_weights = \
-                    comma10k_Dataset.getItemTrain(comma10k_count)
-                comma10k_count += 1
-            
-            # Assign Data
-            trainer.set_data(image, gt, class_weights)
-            
-            # Augmenting Image
-            trainer.apply_augmentations(is_train=True)
+            # Index of the last sample in the mini-batch
+            count = sample_count - 1
+            log_count = count + total_train_samples*epoch
 
-            # Converting to tensor and loading
-            trainer.load_data(is_train=True)
+            # Assign prepared mini-batch and load to device
+            trainer.load_prefetched_batch(batch)
 
             # Run model and calculate loss
             trainer.run_model()
@@ -212,21 +208,22 @@ def main():
             # Gradient accumulation
             trainer.loss_backward()
 
-            # Simulating batch size through gradient accumulation
-            if((count+1) % batch_size == 0):
+            # Run optimizer once the samples of a full batch have been
+            # processed, accumulating gradients over mini-batches
+            if(is_interval_reached(prev_sample_count, sample_count, batch_size)):
                 trainer.run_optimizer()
 
             # Logging loss to Tensor Board every 250 steps
-            if((count+1) % 250 == 0):
+            if(is_interval_reached(prev_sample_count, sample_count, 250)):
                 trainer.log_loss(log_count)
             
             # Logging Image to Tensor Board every 1000 steps
-            if((count+1) % 1000 == 0):  
+            if(is_interval_reached(prev_sample_count, sample_count, 1000)):
                 trainer.save_visualization(log_count)
             
             # Save model and run validation on entire validation 
             # dataset after 8000 steps
-            if((count+1) % 8000 == 0):
+            if(is_interval_reached(prev_sample_count, sample_count, 8000)):
                 
                 # Save Model
                 model_save_path = model_save_root_path + 'iter_' + \
@@ -242,97 +239,22 @@ def main():
                 # Setting model to evaluation mode
                 trainer.set_eval_mode()
 
-                running_IoU_full = 0
-                running_IoU_bg = 0
-                running_IoU_fg = 0
-                running_IoU_rd = 0
-
-                # No gradient calculation
-                with torch.no_grad():
-
-                    # ACDC
-                    for val_count in range(0, acdc_num_val_samples):
-                        image_val, gt_val, _ = \
-                            acdc_Dataset.getItemVal(val_count)
-
-                        # Run Validation and calculate IoU Score
-                        IoU_score_full, IoU_score_bg, IoU_score_fg, IoU_score_rd = \
-                            trainer.validate(image_val, gt_val)
-
-                        running_IoU_full += IoU_score_full
-                        running_IoU_bg += IoU_score_bg
-                        running_IoU_fg += IoU_score_fg
-                        running_IoU_rd += IoU_score_rd
-
-                    # MUSES
-                    for val_count in range(0, muses_num_val_samples):
-                        image_val, gt_val, _ = \
-                            muses_Dataset.getItemVal(val_count)
-                        
-                        # Run Validation and calculate IoU Score
-                        IoU_score_full, IoU_score_bg, IoU_score_fg, IoU_score_rd = \
-                            trainer.validate(image_val, gt_val)
-
-                        running_IoU_full += IoU_score_full
-                        running_IoU_bg += IoU_score_bg
-                        running_IoU_fg += IoU_score_fg
-                        running_IoU_rd += IoU_score_rd
-                    
-                    # IDDAW
-                    for val_count in range(0, iddaw_num_val_samples):
-                        image_val, gt_val, _ = \
-                            iddaw_Dataset.getItemVal(val_count)
-                        
-                        # Run Validation and calculate IoU Score
-                        IoU_score_full, IoU_score_bg, IoU_score_fg, IoU_score_rd = \
-                            trainer.validate(image_val, gt_val)
-
-                        running_IoU_full += IoU_score_full
-                        running_IoU_bg += IoU_score_bg
-                        running_IoU_fg += IoU_score_fg
-                        running_IoU_rd += IoU_score_rd
-
-                    # MAPILLARY
-                    for val_count in range(0, mapillary_num_val_samples):
-                        image_val, gt_val, _ = \
-                            mapillary_Dataset.getItemVal(val_count)
-                        
-                         # Run Validation and calculate IoU Score
-                        IoU_score_full, IoU_score_bg, IoU_score_fg, IoU_score_rd = \
-                            trainer.validate(image_val, gt_val)
-
-                        running_IoU_full += IoU_score_full
-                        running_IoU_bg += IoU_score_bg
-                        running_IoU_fg += IoU_score_fg
-                        running_IoU_rd += IoU_score_rd
-
-                    # COMMA10K
-                    for val_count in range(0, comma10k_num_val_samples):
-                        image_val, gt_val, _ = \
-                            comma10k_Dataset.getItemVal(val_count)
-                        
-                        # Run Validation and calculate IoU Score
-                        IoU_score_full, IoU_score_bg, IoU_score_fg, IoU_score_rd = \
-                            trainer.validate(image_val, gt_val)
-
-                        running_IoU_full += IoU_score_full
-                        running_IoU_bg += IoU_score_bg
-                        running_IoU_fg += IoU_score_fg
-                        running_IoU_rd += IoU_score_rd
-                    
-                    # Calculating average loss of complete validation set
-                    mIoU_full = running_IoU_full/total_val_samples
-                    mIoU_bg = running_IoU_bg/total_val_samples
-                    mIoU_fg = running_IoU_fg/total_val_samples
-                    mIoU_rd = running_IoU_rd/total_val_samples
-                    
-                    # Logging average validation loss to TensorBoard
-                    trainer.log_IoU(mIoU_full, mIoU_bg, mIoU_fg, mIoU_rd, log_count)
+                # Run validation on all validation samples, IoU
+                # metrics are accumulated over the validation pass
+                val_runner.run(trainer)
+
+                # Calculating average loss of complete validation set
+                mIoU_full, mIoU_bg, mIoU_fg, mIoU_rd = trainer.get_val_mIoU()
+                
+                # Logging average validation loss to TensorBoard
+                trainer.log_IoU(mIoU_full, mIoU_bg, mIoU_fg, mIoU_rd, log_count)
+
+                # Dataset-level IoU from the intersection and union of the whole validation set
+                IoU_full, IoU_bg, IoU_fg, IoU_rd = trainer.get_val_dataset_IoU()
+                trainer.log_dataset_IoU(IoU_full, IoU_bg, IoU_fg, IoU_rd, log_count)
 
                 # Resetting model back to training
                 trainer.set_train_mode()
-                
-            data_list_count += 1
 
     trainer.cleanup()
 
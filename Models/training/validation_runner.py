@@ -0,0 +1,28 @@
+#! /usr/bin/env python3
+import torch
+import sys
+sys.path.append('..')
+from data_utils.data_pipeline import getSequentialSchedule, createDataLoader
+
+# Runs validation over all validation samples of one or more datasets. Samples
+# are prepared and stacked into mini-batches by worker processes while the
+# network runs under inference mode, and the trainer accumulates its validation
+# metrics batch by batch
+class ValidationRunner():
+    def __init__(self, val_data, data_list, num_val_samples, batch_size = 8, num_workers = 4):
+
+        # Every validation sample of each dataset, in order
+        self.val_schedule = getSequentialSchedule(data_list, num_val_samples)
+        self.num_samples = len(self.val_schedule)
+
+        # Loader is reused for every validation pass
+        self.val_loader = createDataLoader(val_data, self.val_schedule, num_workers, \
+            batch_size=batch_size)
+
+    # Run a validation pass, validation metrics are then read from the trainer
+    def run(self, trainer):
+        trainer.reset_val_metrics()
+
+        with torch.inference_mode():
+            for batch in self.val_loader:
+                trainer.validate_batch(batch)
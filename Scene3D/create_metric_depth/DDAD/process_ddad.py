@@ -2,10 +2,14 @@
 import matplotlib.pyplot as plt
 from PIL import Image
 import numpy as np
+import os
+import queue
+import threading
+from multiprocessing import Pool
 from argparse import ArgumentParser
 from dgp.datasets import SynchronizedSceneDataset
 import sys
-sys.path.append('../../../../')
+sys.path.append('../../../')
 from Scene3D.create_metric_depth.common.lidar_depth_fill import LidarDepthFill
 
 def cropData(image, depth_map, validity_mask):
@@ -13,7 +17,6 @@ def cropData(image, depth_map, validity_mask):
     # Cropping out those parts of data for which depth is unavailable
     image = image.crop((268, 200, 1668, 900))
     depth_map = depth_map[200:900, 268:1668]
-    height_map_fill_only = height_map_fill_only[200:900, 268:1668]
     validity_mask = validity_mask[200:900, 268:1668]
 
     return image, depth_map, validity_mask
@@ -61,12 +64,103 @@ def saveData(root_save_path, counter, image, depth_map, validity_mask):
   validity_mask = Image.fromarray(np.uint8(validity_mask*255))
   validity_mask.save(validity_save_path, "PNG")
 
+# Camera datum and split of each dataset in the order in which its samples are numbered
+DATASET_SPLITS = [
+  ('CAMERA_09', 'train'),
+  ('CAMERA_01', 'train'),
+  ('CAMERA_09', 'val'),
+  ('CAMERA_01', 'val')
+]
+
+# Maximum number of processed samples waiting to be saved by a writer thread
+MAX_WRITE_QUEUE_SIZE = 8
+
+# Datasets loaded by each worker process
+WORKER_DATASETS = []
+
+# Load synchronized pairs of camera and lidar frames of all splits
+def loadDatasets(ddad_json_path):
+
+  datasets = []
+  for camera, split in DATASET_SPLITS:
+    datasets.append(
+      SynchronizedSceneDataset(ddad_json_path,
+        datum_names=('lidar', camera),
+        generate_depth_from_datum='lidar',
+        split=split
+        ))
+
+  return datasets
+
+# Load the datasets once per worker process
+def initWorker(ddad_json_path):
+  WORKER_DATASETS.extend(loadDatasets(ddad_json_path))
+
+# Saves processed samples in a background thread, so that PNG encoding
+# and file writes overlap with the lidar projection of the next samples
+class AsyncDataWriter():
+  def __init__(self, root_save_path, max_queue_size = MAX_WRITE_QUEUE_SIZE):
+
+    self.root_save_path = root_save_path
+    self.write_queue = queue.Queue(maxsize=max_queue_size)
+    self.error = None
+
+    self.writer_thread = threading.Thread(target=self.writeData, daemon=True)
+    self.writer_thread.start()
+
+  # Save samples from the queue until the end of the queue is reached
+  def writeData(self):
+    while True:
+      data = self.write_queue.get()
+      if(data is None):
+        break
+      try:
+        saveData(self.root_save_path, *data)
+      except Exception as error:
+        self.error = error
+
+  # Add a processed sample to the queue, waiting if the queue is full
+  def write(self, counter, image, depth_map, validity_mask):
+    if(self.error is not None):
+      raise self.error
+    self.write_queue.put((counter, image, depth_map, validity_mask))
+
+  # Wait until all queued samples have been saved
+  def close(self):
+    self.write_queue.put(None)
+    self.writer_thread.join()
+    if(self.error is not None):
+      raise self.error
+
+# Process and save a shard of samples given as (counter, dataset index,
+# sample index) tuples, returning the number of processed samples
+def processShard(root_save_path, shard, total_samples):
+
+  writer = AsyncDataWriter(root_save_path)
+
+  try:
+    for counter, dataset_index, sample_index in shard:
+
+      # Get data sample and process it
+      sample = WORKER_DATASETS[dataset_index][sample_index]
+      image, depth_map, validity_mask = processSample(sample)
+
+      # Save data
+      writer.write(counter, image, depth_map, validity_mask)
+
+      print('Processing image ', counter, ' of ', total_samples - 1)
+  finally:
+    writer.close()
+
+  return len(shard)
+
 def main():
   
   # Argument parser for data root path and save path
   parser = ArgumentParser()
   parser.add_argument("-d", "--data", dest="ddad_json_path", help="path to ddad.json file")
   parser.add_argument("-s", "--save", dest="root_save_path", help="path to folder where processed data will be saved")
+  parser.add_argument("-w", "--num_workers", dest="num_workers", type=int, default=None, help="number of worker processes, defaults to the number of CPUs")
   args = parser.parse_args()
 
   # Path to dataset main json file
@@ -75,110 +169,36 @@ def main():
   # Save path
   root_save_path = args.root_save_path
 
+  # Number of worker processes
+  num_workers = args.num_workers if args.num_workers else os.cpu_count()
+
   # Load synchronized pairs of camera and lidar frames.
-  dataset_train_front = \
-  SynchronizedSceneDataset(ddad_json_path,
-      datum_names=('lidar', 'CAMERA_01'),
-      generate_depth_from_datum='lidar',
-      split='train'
-      )
-  
-  dataset_val_front = \
-  SynchronizedSceneDataset(ddad_json_path,
-      datum_names=('lidar', 'CAMERA_01'),
-      generate_depth_from_datum='lidar',
-      split='val'
-      )
-  
-  dataset_train_rear = \
-  SynchronizedSceneDataset(ddad_json_path,
-      datum_names=('lidar', 'CAMERA_09'),
-      generate_depth_from_datum='lidar',
-      split='train'
-      )
-  
-  dataset_val_rear = \
-  SynchronizedSceneDataset(ddad_json_path,
-      datum_names=('lidar', 'CAMERA_09'),
-      generate_depth_from_datum='lidar',
-      split='val'
-      )
-
-  # Iterate through the dataset.
-  num_train_front_samples = len(dataset_train_front)
-  num_val_front_samples = len(dataset_val_front)
-  num_train_rear_samples = len(dataset_train_rear)
-  num_val_rear_samples = len(dataset_val_rear)
-  total_data = num_train_front_samples + num_val_front_samples \
-    + num_train_rear_samples + num_val_rear_samples
+  datasets = loadDatasets(ddad_json_path)
 
+  total_data = sum([len(dataset) for dataset in datasets])
   print('Total samples', total_data)
 
-  # Data counter
-  counter = 0
-
-  # Camera height above road surface
-  camera_height_front = 1.3
-  camera_height_rear = 1.4
-
-  # Height map limits
-  max_height = 7
-  min_height = -2
-  
-  # Training dataset
-  for index in range(0, num_train_rear_samples, 2):
-
-    # Get data sample and process it
-    sample = dataset_train_rear[index]
-    image, depth_map, validity_mask = processSample(sample)
-
-    # Save data
-    saveData(root_save_path, counter, image, depth_map, validity_mask)
-
-    print('Processing image ', counter, ' of ', round(total_data/2)-1)
-
-    counter += 1
-  
-  for index in range(0, num_train_front_samples, 2):
-
-    # Get data sample and process it
-    sample = dataset_train_front[index]
-    image, depth_map, validity_mask = processSample(sample)
-
-    # Save data
-    saveData(root_save_path, counter, image, depth_map, validity_mask)
-
-    print('Processing image ', counter, ' of ', round(total_data/2)-1)
-
-    counter += 1
-
-    # Training dataset
-  for index in range(0, num_val_rear_samples, 2):
-
-    # Get data sample and process it
-    sample = dataset_val_rear[index]
-    image, depth_map, validity_mask = processSample(sample)
-
-    # Save data
-    saveData(root_save_path, counter, image, depth_map, validity_mask)
-
-    print('Processing image ', counter, ' of ', round(total_data/2)-1)
-
-    counter += 1
-  
-  # Validation dataset
-  for index in range(0, num_val_front_samples, 2):
-
-    # Get data sample and process it
-    sample = dataset_val_front[index]
-    image, depth_map, validity_mask = processSample(sample)
-
-    # Save data
-    saveData(root_save_path, counter, image, depth_map, validity_mask)
-
-    print('Processing image ', counter, ' of ', round(total_data/2)-1)
-
-    counter += 1
+  # Every second sample of each dataset is used, numbered in the order of the
+  # datasets so that the numbering does not depend on the number of workers
+  samples = []
+  for dataset_index, dataset in enumerate(datasets):
+    for sample_index in range(0, len(dataset), 2):
+      samples.append((len(samples), dataset_index, sample_index))
+
+  total_samples = len(samples)
+
+  # Interleaved shards of samples, one per worker process
+  num_workers = max(min(num_workers, total_samples), 1)
+  shards = [samples[worker_index::num_workers] for worker_index in range(0, num_workers)]
+
+  # Workers run in the main process if no pool is required
+  if(num_workers == 1):
+    WORKER_DATASETS.extend(datasets)
+    processShard(root_save_path, shards[0], total_samples)
+  else:
+    with Pool(num_workers, initializer=initWorker, initargs=(ddad_json_path,)) as pool:
+      pool.starmap(processShard, \
+        [(root_save_path, shard, total_samples) for shard in shards])
   
   print('--- Processing Complete ----')
   
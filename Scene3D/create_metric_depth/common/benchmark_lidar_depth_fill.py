@@ -0,0 +1,53 @@
+#! /usr/bin/env python3
+import time
+import numpy as np
+from argparse import ArgumentParser
+import sys
+sys.path.append('../../../')
+from Scene3D.create_metric_depth.common.lidar_depth_fill import fillDepthMap, fillDepthMaps
+
+# Depth map resolutions (height, width) of the processed datasets
+RESOLUTIONS = {
+    'KITTI': (375, 1242),
+    'DDAD': (1216, 1936)
+}
+
+# Random sparse lidar depth maps with depth for a fraction of pixels
+def createSparseDepthMaps(num_frames, height, width, density):
+    rng = np.random.default_rng(0)
+    depth_maps = np.zeros((num_frames, height, width), dtype=np.float32)
+    is_valid = rng.random((num_frames, height, width)) < density
+    depth_maps[is_valid] = rng.uniform(1, 80, np.count_nonzero(is_valid))
+    return depth_maps
+
+def main():
+
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--num_frames", dest="num_frames", type=int, default=32, help="number of frames filled at each resolution")
+    parser.add_argument("-t", "--num_threads", dest="num_threads", type=int, default=None, help="number of threads filling a stack of frames, defaults to the number of CPUs")
+    parser.add_argument("-d", "--density", dest="density", type=float, default=0.05, help="fraction of pixels with lidar depth")
+    args = parser.parse_args()
+
+    for dataset, (height, width) in RESOLUTIONS.items():
+
+        depth_maps = createSparseDepthMaps(args.num_frames, height, width, args.density)
+
+        # Warm up
+        fillDepthMap(depth_maps[0])
+
+        # One frame at a time
+        start_time = time.perf_counter()
+        for depth_map in depth_maps:
+            fillDepthMap(depth_map)
+        single_time = (time.perf_counter() - start_time)*1000/args.num_frames
+
+        # Stack of frames in a thread pool
+        start_time = time.perf_counter()
+        fillDepthMaps(depth_maps, num_threads=args.num_threads)
+        batch_time = (time.perf_counter() - start_time)*1000/args.num_frames
+
+        print(f'{dataset} {width}x{height}: {single_time:.2f} ms/frame single, ' \
+            f'{batch_time:.2f} ms/frame in thread pool')
+
+if __name__ == '__main__':
+    main()
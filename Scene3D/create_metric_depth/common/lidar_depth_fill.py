@@ -1,23 +1,89 @@
 #! /usr/bin/env python3
 import cv2
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
 
-class LidarDepthFill():
-    def __init__(self, depth_map):
+# Kernel schedule of the depth completion - a list of (operation, kernel size,
+# iterations) steps applied in order, where operation is one of 'dilate',
+# 'close' or 'median'. The default dilates sparse lidar points with a 3x3
+# kernel three times, fills holes with a 15x15 morphological close and
+# removes outliers with a 5x5 median blur
+DEFAULT_KERNEL_SCHEDULE = [
+    ('dilate', 3, 3),
+    ('close', 15, 1),
+    ('median', 5, 1)
+]
+
+# Largest kernel size of cv2.medianBlur for float32 input
+MAX_FLOAT_MEDIAN_KERNEL_SIZE = 5
+
+# Number of rows of each tile of the median blur with larger kernels
+MEDIAN_TILE_ROWS = 64
+
+# Median blur of a float32 depth map. cv2.medianBlur only supports kernel
+# sizes up to 5 on float input, larger kernels are applied with a sliding
+# window median over tiles of rows, with replicated borders like cv2.medianBlur
+def medianBlurFloat(depth_map, kernel_size):
+
+    if(kernel_size <= MAX_FLOAT_MEDIAN_KERNEL_SIZE):
+        return cv2.medianBlur(depth_map, kernel_size)
+
+    radius = kernel_size // 2
+    padded_depth_map = np.pad(depth_map, radius, mode='edge')
+    blurred_depth_map = np.empty_like(depth_map)
+
+    for tile_start in range(0, depth_map.shape[0], MEDIAN_TILE_ROWS):
+        tile_end = min(tile_start + MEDIAN_TILE_ROWS, depth_map.shape[0])
+        windows = sliding_window_view( \
+            padded_depth_map[tile_start:tile_end + 2*radius], (kernel_size, kernel_size))
+        blurred_depth_map[tile_start:tile_end] = \
+            np.median(windows.reshape(windows.shape[0], windows.shape[1], -1), axis=2)
+
+    return blurred_depth_map
+
+# Fill in a sparse lidar depth map by applying the steps of a kernel schedule,
+# the depth map is processed as float32
+def fillDepthMap(depth_map, kernel_schedule = DEFAULT_KERNEL_SCHEDULE):
 
-        self.depth_map = depth_map
+    depth_map = np.ascontiguousarray(depth_map, dtype=np.float32)
 
-        # Filter kernels
-        erosion_kernel = np.ones((3,3), np.uint8) 
-        closing_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (15,15))
+    for operation, kernel_size, iterations in kernel_schedule:
+
+        if(operation == 'dilate'):
+            kernel = np.ones((kernel_size, kernel_size), np.uint8)
+            depth_map = cv2.dilate(depth_map, kernel, iterations=iterations)
+
+        elif(operation == 'close'):
+            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
+            depth_map = cv2.morphologyEx(depth_map, cv2.MORPH_CLOSE, kernel, \
+                iterations=iterations)
+
+        elif(operation == 'median'):
+            for _ in range(iterations):
+                depth_map = medianBlurFloat(depth_map, kernel_size)
+
+        else:
+            raise ValueError('Unknown depth fill operation ' + str(operation) + \
+                ' - operation must be dilate, close or median')
+
+    return depth_map
+
+# Fill in a stack of sparse lidar depth maps, given as a list or as an
+# (N, H, W) array, in a pool of threads - OpenCV releases the GIL while
+# filtering so frames are processed in parallel
+def fillDepthMaps(depth_maps, kernel_schedule = DEFAULT_KERNEL_SCHEDULE, num_threads = None):
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        return list(executor.map( \
+            lambda depth_map: fillDepthMap(depth_map, kernel_schedule), depth_maps))
+
+class LidarDepthFill():
+    def __init__(self, depth_map, kernel_schedule = DEFAULT_KERNEL_SCHEDULE):
 
-        # Morphology filters
-        self.depth_map = cv2.dilate(self.depth_map, erosion_kernel, iterations=3) 
-        self.depth_map = cv2.morphologyEx(self.depth_map, cv2.MORPH_CLOSE, closing_kernel)
-        # Median blur
-        self.depth_map = cv2.medianBlur(self.depth_map, 5)
+        # Morphology filters and median blur
+        self.depth_map = fillDepthMap(depth_map, kernel_schedule)
 
     # Get filled in and interpolated lidar depth map
     def getDepthMap(self):
         return self.depth_map
-    
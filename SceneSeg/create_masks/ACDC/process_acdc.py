@@ -5,98 +5,95 @@ from PIL import Image
 import sys
 sys.path.append('../../../')
 from Models.data_utils.check_data import CheckData
-
+from Models.data_utils.colour_remap import ColourRemap
+from Models.data_utils.conversion_driver import ConversionDriver, saveImageAtomic
+
+
+# Colourmaps for classes
+SKY_COLOUR = (61, 184, 255)
+BACKGROUND_OBJECTS_COLOUR = (61, 93, 255)
+VULNERABLE_LIVING_COLOUR = (255, 61, 61)
+SMALL_MOBILE_VEHICLE_COLOUR = (255, 190, 61)
+LARGE_MOBILE_VEHICLE_COLOUR = (255, 116, 61)
+ROAD_EDGE_DELIMITER_COLOUR = (216, 255, 61)
+ROAD_COLOUR = (0, 255, 220)
+
+# ACDC labels and the colours of the combined classes they are assigned to,
+# pixels with any other label are left unlabelled
+REMAP_TABLE = {
+    # SKY
+    (70, 130, 180): SKY_COLOUR,
+
+    # BACKGROUND OBJECTS
+    # Building
+    (70, 70, 70): BACKGROUND_OBJECTS_COLOUR,
+    # Pole
+    (153, 153, 153): BACKGROUND_OBJECTS_COLOUR,
+    # Traffic Light
+    (250, 170, 30): BACKGROUND_OBJECTS_COLOUR,
+    # Traffic Sign
+    (220, 220, 0): BACKGROUND_OBJECTS_COLOUR,
+    # Vegetation
+    (107, 142, 35): BACKGROUND_OBJECTS_COLOUR,
+    # Terrain
+    (152, 251, 152): BACKGROUND_OBJECTS_COLOUR,
+
+    # VULNERABLE LIVING
+    # Person
+    (220, 20, 60): VULNERABLE_LIVING_COLOUR,
+
+    # SMALL MOBILE VEHICLE
+    # Rider
+    (255, 0, 0): SMALL_MOBILE_VEHICLE_COLOUR,
+    # Motorcylce
+    (0, 0, 230): SMALL_MOBILE_VEHICLE_COLOUR,
+    # Bicycle
+    (119, 11, 32): SMALL_MOBILE_VEHICLE_COLOUR,
+
+    # LARGE MOBILE VEHICLE
+    # Car
+    (0, 0, 142): LARGE_MOBILE_VEHICLE_COLOUR,
+    # Truck
+    (0, 0, 70): LARGE_MOBILE_VEHICLE_COLOUR,
+    # Bus
+    (0, 60, 100): LARGE_MOBILE_VEHICLE_COLOUR,
+    # Train
+    (0, 80, 100): LARGE_MOBILE_VEHICLE_COLOUR,
+
+    # ROAD EDGE DELIMITER
+    # Wall
+    (102, 102, 156): ROAD_EDGE_DELIMITER_COLOUR,
+    # Fence
+    (190, 153, 153): ROAD_EDGE_DELIMITER_COLOUR,
+
+    # ROAD
+    (128, 64, 128): ROAD_COLOUR,
+}
+
+# Lookup tables for remapping all pixels of a label at once
+COLOUR_REMAP = ColourRemap(REMAP_TABLE)
 
 # Create coarse semantic segmentation mask
 # of combined classes
 def createMask(colorMap):
+    return COLOUR_REMAP.remapImage(colorMap)
+
+# Create new coarse segmentation mask of a sample and save it with
+# its image, returning the filepaths of the saved outputs
+def processSample(image_filepath, label_filepath, image_save_filepath, label_save_filepath):
+
+    # Open images and pre-existing masks
+    image = Image.open(image_filepath)
+    label = Image.open(label_filepath)
+
+    # Create new Coarse Segmentation mask
+    coarseSegColorMap = createMask(label)
 
-    # Initializing and loading pixel data
-    row, col = colorMap.size
-    px = colorMap.load()
-    coarseSegColorMap = Image.new(mode="RGB", size=(row, col))
-    cx = coarseSegColorMap.load()
-
-    # Colourmaps for classes
-    sky_colour = (61, 184, 255)
-    background_objects_colour = (61, 93, 255)
-    vulnerable_living_colour = (255, 61, 61)
-    small_mobile_vehicle_colour = (255, 190, 61)
-    large_mobile_vehicle_colour = (255, 116, 61)
-    road_edge_delimiter_colour = (216, 255, 61)
-    road_colour = (0, 255, 220)
-
-    # Extracting classes and assigning to colourmap
-    for x in range(row):
-        for y in range(col):
-
-            # SKY
-            if px[x, y] == (70,130,180):
-                cx[x,y] = sky_colour
-
-            # BACKGROUND OBJECTS
-            # Building    
-            elif px[x,y] == (70, 70, 70):
-                cx[x,y] = background_objects_colour
-            # Pole  
-            elif px[x,y] == (153, 153, 153):
-                cx[x,y] = background_objects_colour
-            # Traffic Light
-            elif px[x,y] == (250, 170, 30):
-                cx[x,y] = background_objects_colour 
-            # Traffic Sign
-            elif px[x,y] == (220, 220, 0):
-                cx[x,y] = background_objects_colour 
-            # Vegetation
-            elif px[x,y] == (107, 142, 35):
-                cx[x,y] = background_objects_colour
-            # Terrain
-            elif px[x,y] == (152, 251, 152):
-                cx[x,y] = background_objects_colour
-
-            # VULNERABLE LIVING
-            # Person
-            elif px[x,y] == (220, 20, 60):
-                cx[x,y] = vulnerable_living_colour
-
-            # SMALL MOBILE VEHICLE
-            # Rider
-            elif px[x,y] == (255, 0, 0):
-                cx[x,y] = small_mobile_vehicle_colour
-            # Motorcylce
-            elif px[x,y] == (0, 0, 230):
-                cx[x,y] = small_mobile_vehicle_colour
-            # Bicycle
-            elif px[x,y] == (119, 11, 32):
-                cx[x,y] = small_mobile_vehicle_colour
-
-            # LARGE MOBILE VEHICLE
-            # Car
-            elif px[x,y] == (0, 0, 142):
-                cx[x,y] = large_mobile_vehicle_colour
-            # Truck
-            elif px[x,y] == (0, 0, 70):
-                cx[x,y] = large_mobile_vehicle_colour
-            # Bus
-            elif px[x,y] == (0, 60, 100):
-                cx[x,y] = large_mobile_vehicle_colour
-            # Train
-            elif px[x,y] == (0, 80, 100):
-                cx[x,y] = large_mobile_vehicle_colour
-            
-            # ROAD EDGE DELIMITER
-            # Wall
-            elif px[x,y] == (102, 102, 156):
-                cx[x,y] = road_edge_delimiter_colour
-            # Fence
-            elif px[x,y] == (190, 153, 153):
-                cx[x,y] = road_edge_delimiter_colour
-
-            # ROAD
-            elif px[x,y] == (128, 64, 128):
-                cx[x,y] = road_colour
-
-    return coarseSegColorMap
+    # Save images
+    saveImageAtomic(image, image_save_filepath, "PNG")
+    saveImageAtomic(coarseSegColorMap, label_save_filepath, "PNG")
+
+    return [image_save_filepath, label_save_filepath]
 
 def main():
 
@@ -105,6 +102,7 @@ def main():
     parser.add_argument("-i", "--images", dest="images_filepath", help="path to folder with input images")
     parser.add_argument("-ls", "--labels-save", dest="labels_save_path", help="path to folder where processed labels will be saved")
     parser.add_argument("-is", "--images-save", dest="images_save_path", help="path to folder where corresponding images will be saved")
+    parser.add_argument("-w", "--num_workers", dest="num_workers", type=int, default=None, help="number of worker processes, defaults to the number of CPUs")
     args = parser.parse_args()
 
     # Paths to read input images and ground truth label masks from training data
@@ -132,23 +130,18 @@ def main():
 
         print('Beginning processing of data')
 
-        # Looping through data
+        # Tasks identified by output index and input label
+        tasks = []
         for index in range(0, num_images):
-            
-            # Open images and pre-existing masks
-            image = Image.open(str(images[index]))
-            label = Image.open(str(labels[index]))
-
-            # Create new Coarse Segmentation mask
-            coarseSegColorMap = createMask(label)
-            
-            # Save images
-            image.save(images_save_path + str(index) + ".png","PNG")
-            coarseSegColorMap.save(labels_save_path + str(index) + ".png","PNG")
-
-            print(f'Processing image {index} of {num_images-1}')
-    
-        print('----- Processing complete -----') 
+            task_id = str(index) + ':' + labels[index].name
+            tasks.append((task_id, (str(images[index]), str(labels[index]), \
+                images_save_path + str(index) + ".png", labels_save_path + str(index) + ".png")))
+
+        # Process samples in parallel, skipping samples completed by an earlier run
+        driver = ConversionDriver(labels_save_path + 'conversion_manifest.jsonl', args.num_workers)
+        driver.run(processSample, tasks)
+
+        print('----- Processing complete -----')
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -2,82 +2,151 @@
 import pathlib
 from argparse import ArgumentParser
 import json
-from PIL import Image, ImageDraw
+import numpy as np
+import cv2
+from PIL import Image
 import sys
 sys.path.append('../../../')
 from Models.data_utils.check_data import CheckData
-
+from Models.data_utils.conversion_driver import ConversionDriver, saveImageAtomic
+
+
+# Colourmaps for classes
+SKY_COLOUR = (61, 184, 255)
+BACKGROUND_OBJECTS_COLOUR = (61, 93, 255)
+VULNERABLE_LIVING_COLOUR = (255, 61, 61)
+SMALL_MOBILE_VEHICLE_COLOUR = (255, 190, 61)
+LARGE_MOBILE_VEHICLE_COLOUR = (255, 116, 61)
+ROAD_EDGE_DELIMITER_COLOUR = (216, 255, 61)
+ROAD_COLOUR = (0, 255, 220)
+
+# IDDAW object labels and the colours of the combined classes they are
+# assigned to, objects with any other label are not drawn
+LABEL_COLOURS = {
+    # SKY
+    'sky': SKY_COLOUR,
+
+    # BACKGROUND OBJECTS
+    'billboard': BACKGROUND_OBJECTS_COLOUR,
+    'traffic sign': BACKGROUND_OBJECTS_COLOUR,
+    'traffic light': BACKGROUND_OBJECTS_COLOUR,
+    'pole': BACKGROUND_OBJECTS_COLOUR,
+    'obs-str-bar-fallback': BACKGROUND_OBJECTS_COLOUR,
+    'building': BACKGROUND_OBJECTS_COLOUR,
+    'bridge': BACKGROUND_OBJECTS_COLOUR,
+    'vegetation': BACKGROUND_OBJECTS_COLOUR,
+    'fallback background': BACKGROUND_OBJECTS_COLOUR,
+    'parking': BACKGROUND_OBJECTS_COLOUR,
+    'drivable-fallback': BACKGROUND_OBJECTS_COLOUR,
+    'sidewalk': BACKGROUND_OBJECTS_COLOUR,
+    'non-drivable fallback': BACKGROUND_OBJECTS_COLOUR,
+
+    # ROAD
+    'road': ROAD_COLOUR,
+
+    # ROAD EDGE DELIMITER
+    'curb': ROAD_EDGE_DELIMITER_COLOUR,
+    'wall': ROAD_EDGE_DELIMITER_COLOUR,
+    'fence': ROAD_EDGE_DELIMITER_COLOUR,
+    'guard rail': ROAD_EDGE_DELIMITER_COLOUR,
+
+    # VULNERABLE LIVING
+    'person': VULNERABLE_LIVING_COLOUR,
+    'animal': VULNERABLE_LIVING_COLOUR,
+
+    # SMALL MOBILE VEHICLE
+    'rider': SMALL_MOBILE_VEHICLE_COLOUR,
+    'motorcycle': SMALL_MOBILE_VEHICLE_COLOUR,
+    'bicycle': SMALL_MOBILE_VEHICLE_COLOUR,
+
+    # LARGE MOBILE VEHICLE
+    'autorickshaw': LARGE_MOBILE_VEHICLE_COLOUR,
+    'car': LARGE_MOBILE_VEHICLE_COLOUR,
+    'truck': LARGE_MOBILE_VEHICLE_COLOUR,
+    'bus': LARGE_MOBILE_VEHICLE_COLOUR,
+    'caravan': LARGE_MOBILE_VEHICLE_COLOUR,
+    'vehicle fallback': LARGE_MOBILE_VEHICLE_COLOUR,
+}
+
+# Group consecutive polygons of the same colour into batches which are drawn
+# with a single call. cv2.fillPoly fills overlapping polygons of one call with
+# the even-odd rule, so a polygon whose bounding box overlaps that of a polygon
+# in the current batch starts a new batch - batches are drawn in annotation
+# order, which preserves the z-order of the annotations
+def getPolygonBatches(polygons, colour_ids, polygon_min, polygon_max):
+
+    batches = []
+    batch_start = 0
+
+    for index in range(1, len(polygons) + 1):
+
+        if(index < len(polygons) and colour_ids[index] == colour_ids[batch_start]):
+            is_overlapping = np.any(np.all( \
+                (polygon_min[index] <= polygon_max[batch_start:index]) & \
+                (polygon_max[index] >= polygon_min[batch_start:index]), axis=1))
+            if(not is_overlapping):
+                continue
+
+        batches.append((colour_ids[batch_start], polygons[batch_start:index]))
+        batch_start = index
+
+    return batches
 
 # Create coarse semantic segmentation mask
 # of combined classes
 def createMask(json_filepath, row, col):
-    
+
     # Initializing colormap
-    coarseSegColorMap = Image.new(mode="RGB", size=(row, col))
-    draw = ImageDraw.Draw(coarseSegColorMap) 
-
-    # Colourmaps for classes
-    sky_colour = (61, 184, 255)
-    background_objects_colour = (61, 93, 255)
-    vulnerable_living_colour = (255, 61, 61)
-    small_mobile_vehicle_colour = (255, 190, 61)
-    large_mobile_vehicle_colour = (255, 116, 61)
-    road_edge_delimiter_colour = (216, 255, 61)
-    road_colour = (0, 255, 220)
+    coarseSegColorMap = np.zeros((col, row, 3), dtype=np.uint8)
 
-    
     # Open json file and get object labels and polygon points
-    with open(json_filepath, 'r') as file: 
+    with open(json_filepath, 'r') as file:
         annotations = json.load(file)
-        
-        for obj in annotations['objects']:
-            
-            label = obj['label']
-            polygon = obj['polygon']
-            coordinates = []
-
-            for i in range(0, len(polygon)):
-                    polygon[i][0] = int(polygon[i][0])
-                    polygon[i][1] = int(polygon[i][1])
-                    coordinates.append(int(polygon[i][0]))
-                    coordinates.append(int(polygon[i][1]))
-
-            # If there is a valid label
-            if(len(polygon) > 1):
-                # SKY
-                if label == 'sky':
-                    draw.polygon(coordinates, fill = sky_colour, outline = sky_colour) 
-
-                # BACKGROUND OBJECTS
-                elif label == 'billboard' or label == 'traffic sign' or label == 'traffic light' or \
-                    label == 'pole' or label == 'obs-str-bar-fallback' or label == 'building' or \
-                    label == 'bridge' or label == 'vegetation' or label == 'fallback background' or \
-                    label == 'parking' or label == 'drivable-fallback' or label == 'sidewalk' or \
-                    label == 'non-drivable fallback':
-                    draw.polygon(coordinates, fill = background_objects_colour, outline = background_objects_colour) 
-
-                # ROAD
-                elif label == 'road':
-                    draw.polygon(coordinates, fill = road_colour, outline = road_colour) 
-
-                # ROAD EDGE DELIMITER
-                elif label == 'curb' or label == 'wall' or label == 'fence' or label == 'guard rail':
-                    draw.polygon(coordinates, fill = road_edge_delimiter_colour, outline = road_edge_delimiter_colour) 
-                
-                # VULNERABLE LIVING
-                elif label == 'person' or label == 'animal':
-                    draw.polygon(coordinates, fill = vulnerable_living_colour, outline = vulnerable_living_colour) 
-
-                # SMALL MOBILE VEHICLE
-                elif label == 'rider' or label == 'motorcycle' or label == 'bicycle':
-                    draw.polygon(coordinates, fill = small_mobile_vehicle_colour, outline = small_mobile_vehicle_colour) 
-
-                # LARGE MOBILE VEHICLE
-                elif label == 'autorickshaw' or label == 'car' or label == 'truck' or label == 'bus' or \
-                    label == 'caravan' or label == 'vehicle fallback':
-                    draw.polygon(coordinates, fill = large_mobile_vehicle_colour, outline = large_mobile_vehicle_colour) 
-
-    return coarseSegColorMap
+
+    # Objects with a valid label in annotation order
+    objects = [obj for obj in annotations['objects'] \
+        if obj['label'] in LABEL_COLOURS and len(obj['polygon']) > 1]
+
+    if(len(objects) == 0):
+        return Image.fromarray(coarseSegColorMap)
+
+    colour_ids = [LABEL_COLOURS[obj['label']] for obj in objects]
+
+    # Vertices of all polygons converted at once, truncated to integer pixel coordinates
+    num_vertices = np.array([len(obj['polygon']) for obj in objects])
+    vertices = np.array([vertex for obj in objects for vertex in obj['polygon']], \
+        dtype=np.float64).astype(np.int32)
+
+    polygon_start = np.concatenate(([0], np.cumsum(num_vertices)[:-1]))
+    polygons = np.split(vertices, polygon_start[1:])
+    polygon_min = np.minimum.reduceat(vertices, polygon_start, axis=0)
+    polygon_max = np.maximum.reduceat(vertices, polygon_start, axis=0)
+
+    # Fill polygons and draw their outlines
+    for colour, batch in getPolygonBatches(polygons, colour_ids, polygon_min, polygon_max):
+        cv2.fillPoly(coarseSegColorMap, batch, colour)
+        cv2.polylines(coarseSegColorMap, batch, True, colour)
+
+    return Image.fromarray(coarseSegColorMap)
+
+# Create new coarse segmentation mask of a sample and save it with
+# its image, returning the filepaths of the saved outputs
+def processSample(image_filepath, json_filepath, image_save_filepath, label_save_filepath):
+
+    # Open images
+    image = Image.open(image_filepath)
+
+    # Get image size
+    row, col = image.size
+
+    # Create new Coarse Segmentation mask
+    coarseSegColorMap = createMask(json_filepath, row, col)
+
+    # Save images
+    saveImageAtomic(image, image_save_filepath, "PNG")
+    saveImageAtomic(coarseSegColorMap, label_save_filepath, "PNG")
+
+    return [image_save_filepath, label_save_filepath]
 
 def main():
 
@@ -86,6 +155,7 @@ def main():
     parser.add_argument("-i", "--images", dest="images_filepath", help="path to folder with input images")
     parser.add_argument("-ls", "--labels-save", dest="labels_save_path", help="path to folder where processed labels will be saved")
     parser.add_argument("-is", "--images-save", dest="images_save_path", help="path to folder where corresponding images will be saved")
+    parser.add_argument("-w", "--num_workers", dest="num_workers", type=int, default=None, help="number of worker processes, defaults to the number of CPUs")
     args = parser.parse_args()
 
     # Paths to read input images and ground truth label masks from training data
@@ -113,26 +183,18 @@ def main():
 
         print('Beginning processing of data')
 
-        # Looping through data
+        # Tasks identified by output index and input json file
+        tasks = []
         for index in range(0, num_images):
+            task_id = str(index) + ':' + labels[index].name
+            tasks.append((task_id, (str(images[index]), str(labels[index]), \
+                images_save_path + str(index) + ".png", labels_save_path + str(index) + ".png")))
 
-            # Open images and json files
-            image = Image.open(str(images[index]))
-            json_filepath = str(labels[index])
-
-            # Get image size
-            row, col = image.size
-
-            # Create new Coarse Segmentation mask
-            coarseSegColorMap = createMask(json_filepath, row, col)
+        # Process samples in parallel, skipping samples completed by an earlier run
+        driver = ConversionDriver(labels_save_path + 'conversion_manifest.jsonl', args.num_workers)
+        driver.run(processSample, tasks)
 
-            # Save images
-            image.save(images_save_path + str(index) + ".png","PNG")
-            coarseSegColorMap.save(labels_save_path + str(index) + ".png","PNG")
-
-            print(f'Processing image {index} of {num_images-1}')
-    
-        print('----- Processing complete -----')             
+        print('----- Processing complete -----')
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
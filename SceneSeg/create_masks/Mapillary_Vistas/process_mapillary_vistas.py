@@ -5,248 +5,216 @@ from PIL import Image
 import sys
 sys.path.append('../../../')
 from Models.data_utils.check_data import CheckData
+from Models.data_utils.colour_remap import ColourRemap
+from Models.data_utils.conversion_driver import ConversionDriver, saveImageAtomic
+
+# Colourmaps for classes
+SKY_COLOUR = (61, 184, 255)
+BACKGROUND_OBJECTS_COLOUR = (61, 93, 255)
+VULNERABLE_LIVING_COLOUR = (255, 61, 61)
+SMALL_MOBILE_VEHICLE_COLOUR = (255, 190, 61)
+LARGE_MOBILE_VEHICLE_COLOUR = (255, 116, 61)
+ROAD_EDGE_DELIMITER_COLOUR = (216, 255, 61)
+ROAD_COLOUR = (0, 255, 220)
+
+# Mapillary Vistas labels and the colours of the combined classes they are assigned to,
+# pixels with any other label are left unlabelled
+REMAP_TABLE = {
+    # SKY
+    27: SKY_COLOUR,
+
+    # BACKGROUND OBJECTS
+    # Building
+    17: BACKGROUND_OBJECTS_COLOUR,
+    # Pole
+    45: BACKGROUND_OBJECTS_COLOUR,
+    47: BACKGROUND_OBJECTS_COLOUR,
+    # Traffic Light
+    48: BACKGROUND_OBJECTS_COLOUR,
+    # Traffic Sign
+    50: BACKGROUND_OBJECTS_COLOUR,
+    # Traffic Sign Back
+    49: BACKGROUND_OBJECTS_COLOUR,
+    # Traffic Sign Frame
+    46: BACKGROUND_OBJECTS_COLOUR,
+    # Vegetation
+    30: BACKGROUND_OBJECTS_COLOUR,
+    # Terrain
+    29: BACKGROUND_OBJECTS_COLOUR,
+    # Bird
+    0: BACKGROUND_OBJECTS_COLOUR,
+    # Parking
+    10: BACKGROUND_OBJECTS_COLOUR,
+    # Pedestrian Area
+    11: BACKGROUND_OBJECTS_COLOUR,
+    # Rail Track
+    12: BACKGROUND_OBJECTS_COLOUR,
+    # Sidewalk
+    15: BACKGROUND_OBJECTS_COLOUR,
+    # Bridge
+    16: BACKGROUND_OBJECTS_COLOUR,
+    # Tunnel
+    18: BACKGROUND_OBJECTS_COLOUR,
+    # Mountain
+    25: BACKGROUND_OBJECTS_COLOUR,
+    # Sand
+    26: BACKGROUND_OBJECTS_COLOUR,
+    # Snow
+    28: BACKGROUND_OBJECTS_COLOUR,
+    # Water
+    31: BACKGROUND_OBJECTS_COLOUR,
+    # Banner
+    32: BACKGROUND_OBJECTS_COLOUR,
+    # Bench
+    33: BACKGROUND_OBJECTS_COLOUR,
+    # Bike Rack
+    34: BACKGROUND_OBJECTS_COLOUR,
+    # Billboard
+    35: BACKGROUND_OBJECTS_COLOUR,
+    # CCTV Camera
+    37: BACKGROUND_OBJECTS_COLOUR,
+    # Fire Hydrant
+    38: BACKGROUND_OBJECTS_COLOUR,
+    # Junction Box
+    39: BACKGROUND_OBJECTS_COLOUR,
+    # Mail Box
+    40: BACKGROUND_OBJECTS_COLOUR,
+    # Phone Booth
+    42: BACKGROUND_OBJECTS_COLOUR,
+    # Pothole
+    43: BACKGROUND_OBJECTS_COLOUR,
+    # Street Light
+    44: BACKGROUND_OBJECTS_COLOUR,
+    # Trash Can
+    51: BACKGROUND_OBJECTS_COLOUR,
+    # Ego Vehicle
+    63: BACKGROUND_OBJECTS_COLOUR,
+    64: BACKGROUND_OBJECTS_COLOUR,
+
+    # VULNERABLE LIVING
+    # Person
+    19: VULNERABLE_LIVING_COLOUR,
+    # Animal
+    1: VULNERABLE_LIVING_COLOUR,
+
+    # SMALL MOBILE VEHICLE
+    # Rider
+    20: SMALL_MOBILE_VEHICLE_COLOUR,
+    21: SMALL_MOBILE_VEHICLE_COLOUR,
+    22: SMALL_MOBILE_VEHICLE_COLOUR,
+    # Motorcylce
+    57: SMALL_MOBILE_VEHICLE_COLOUR,
+    # Bicycle
+    52: SMALL_MOBILE_VEHICLE_COLOUR,
+
+    # LARGE MOBILE VEHICLE
+    # Car
+    55: LARGE_MOBILE_VEHICLE_COLOUR,
+    # Truck
+    61: LARGE_MOBILE_VEHICLE_COLOUR,
+    # Bus
+    54: LARGE_MOBILE_VEHICLE_COLOUR,
+    # Train
+    58: LARGE_MOBILE_VEHICLE_COLOUR,
+    # Boat
+    53: LARGE_MOBILE_VEHICLE_COLOUR,
+    # Caravan
+    56: LARGE_MOBILE_VEHICLE_COLOUR,
+    # Other Vehicle
+    59: LARGE_MOBILE_VEHICLE_COLOUR,
+    # Trailer
+    60: LARGE_MOBILE_VEHICLE_COLOUR,
+    # Wheeled slow
+    62: LARGE_MOBILE_VEHICLE_COLOUR,
+
+    # ROAD EDGE DELIMITER
+    # Curb
+    2: ROAD_EDGE_DELIMITER_COLOUR,
+    # Wall
+    6: ROAD_EDGE_DELIMITER_COLOUR,
+    # Fence
+    3: ROAD_EDGE_DELIMITER_COLOUR,
+    # Guard Rail
+    4: ROAD_EDGE_DELIMITER_COLOUR,
+    # Barrier
+    5: ROAD_EDGE_DELIMITER_COLOUR,
+    # Curb Cut
+    9: ROAD_EDGE_DELIMITER_COLOUR,
+
+    # ROAD
+    13: ROAD_COLOUR,
+    # Bike Lane
+    7: ROAD_COLOUR,
+    # Cross Walk
+    8: ROAD_COLOUR,
+    # Service Lane
+    14: ROAD_COLOUR,
+    # Cross Walk Lane Marking
+    23: ROAD_COLOUR,
+    # General Lane Marking
+    24: ROAD_COLOUR,
+    # Catch Basin
+    36: ROAD_COLOUR,
+    # Man Hole
+    41: ROAD_COLOUR,
+}
+
+# Lookup tables for remapping all pixels of a label at once
+COLOUR_REMAP = ColourRemap(REMAP_TABLE)
+
+# Labels used for checking validity of image for on-road scene
+ROAD_LABELS = [13]
+DRIVABLE_OTHER_LABELS = [10, 11, 12, 15]
+
+# Snow images in this dataset conflict with
+# snow images in other datasets especially
+# for snowy road surfaces
+SNOW_LABELS = [28]
 
 # Create coarse semantic segmentation mask
 # of combined classes
 def createMask(colorMap):
 
-    # Initializing and loading pixel data
-    row, col = colorMap.size
-    px = colorMap.load()
-    coarseSegColorMap = Image.new(mode="RGB", size=(row, col))
-    cx = coarseSegColorMap.load()
-
-    # Colourmaps for classes
-    sky_colour = (61, 184, 255)
-    background_objects_colour = (61, 93, 255)
-    vulnerable_living_colour = (255, 61, 61)
-    small_mobile_vehicle_colour = (255, 190, 61)
-    large_mobile_vehicle_colour = (255, 116, 61)
-    road_edge_delimiter_colour = (216, 255, 61)
-    road_colour = (0, 255, 220)
+    coarseSegColorMap = COLOUR_REMAP.remapImage(colorMap)
 
+    # Checking validity of image for on-road scene
     is_valid_image = True
-    road_sum = 0
-    drivable_other_sum = 0
-    
-    # Extracting classes and assigning to colourmap
-    for x in range(row):
-        for y in range(col):
-                       
-            # SKY
-            if px[x,y] == 27:
-                cx[x,y] = sky_colour
-
-            # BACKGROUND OBJECTS
-            # Building    
-            elif px[x,y] == 17:
-                cx[x,y] = background_objects_colour
-            # Pole  
-            elif px[x,y] == 45 or px[x,y] == 47:
-                cx[x,y] = background_objects_colour
-            # Traffic Light
-            elif px[x,y] == 48:
-                cx[x,y] = background_objects_colour 
-            # Traffic Sign
-            elif px[x,y] == 50:
-                cx[x,y] = background_objects_colour 
-            # Traffic Sign Back
-            elif px[x,y] == 49:
-                cx[x,y] = background_objects_colour 
-            # Traffic Sign Frame
-            elif px[x,y] == 46:
-                cx[x,y] = background_objects_colour
-            # Vegetation
-            elif px[x,y] == 30:
-                cx[x,y] = background_objects_colour
-            # Terrain
-            elif px[x,y] == 29:
-                cx[x,y] = background_objects_colour
-            # Bird
-            elif px[x,y] == 0:
-                cx[x,y] = background_objects_colour
-            # Parking
-            elif px[x,y] == 10:
-                cx[x,y] = background_objects_colour
-                # Checking Validity of Image for on-road scene
-                drivable_other_sum += 1
-            # Pedestrian Area
-            elif px[x,y] == 11:
-                cx[x,y] = background_objects_colour
-                # Checking Validity of Image for on-road scene
-                drivable_other_sum += 1
-            # Rail Track
-            elif px[x,y] == 12:
-                cx[x,y] = background_objects_colour
-                # Checking Validity of Image for on-road scene
-                drivable_other_sum += 1
-            # Sidewalk
-            elif px[x,y] == 15:
-                cx[x,y] = background_objects_colour
-                # Checking Validity of Image for on-road scene
-                drivable_other_sum += 1
-            # Bridge
-            elif px[x,y] == 16:
-                cx[x,y] = background_objects_colour
-            # Tunnel
-            elif px[x,y] == 18:
-                cx[x,y] = background_objects_colour   
-            # Mountain
-            elif px[x,y] == 25:
-                cx[x,y] = background_objects_colour
-            # Sand
-            elif px[x,y] == 26:
-               cx[x,y] = background_objects_colour
-            # Snow
-            elif px[x,y] == 28:
-                cx[x,y] = background_objects_colour
-                # Snow images in this dataset conflict with
-                # snow images in other datasets especially
-                # for snowy road surfaces
-                is_valid_image = False
-            # Water
-            elif px[x,y] == 31:
-                cx[x,y] = background_objects_colour
-            # Banner
-            elif px[x,y] == 32:
-                cx[x,y] = background_objects_colour
-            # Bench
-            elif px[x,y] == 33:
-                cx[x,y] = background_objects_colour
-            # Bike Rack
-            elif px[x,y] == 34:
-                cx[x,y] = background_objects_colour
-            # Billboard
-            elif px[x,y] == 35:
-                cx[x,y] = background_objects_colour
-            # CCTV Camera
-            elif px[x,y] == 37:
-                cx[x,y] = background_objects_colour 
-            # Fire Hydrant
-            elif px[x,y] == 38:
-                cx[x,y] = background_objects_colour 
-            # Junction Box
-            elif px[x,y] == 39:
-                cx[x,y] = background_objects_colour 
-            # Mail Box
-            elif px[x,y] == 40:
-                cx[x,y] = background_objects_colour 
-            # Phone Booth
-            elif px[x,y] == 42:
-                cx[x,y] = background_objects_colour  
-            # Pothole
-            elif px[x,y] == 43:
-                cx[x,y] = background_objects_colour
-            # Street Light
-            elif px[x,y] == 44:
-                cx[x,y] = background_objects_colour
-            # Trash Can
-            elif px[x,y] == 51:
-                cx[x,y] = background_objects_colour
-            # Ego Vehicle
-            elif px[x,y] == 63 or px[x,y] == 64:
-                cx[x,y] = background_objects_colour
-
-            # VULNERABLE LIVING
-            # Person
-            elif px[x,y] == 19:
-                cx[x,y] = vulnerable_living_colour
-            # Animal
-            elif px[x,y] == 1:
-                cx[x,y] = vulnerable_living_colour    
-
-            # SMALL MOBILE VEHICLE
-            # Rider
-            elif px[x,y] == 20 or px[x,y] == 21 \
-                or px[x,y] == 22:
-                cx[x,y] = small_mobile_vehicle_colour
-            # Motorcylce
-            elif px[x,y] == 57:
-                cx[x,y] = small_mobile_vehicle_colour
-            # Bicycle
-            elif px[x,y] == 52:
-                cx[x,y] = small_mobile_vehicle_colour
-
-            # LARGE MOBILE VEHICLE
-            # Car
-            elif px[x,y] == 55:
-                cx[x,y] = large_mobile_vehicle_colour
-            # Truck
-            elif px[x,y] == 61:
-                cx[x,y] = large_mobile_vehicle_colour
-            # Bus
-            elif px[x,y] == 54:
-                cx[x,y] = large_mobile_vehicle_colour
-            # Train
-            elif px[x,y] == 58:
-                cx[x,y] = large_mobile_vehicle_colour
-            # Boat
-            elif px[x,y] == 53:
-                cx[x,y] = large_mobile_vehicle_colour
-            # Caravan
-            elif px[x,y] == 56:
-                cx[x,y] = large_mobile_vehicle_colour
-            # Other Vehicle
-            elif px[x,y] == 59:
-                cx[x,y] = large_mobile_vehicle_colour
-            # Trailer
-            elif px[x,y] == 60:
-                cx[x,y] = large_mobile_vehicle_colour
-            # Wheeled slow
-            elif px[x,y] == 62:
-               cx[x,y] = large_mobile_vehicle_colour 
-            
-            # ROAD EDGE DELIMITER
-            # Curb
-            elif px[x,y] == 2:
-                cx[x,y] = road_edge_delimiter_colour
-            # Wall
-            elif px[x,y] == 6:
-                cx[x,y] = road_edge_delimiter_colour
-            # Fence
-            elif px[x,y] == 3:
-                cx[x,y] = road_edge_delimiter_colour
-            # Guard Rail
-            elif px[x,y] == 4:
-                cx[x,y] = road_edge_delimiter_colour
-            # Barrier
-            elif px[x,y] == 5:
-                cx[x,y] = road_edge_delimiter_colour
-            # Curb Cut
-            elif px[x,y] == 9:
-                cx[x,y] = road_edge_delimiter_colour
-
-            # ROAD
-            elif px[x,y] == 13:
-                cx[x,y] = road_colour
-                road_sum+=1
-            # Bike Lane
-            elif px[x,y] == 7:
-                cx[x,y] = road_colour   
-            # Cross Walk 
-            elif px[x,y] == 8:
-                cx[x,y] = road_colour     
-            # Service Lane
-            elif px[x,y] == 14:
-                cx[x,y] = road_colour   
-            # Cross Walk Lane Marking
-            elif px[x,y] == 23:
-                cx[x,y] = road_colour   
-            # General Lane Marking 
-            elif px[x,y] == 24:
-                cx[x,y] = road_colour 
-            # Catch Basin  
-            elif px[x,y] == 36:
-               cx[x,y] = road_colour 
-            # Man Hole
-            elif px[x,y] == 41:
-               cx[x,y] = road_colour  
+    road_sum = COLOUR_REMAP.countPixels(colorMap, ROAD_LABELS)
+    drivable_other_sum = COLOUR_REMAP.countPixels(colorMap, DRIVABLE_OTHER_LABELS)
+
+    if(COLOUR_REMAP.countPixels(colorMap, SNOW_LABELS) > 0):
+        is_valid_image = False
 
     if (road_sum <= drivable_other_sum):
         is_valid_image = False
 
     return coarseSegColorMap, is_valid_image
 
+# Create new coarse segmentation mask of a sample at half resolution and
+# save it with its image if the image is valid, returning the filepaths
+# of the saved outputs
+def processSample(image_filepath, label_filepath, image_save_filepath, label_save_filepath):
+
+    # Open images and pre-existing masks
+    image = Image.open(image_filepath)
+    label = Image.open(label_filepath)
+
+    row, col = image.size
+    half_res = (int(row/2), int(col/2))
+    image = image.resize(half_res)
+    label = label.resize(half_res)
+
+    # Create new Coarse Segmentation mask
+    coarseSegColorMap, is_valid_image = createMask(label)
+
+    # Save images
+    if(is_valid_image):
+        saveImageAtomic(image, image_save_filepath, "PNG")
+        saveImageAtomic(coarseSegColorMap, label_save_filepath, "PNG")
+        return [image_save_filepath, label_save_filepath]
+
+    return []
+
 def main():
 
     parser = ArgumentParser()
@@ -254,6 +222,7 @@ def main():
     parser.add_argument("-i", "--images", dest="images_filepath", help="path to folder with input images")
     parser.add_argument("-ls", "--labels-save", dest="labels_save_path", help="path to folder where processed labels will be saved")
     parser.add_argument("-is", "--images-save", dest="images_save_path", help="path to folder where corresponding images will be saved")
+    parser.add_argument("-w", "--num_workers", dest="num_workers", type=int, default=None, help="number of worker processes, defaults to the number of CPUs")
     args = parser.parse_args()
 
     # Paths to read input images and ground truth label masks from training data
@@ -281,27 +250,16 @@ def main():
 
         print('Beginning processing of data')
 
-        # Looping through data
+        # Tasks identified by output index and input label
+        tasks = []
         for index in range(0, num_images):
-            
-            # Open images and pre-existing masks
-            image = Image.open(str(images[index]))
-            label = Image.open(str(labels[index]))
-
-            row, col = image.size
-            half_res = (int(row/2), int(col/2))
-            image = image.resize(half_res)
-            label = label.resize(half_res)
-
-            # Create new Coarse Segmentation mask
-            coarseSegColorMap, is_valid_image = createMask(label)
-
-            # Save images
-            if(is_valid_image):
-                image.save(images_save_path + str(index) + ".png","PNG")
-                coarseSegColorMap.save(labels_save_path + str(index) + ".png","PNG")
+            task_id = str(index) + ':' + labels[index].name
+            tasks.append((task_id, (str(images[index]), str(labels[index]), \
+                images_save_path + str(index) + ".png", labels_save_path + str(index) + ".png")))
 
-            print(f'Processing image {index} of {num_images-1}')
+        # Process samples in parallel, skipping samples completed by an earlier run
+        driver = ConversionDriver(labels_save_path + 'conversion_manifest.jsonl', args.num_workers)
+        driver.run(processSample, tasks)
 
         print('----- Processing complete -----')
 
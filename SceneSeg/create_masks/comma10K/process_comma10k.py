@@ -1,89 +1,94 @@
 #! /usr/bin/env python3
 import pathlib
+import numpy as np
 from argparse import ArgumentParser
 from PIL import Image
 import sys
 sys.path.append('../../../')
 from Models.data_utils.check_data import CheckData
+from Models.data_utils.colour_remap import ColourRemap
+from Models.data_utils.conversion_driver import ConversionDriver, saveImageAtomic
 
 
-# Create coarse semantic segmentation mask
-# of combined classes
-def createMask(colorMap, skyMap):
+# Colourmaps for classes
+BACKGROUND_OBJECTS_COLOUR = (61, 93, 255)
+FOREGROUND_OBJECTS_COLOUR = (255, 28, 145)
+ROAD_COLOUR = (0, 255, 220)
+SKY_COLOUR = (61, 184, 255)
 
-    # Initializing and loading pixel data
-    row, col = colorMap.size
-    px = colorMap.load()
+# comma10K labels and the colours of the combined classes they are assigned to,
+# given as label IDs for palette labels and as colours for RGB labels - pixels
+# with any other label are left unlabelled
+REMAP_TABLE = {
+    # BACKGROUND OBJECTS
+    2: BACKGROUND_OBJECTS_COLOUR,
 
-    # Loading and resizing sky pixel mask
-    skyMap = skyMap.resize((row,col))
-    ps = skyMap.load()
+    # EGO VEHICLE
+    4: BACKGROUND_OBJECTS_COLOUR,
 
-    coarseSegColorMap = Image.new(mode="RGB", size=(row, col))
-    cx = coarseSegColorMap.load()
+    # MOVABLE OBJECTS
+    1: FOREGROUND_OBJECTS_COLOUR,
 
-    # Colourmaps for classes
-    background_objects_colour = (61, 93, 255)
-    foreground_objects_colour = (255, 28, 145)
-    road_colour = (0, 255, 220)
-    sky_colour = (61, 184, 255)
+    # LANE MARKINGS
+    0: ROAD_COLOUR,
 
+    # ROAD
+    3: ROAD_COLOUR,
 
-    # Extracting classes and assigning to colourmap
-    for x in range(row):
-        for y in range(col):
+    # BACKGROUND OBJECTS
+    (128, 128, 96): BACKGROUND_OBJECTS_COLOUR,
 
-            if type(px[x,y]) == int:
-                # BACKGROUND OBJECTS
-                if px[x,y] == 2:
-                    cx[x,y] = background_objects_colour
+    # EGO VEHICLE
+    (204, 0, 255): BACKGROUND_OBJECTS_COLOUR,
 
-                # EGO VEHICLE
-                elif px[x,y] == 4:
-                    cx[x,y] = background_objects_colour
+    # MOVABLE OBJECTS
+    (0, 255, 102): FOREGROUND_OBJECTS_COLOUR,
 
-                # MOVABLE OBJECTS
-                elif px[x,y] == 1:
-                    cx[x,y] = foreground_objects_colour
+    # LANE MARKINGS
+    (255, 0, 0): ROAD_COLOUR,
 
-                # LANE MARKINGS
-                elif px[x,y] == 0:
-                    cx[x,y] = road_colour
+    # ROAD
+    (64, 32, 32): ROAD_COLOUR,
+}
 
-                # ROAD
-                elif px[x,y] == 3:
-                    cx[x,y] = road_colour
+# Lookup tables for remapping all pixels of a label at once
+COLOUR_REMAP = ColourRemap(REMAP_TABLE)
 
-                # SKY
-                if ps[x,y] == sky_colour:
-                    cx[x,y] = sky_colour
+# Create coarse semantic segmentation mask
+# of combined classes
+def createMask(colorMap, skyMap):
+
+    row, col = colorMap.size
+    coarseSegColorMap = COLOUR_REMAP.remap(colorMap)
 
-            else:
-                # BACKGROUND OBJECTS   
-                if px[x,y][0:3] == (128, 128, 96):
-                    cx[x,y] = background_objects_colour
+    # Loading and resizing sky pixel mask
+    skyMap = np.asarray(skyMap.resize((row,col)))
+
+    # SKY
+    if(skyMap.ndim == 3 and skyMap.shape[2] == 3):
+        is_sky = np.all(skyMap == SKY_COLOUR, axis=2)
+        coarseSegColorMap[is_sky] = SKY_COLOUR
 
-                # EGO VEHICLE
-                elif px[x,y][0:3] == (204, 0, 255):
-                    cx[x,y] = background_objects_colour
+    return Image.fromarray(coarseSegColorMap, mode='RGB')
 
-                # MOVABLE OBJECTS
-                elif px[x,y][0:3] == (0, 255, 102):
-                    cx[x,y] = foreground_objects_colour
+# Create new coarse segmentation mask of a sample and save it with
+# its image, returning the filepaths of the saved outputs
+def processSample(image_filepath, label_filepath, sky_mask_filepath, \
+                  image_save_filepath, label_save_filepath):
 
-                # LANE MARKINGS
-                elif px[x,y][0:3] == (255, 0, 0):
-                    cx[x,y] = road_colour
+    # Open images and pre-existing masks
+    image = Image.open(image_filepath).convert('RGB')
+    label = Image.open(label_filepath)
+    sky_mask = Image.open(sky_mask_filepath)
 
-                # ROAD
-                elif px[x,y][0:3] == (64, 32, 32):
-                    cx[x,y] = road_colour
+    # Create new Coarse Segmentation mask
+    coarseSegColorMap = createMask(label, sky_mask)
 
-                # SKY
-                if ps[x,y] == sky_colour:
-                    cx[x,y] = sky_colour
+    # Save images
+    saveImageAtomic(image, image_save_filepath, "PNG")
+    saveImageAtomic(coarseSegColorMap, label_save_filepath, "PNG")
 
-    return coarseSegColorMap
+    return [image_save_filepath, label_save_filepath]
 
 def main():
 
@@ -93,6 +98,7 @@ def main():
     parser.add_argument("-i", "--images", dest="images_filepath", help="path to folder with input images")
     parser.add_argument("-ls", "--labels-save", dest="labels_save_path", help="path to folder where processed labels will be saved")
     parser.add_argument("-is", "--images-save", dest="images_save_path", help="path to folder where corresponding images will be saved")
+    parser.add_argument("-w", "--num_workers", dest="num_workers", type=int, default=None, help="number of worker processes, defaults to the number of CPUs")
     args = parser.parse_args()
 
     # Paths to read input images and ground truth label masks from training data
@@ -125,24 +131,18 @@ def main():
 
         print('Beginning processing of data')
 
-        # Looping through data
+        # Tasks identified by output index and input label
+        tasks = []
         for index in range(0, len(labels)):
+            task_id = str(index) + ':' + labels[index].name
+            tasks.append((task_id, (str(images[index]), str(labels[index]), str(sky_masks[index]), \
+                images_save_path + str(index) + ".png", labels_save_path + str(index) + ".png")))
+
+        # Process samples in parallel, skipping samples completed by an earlier run
+        driver = ConversionDriver(labels_save_path + 'conversion_manifest.jsonl', args.num_workers)
+        driver.run(processSample, tasks)
 
-            # Open images and pre-existing masks
-            image = Image.open(str(images[index])).convert('RGB')
-            label = Image.open(str(labels[index]))
-            sky_mask = Image.open(str(sky_masks[index]))
-
-            # Create new Coarse Segmentation mask
-            coarseSegColorMap = createMask(label, sky_mask)
-        
-            # Save images
-            image.save(images_save_path + str(index) + ".png","PNG")
-            coarseSegColorMap.save(labels_save_path + str(index) + ".png","PNG")
-
-            print(f'Processing image {index} of {num_images-1}')
-    
-        print('----- Processing complete -----') 
+        print('----- Processing complete -----')
 
 if __name__ == '__main__':
     main()
\ No newline at end of file